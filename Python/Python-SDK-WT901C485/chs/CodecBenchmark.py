@@ -0,0 +1,59 @@
+# coding:UTF-8
+"""
+    压缩编解码测试  Codec benchmark
+    用二进制记录（.bin）中的原始寄存器数据测试差分/异或编码的往返正确性、压缩比和速度；不指定文件时使用模拟数据
+    Round-trips the raw registers of a binary record (.bin) through the delta/XOR codec and reports
+    compression ratio and MB/s; simulated data is used when no file is given
+    python CodecBenchmark.py [文件] [每帧采样数]
+    python CodecBenchmark.py [file] [samples per block]
+"""
+import sys
+import time
+import zlib
+import numpy as np
+from lib.recorder.binary_reader import BinaryRecord
+from lib.utils.delta_codec import Int16Encoder, iterBlocks
+
+
+def loadSamples(fileName):
+    """
+    读取记录中第一个设备的原始寄存器
+    :param fileName: 文件名，None为模拟数据
+    :return: int16数组 (采样数, 通道数)
+    """
+    if fileName is None:
+        t = np.arange(200000) / 200.0
+        columns = [np.round(np.sin(t * f) * a + np.random.normal(0, 3, len(t)))
+                   for f, a in ((0.5, 500), (0.7, 300), (0.1, 2048), (2.0, 800), (3.0, 600), (1.0, 400))]
+        return np.clip(np.stack(columns, axis=1), -32768, 32767).astype(np.int16)
+    record = BinaryRecord(fileName)
+    records = record.records[record.records["device"] == record.records["device"][0]]
+    return np.stack([np.asarray(records[name]) for _, name, _ in record.channels], axis=1)
+
+
+if __name__ == '__main__':
+    fileName = sys.argv[1] if len(sys.argv) > 1 else None
+    blockSamples = int(sys.argv[2]) if len(sys.argv) > 2 else 1024
+    samples = loadSamples(fileName)
+    rawSize = samples.nbytes
+    print("采样数 Samples: %d  通道数 Channels: %d  原始大小 Raw: %.2f MB"
+          % (samples.shape[0], samples.shape[1], rawSize / 1e6))
+
+    startTime = time.perf_counter()
+    baseline = len(zlib.compress(samples.tobytes(), 6))
+    print("%-12s 压缩比 ratio %6.2f  编码 encode %7.1f MB/s" % ("raw+zlib", rawSize / baseline,
+                                                           rawSize / 1e6 / (time.perf_counter() - startTime)))
+    for transform in ("delta", "xor"):
+        for compression in (None, "zlib", "lzma"):
+            encoder = Int16Encoder(samples.shape[1], blockSamples, transform, compression)
+            startTime = time.perf_counter()
+            data = encoder.write(samples) + encoder.flush()
+            encodeTime = time.perf_counter() - startTime
+            startTime = time.perf_counter()
+            decoded = np.concatenate(list(iterBlocks(data)))
+            decodeTime = time.perf_counter() - startTime
+            if not np.array_equal(decoded, samples):
+                raise ValueError("往返结果不一致 round trip mismatch: %s %s" % (transform, compression))
+            print("%-12s 压缩比 ratio %6.2f  编码 encode %7.1f MB/s  解码 decode %7.1f MB/s"
+                  % (transform + "+" + str(compression), rawSize / len(data), rawSize / 1e6 / encodeTime,
+                     rawSize / 1e6 / decodeTime))
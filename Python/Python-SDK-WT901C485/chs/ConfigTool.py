@@ -0,0 +1,78 @@
+# coding:UTF-8
+"""
+    配置备份和批量配置示例  Configuration backup and commissioning example
+    读出一个传感器的全部配置保存为文件；把文件里的配置套用到总线上的多个传感器，只写不同的寄存器
+    Saves one sensor's whole configuration to a file, then applies it to many sensors on the bus, writing only
+    the registers that differ
+    python ConfigTool.py snapshot golden.json 0x50          备份配置 Back up a configuration
+    python ConfigTool.py restore golden.json 0x50 0x51 ...  套用配置 Apply a configuration
+    python ConfigTool.py demo                               模拟50个传感器 Simulate 50 sensors
+"""
+import sys
+import time
+import platform
+import lib.device_model as deviceModel
+from lib.bus.bus_manager import BusManager
+from lib.config.config_snapshot import snapshot, loadSnapshot, commission
+from lib.data_processor.roles.jy901s_dataProcessor import JY901SDataProcessor
+from lib.protocol_resolver.roles.protocol_485_resolver import Protocol485Resolver
+
+welcome = """
+欢迎使用维特智能示例程序    Welcome to the Wit-Motoin sample program
+"""
+
+
+def openBus(addresses, portFactory=None):
+    """
+    打开总线并添加设备（只做配置，不轮询数据）
+    :param addresses: 设备地址列表
+    :param portFactory: 串口工厂，None为真实串口
+    :return: 总线管理器, 设备列表
+    """
+    manager = BusManager()
+    portName = "/dev/ttyUSB0" if platform.system().lower() == 'linux' else "COM3"
+    options = {} if portFactory is None else {"portFactory": portFactory}
+    manager.addPort(portName, 9600, interval=1.0, **options)
+    devices = []
+    for address in addresses:
+        device = deviceModel.DeviceModel("设备" + hex(address), Protocol485Resolver(), JY901SDataProcessor(), "")
+        device.ADDR = address                                       # 设置传感器ID   Setting the Sensor ID
+        manager.addDevice(portName, device)
+        devices.append(device)
+    manager.start()
+    return manager, devices
+
+
+def runDemo(count=50):
+    from lib.simulator.simulated_sensor import SimulatedSensor
+    from lib.simulator.simulated_serial import SimulatedSerial
+    sensors = [SimulatedSensor(ADDR=0x50 + i, phase=i) for i in range(count)]
+    sensors[0].registers[0x03] = 0x08                               # 黄金配置：50Hz  Golden config: 50 Hz
+    sensors[0].registers[0x23] = 0x01
+    sensors[0].registers[0x24] = 0x01
+    manager, devices = openBus([sensor.ADDR for sensor in sensors],
+                               lambda name, baud: SimulatedSerial(sensors, port=name, baudrate=baud))
+    golden = snapshot(devices[0], "golden.json")
+    start = time.monotonic()
+    reports = commission(devices[1:], golden)
+    elapsed = time.monotonic() - start
+    print("配置%d个传感器用时 commissioned %d sensors in %.1f s" % (count - 1, count - 1, elapsed))
+    print(reports[devices[1].ADDR])
+    manager.stop()
+
+
+if __name__ == '__main__':
+    print(welcome)
+    command = sys.argv[1] if len(sys.argv) > 1 else "demo"
+    if command == "demo":
+        runDemo()
+    else:
+        addresses = [int(arg, 0) for arg in sys.argv[3:]] or [0x50]
+        manager, devices = openBus(addresses)
+        if command == "snapshot":
+            config = snapshot(devices[0], sys.argv[2])
+            print("已保存 saved", len(config.registers), "个寄存器 registers, 版本 firmware", config.firmware)
+        else:
+            for address, report in commission(devices, loadSnapshot(sys.argv[2])).items():
+                print(hex(address), report)
+        manager.stop()
@@ -0,0 +1,70 @@
+# coding:UTF-8
+"""
+    总线发现示例  Bus discovery example
+    并行扫描所有端口上的设备（波特率、地址、型号），结果保存在wit_devices.json，下次启动确认后直接连接
+    Scans every port in parallel for devices (baud rate, address, model); the result is cached in wit_devices.json
+    so the next start only confirms it and connects
+    python Discover.py /dev/ttyUSB0 /dev/ttyUSB1        扫描指定端口 Scan the given ports
+    python Discover.py rescan /dev/ttyUSB0              忽略缓存重新扫描 Ignore the cache and rescan
+    python Discover.py sim                              模拟两条总线 Simulate two buses
+"""
+import sys
+import time
+import platform
+import lib.device_model as deviceModel
+from lib.bus.bus_discovery import discover, WT53R
+from lib.bus.bus_manager import BusManager
+from lib.data_processor.roles.jy901s_dataProcessor import JY901SDataProcessor
+from lib.data_processor.roles.wt53r485_dataProcessor import WT53R485DataProcessor
+from lib.protocol_resolver.roles.protocol_485_resolver import Protocol485Resolver
+from lib.protocol_resolver.roles.wt53r485_protocol_resolver import WT53RProtocol485Resolver
+
+welcome = """
+欢迎使用维特智能示例程序    Welcome to the Wit-Motoin sample program
+"""
+
+
+def createDevice(found):
+    """
+    按发现的型号创建设备模型
+    :param found: 发现的设备
+    :return: 设备模型
+    """
+    if found.model == WT53R:
+        device = deviceModel.DeviceModel(repr(found), WT53RProtocol485Resolver(), WT53R485DataProcessor(), "")
+    else:
+        device = deviceModel.DeviceModel(repr(found), Protocol485Resolver(), JY901SDataProcessor(), "")
+    device.ADDR = found.ADDR                                        # 设置传感器ID   Setting the Sensor ID
+    return device
+
+
+if __name__ == '__main__':
+    print(welcome)
+    args = sys.argv[1:]
+    rescan = bool(args) and args[0] == "rescan"
+    if rescan:
+        args = args[1:]
+    options = {}
+    if args == ["sim"]:
+        from lib.simulator.simulated_sensor import SimulatedSensor
+        from lib.simulator.simulated_serial import SimulatedSerial
+        buses = {"SIM0": [SimulatedSensor(ADDR=0x50), SimulatedSensor(ADDR=0x51, phase=1)],
+                 "SIM1": [SimulatedSensor(ADDR=0x07, phase=2)]}
+        options["portFactory"] = lambda name, baud: SimulatedSerial(buses[name], port=name, baudrate=baud)
+        args = list(buses)
+    elif not args:
+        args = ["/dev/ttyUSB0"] if platform.system().lower() == 'linux' else ["COM3"]
+    start = time.monotonic()
+    result = discover(args, rescan=rescan, **options)
+    print("用时 elapsed %.2f s" % (time.monotonic() - start))
+    manager = BusManager()
+    for portName, devices in result.items():
+        print(portName, devices)
+        if devices:
+            manager.addPort(portName, devices[0].baud, **options)
+            for found in devices:
+                manager.addDevice(portName, createDevice(found))
+    manager.start()
+    time.sleep(1)
+    print(manager.getStatus())
+    manager.stop()
@@ -0,0 +1,67 @@
+# coding:UTF-8
+"""
+    数据分发示例  Fan-out example
+    服务端独占串口，把采样通过TCP分发给多个客户端；客户端按设备和通道订阅
+    The server owns the serial ports and streams samples to many TCP clients; clients subscribe by device and field
+    python FanOut.py server [sim]                           启动服务 Start the server
+    python FanOut.py client [地址] [设备ID] [通道,...]        订阅 Subscribe
+    python FanOut.py client 127.0.0.1 0x51 angleX,angleY
+"""
+import sys
+import platform
+import lib.device_model as deviceModel
+from lib.bus.bus_manager import BusManager
+from lib.data_processor.roles.jy901s_dataProcessor import JY901SDataProcessor
+from lib.network.stream_client import StreamClient
+from lib.network.stream_server import StreamServer
+from lib.protocol_resolver.roles.protocol_485_resolver import Protocol485Resolver
+from lib.simulator.simulated_sensor import SimulatedSensor
+from lib.simulator.simulated_serial import SimulatedSerial
+
+welcome = """
+欢迎使用维特智能示例程序    Welcome to the Wit-Motoin sample program
+"""
+
+DEVICE_COUNT = 4    # 总线上的设备数量 Devices on the bus
+PORT = 9901         # 服务端口 Server port
+
+
+def runServer(simulate):
+    server = StreamServer(port=PORT)
+    manager = BusManager()
+    portName = "/dev/ttyUSB0" if platform.system().lower() == 'linux' else "COM3"
+    options = {}
+    if simulate:
+        sensors = [SimulatedSensor(ADDR=0x50 + i, phase=i) for i in range(DEVICE_COUNT)]
+        options["portFactory"] = lambda name, baud: SimulatedSerial(sensors, port=name, baudrate=baud)
+    manager.addPort(portName, 9600, interval=0.05, **options)
+    for i in range(DEVICE_COUNT):
+        device = deviceModel.DeviceModel("设备" + str(i), Protocol485Resolver(), JY901SDataProcessor(), "")
+        device.ADDR = 0x50 + i                                      # 设置传感器ID   Setting the Sensor ID
+        device.dataProcessor.onVarChanged.append(server.write)     # 采样送给分发服务 Samples to the server
+        manager.addDevice(portName, device)
+    server.start()
+    manager.start()
+    print("服务已启动 Server listening on port", server.port)
+    input()
+    manager.stop()
+    server.stop()
+    print(server.getStatus())
+
+
+def runClient(host, devices, fields):
+    client = StreamClient(host, PORT, devices, fields)
+    client.connect()
+    for sample in client:
+        print(sample)
+
+
+if __name__ == '__main__':
+    print(welcome)
+    if len(sys.argv) > 1 and sys.argv[1] == "client":
+        host = sys.argv[2] if len(sys.argv) > 2 else "127.0.0.1"
+        devices = [int(sys.argv[3], 0)] if len(sys.argv) > 3 else None
+        fields = sys.argv[4].split(",") if len(sys.argv) > 4 else ["angleX", "angleY", "angleZ"]
+        runClient(host, devices, fields)
+    else:
+        runServer(len(sys.argv) > 2 and sys.argv[2] == "sim")
@@ -4,18 +4,18 @@
     Test file
 """
 import time
-import datetime
 import platform
 import struct
 import lib.device_model as deviceModel
 from lib.data_processor.roles.jy901s_dataProcessor import JY901SDataProcessor
 from lib.protocol_resolver.roles.wit_protocol_resolver import WitProtocolResolver
+from lib.recorder.binary_recorder import JY901S_CHANNELS
+from lib.recorder.rotating_recorder import RotatingRecorder
 
 welcome = """
 欢迎使用维特智能示例程序    Welcome to the Wit-Motoin sample program
 """
-_writeF = None                    #写文件  Write file
-_IsWriteF = False                 #写文件标识    Write file identification
+_recorder = None                  #滚动记录器    Rotating recorder
 
 def readConfig(device):
     """
@@ -86,40 +86,17 @@ def onUpdate(deviceModel):
         , " 航向角:" + str(deviceModel.getDeviceData("Yaw")) + " 地速:" + str(deviceModel.getDeviceData("Speed"))
          , " 四元素:" + str(deviceModel.getDeviceData("q1")) + "," + str(deviceModel.getDeviceData("q2")) + "," + str(deviceModel.getDeviceData("q3"))+ "," + str(deviceModel.getDeviceData("q4"))
           )
-    if (_IsWriteF):    #记录数据    Record data
-        Tempstr = " " + str(deviceModel.getDeviceData("Chiptime"))
-        Tempstr += "\t"+str(deviceModel.getDeviceData("accX")) + "\t"+str(deviceModel.getDeviceData("accY"))+"\t"+ str(deviceModel.getDeviceData("accZ"))
-        Tempstr += "\t" + str(deviceModel.getDeviceData("gyroX")) +"\t"+ str(deviceModel.getDeviceData("gyroY")) +"\t"+ str(deviceModel.getDeviceData("gyroZ"))
-        Tempstr += "\t" + str(deviceModel.getDeviceData("angleX")) +"\t" + str(deviceModel.getDeviceData("angleY")) +"\t"+ str(deviceModel.getDeviceData("angleZ"))
-        Tempstr += "\t" + str(deviceModel.getDeviceData("temperature"))
-        Tempstr += "\t" + str(deviceModel.getDeviceData("magX")) +"\t" + str(deviceModel.getDeviceData("magY")) +"\t"+ str(deviceModel.getDeviceData("magZ"))
-        Tempstr += "\t" + str(deviceModel.getDeviceData("lon")) + "\t" + str(deviceModel.getDeviceData("lat"))
-        Tempstr += "\t" + str(deviceModel.getDeviceData("Yaw")) + "\t" + str(deviceModel.getDeviceData("Speed"))
-        Tempstr += "\t" + str(deviceModel.getDeviceData("q1")) + "\t" + str(deviceModel.getDeviceData("q2"))
-        Tempstr += "\t" + str(deviceModel.getDeviceData("q3")) + "\t" + str(deviceModel.getDeviceData("q4"))
-        Tempstr += "\r\n"
-        _writeF.write(Tempstr)
+    if _recorder is not None:    #记录数据    Record data
+        _recorder.write(deviceModel)
 
 def startRecord():
     """
     开始记录数据  Start recording data
     :return:
     """
-    global _writeF
-    global _IsWriteF
-    _writeF = open(str(datetime.datetime.now().strftime('%Y%m%d%H%M%S')) + ".txt", "w")    #新建一个文件
-    _IsWriteF = True                                                                        #标记写入标识
-    Tempstr = "Chiptime"
-    Tempstr +=  "\tax(g)\tay(g)\taz(g)"
-    Tempstr += "\twx(deg/s)\twy(deg/s)\twz(deg/s)"
-    Tempstr += "\tAngleX(deg)\tAngleY(deg)\tAngleZ(deg)"
-    Tempstr += "\tT(°)"
-    Tempstr += "\tmagx\tmagy\tmagz"
-    Tempstr += "\tlon\tlat"
-    Tempstr += "\tYaw\tSpeed"
-    Tempstr += "\tq1\tq2\tq3\tq4"
-    Tempstr += "\r\n"
-    _writeF.write(Tempstr)
+    global _recorder
+    _recorder = RotatingRecorder("record", "JY901S", JY901S_CHANNELS, maxBytes=64 << 20, maxDuration=3600)  #按大小或时长滚动分段，旧分段后台压缩 Roll segments by size or time, compress old ones in the background
+    _recorder.open()                #开始写盘和压缩线程 Start the writer and compression threads
     print("开始记录数据")
 
 def endRecord():
@@ -127,10 +104,10 @@ def endRecord():
     结束记录数据  End record data
     :return:
     """
-    global _writeF
-    global _IsWriteF
-    _IsWriteF = False             # 标记不可写入标识    Tag cannot write the identity
-    _writeF.close()               #关闭文件 Close file
+    global _recorder
+    recorder = _recorder
+    _recorder = None              # 停止写入记录   Stop writing records
+    recorder.close()              # 写完剩余数据并关闭文件   Flush and close file
     print("结束记录数据")
 
 if __name__ == '__main__':
@@ -154,6 +131,13 @@ if __name__ == '__main__':
     device.openDevice()                                 #打开串口   Open serial port
     readConfig(device)                                  #读取配置信息 Read configuration information
     device.dataProcessor.onVarChanged.append(onUpdate)  #数据更新事件 Data update event
+    # 数据停滞监视：按回传速率判断，停止回传时提示    Stall watchdog: expected interval from the output rate
+    # from lib.bus.stall_watchdog import StallWatchdog
+    # watchdog = StallWatchdog()
+    # watchdog.watch(device)
+    # watchdog.readRate(device)
+    # watchdog.onStall.append(lambda d: print("数据停滞 stalled", d.deviceName))
+    # watchdog.start()
 
     startRecord()                                       # 开始记录数据    Start recording data
     input()
@@ -0,0 +1,44 @@
+# coding:UTF-8
+"""
+    Modbus TCP网关示例  Modbus TCP gateway example
+    把RS-485总线上的传感器以Modbus TCP提供给SCADA等客户端，单元ID与传感器地址相同
+    Exposes the sensors on an RS-485 bus to SCADA and other clients over Modbus TCP; unit id = sensor address
+    python ModbusGateway.py [端口]          使用真实串口 Use the real serial port
+    python ModbusGateway.py [port] sim      使用伪终端模拟传感器 Use simulated sensors behind a pseudo terminal
+"""
+import sys
+import platform
+from lib.network.modbus_gateway import ModbusGateway
+
+welcome = """
+欢迎使用维特智能示例程序    Welcome to the Wit-Motoin sample program
+"""
+
+DEVICE_COUNT = 4    # 总线上的设备数量 Devices on the bus
+
+if __name__ == '__main__':
+    print(welcome)
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 5020
+    simulator = None
+    if len(sys.argv) > 2 and sys.argv[2] == "sim":
+        from lib.simulator.pty_simulator import PtySimulator
+        from lib.simulator.simulated_sensor import SimulatedSensor
+        simulator = PtySimulator([SimulatedSensor(ADDR=0x50 + i, phase=i) for i in range(DEVICE_COUNT)])
+        simulator.start()
+        portName = simulator.portName
+    elif platform.system().lower() == 'linux':
+        portName = "/dev/ttyUSB0"
+    else:
+        portName = "COM3"
+
+    gateway = ModbusGateway(port=port)
+    gateway.addBus("bus0", portName, 9600)
+    for i in range(DEVICE_COUNT):
+        gateway.mapUnit(0x50 + i, "bus0")           # 单元ID -> 传感器地址 Unit id -> sensor address
+    gateway.start()
+    print("网关已启动 Gateway listening on port", gateway.port, "串口 serial", portName)
+    input()
+    gateway.stop()
+    if simulator is not None:
+        simulator.stop()
+    print(gateway.getStatus())
@@ -0,0 +1,71 @@
+# coding:UTF-8
+"""
+    多串口示例  Multi-port example
+    一个程序同时读取多条RS-485总线，每条总线挂多个传感器
+    One application reading several RS-485 buses with several sensors each
+    python MultiBus.py          使用真实串口 Use the real serial ports
+    python MultiBus.py sim      使用模拟传感器 Use simulated sensors
+"""
+import sys
+import platform
+import lib.device_model as deviceModel
+from lib.bus.bus_manager import BusManager
+from lib.bus.time_merger import TimeMerger
+from lib.data_processor.roles.jy901s_dataProcessor import JY901SDataProcessor
+from lib.protocol_resolver.roles.protocol_485_resolver import Protocol485Resolver
+from lib.simulator.simulated_sensor import SimulatedSensor
+from lib.simulator.simulated_serial import SimulatedSerial
+
+welcome = """
+欢迎使用维特智能示例程序    Welcome to the Wit-Motoin sample program
+"""
+
+PORT_COUNT = 6      # 串口数量 Number of serial ports
+DEVICE_COUNT = 8    # 每条总线的设备数量 Devices per bus
+
+
+def portNames():
+    """
+    串口列表    Serial port list
+    :return:
+    """
+    if platform.system().lower() == 'linux':
+        return ["/dev/ttyUSB" + str(i) for i in range(PORT_COUNT)]
+    return ["COM" + str(i + 3) for i in range(PORT_COUNT)]
+
+
+def onSample(sample):
+    """
+    按时间排序的合并输出流的样本  Sample from the time-ordered merged stream
+    :param sample: 样本 Sample
+    :return:
+    """
+    print(sample.portName, hex(sample.ADDR), " 角度:" + str(sample.get("angleX")) + "," + str(sample.get("angleY"))
+          + "," + str(sample.get("angleZ")))
+
+
+if __name__ == '__main__':
+    print(welcome)
+    simulate = len(sys.argv) > 1 and sys.argv[1] == "sim"
+    manager = BusManager()
+    for portName in portNames():
+        options = {}
+        if simulate:
+            sensors = [SimulatedSensor(ADDR=0x50 + i, phase=i) for i in range(DEVICE_COUNT)]
+            options["portFactory"] = lambda name, baud, sensors=sensors: SimulatedSerial(sensors, port=name, baudrate=baud)
+        manager.addPort(portName, 9600, interval=0.1, **options)    # 每100毫秒轮询一轮 Poll the bus every 100ms
+        for i in range(DEVICE_COUNT):
+            device = deviceModel.DeviceModel("设备" + str(i), Protocol485Resolver(), JY901SDataProcessor(), "")
+            device.ADDR = 0x50 + i                                  # 设置传感器ID   Setting the Sensor ID
+            manager.addDevice(portName, device)
+    merger = TimeMerger(window=0.05)                                 # 50毫秒重排窗口 50ms reorder window
+    merger.listeners.append(onSample)                               # 有序输出回调 Ordered stream callback
+    manager.listeners.append(merger.push)                           # 合并输出流送入排序 Merged stream into the merger
+    merger.start()
+    manager.start()                                                 # 启动所有端口 Start all ports
+
+    input()
+    manager.stop()
+    merger.stop()
+    print(manager.getStatus())
+    print(merger.getStatus())
@@ -0,0 +1,118 @@
+# coding:UTF-8
+"""
+    多设备压力测试  Multi-device stress test
+    在一个进程中运行多个模拟传感器，检查吞吐量和设备间是否串数据
+    Runs many simulated sensors in one interpreter, checking throughput and cross-talk between devices
+"""
+import sys
+import threading
+import time
+import lib.device_model as deviceModel
+from lib.data_processor.roles.jy901s_dataProcessor import JY901SDataProcessor
+from lib.protocol_resolver.roles.wit_protocol_resolver import WitProtocolResolver
+from lib.protocol_resolver.roles.protocol_485_resolver import Protocol485Resolver
+from lib.simulator.simulated_sensor import SimulatedSensor
+from lib.simulator.simulated_serial import SimulatedSerial
+
+welcome = """
+欢迎使用维特智能示例程序    Welcome to the Wit-Motoin sample program
+"""
+
+
+def makeDevice(index, protocol):
+    """
+    创建一个连接模拟传感器的设备模型    Create a device model connected to a simulated sensor
+    :param index: 设备序号 Device index
+    :param protocol: "wit" 或 "modbus"
+    :return: 设备模型 Device model
+    """
+    addr = 0x50 + index
+    sensor = SimulatedSensor(ADDR=addr, phase=index, temperature=20.0 + index)   # 每个设备温度不同，用于检查串数据 Distinct temperature per device
+    if protocol == "wit":
+        resolver = WitProtocolResolver()
+        rate = None
+    else:
+        resolver = Protocol485Resolver()
+        rate = 0.0
+    device = deviceModel.DeviceModel("模拟设备" + str(index), resolver, JY901SDataProcessor(), "")
+    device.ADDR = addr
+    device.serialConfig.portName = "SIM" + str(index)
+    device.portFactory = lambda portName, baud: SimulatedSerial([sensor], protocol=protocol, rate=rate, burst=4,
+                                                                port=portName, baudrate=baud)
+    return device
+
+
+def runStream(count, duration):
+    """
+    维特协议主动回传压力测试    Wit protocol streaming stress test
+    :param count: 设备数量 Number of devices
+    :param duration: 运行时间（秒） Duration in seconds
+    :return: (每秒总更新数, 串数据次数)
+    """
+    devices = []
+    counters = []
+    errors = [0]
+    for i in range(count):
+        device = makeDevice(i, "wit")
+        counter = [0]
+        expected = round(20.0 + i, 2)
+
+        def onUpdate(model, counter=counter, expected=expected):
+            counter[0] += 1
+            if model.getDeviceData("temperature") != expected:     # 收到其他设备的数据 Data from another device
+                errors[0] += 1
+
+        device.dataProcessor.onVarChanged.append(onUpdate)
+        devices.append(device)
+        counters.append(counter)
+    for device in devices:
+        device.openDevice()
+    startCount = sum(c[0] for c in counters)       # 只统计计时窗口内的更新 Only count updates inside the window
+    startTime = time.monotonic()
+    time.sleep(duration)
+    total = sum(c[0] for c in counters) - startCount
+    elapsed = time.monotonic() - startTime
+    for device in devices:
+        device.closeDevice()
+    time.sleep(0.2)
+    return total / elapsed, errors[0]
+
+
+def runReadReg(count):
+    """
+    并发读取寄存器，检查每个设备读到的是自己的地址    Concurrent readReg, each device must read its own address
+    :param count: 设备数量 Number of devices
+    :return: 读错的设备数
+    """
+    devices = [makeDevice(i, "modbus") for i in range(count)]
+    results = {}
+
+    def readAddr(device):
+        results[device.ADDR] = device.readReg(0x1a, 1)
+
+    for device in devices:
+        device.openDevice()
+    threads = [threading.Thread(target=readAddr, args=(device,)) for device in devices]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    for device in devices:
+        device.closeDevice()
+    return sum(1 for addr, vals in results.items() if vals != [addr])
+
+
+if __name__ == '__main__':
+    print(welcome)
+    maxCount = int(sys.argv[1]) if len(sys.argv) > 1 else 32
+    duration = float(sys.argv[2]) if len(sys.argv) > 2 else 2.0
+    report = []
+    count = 1
+    while count <= maxCount:
+        rate, errors = runStream(count, duration)
+        badReads = runReadReg(count)
+        report.append((count, rate, rate / count, errors, badReads))
+        count *= 2
+    print("设备数 devices\t总更新/秒 updates/s\t每设备 per device\t串数据 cross-talk\t读错 bad reads")
+    for row in report:
+        print("{}\t{:.0f}\t{:.0f}\t{}\t{}".format(*row))
@@ -0,0 +1,69 @@
+# coding:UTF-8
+"""
+    端口守护进程示例  Port daemon example
+    守护进程独占串口并轮询；其他程序通过Unix域套接字读写寄存器，通过共享内存读取最新值，不再争抢串口
+    The daemon owns and polls the serial port; other programs read/write registers over a Unix socket and read
+    the latest values from shared memory instead of competing for the port
+    python PortDaemon.py daemon [sim]                   启动守护进程 Start the daemon
+    python PortDaemon.py read 0x50 0x3d 3               读取寄存器 Read registers
+    python PortDaemon.py write 0x50 0x03 0x0006         写入寄存器 Write a register
+    python PortDaemon.py latest 0x50                    读取最新值 Read the latest values
+"""
+import sys
+import time
+import platform
+import lib.device_model as deviceModel
+from lib.bus.bus_manager import BusManager
+from lib.data_processor.roles.jy901s_dataProcessor import JY901SDataProcessor
+from lib.network.daemon_client import DaemonClient
+from lib.network.port_daemon import PortDaemon
+from lib.protocol_resolver.roles.protocol_485_resolver import Protocol485Resolver
+
+welcome = """
+欢迎使用维特智能示例程序    Welcome to the Wit-Motoin sample program
+"""
+
+DEVICE_COUNT = 4    # 总线上的设备数量 Devices on the bus
+
+
+def runDaemon(simulate):
+    manager = BusManager()
+    portName = "/dev/ttyUSB0" if platform.system().lower() == 'linux' else "COM3"
+    options = {}
+    if simulate:
+        from lib.simulator.simulated_sensor import SimulatedSensor
+        from lib.simulator.simulated_serial import SimulatedSerial
+        sensors = [SimulatedSensor(ADDR=0x50 + i, phase=i) for i in range(DEVICE_COUNT)]
+        options["portFactory"] = lambda name, baud: SimulatedSerial(sensors, port=name, baudrate=baud)
+    manager.addPort(portName, 9600, interval=0.05, **options)
+    for i in range(DEVICE_COUNT):
+        device = deviceModel.DeviceModel("设备" + str(i), Protocol485Resolver(), JY901SDataProcessor(), "")
+        device.ADDR = 0x50 + i                                      # 设置传感器ID   Setting the Sensor ID
+        manager.addDevice(portName, device)
+    daemon = PortDaemon(manager)
+    daemon.start()
+    print("守护进程已启动 Daemon listening on", daemon.socketPath, "共享内存 shared memory", daemon.table.name)
+    input()
+    daemon.stop()
+
+
+if __name__ == '__main__':
+    print(welcome)
+    command = sys.argv[1] if len(sys.argv) > 1 else "daemon"
+    if command == "daemon":
+        runDaemon(len(sys.argv) > 2 and sys.argv[2] == "sim")
+    else:
+        client = DaemonClient()
+        address = int(sys.argv[2], 0) if len(sys.argv) > 2 else 0x50
+        if command == "read":
+            print(client.readReg(address, int(sys.argv[3], 0), int(sys.argv[4], 0) if len(sys.argv) > 4 else 1))
+        elif command == "write":
+            client.writeReg(address, int(sys.argv[3], 0), int(sys.argv[4], 0))
+        else:
+            table = client.openTable()
+            start = time.perf_counter()
+            for _ in range(100000):
+                latest = table.readRaw(address)
+            print("每次读取 per read %.0f ns" % ((time.perf_counter() - start) / 100000 * 1e9))
+            print(table.read(address))
+        client.close()
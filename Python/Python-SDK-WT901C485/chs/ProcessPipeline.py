@@ -0,0 +1,55 @@
+# coding:UTF-8
+"""
+    多进程解析示例  Process-pool decoding example
+    主进程只负责收发串口字节，协议解析在每个端口独立的进程中进行
+    The main process only moves serial bytes; decoding runs in one process per port
+    python ProcessPipeline.py          使用真实串口 Use the real serial ports
+    python ProcessPipeline.py sim      使用模拟传感器 Use simulated sensors
+"""
+import sys
+import platform
+from lib.bus.process_pipeline import ProcessPipeline
+from lib.simulator.simulated_sensor import SimulatedSensor
+from lib.simulator.simulated_serial import SimulatedSerial
+
+welcome = """
+欢迎使用维特智能示例程序    Welcome to the Wit-Motoin sample program
+"""
+
+PORT_COUNT = 6      # 串口数量 Number of serial ports
+DEVICE_COUNT = 8    # 每条总线的设备数量 Devices per bus
+
+
+def portNames():
+    """
+    串口列表    Serial port list
+    :return:
+    """
+    if platform.system().lower() == 'linux':
+        return ["/dev/ttyUSB" + str(i) for i in range(PORT_COUNT)]
+    return ["COM" + str(i + 3) for i in range(PORT_COUNT)]
+
+
+if __name__ == '__main__':
+    print(welcome)
+    simulate = len(sys.argv) > 1 and sys.argv[1] == "sim"
+    pipeline = ProcessPipeline()
+    devices = [(0x50 + i, "设备" + str(i)) for i in range(DEVICE_COUNT)]
+    for portName in portNames():
+        options = {}
+        if simulate:
+            sensors = [SimulatedSensor(ADDR=0x50 + i, phase=i) for i in range(DEVICE_COUNT)]
+            options["portFactory"] = lambda name, baud, sensors=sensors: SimulatedSerial(sensors, port=name, baudrate=baud)
+        pipeline.addPort(portName, 9600, devices, interval=0.1, **options)  # 每100毫秒轮询一轮 Poll every 100ms
+    pipeline.start()
+
+    try:
+        while True:
+            sample = pipeline.get(1)
+            if sample is not None:
+                print(sample.portName, hex(sample.ADDR), " 角度:" + str(sample.get("angleX")) + ","
+                      + str(sample.get("angleY")) + "," + str(sample.get("angleZ")))
+    except KeyboardInterrupt:
+        pass
+    print(pipeline.getStatus())
+    pipeline.stop()
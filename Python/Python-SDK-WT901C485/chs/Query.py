@@ -0,0 +1,54 @@
+# coding:UTF-8
+"""
+    查询示例  Query example
+    按时间范围查询二进制记录（.bin、.bin.gz）、滚动记录目录（如示例程序的record）或按列存储目录，可选降采样，
+    结果按CSV输出
+    Queries a binary record (.bin, .bin.gz), a rotating recorder directory (such as the demos' record) or a
+    columnar store directory by time range, optionally downsampled, and prints CSV
+    python Query.py 文件 --device 0x50 --fields angleX,angleY --start 2026-10-19T02:00 --end 2026-10-19T03:00 --every 100ms --agg mean
+    python Query.py file --device 0x50 --fields angleX,angleY --start 2026-10-19T02:00 --end 2026-10-19T03:00 --every 100ms --agg mean
+"""
+import argparse
+import datetime
+import sys
+import time
+from lib.recorder.record_query import AGGREGATES, query
+
+
+def parseTime(text):
+    """
+    解析时间：ISO格式（本地时间）或纳秒整数
+    :param text: 时间
+    :return: 纳秒
+    """
+    if text is None:
+        return None
+    if text.isdigit():
+        return int(text)
+    return int(datetime.datetime.fromisoformat(text).timestamp() * 1000000) * 1000
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="按时间范围查询记录 Time-range query over recordings")
+    parser.add_argument("path", help="二进制记录文件或记录目录 Binary record, rotating recorder or columnar store directory")
+    parser.add_argument("--device", default="0x50", help="设备ID Device id, 'all' for every device")
+    parser.add_argument("--fields", default="angleX,angleY,angleZ", help="通道名，逗号分隔 Comma separated channels")
+    parser.add_argument("--start", help="开始时间 Start (ISO or ns)")
+    parser.add_argument("--end", help="结束时间（不含） End, exclusive (ISO or ns)")
+    parser.add_argument("--every", help="降采样间隔 Downsampling interval, e.g. 100ms, 1s, 5min")
+    parser.add_argument("--agg", default="mean", choices=AGGREGATES, help="降采样统计方式 Aggregate")
+    args = parser.parse_args()
+
+    fields = args.fields.split(",")
+    startTime = time.perf_counter()
+    result = query(args.path, None if args.device == "all" else int(args.device, 0), fields,
+                   parseTime(args.start), parseTime(args.end), args.every, args.agg)
+    elapsed = time.perf_counter() - startTime
+
+    out = sys.stdout
+    out.write("time," + ",".join(fields) + "\n")
+    timestamps = result["timestamp"]
+    for i in range(len(timestamps)):
+        stamp = datetime.datetime.fromtimestamp(timestamps[i] / 1000000000).isoformat(timespec="milliseconds")
+        out.write(stamp + "," + ",".join("%.6g" % result[name][i] for name in fields) + "\n")
+    print("行数 Rows: %d  用时 Elapsed: %.3fs" % (len(timestamps), elapsed), file=sys.stderr)
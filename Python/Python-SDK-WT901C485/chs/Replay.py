@@ -0,0 +1,55 @@
+# coding:UTF-8
+"""
+    回放示例  Replay example
+    把原始字节记录（或convert.py使用的纯字节文件）通过设备模型重新解析，用于离线复现问题和测试解析速度
+    Feeds a raw capture (or a plain byte dump as used by convert.py) back through the device models,
+    to reproduce incidents offline and benchmark decoding
+    python Replay.py 文件 [速度|asap] [wit|modbus]
+    python Replay.py file [speed|asap] [wit|modbus]
+"""
+import sys
+import time
+import lib.device_model as deviceModel
+from lib.bus.bus_manager import BusManager
+from lib.data_processor.roles.jy901s_dataProcessor import JY901SDataProcessor
+from lib.protocol_resolver.roles.protocol_485_resolver import Protocol485Resolver
+from lib.protocol_resolver.roles.wit_protocol_resolver import WitProtocolResolver
+from lib.simulator.replay_serial import ReplaySerial
+
+welcome = """
+欢迎使用维特智能示例程序    Welcome to the Wit-Motoin sample program
+"""
+
+if __name__ == '__main__':
+    print(welcome)
+    if len(sys.argv) < 2:
+        print("请输入回放文件名 please input the replay file name")
+        exit(1)
+    fileName = sys.argv[1]
+    speed = 1.0
+    if len(sys.argv) > 2:
+        speed = None if sys.argv[2] == "asap" else float(sys.argv[2])   # asap 尽可能快 As fast as possible
+    protocol = sys.argv[3] if len(sys.argv) > 3 else "wit"
+
+    replay = ReplaySerial(fileName, speed=speed, mode="poll" if protocol == "modbus" else "stream")
+    manager = BusManager()
+    manager.addPort("REPLAY", 9600, mode=replay.mode, timeout=0.05, portFactory=lambda name, baud: replay)
+    if replay.mode == "poll":
+        addrs = sorted({key[0] for key in replay.responses if key[0] != "wit"})     # 记录中出现的设备 Devices in the capture
+    else:
+        addrs = [0x50]
+    for addr in addrs:
+        resolver = Protocol485Resolver() if protocol == "modbus" else WitProtocolResolver()
+        device = deviceModel.DeviceModel("回放设备" + hex(addr), resolver, JY901SDataProcessor(), "")
+        device.ADDR = addr
+        manager.addDevice("REPLAY", device)
+
+    startTime = time.monotonic()
+    manager.start()
+    while not replay.isFinished():
+        time.sleep(0.01)
+    time.sleep(0.1)
+    manager.stop()
+    elapsed = time.monotonic() - startTime
+    print("样本数 Samples:", manager.sampleCount, " 用时 Elapsed: %.3fs" % elapsed,
+          " 每秒 Per second: %.0f" % (manager.sampleCount / elapsed))
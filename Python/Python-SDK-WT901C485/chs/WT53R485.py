@@ -8,6 +8,7 @@ import datetime
 import platform
 import threading
 import lib.device_model as deviceModel
+from lib.bus.command_queue import POLL
 from lib.data_processor.roles.wt53r485_dataProcessor import WT53R485DataProcessor
 from lib.protocol_resolver.roles.wt53r485_protocol_resolver import WT53RProtocol485Resolver
 
@@ -110,7 +111,7 @@ def LoopReadThead(device):
     :return:
     """
     while True:     # 循环读取数据 Cyclic read data
-        device.readReg(0x34, 2)   # 读取距离、状态数据  Reading distance and status data
+        device.readReg(0x34, 2, POLL)     # 读取距离、状态数据（轮询优先级）  Reading distance and status data (poll priority)
         time.sleep(0.2)
 
 
@@ -4,18 +4,21 @@
     Test file
 """
 import time
-import datetime
 import platform
 import threading
 import lib.device_model as deviceModel
+from lib.bus.command_queue import POLL
+from lib.data_processor.roles.deadband_dataProcessor import DeadbandDataProcessor
 from lib.data_processor.roles.jy901s_dataProcessor import JY901SDataProcessor
 from lib.protocol_resolver.roles.protocol_485_resolver import Protocol485Resolver
+from lib.recorder.binary_recorder import WT901C485_CHANNELS
+from lib.recorder.rotating_recorder import RotatingRecorder
 
 welcome = """
 欢迎使用维特智能示例程序    Welcome to the Wit-Motoin sample program
 """
-_writeF = None                    #写文件  Write file
-_IsWriteF = False                 #写文件标识    Write file identification
+_recorder = None                  #滚动记录器    Rotating recorder
+USE_DEADBAND = False              #死区过滤：角度变化超过0.1度才触发更新，至少5秒心跳一次    Deadband filter: only angle changes above 0.1 deg trigger updates, heartbeat every 5s
 def readConfig(device):
     """
     读取配置信息示例    Example of reading configuration information
@@ -74,18 +77,9 @@ def startRecord():
     开始记录数据  Start recording data
     :return:
     """
-    global _writeF
-    global _IsWriteF
-    _writeF = open(str(datetime.datetime.now().strftime('%Y%m%d%H%M%S')) + ".txt", "w")    #新建一个文件
-    _IsWriteF = True                                                                        #标记写入标识
-    Tempstr = "Chiptime"
-    Tempstr +=  "\tax(g)\tay(g)\taz(g)"
-    Tempstr += "\twx(deg/s)\twy(deg/s)\twz(deg/s)"
-    Tempstr += "\tAngleX(deg)\tAngleY(deg)\tAngleZ(deg)"
-    Tempstr += "\tT(°)"
-    Tempstr += "\tmagx\tmagy\tmagz"
-    Tempstr += "\r\n"
-    _writeF.write(Tempstr)
+    global _recorder
+    _recorder = RotatingRecorder("record", "WT901C485", WT901C485_CHANNELS, maxBytes=64 << 20, maxDuration=3600)  #按大小或时长滚动分段，旧分段后台压缩 Roll segments by size or time, compress old ones in the background
+    _recorder.open()                #开始写盘和压缩线程 Start the writer and compression threads
     print("开始记录数据")
 
 def endRecord():
@@ -93,10 +87,10 @@ def endRecord():
     结束记录数据  End record data
     :return:
     """
-    global _writeF
-    global _IsWriteF
-    _IsWriteF = False             # 标记不可写入标识    Tag cannot write the identity
-    _writeF.close()               #关闭文件     Close file
+    global _recorder
+    recorder = _recorder
+    _recorder = None              # 停止写入记录   Stop writing records
+    recorder.close()              # 写完剩余数据并关闭文件   Flush and close file
     print("结束记录数据")
 
 def onUpdate(deviceModel):
@@ -112,15 +106,8 @@ def onUpdate(deviceModel):
          , " 角度:" + str(deviceModel.getDeviceData("angleX")) +","+ str(deviceModel.getDeviceData("angleY")) +","+ str(deviceModel.getDeviceData("angleZ"))
         , " 磁场:" + str(deviceModel.getDeviceData("magX")) +","+ str(deviceModel.getDeviceData("magY"))+","+ str(deviceModel.getDeviceData("magZ"))
           )
-    if (_IsWriteF):    #记录数据    Record data
-        Tempstr = " " + str(deviceModel.getDeviceData("Chiptime"))
-        Tempstr += "\t"+str(deviceModel.getDeviceData("accX")) + "\t"+str(deviceModel.getDeviceData("accY"))+"\t"+ str(deviceModel.getDeviceData("accZ"))
-        Tempstr += "\t" + str(deviceModel.getDeviceData("gyroX")) +"\t"+ str(deviceModel.getDeviceData("gyroY")) +"\t"+ str(deviceModel.getDeviceData("gyroZ"))
-        Tempstr += "\t" + str(deviceModel.getDeviceData("angleX")) +"\t" + str(deviceModel.getDeviceData("angleY")) +"\t"+ str(deviceModel.getDeviceData("angleZ"))
-        Tempstr += "\t" + str(deviceModel.getDeviceData("temperature"))
-        Tempstr += "\t" + str(deviceModel.getDeviceData("magX")) +"\t" + str(deviceModel.getDeviceData("magY")) +"\t"+ str(deviceModel.getDeviceData("magZ"))
-        Tempstr += "\r\n"
-        _writeF.write(Tempstr)
+    if _recorder is not None:    #记录数据    Record data
+        _recorder.write(deviceModel)
 
 def LoopReadThead(device):
     """
@@ -129,7 +116,7 @@ def LoopReadThead(device):
     :return:
     """
     while(True):                            #循环读取数据 Cyclic read data
-        device.readReg(0x30, 41)            #读取 数据  Read data
+        device.readReg(0x30, 41, POLL)      #读取 数据，轮询优先级不挡配置读写  Read data at poll priority so config reads/writes go first
 
 if __name__ == '__main__':
 
@@ -145,15 +132,27 @@ if __name__ == '__main__':
         device.serialConfig.portName = "/dev/ttyUSB0"        #设置串口  Set serial port
     else:
         device.serialConfig.portName = "COM82"               #设置串口  Set serial port
+    # 串口服务器（RTU over TCP）Serial-to-Ethernet converter (RTU over TCP)
+    # device.serialConfig.portName = "tcp://192.168.1.200:4196"
     device.serialConfig.baud = 9600                          #设置波特率 Set baud rate
     device.openDevice()                                      #打开串口  Open serial port
     readConfig(device)                                       #读取配置信息    Read configuration information
+    if USE_DEADBAND:                                         #死区过滤    Deadband filter
+        device.dataProcessor = DeadbandDataProcessor(device.dataProcessor, minInterval=0.02, maxSilence=5)
+        for key in ("angleX", "angleY", "angleZ"):
+            device.dataProcessor.setDeadband(key, absolute=0.1)
     device.dataProcessor.onVarChanged.append(onUpdate)       #数据更新事件    Data update event
+    # 长时间记录：每分钟一块按列存储，带每块统计值，可快速查询    Long recordings: one columnar chunk per minute with per-chunk stats for fast queries
+    # from lib.recorder.columnar_store import ColumnarStore
+    # store = ColumnarStore("store", WT901C485_CHANNELS, chunkDuration=60)
+    # store.open()
+    # device.dataProcessor.onVarChanged.append(store.write)
 
     startRecord()                                            # 开始记录数据   Start recording data
     t = threading.Thread(target=LoopReadThead, args=(device,))  #开启一个线程读取数据 Start a thread to read data
     t.start()
 
     input()
+    print("寄存器缓存 Register cache:", device.registerCache.getStatus())    # 命中率 Hit rate
     device.closeDevice()
     endRecord()                             # 结束记录数据    End record data
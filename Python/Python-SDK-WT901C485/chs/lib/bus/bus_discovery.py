@@ -0,0 +1,312 @@
+# coding:UTF-8
+import concurrent.futures
+import datetime
+import json
+import math
+import os
+import struct
+import time
+from serial import SerialException
+from lib.bus.command_queue import BITS_PER_BYTE, TURNAROUND_CHARS, MIN_TURNAROUND
+from lib.transport.rtt_estimator import wireTime
+from lib.transport.transport import openTransport
+from lib.utils.crc_utils import append_crc, check_crc
+
+"""
+    总线发现 Bus discovery
+    所有端口并行扫描：波特率按常见程度排序，先在每个波特率下探测常用地址（0x50起）确定总线的波特率，再用这个波特率
+    探测全部247个地址；每次探测的超时按波特率和帧长计算，再加上USB转换器延迟和设备响应的余量，余量按第一个
+    应答的设备实测的延迟校准。找到的设备按特征寄存器识别型号，结果保存在本地文件，下次启动先按文件里的波特率和
+    地址确认，设备都在就不再扫描
+    Scans all ports in parallel: baud rates are tried in order of likelihood, common addresses (from 0x50) are
+    probed at each rate to find the bus baud rate, then all 247 addresses are probed at that rate, each with a
+    timeout computed from the baud rate and frame lengths plus slack for USB adapter latency and device turnaround,
+    calibrated against the latency measured on the first device that answers. Each device found is identified
+    from its signature registers, and the result is cached in a local file so the next start only confirms the
+    cached baud rate and addresses instead of scanning
+"""
+
+# 波特率按常见程度排序（出厂9600，其次115200） Baud rates by likelihood (factory 9600, then 115200)
+BAUD_CANDIDATES = [9600, 115200, 19200, 38400, 57600, 4800, 230400, 460800, 921600, 2400]
+LIKELY_ADDRESSES = [0x50 + i for i in range(16)] + [0x01]    # 出厂地址0x50 Factory address 0x50
+ADDRESSES = range(1, 248)               # Modbus从站地址 Modbus slave addresses
+PROBE_REG = 0x34                        # 所有型号都有的数据寄存器 Data register present on every model
+# 传输时间之外等待设备应答的时间（秒），要盖过USB转换器的延迟（FTDI默认16毫秒）和设备响应时间
+# Wait beyond the wire time (s); must cover USB adapter latency (FTDI default 16 ms) plus device turnaround
+DEVICE_SLACK = 0.05
+MIN_SLACK = 0.02                        # 校准后的最小余量（秒） Smallest slack after calibration (s)
+DEFAULT_CACHE = "wit_devices.json"      # 缓存文件 Cache file
+CACHE_VERSION = 1                       # 缓存文件版本 Cache file version
+
+# 姿态传感器（WT901C485、JY901S等寄存器相同，无法区分，需要时按返回的版本号区分）
+# Attitude sensor (WT901C485, JY901S and others share one register map; use the returned version to tell them apart)
+IMU = "WT901C485"
+WTVB01 = "WTVB01"       # 振动传感器 Vibration sensor
+WT53R = "WT53R"         # 激光测距 Laser rangefinder
+UNKNOWN = "unknown"
+
+
+class DiscoveredDevice:
+    __slots__ = ('portName', 'baud', 'ADDR', 'model', 'version')
+
+    def __init__(self, portName, baud, ADDR, model=UNKNOWN, version=None):
+        self.portName = portName            # 端口名 Port name
+        self.baud = baud                    # 波特率 Baud rate
+        self.ADDR = ADDR                    # 设备地址 Device address
+        self.model = model                  # 型号 Model
+        self.version = version              # 版本号 Version register
+
+    def __repr__(self):
+        return "%s@%s:%d 0x%02X" % (self.model, self.portName, self.baud, self.ADDR)
+
+
+class BusProber:
+    __slots__ = ('portName', 'portFactory', 'slack', 'serialPort', 'baud', 'probeCount', 'latency')
+
+    def __init__(self, portName, portFactory=None, slack=DEVICE_SLACK):
+        """
+        初始化
+        :param portName: 端口名
+        :param portFactory: 串口工厂(端口, 波特率)，None时按端口名打开串口或tcp://地址:端口
+        :param slack: 传输时间之外等待设备应答的时间（秒），扫描全部地址前按实测延迟校准
+        """
+        self.portName = portName
+        self.portFactory = portFactory
+        self.slack = slack
+        self.serialPort = None
+        self.baud = None
+        self.probeCount = 0                 # 探测次数 Probes sent
+        self.latency = None                 # 实测的最大应答延迟（秒，传输时间之外） Largest measured latency beyond wire time
+
+    def open(self, baud):
+        """
+        按波特率打开端口
+        :param baud: 波特率
+        :return: 无返回
+        """
+        if self.baud == baud and self.serialPort is not None:
+            return
+        self.close()
+        if self.portFactory is not None:
+            self.serialPort = self.portFactory(self.portName, baud)
+        else:
+            self.serialPort = openTransport(self.portName, baud, timeout=0)
+        self.baud = baud
+
+    def close(self):
+        if self.serialPort is not None:
+            self.serialPort.close()
+            self.serialPort = None
+            self.baud = None
+
+    def readRegs(self, address, regAddr, regCount):
+        """
+        读取寄存器，超时按波特率计算
+        :param address: 设备地址
+        :param regAddr: 寄存器地址
+        :param regCount: 寄存器个数
+        :return: 寄存器值列表（无符号16位）；异常应答返回[]（设备存在）；没有应答返回None
+        """
+        port = self.serialPort
+        frame = append_crc(struct.pack(">BBHH", address, 0x03, regAddr, regCount))
+        expected = regCount * 2 + 5
+        turnaround = max(MIN_TURNAROUND, TURNAROUND_CHARS * BITS_PER_BYTE / float(self.baud))
+        wire = wireTime(self.baud, len(frame), expected)
+        start = time.monotonic()
+        deadline = start + wire + self.slack
+        port.flushInput()
+        port.write(frame)
+        self.probeCount += 1
+        response = bytearray()
+        result = None
+        while time.monotonic() < deadline:
+            tlen = port.inWaiting()
+            if tlen > 0:
+                response += port.read(tlen)
+                while response and response[0] != address:     # 跳过噪声 Skip noise
+                    del response[0]
+                if len(response) >= 5 and response[1] == 0x83 and check_crc(response[:5]):
+                    result = []                 # 异常应答，设备存在 Exception response: device present
+                    break
+                if len(response) >= expected:
+                    if response[1] == 0x03 and check_crc(response[:expected]):
+                        result = [value for value in struct.unpack(">%dH" % regCount, response[3:expected - 2])]
+                    break
+            else:
+                time.sleep(0.0002)
+        if result is not None:
+            latency = max(0.0, time.monotonic() - start - wire)
+            self.latency = latency if self.latency is None else max(self.latency, latency)
+        time.sleep(turnaround)                  # 半双工换向 Half-duplex turnaround
+        return result
+
+    def probe(self, address):
+        """
+        探测地址上有没有设备
+        :param address: 设备地址
+        :return: 是否有应答
+        """
+        return self.readRegs(address, PROBE_REG, 1) is not None
+
+    def identify(self, address):
+        """
+        按特征寄存器识别型号：
+        WT53R只有距离、状态、模式几个寄存器；姿态传感器的角度与加速度方向一致；振动传感器有加速度但0x3D起是振动角度
+        Identify the model from signature registers: the WT53R only has distance/status/mode; an IMU's angles agree
+        with its acceleration vector; a vibration sensor has acceleration but 0x3D holds vibration angles
+        :param address: 设备地址
+        :return: (型号, 版本号)
+        """
+        version = self.readRegs(address, 0x2E, 1)
+        version = version[0] if version else None
+        block = self.readRegs(address, 0x34, 13)    # 加速度到角度、温度 Acceleration through angle and temperature
+        if not block:
+            return WT53R if self.readRegs(address, 0x34, 3) else UNKNOWN, version
+        signed = [value - 0x10000 if value >= 0x8000 else value for value in block]
+        ax, ay, az = (value / 32768.0 * 16 for value in signed[0:3])
+        g = math.sqrt(ax * ax + ay * ay + az * az)
+        if not 0.5 < g < 1.5:
+            return UNKNOWN, version
+        roll = math.degrees(math.atan2(ay, az))
+        rollReg = signed[9] / 32768.0 * 180
+        error = abs((roll - rollReg + 180) % 360 - 180)
+        return (IMU if error < 15 else WTVB01), version
+
+    def calibrate(self):
+        """
+        按实测的应答延迟缩小余量：实测最大延迟的2倍，不小于MIN_SLACK，不大于初始余量
+        :return: 校准后的余量（秒）
+        """
+        if self.latency is not None:
+            self.slack = min(self.slack, max(MIN_SLACK, 2 * self.latency))
+        return self.slack
+
+    def findBaud(self, bauds):
+        """
+        按顺序在每个波特率下探测常用地址
+        :param bauds: 波特率列表
+        :return: 有应答的波特率，没有返回None
+        """
+        for baud in bauds:
+            self.open(baud)
+            if any(self.probe(address) for address in LIKELY_ADDRESSES):
+                return baud
+        return None
+
+    def sweep(self, baud, addresses=ADDRESSES):
+        """
+        探测全部地址，有设备应答后按实测延迟缩小余量
+        :param baud: 波特率
+        :param addresses: 地址列表
+        :return: 有应答的地址列表
+        """
+        self.open(baud)
+        found = []
+        for address in addresses:
+            if self.probe(address):
+                found.append(address)
+                self.calibrate()            # 第一个应答后就按实测延迟校准 Calibrate as soon as a device answers
+        return found
+
+    def scan(self, bauds=BAUD_CANDIDATES, addresses=ADDRESSES):
+        """
+        扫描端口：先用常用地址确定波特率，再探测全部地址；常用地址都没有应答时逐个波特率全扫
+        :param bauds: 波特率列表（按可能性排序）
+        :param addresses: 地址列表
+        :return: 找到的设备列表
+        """
+        try:
+            baud = self.findBaud(bauds)
+            self.calibrate()                # 按第一个应答的设备校准余量 Calibrate against the devices that answered
+            candidates = [baud] if baud is not None else bauds
+            for baud in candidates:
+                found = self.sweep(baud, addresses)
+                if found:
+                    return [DiscoveredDevice(self.portName, baud, address, *self.identify(address))
+                            for address in found]
+            return []
+        finally:
+            self.close()
+
+    def confirm(self, devices):
+        """
+        确认缓存的设备还在
+        :param devices: 缓存的设备列表
+        :return: 都有应答返回True
+        """
+        try:
+            for device in devices:
+                self.open(device.baud)
+                if not self.probe(device.ADDR):
+                    return False
+            return True
+        finally:
+            self.close()
+
+
+def loadCache(fileName=DEFAULT_CACHE):
+    """
+    读取缓存文件
+    :param fileName: 文件名
+    :return: 端口名 -> 设备列表，文件不存在或版本不对时返回空字典
+    """
+    if not os.path.exists(fileName):
+        return {}
+    try:
+        with open(fileName, "r", encoding="utf-8") as f:
+            content = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    if content.get("version") != CACHE_VERSION:
+        return {}
+    return {portName: [DiscoveredDevice(portName, entry["baud"], entry["addr"], entry.get("model", UNKNOWN),
+                                        entry.get("firmware")) for entry in entries]
+            for portName, entries in content.get("ports", {}).items()}
+
+
+def saveCache(ports, fileName=DEFAULT_CACHE):
+    """
+    保存缓存文件
+    :param ports: 端口名 -> 设备列表
+    :param fileName: 文件名
+    :return: 无返回
+    """
+    content = {"version": CACHE_VERSION, "updated": datetime.datetime.now().isoformat(timespec="seconds"),
+               "ports": {portName: [{"baud": device.baud, "addr": device.ADDR, "model": device.model,
+                                     "firmware": device.version} for device in devices]
+                         for portName, devices in ports.items()}}
+    with open(fileName, "w", encoding="utf-8") as f:
+        json.dump(content, f, indent=2)
+
+
+def discover(portNames, cacheFile=DEFAULT_CACHE, rescan=False, bauds=BAUD_CANDIDATES, addresses=ADDRESSES,
+             portFactory=None, slack=DEVICE_SLACK):
+    """
+    并行发现所有端口上的设备
+    :param portNames: 端口名列表
+    :param cacheFile: 缓存文件，None为不使用缓存
+    :param rescan: 是否忽略缓存重新扫描
+    :param bauds: 波特率列表（按可能性排序）
+    :param addresses: 地址列表
+    :param portFactory: 串口工厂(端口, 波特率)，None时按端口名打开
+    :param slack: 传输时间之外等待设备应答的时间（秒）
+    :return: 端口名 -> 设备列表
+    """
+    cached = {} if cacheFile is None or rescan else loadCache(cacheFile)
+
+    def discoverPort(portName):
+        prober = BusProber(portName, portFactory, slack)
+        devices = cached.get(portName)
+        try:
+            if devices and prober.confirm(devices):
+                return devices
+            return prober.scan(bauds, addresses)
+        except (SerialException, OSError) as ex:
+            print("扫描" + portName + "失败 scan failed: " + str(ex))
+            return []
+
+    with concurrent.futures.ThreadPoolExecutor(max(1, len(portNames)), thread_name_prefix="Discover") as executor:
+        results = dict(zip(portNames, executor.map(discoverPort, portNames)))
+    if cacheFile is not None:
+        saveCache(results, cacheFile)
+    return results
@@ -0,0 +1,263 @@
+# coding:UTF-8
+import queue
+import threading
+import time
+from lib.bus.bus_sample import BusSample
+from lib.bus.command_queue import CONFIG
+from lib.bus.port_worker import PortConfig, PortWorker
+
+"""
+    多端口总线管理器 Multi-port bus manager
+    管理多个串口，每个串口一个工作线程，所有设备的数据合并到一个输出流
+    Owns several serial ports with one worker each; all devices feed one merged output stream
+"""
+
+
+class BusManager:
+    __slots__ = ('workers', 'listeners', 'output', 'lock', 'outputLock', 'dropCount', 'sampleCount',
+                 'deviceListeners')
+
+    def __init__(self, maxQueue=10000):
+        """
+        初始化
+        :param maxQueue: 输出队列长度，满了丢弃最旧的样本
+        """
+        self.workers = {}                       # 端口名 -> 工作线程 Port name -> worker
+        self.listeners = []                     # 样本回调 Sample callbacks
+        self.output = queue.Queue(maxQueue)     # 合并输出队列 Merged output queue
+        self.lock = threading.Lock()
+        self.outputLock = threading.Lock()      # 各端口线程同时发布时保护输出队列 Guards the output across port threads
+        self.dropCount = 0                      # 丢弃的样本数 Dropped samples
+        self.sampleCount = 0                    # 样本总数 Total samples
+        self.deviceListeners = {}               # 设备 -> 数据更新事件 Device -> update listener
+
+    # region 端口管理 Port management
+
+    def addPort(self, portName, baud=9600, devices=(), **options):
+        """
+        添加端口
+        :param portName: 端口名
+        :param baud: 波特率
+        :param devices: 总线上的设备模型列表
+        :param options: 其他端口配置，见PortConfig
+        :return: 端口工作线程
+        """
+        with self.lock:
+            if portName in self.workers:
+                raise ValueError("端口已存在 port exists: " + portName)
+            worker = PortWorker(PortConfig(portName, baud, **options))
+            self.workers[portName] = worker
+        for device in devices:
+            self.addDevice(portName, device)
+        return worker
+
+    def removePort(self, portName):
+        """
+        停止并删除端口
+        :param portName: 端口名
+        :return: 无返回
+        """
+        with self.lock:
+            worker = self.workers.pop(portName, None)
+        if worker is None:
+            return
+        worker.stop()
+        for device in list(worker.devices):
+            self.unbindDevice(device)
+
+    def addDevice(self, portName, device):
+        """
+        把设备加到端口，正在运行的端口下一轮开始轮询该设备
+        :param portName: 端口名
+        :param device: 设备模型
+        :return: 无返回
+        """
+        worker = self.workers[portName]
+        self.bindDevice(portName, device)
+        worker.addDevice(device)
+
+    def removeDevice(self, portName, device):
+        worker = self.workers[portName]
+        worker.removeDevice(device)
+        self.unbindDevice(device)
+
+    def bindDevice(self, portName, device):
+        """
+        注册设备数据更新事件，把数据转成带标记的样本
+        :param portName: 端口名
+        :param device: 设备模型
+        :return: 无返回
+        """
+        def onUpdate(deviceModel):
+            self.publish(BusSample(time.time_ns(), portName, deviceModel.ADDR, deviceModel.deviceName,
+                                   dict(deviceModel.deviceData)))
+
+        self.deviceListeners[device] = onUpdate
+        device.dataProcessor.onVarChanged.append(onUpdate)
+
+    def unbindDevice(self, device):
+        onUpdate = self.deviceListeners.pop(device, None)
+        if onUpdate is not None and onUpdate in device.dataProcessor.onVarChanged:
+            device.dataProcessor.onVarChanged.remove(onUpdate)
+
+    def setWatchdog(self, watchdog, portName=None):
+        """
+        给端口设置停滞监视
+        :param watchdog: 停滞监视 StallWatchdog
+        :param portName: 端口名，None为所有端口
+        :return: 无返回
+        """
+        for name, worker in list(self.workers.items()):
+            if portName is None or name == portName:
+                worker.setWatchdog(watchdog)
+
+    def startPort(self, portName):
+        return self.workers[portName].start()
+
+    def stopPort(self, portName):
+        self.workers[portName].stop()
+
+    def reconfigurePort(self, portName, **options):
+        """
+        修改端口配置，只重启该端口，其他端口不受影响
+        :param portName: 端口名
+        :param options: 要修改的配置，见PortConfig（baud、mode、pollReg、pollCount、interval、timeout、portFactory）
+        :return: 无返回
+        """
+        worker = self.workers[portName]
+        running = worker.isRunning()
+        if running:
+            worker.stop()
+        for key, value in options.items():
+            if key == "portName" or not hasattr(worker.config, key):
+                raise ValueError("不支持的配置 unsupported option: " + key)
+            setattr(worker.config, key, value)
+        worker.commands.baud = worker.config.baud   # 换向间隔和设备的串口配置跟着改 Keep turnaround and devices in step
+        with worker.lock:
+            for device in worker.devices:
+                device.serialConfig.baud = worker.config.baud
+        if running:
+            worker.start()
+
+    def start(self):
+        """
+        启动所有端口
+        :return: 无返回
+        """
+        for worker in list(self.workers.values()):
+            worker.start()
+
+    def stop(self):
+        """
+        停止所有端口
+        :return: 无返回
+        """
+        for worker in list(self.workers.values()):
+            worker.stop()
+
+    # endregion
+
+    # region 指令 Requests
+
+    def findPort(self, address):
+        """
+        查找设备所在的端口
+        :param address: 设备地址
+        :return: 端口名，没有找到返回None
+        """
+        for name, worker in list(self.workers.items()):
+            with worker.lock:
+                if any(device.ADDR == address for device in worker.devices):
+                    return name
+        return None
+
+    def request(self, portName, frame, responseLength, timeout=None, priority=CONFIG, deadline=None, retries=0):
+        """
+        提交一条Modbus指令，由端口工作线程按优先级插在轮询之间执行
+        :param portName: 端口名
+        :param frame: 含CRC的RTU指令
+        :param responseLength: 正常应答的长度（含CRC）
+        :param timeout: 应答超时（秒）
+        :param priority: 优先级 CONTROL/CONFIG/POLL
+        :param deadline: 截止时间（time.monotonic），None为不限
+        :param retries: 超时后最多重试的次数
+        :return: Future，结果为含CRC的应答帧
+        """
+        return self.workers[portName].request(frame, responseLength, timeout, priority, deadline, retries)
+
+    def getQueueStatus(self):
+        """
+        获取各端口的指令队列统计
+        :return: 端口名 -> 排队数、获得总线次数、重试次数、被预算拒绝的重试、取消数、过期数、排队时间
+        """
+        return {name: worker.commands.getStatus() for name, worker in list(self.workers.items())}
+
+    # endregion
+
+    # region 输出流 Output stream
+
+    def publish(self, sample):
+        """
+        发布样本到合并输出流
+        :param sample: 样本
+        :return: 无返回
+        """
+        for fun in self.listeners:
+            fun(sample)
+        # 丢弃最旧的和放入新的之间不能被别的端口线程插入 No other port thread may fill the freed slot
+        with self.outputLock:
+            self.sampleCount += 1
+            try:
+                self.output.put_nowait(sample)
+            except queue.Full:                  # 队列满了丢弃最旧的 Drop the oldest when full
+                try:
+                    self.output.get_nowait()
+                except queue.Empty:
+                    pass
+                self.dropCount += 1
+                self.output.put_nowait(sample)
+
+    def get(self, timeout=None):
+        """
+        从合并输出流取一个样本
+        :param timeout: 超时时间（秒），None为一直等待
+        :return: 样本，超时返回None
+        """
+        try:
+            return self.output.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def getStatus(self):
+        """
+        获取各端口状态
+        :return: 端口名 -> (是否运行, 设备数, 轮询次数, 超时次数)
+        """
+        return {name: (worker.isRunning(), len(worker.devices), worker.pollCount, worker.timeoutCount)
+                for name, worker in self.workers.items()}
+
+    def getConnectionStatus(self):
+        """
+        获取各端口的连接状态
+        :return: 端口名 -> 断线重连统计，见ConnectionSupervisor.getStatus
+        """
+        return {name: worker.connection.getStatus() for name, worker in self.workers.items()}
+
+    def getRttStatus(self):
+        """
+        获取各设备的应答时间统计
+        :return: 端口名 -> {设备地址: 应答时间统计}，见RttEstimator.getStatus
+        """
+        return {name: {device.ADDR: device.rtt.getStatus() for device in list(worker.devices)}
+                for name, worker in self.workers.items()}
+
+    def getCacheStatus(self):
+        """
+        获取各设备的寄存器缓存统计
+        :return: 端口名 -> {设备地址: 缓存统计}，见RegisterCache.getStatus
+        """
+        return {name: {device.ADDR: device.registerCache.getStatus() for device in list(worker.devices)
+                       if device.registerCache is not None}
+                for name, worker in self.workers.items()}
+
+    # endregion
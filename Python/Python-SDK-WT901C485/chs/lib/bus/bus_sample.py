@@ -0,0 +1,36 @@
+# coding:UTF-8
+"""
+    总线数据样本 Bus sample
+    合并输出流中的一条记录，带端口和设备标记
+    One record of the merged output stream, tagged with port and device
+"""
+
+
+class BusSample:
+    __slots__ = ('timestamp', 'portName', 'ADDR', 'deviceName', 'data')
+
+    def __init__(self, timestamp, portName, ADDR, deviceName, data):
+        """
+        初始化
+        :param timestamp: 主机时间（纳秒，time.time_ns）
+        :param portName: 端口名
+        :param ADDR: 设备地址
+        :param deviceName: 设备名称
+        :param data: 设备数据字典的副本
+        """
+        self.timestamp = timestamp      # 主机时间 Host timestamp (ns)
+        self.portName = portName        # 端口名 Port name
+        self.ADDR = ADDR                # 设备地址 Device address
+        self.deviceName = deviceName    # 设备名称 Device name
+        self.data = data                # 设备数据 Device data
+
+    def get(self, key):
+        """
+        获得数据
+        :param key: 数据key
+        :return: 返回数据值，不存在的数据key则返回None
+        """
+        return self.data.get(key)
+
+    def __repr__(self):
+        return "BusSample({}, {}, 0x{:02x}, {})".format(self.timestamp, self.portName, self.ADDR, self.data)
@@ -0,0 +1,409 @@
+# coding:UTF-8
+import collections
+import concurrent.futures
+import heapq
+import itertools
+import threading
+import time
+
+"""
+    总线指令队列 Bus command queue
+    一条总线一个队列：所有要占用总线的操作（校准、配置读写、轮询）先排队，按优先级（控制 > 配置 > 轮询）、截止时间、
+    先来后到依次获得总线，同一时刻只有一个操作在收发，两次操作之间留出半双工的换向间隔（3.5个字符）。
+    排队的操作可以取消，超过截止时间自动放弃；失败后按次数重试，重试还受每个时间窗口的重试预算限制，
+    一个坏设备不会把总线时间都用在重试上。高速轮询每个设备单独排一次队，配置操作最多等一个设备的轮询
+    One queue per bus: every operation that needs the bus (calibration, config reads/writes, polls) queues first
+    and gets the bus in order of priority (control > config > poll), deadline and arrival, so only one operation
+    talks at a time, with the half-duplex turnaround (3.5 characters) between operations. Queued operations can be
+    cancelled and are dropped once their deadline passes; failures are retried a bounded number of times, further
+    limited by a per-window retry budget so one bad device cannot spend the bus on retries. High-rate polls queue
+    once per device, so a config operation waits for at most one device's poll
+"""
+
+CONTROL = 0     # 控制指令：解锁、保存、校准 Control: unlock, save, calibration
+CONFIG = 1      # 配置读写 Config reads and writes
+POLL = 2        # 数据轮询 Data polls
+
+BITS_PER_BYTE = 10          # 起始位+8数据位+停止位 Start + 8 data + stop bits
+TURNAROUND_CHARS = 3.5      # 帧间隔字符数 Inter-frame gap in characters
+MIN_TURNAROUND = 0.00175    # 高波特率时的最短帧间隔（Modbus规定19200以上为1.75毫秒） Fixed gap above 19200 baud
+
+
+class Command:
+    __slots__ = ('priority', 'deadline', 'seq', 'retries', 'attempts', 'frame', 'responseLength', 'timeout',
+                 'future', 'event', 'granted', 'cancelled')
+
+    def __init__(self, priority, deadline, seq, retries=0, frame=None, responseLength=0, timeout=None):
+        """
+        初始化
+        :param priority: 优先级 CONTROL/CONFIG/POLL
+        :param deadline: 截止时间（time.monotonic），None为不限
+        :param seq: 序号，同优先级同截止时间按先来后到
+        :param retries: 失败后最多重试的次数
+        :param frame: 交给执行线程发送的指令，None为排队者自己使用总线
+        :param responseLength: 正常应答的长度（含CRC）
+        :param timeout: 应答超时（秒）
+        """
+        self.priority = priority
+        self.deadline = deadline
+        self.seq = seq
+        self.retries = retries
+        self.attempts = 0                   # 已执行次数 Attempts made
+        self.frame = frame
+        self.responseLength = responseLength
+        self.timeout = timeout
+        # 交给执行线程的指令通过Future返回应答 Delegated commands answer through a Future
+        self.future = None if frame is None else concurrent.futures.Future()
+        self.event = threading.Event()      # 获得总线 Set when granted the bus
+        self.granted = False
+        self.cancelled = False
+
+    def __lt__(self, other):
+        return self.sortKey() < other.sortKey()
+
+    def sortKey(self):
+        return self.priority, float("inf") if self.deadline is None else self.deadline, self.seq
+
+    def isExpired(self, now):
+        return self.deadline is not None and now >= self.deadline
+
+
+class RetryBudget:
+    __slots__ = ('limit', 'window', 'spent', 'deniedCount', 'lock')
+
+    def __init__(self, limit=10, window=1.0):
+        """
+        初始化
+        :param limit: 每个时间窗口最多的重试次数
+        :param window: 时间窗口（秒）
+        """
+        self.limit = limit
+        self.window = window
+        self.spent = collections.deque()    # 窗口内的重试时间 Retry times inside the window
+        self.deniedCount = 0                # 因预算用完没有重试的次数 Retries refused by the budget
+        self.lock = threading.Lock()
+
+    def allow(self):
+        """
+        申请一次重试
+        :return: 预算内返回True并记一次，用完返回False
+        """
+        now = time.monotonic()
+        with self.lock:
+            while self.spent and now - self.spent[0] >= self.window:
+                self.spent.popleft()
+            if len(self.spent) >= self.limit:
+                self.deniedCount += 1
+                return False
+            self.spent.append(now)
+            return True
+
+    def getRemaining(self):
+        now = time.monotonic()
+        with self.lock:
+            return self.limit - sum(1 for t in self.spent if now - t < self.window)
+
+
+class CommandQueue:
+    __slots__ = ('name', 'baud', 'heap', 'lock', 'current', 'owner', 'quietUntil', 'counter', 'budget', 'activity',
+                 'grantCount', 'retryCount', 'cancelCount', 'expireCount', 'waitCount', 'waitTime', 'maxWait')
+
+    def __init__(self, name="", baud=9600, retryBudget=None):
+        """
+        初始化
+        :param name: 总线名（端口名）
+        :param baud: 波特率，用于换向间隔
+        :param retryBudget: 重试预算 RetryBudget，None为每秒最多10次
+        """
+        self.name = name
+        self.baud = baud
+        self.heap = []                      # 排队的指令 Queued commands
+        self.lock = threading.Lock()
+        self.current = None                 # 正在使用总线的指令 Command holding the bus
+        self.owner = None                   # 正在使用总线的线程 Thread holding the bus
+        self.quietUntil = 0.0               # 这之前总线不能发送（换向间隔） No sending before this (turnaround)
+        self.counter = itertools.count()
+        self.budget = RetryBudget() if retryBudget is None else retryBudget
+        self.activity = threading.Event()   # 有新指令时唤醒空闲的执行线程 Wakes an idle executor on new commands
+        self.grantCount = 0                 # 获得总线的次数 Times the bus was granted
+        self.retryCount = 0                 # 重试次数 Retries
+        self.cancelCount = 0                # 取消的指令数 Cancelled commands
+        self.expireCount = 0                # 超过截止时间的指令数 Commands past their deadline
+        self.waitCount = 0                  # 自己使用总线的次数 Turns taken through wait
+        self.waitTime = 0.0                 # 排队总时间（秒） Total queueing time (s)
+        self.maxWait = 0.0                  # 最长排队时间（秒） Longest queueing time (s)
+
+    def getTurnaround(self):
+        """
+        半双工换向间隔：3.5个字符，最短1.75毫秒
+        :return: 秒
+        """
+        return max(MIN_TURNAROUND, TURNAROUND_CHARS * BITS_PER_BYTE / float(self.baud))
+
+    # region 排队 Queueing
+
+    def enqueue(self, priority=CONFIG, deadline=None, retries=0):
+        """
+        排队等待自己使用总线，获得后用wait返回，用完调用release
+        :param priority: 优先级 CONTROL/CONFIG/POLL
+        :param deadline: 截止时间（time.monotonic），None为不限
+        :param retries: 失败后最多重试的次数
+        :return: 指令
+        """
+        command = Command(priority, deadline, next(self.counter), retries)
+        self.push(command)
+        return command
+
+    def submit(self, frame, responseLength, timeout, priority=CONFIG, deadline=None, retries=0):
+        """
+        提交一条指令，由执行线程（端口工作线程）轮到时发送
+        :param frame: 含CRC的RTU指令
+        :param responseLength: 正常应答的长度（含CRC）
+        :param timeout: 应答超时（秒）
+        :param priority: 优先级 CONTROL/CONFIG/POLL
+        :param deadline: 截止时间（time.monotonic），None为不限
+        :param retries: 超时后最多重试的次数
+        :return: 指令，应答通过command.future返回，command.future.cancel()或cancel取消
+        """
+        command = Command(priority, deadline, next(self.counter), retries, bytes(frame), responseLength, timeout)
+        self.push(command)
+        return command
+
+    def push(self, command):
+        with self.lock:
+            heapq.heappush(self.heap, command)
+            self.grantNext()
+        self.activity.set()
+
+    def grantNext(self):
+        """
+        总线空闲时交给排在最前面的指令（调用时已持有锁）
+        :return: 无返回
+        """
+        if self.current is not None:
+            return
+        now = time.monotonic()
+        if any(command.isExpired(now) for command in self.heap):   # 清掉过期的指令 Drop expired commands
+            live = []
+            for command in self.heap:
+                if command.isExpired(now) and not command.cancelled:
+                    self.finish(command, TimeoutError("超过截止时间 deadline passed"))
+                    self.expireCount += 1
+                else:
+                    live.append(command)
+            heapq.heapify(live)
+            self.heap = live
+        while self.heap:
+            command = heapq.heappop(self.heap)
+            if command.cancelled or (command.future is not None and command.future.cancelled()):
+                continue
+            command.granted = True
+            self.current = command
+            self.grantCount += 1
+            command.event.set()
+            return
+
+    def finish(self, command, error):
+        """
+        放弃一条没有执行的指令
+        :param command: 指令
+        :param error: 交给等待者的异常
+        :return: 无返回
+        """
+        command.cancelled = True
+        if command.future is not None:
+            if command.future.set_running_or_notify_cancel():
+                command.future.set_exception(error)
+        command.event.set()
+
+    def cancel(self, command):
+        """
+        取消排队的指令，已经在执行的指令不受影响
+        :param command: 指令
+        :return: 是否取消
+        """
+        with self.lock:
+            if command.cancelled or (command.granted and self.owner is not None and self.current is command):
+                return False
+            if command.future is not None and not command.future.cancel():
+                return False
+            command.cancelled = True
+            self.cancelCount += 1
+            command.event.set()
+            if self.current is command:         # 获得总线但还没开始 Granted but not started yet
+                self.current = None
+                self.grantNext()
+            return True
+
+    def wait(self, command, idle=None):
+        """
+        等待获得总线，并等过换向间隔
+        :param command: enqueue返回的指令
+        :param idle: 等待期间反复调用的函数（端口工作线程在等待时接收数据、执行交给它的指令），None为阻塞等待
+        :return: 是否获得总线，取消或超过截止时间返回False
+        """
+        queued = time.monotonic()
+        while not command.event.is_set():
+            if command.isExpired(time.monotonic()):
+                with self.lock:
+                    if not command.granted:
+                        command.cancelled = True
+                        self.expireCount += 1
+                        return False
+                break
+            if idle is not None:
+                idle()
+            else:
+                rest = 0.05 if command.deadline is None else command.deadline - time.monotonic()
+                command.event.wait(max(0.0, min(rest, 0.05)))
+        with self.lock:
+            if command.cancelled or not command.granted:
+                return False
+            self.owner = threading.get_ident()
+        waited = time.monotonic() - queued
+        self.waitCount += 1
+        self.waitTime += waited
+        self.maxWait = max(self.maxWait, waited)
+        self.waitQuiet()
+        return True
+
+    def waitQuiet(self):
+        rest = self.quietUntil - time.monotonic()
+        if rest > 0:
+            time.sleep(rest)
+
+    def release(self, command, busyFor=0.0):
+        """
+        用完总线，留出换向间隔后交给下一条指令
+        :param command: 指令
+        :param busyFor: 另外要留出的时间（秒），如没有等待的写入应答
+        :return: 无返回
+        """
+        with self.lock:
+            self.quietUntil = time.monotonic() + self.getTurnaround() + busyFor
+            if self.current is command:
+                self.current = None
+                self.owner = None
+            self.grantNext()
+
+    def isIdle(self):
+        return self.current is None and not self.heap
+
+    def waitActivity(self, timeout):
+        """
+        空闲时等待新指令
+        :param timeout: 最长等待时间（秒）
+        :return: 无返回
+        """
+        if self.activity.wait(timeout):
+            self.activity.clear()
+
+    # endregion
+
+    # region 执行 Running
+
+    def run(self, action, priority=CONFIG, deadline=None, retries=0, busyFor=0.0, idle=None):
+        """
+        排队使用总线执行一个操作，结果为空（超时）时在重试预算内重试
+        :param action: 使用总线的操作，返回结果
+        :param priority: 优先级 CONTROL/CONFIG/POLL
+        :param deadline: 截止时间（time.monotonic），None为不限
+        :param retries: 结果为空时最多重试的次数
+        :param busyFor: 操作后另外要留出的时间（秒）
+        :param idle: 等待期间反复调用的函数
+        :return: 操作的结果，取消或超过截止时间返回None
+        """
+        if self.owner == threading.get_ident():    # 已经持有总线（操作内嵌套调用） Already holding the bus
+            return action()
+        command = self.enqueue(priority, deadline, retries)
+        if not self.wait(command, idle):
+            return None
+        try:
+            while True:
+                command.attempts += 1
+                result = action()
+                if result or not self.shouldRetry(command):
+                    return result
+                self.quietUntil = time.monotonic() + self.getTurnaround()
+                self.waitQuiet()
+        finally:
+            self.release(command, busyFor)
+
+    def shouldRetry(self, command):
+        """
+        失败后是否重试：还有重试次数、没过截止时间、重试预算没用完
+        :param command: 指令
+        :return: 是否重试
+        """
+        if command.attempts > command.retries or command.cancelled or command.isExpired(time.monotonic()):
+            return False
+        if not self.budget.allow():
+            return False
+        self.retryCount += 1
+        return True
+
+    def executeGranted(self, execute):
+        """
+        执行线程调用：如果获得总线的是交给执行线程的指令，就发送它
+        :param execute: 执行函数(指令)，返回应答帧，超时返回None
+        :return: 是否执行了指令
+        """
+        with self.lock:
+            command = self.current
+            if command is None or command.future is None or self.owner is not None:
+                return False
+            if not command.future.set_running_or_notify_cancel():   # 已取消 Cancelled
+                self.cancelCount += 1
+                self.current = None
+                self.grantNext()
+                return True
+            self.owner = threading.get_ident()
+        self.waitQuiet()
+        try:
+            while True:
+                command.attempts += 1
+                response = execute(command)
+                if response is not None or not self.shouldRetry(command):
+                    break
+                self.quietUntil = time.monotonic() + self.getTurnaround()
+                self.waitQuiet()
+        except Exception as ex:
+            command.future.set_exception(ex)
+        else:
+            if response is None:
+                command.future.set_exception(TimeoutError("应答超时 response timeout"))
+            else:
+                command.future.set_result(response)
+        finally:
+            self.release(command)
+        return True
+
+    def failAll(self, error):
+        """
+        放弃所有排队的指令（端口停止时）
+        :param error: 交给等待者的异常
+        :return: 无返回
+        """
+        with self.lock:
+            for command in self.heap:
+                if not command.cancelled:
+                    self.finish(command, error)
+            self.heap = []
+            command = self.current
+            if command is not None and self.owner is None:
+                self.finish(command, error)
+                self.current = None
+
+    # endregion
+
+    def getStatus(self):
+        """
+        获取统计
+        :return: 排队数、获得总线次数、重试次数、被预算拒绝的重试、取消数、过期数、平均和最长排队时间（秒）
+        """
+        with self.lock:
+            queued = sum(1 for command in self.heap if not command.cancelled)
+        return {"queued": queued, "grants": self.grantCount, "retries": self.retryCount,
+                "retriesDenied": self.budget.deniedCount, "cancelled": self.cancelCount,
+                "expired": self.expireCount, "avgWait": self.waitTime / self.waitCount if self.waitCount else 0.0,
+                "maxWait": self.maxWait, "turnaround": self.getTurnaround()}
@@ -0,0 +1,402 @@
+# coding:UTF-8
+import concurrent.futures
+import threading
+import time
+from serial import SerialException
+from lib.bus.command_queue import CommandQueue, CONFIG, POLL
+from lib.transport.connection_supervisor import ConnectionSupervisor
+from lib.transport.transport import openTransport
+
+"""
+    端口工作线程 Port worker
+    一个串口一个线程：负责打开端口、轮询总线上的设备、把收到的数据交给对应设备的协议解析器
+    One thread per serial port: opens the port, polls the devices on the bus and feeds the replies to their resolvers
+    轮询和其他线程的读写都经过端口的指令队列，按优先级轮流使用总线；其他线程使用总线时由工作线程接收数据
+    Polls and other threads' reads/writes all go through the port's command queue and take turns on the bus by
+    priority; while another thread holds the bus the worker keeps receiving for it
+"""
+
+
+class PortConfig:
+    __slots__ = ('portName', 'baud', 'mode', 'pollReg', 'pollCount', 'interval', 'timeout', 'portFactory')
+
+    def __init__(self, portName, baud=9600, mode="poll", pollReg=0x30, pollCount=41, interval=0.0, timeout=0.15,
+                 portFactory=None):
+        """
+        初始化
+        :param portName: 端口名
+        :param baud: 波特率
+        :param mode: "poll" 主站轮询（Modbus），"stream" 被动接收主动回传数据（维特协议）
+        :param pollReg: 轮询起始寄存器
+        :param pollCount: 轮询寄存器个数
+        :param interval: 一轮轮询的最小周期（秒）
+        :param timeout: 每个应答的最长超时时间（秒），实际按各设备的应答时间估计缩短
+        :param portFactory: 串口工厂(端口, 波特率)，None时按端口名打开串口或tcp://地址:端口
+        """
+        self.portName = portName
+        self.baud = baud
+        self.mode = mode
+        self.pollReg = pollReg
+        self.pollCount = pollCount
+        self.interval = interval
+        self.timeout = timeout
+        self.portFactory = portFactory
+
+
+class PortWorker:
+    __slots__ = ('config', 'devices', 'serialPort', 'thread', 'running', 'lock', 'pollCount', 'timeoutCount',
+                 'commands', 'requestCount', 'connection', 'watchdog')
+
+    def __init__(self, config, devices=()):
+        """
+        初始化
+        :param config: 端口配置 PortConfig
+        :param devices: 总线上的设备模型列表
+        """
+        self.config = config            # 端口配置 Port config
+        self.devices = list(devices)    # 总线上的设备 Devices on the bus
+        self.serialPort = None          # 串口 Serial port
+        self.thread = None              # 工作线程 Worker thread
+        self.running = False            # 是否运行 Whether running
+        self.lock = threading.Lock()    # 设备列表锁 Device list lock
+        self.pollCount = 0              # 轮询次数 Poll count
+        self.timeoutCount = 0           # 超时次数 Timeout count
+        self.commands = CommandQueue(config.portName, config.baud)     # 总线指令队列 Bus command queue
+        self.requestCount = 0           # 执行的指令数 Requests run
+        self.connection = ConnectionSupervisor(config.portName)    # 断线重连 Reconnects and downtime
+        self.watchdog = None            # 停滞监视，None为不监视 Stall watchdog, None when off
+
+    def isRunning(self):
+        return self.running and self.thread is not None and self.thread.is_alive()
+
+    def openPort(self):
+        """
+        打开串口并交给总线上的设备
+        :return: 无返回
+        """
+        config = self.config
+        self.commands.baud = config.baud        # 换向间隔按当前波特率 Turnaround follows the current baud rate
+        if config.portFactory is not None:
+            self.serialPort = config.portFactory(config.portName, config.baud)
+        else:
+            self.serialPort = openTransport(config.portName, config.baud, timeout=config.timeout)
+        with self.lock:
+            for device in self.devices:
+                self.attach(device)
+
+    def attach(self, device):
+        """
+        把设备挂到本端口（共用串口，不启动设备自己的读取线程）
+        :param device: 设备模型
+        :return: 无返回
+        """
+        device.serialConfig.portName = self.config.portName
+        device.serialConfig.baud = self.config.baud
+        device.serialPort = self.serialPort
+        device.commandQueue = self.commands     # 设备的读写和轮询共用一个队列 Shares the bus queue with the polls
+        device.isOpen = self.serialPort is not None
+
+    def addDevice(self, device):
+        with self.lock:
+            self.devices.append(device)
+            if self.running:
+                self.attach(device)
+        if self.watchdog is not None:
+            self.watchdog.watch(device)
+
+    def setWatchdog(self, watchdog):
+        """
+        设置停滞监视：停滞的设备按探测周期轮询，有应答后恢复
+        :param watchdog: 停滞监视 StallWatchdog，None为取消
+        :return: 无返回
+        """
+        with self.lock:
+            devices = list(self.devices)
+        if self.watchdog is not None and self.watchdog is not watchdog:    # 换掉旧的监视 Detach the old watchdog
+            for device in devices:
+                self.watchdog.unwatch(device)
+        if watchdog is not None:
+            for device in devices:
+                watchdog.watch(device)
+        self.watchdog = watchdog
+
+    def removeDevice(self, device):
+        with self.lock:
+            if device in self.devices:
+                self.devices.remove(device)
+        if self.watchdog is not None:
+            self.watchdog.unwatch(device)
+        device.isOpen = False
+        device.commandQueue = CommandQueue(device.serialConfig.portName, device.serialConfig.baud)
+
+    def start(self):
+        """
+        启动工作线程
+        :return: 是否启动成功
+        """
+        if self.isRunning():
+            return True
+        if self.thread is not None and self.thread.is_alive():     # 上次停止时没有退出 Did not exit on stop
+            print("端口" + self.config.portName + "的工作线程还没有退出")
+            return False
+        try:
+            self.openPort()
+        except SerialException:
+            print("打开" + self.config.portName + "失败")
+            return False
+        self.connection.acquire()
+        self.connection.markUp()
+        self.running = True
+        self.thread = threading.Thread(target=self.run, name="Port-" + self.config.portName, daemon=True)
+        self.thread.start()
+        return True
+
+    def stop(self):
+        """
+        停止工作线程并关闭串口
+        :return: 无返回
+        """
+        with self.lock:
+            self.running = False
+        self.connection.release()       # 打断重连等待 Interrupt a reconnect wait
+        if self.thread is not None and self.thread is not threading.current_thread():
+            self.thread.join(2)
+        # 没有退出的线程保留引用，退出前不能重新启动，避免两个线程读同一个端口
+        # A thread that has not exited is kept so start() refuses to run a second reader on the port
+        if self.thread is not None and not self.thread.is_alive():
+            self.thread = None
+        if self.serialPort is not None:
+            self.serialPort.close()
+        with self.lock:
+            for device in self.devices:
+                device.isOpen = False
+        self.commands.failAll(ConnectionError("端口已停止 port stopped: " + self.config.portName))
+
+    def run(self):
+        """
+        工作线程
+        :return:
+        """
+        print("启动端口" + self.config.portName)
+        while self.running:
+            try:
+                if self.config.mode == "stream":
+                    self.receive()
+                    if self.watchdog is not None:
+                        self.watchdog.check()
+                else:
+                    cycleStart = time.monotonic()
+                    self.pollOnce()
+                    self.idleUntil(cycleStart + self.config.interval)     # 等待期间照样执行指令 Serve the queue
+            except (SerialException, OSError) as ex:
+                if self.running:
+                    self.reconnect(ex)      # 端口断开，在本线程重连 Port lost: reconnect on this thread
+            except Exception as ex:
+                print(ex)
+                time.sleep(0.1)
+        print("端口" + self.config.portName + "已停止")
+
+    def reconnect(self, error):
+        """
+        端口断开后按退避间隔重新打开，成功后设备列表和排队的指令不变，继续原来的轮询
+        :param error: 断开的原因
+        :return: 是否重连成功
+        """
+        print("端口断开 port lost: " + self.config.portName + " " + str(error))
+        self.connection.markDown(error)
+        with self.lock:
+            for device in self.devices:
+                device.isOpen = False
+        try:
+            self.serialPort.close()
+        except (SerialException, OSError):
+            pass
+        while self.running and self.connection.waitRetry():
+            try:
+                self.openPort()             # 重新交给总线上的设备 Re-attaches the devices
+            except (SerialException, OSError) as ex:
+                self.connection.lastError = str(ex)
+                continue
+            self.connection.markUp()
+            print("端口已恢复 port restored: " + self.config.portName)
+            return True
+        return False
+
+    def receive(self):
+        """
+        被动接收：读到的数据交给端口上的所有设备
+        :return: 无返回
+        """
+        tlen = self.serialPort.inWaiting()
+        if tlen > 0:
+            data = self.serialPort.read(tlen)
+            with self.lock:
+                devices = list(self.devices)
+            for device in devices:
+                device.onDataReceived(data)
+        else:
+            time.sleep(0.001)
+
+    def pollOnce(self):
+        """
+        轮询一轮总线上的所有设备
+        :return: 无返回
+        """
+        with self.lock:
+            devices = list(self.devices)
+        if self.watchdog is not None:           # 跳过停滞的设备 Skip stalled devices
+            devices = self.watchdog.schedule(devices)
+        if len(devices) == 0:
+            self.idleUntil(time.monotonic() + 0.05)
+            return
+        if hasattr(self.serialPort, "submit"):     # 可流水线的传输 Pipelined transport
+            self.commands.run(lambda: self.pollPipelined(devices), POLL, idle=self.idle)
+            return
+        for device in devices:                  # 每个设备排一次队，优先的指令可以插进来 Queue per device
+            if not self.running:
+                break
+            self.commands.run(lambda device=device: self.pollDevice(device), POLL, idle=self.idle)
+
+    def pollPipelined(self, devices):
+        """
+        一次提交所有设备的读取指令，不等前一个应答（RTU over TCP），应答按顺序交给各设备
+        :param devices: 设备模型列表
+        :return: 无返回
+        """
+        config = self.config
+        expected = config.pollCount * 2 + 5     # 应答长度 Response length
+        futures = []
+        for device in devices:
+            cmd = device.protocolResolver.get_readbytes(device.ADDR, config.pollReg, config.pollCount)
+            futures.append((device, self.serialPort.submit(bytes(cmd), expected, config.timeout)))
+            self.pollCount += 1
+        for device, future in futures:
+            try:
+                response = future.result()
+            except (TimeoutError, ConnectionError):
+                self.timeoutCount += 1
+                continue
+            device.onDataReceived(response)
+
+    def pollDevice(self, device):
+        """
+        读取一个设备的数据寄存器，应答交给该设备的协议解析器
+        :param device: 设备模型
+        :return: 是否收到完整应答
+        """
+        config = self.config
+        cmd = device.protocolResolver.get_readbytes(device.ADDR, config.pollReg, config.pollCount)
+        expected = config.pollCount * 2 + 5     # 应答长度 Response length
+        # 按设备的应答时间估计设置超时，最长为端口配置的超时 Per-device RTT timeout, at most the configured one
+        timeout = device.rtt.timeout(config.baud, len(cmd), expected, config.timeout)
+        start = time.monotonic()
+        self.serialPort.write(cmd)
+        self.pollCount += 1
+        received = 0
+        deadline = start + timeout
+        while received < expected and time.monotonic() < deadline:
+            tlen = self.serialPort.inWaiting()
+            if tlen > 0:
+                data = self.serialPort.read(tlen)
+                received += len(data)
+                device.onDataReceived(data)
+            else:
+                time.sleep(0.0005)
+        if received < expected:
+            self.timeoutCount += 1
+            device.rtt.onTimeout()
+            return False
+        device.rtt.update(time.monotonic() - start, config.baud, len(cmd), expected)
+        return True
+
+    # region 指令 Requests
+
+    def request(self, frame, responseLength, timeout=None, priority=CONFIG, deadline=None, retries=0):
+        """
+        提交一条Modbus指令，由工作线程按优先级插在轮询之间执行，其他线程（如守护进程的客户端）不用直接碰串口
+        :param frame: 含CRC的RTU指令
+        :param responseLength: 正常应答的长度（含CRC）
+        :param timeout: 应答超时（秒），None使用端口配置
+        :param priority: 优先级 CONTROL/CONFIG/POLL
+        :param deadline: 截止时间（time.monotonic），过了还没执行就放弃，None为不限
+        :param retries: 超时后最多重试的次数（受重试预算限制）
+        :return: Future，结果为含CRC的应答帧；超时为TimeoutError；future.cancel()取消排队的指令
+        """
+        # 与stop互斥：停止后提交的指令直接失败，停止前提交的由failAll结束 Exclusive with stop: commands submitted
+        # after it fail at once, commands submitted before it are ended by failAll
+        with self.lock:
+            if self.running and self.config.mode != "stream":
+                return self.commands.submit(frame, responseLength,
+                                            self.config.timeout if timeout is None else timeout,
+                                            priority, deadline, retries).future
+        future = concurrent.futures.Future()
+        future.set_exception(ConnectionError("端口未在轮询 port not polling: " + self.config.portName))
+        return future
+
+    def idle(self):
+        """
+        等待总线期间调用（在工作线程中）：轮到交给本线程的指令就执行，否则接收数据（别的线程正在使用总线）
+        :return: 无返回
+        """
+        if not self.commands.executeGranted(self.execute):
+            self.receive()
+
+    def idleUntil(self, end):
+        """
+        轮询间隔：执行排队的指令，没有指令时等待
+        :param end: 结束时间（time.monotonic）
+        :return: 无返回
+        """
+        while self.running:
+            rest = end - time.monotonic()
+            if rest <= 0:
+                break
+            if self.commands.isIdle():
+                self.commands.waitActivity(rest)
+            else:
+                self.idle()
+
+    def execute(self, command):
+        """
+        执行交给工作线程的指令
+        :param command: 指令
+        :return: 应答帧，超时返回None
+        """
+        self.requestCount += 1
+        response = self.transact(command.frame, command.responseLength, command.timeout)
+        if response is None:
+            self.timeoutCount += 1
+        return response
+
+    def transact(self, frame, responseLength, timeout):
+        """
+        发送指令并读取一个完整应答
+        :param frame: 含CRC的RTU指令
+        :param responseLength: 正常应答的长度（含CRC）
+        :param timeout: 应答超时（秒）
+        :return: 应答帧，超时返回None
+        """
+        port = self.serialPort
+        if hasattr(port, "submit"):
+            try:
+                return port.submit(frame, responseLength, timeout).result()
+            except TimeoutError:
+                return None
+        port.flushInput()                       # 丢弃轮询的残余数据 Drop poll leftovers
+        port.write(frame)
+        response = bytearray()
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            tlen = port.inWaiting()
+            if tlen > 0:
+                response += port.read(tlen)
+                while response and response[0] != frame[0]:    # 跳过其他设备的数据 Skip other devices' bytes
+                    del response[0]
+                expected = 5 if len(response) >= 2 and response[1] & 0x80 else responseLength
+                if len(response) >= expected:
+                    return bytes(response[:expected])
+            else:
+                time.sleep(0.0005)
+        return None
+
+    # endregion
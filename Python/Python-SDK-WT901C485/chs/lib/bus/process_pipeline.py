@@ -0,0 +1,265 @@
+# coding:UTF-8
+import multiprocessing
+import queue
+import signal
+import threading
+import time
+from serial import SerialException
+from lib.bus.bus_sample import BusSample
+from lib.bus.shm_ring_buffer import ShmRingBuffer
+from lib.transport.transport import openTransport
+
+"""
+    多进程解析流水线 Process-pool decoding pipeline
+    主进程每个端口只有一个最简单的读取线程，把原始字节拷贝到共享内存环形缓冲区；
+    每个端口一个解析进程，运行协议解析器和数据回调，可以用满多核
+    The main process keeps one minimal reader per port that copies raw bytes into a shared-memory ring;
+    one decoding process per port runs the resolvers and callbacks, so all cores can be used
+"""
+
+
+def decodeWorker(portName, ringName, resolverClass, processorClass, devices, callback, output, stopEvent, lostBytes):
+    """
+    解析进程入口
+    :param portName: 端口名
+    :param ringName: 共享内存环形缓冲区名
+    :param resolverClass: 协议解析器类
+    :param processorClass: 数据处理器类
+    :param devices: [(设备地址, 设备名称)]
+    :param callback: 在解析进程中调用的回调(BusSample)，需可被pickle，可为None
+    :param output: 样本输出队列，可为None
+    :param stopEvent: 停止事件
+    :param lostBytes: 丢失字节数（共享计数）
+    :return:
+    """
+    from lib.device_model import DeviceModel
+    signal.signal(signal.SIGINT, signal.SIG_IGN)    # Ctrl+C由主进程处理 Ctrl+C is handled by the main process
+    ring = ShmRingBuffer(ringName)
+    models = []
+    for ADDR, deviceName in devices:
+        model = DeviceModel(deviceName, resolverClass(), processorClass(), "")
+        model.ADDR = ADDR
+
+        def onUpdate(deviceModel):
+            sample = BusSample(time.time_ns(), portName, deviceModel.ADDR, deviceModel.deviceName,
+                               dict(deviceModel.deviceData))
+            if callback is not None:
+                callback(sample)
+            if output is not None:
+                try:
+                    output.put_nowait(sample)
+                except queue.Full:
+                    pass
+
+        model.dataProcessor.onVarChanged.append(onUpdate)
+        models.append(model)
+    try:
+        while not stopEvent.is_set():
+            data, lost = ring.read()
+            if lost:
+                with lostBytes.get_lock():
+                    lostBytes.value += lost
+                for model in models:                # 数据不连续，清空解析状态重新同步 Resync after a gap
+                    model.protocolResolver.TempBytes = []
+            if len(data) == 0:
+                time.sleep(0.001)
+                continue
+            for model in models:
+                model.onDataReceived(data)
+    finally:
+        ring.close()
+
+
+class PipelinePort:
+    __slots__ = ('portName', 'baud', 'devices', 'resolverClass', 'processorClass', 'mode', 'pollReg', 'pollCount',
+                 'interval', 'timeout', 'callback', 'portFactory', 'requests', 'ring', 'serialPort', 'reader',
+                 'process', 'lostBytes', 'bytesRead')
+
+    def __init__(self, portName, baud, devices, resolverClass, processorClass, mode, pollReg, pollCount, interval,
+                 timeout, callback, portFactory):
+        self.portName = portName
+        self.baud = baud
+        self.devices = list(devices)
+        self.resolverClass = resolverClass
+        self.processorClass = processorClass
+        self.mode = mode
+        self.pollReg = pollReg
+        self.pollCount = pollCount
+        self.interval = interval
+        self.timeout = timeout
+        self.callback = callback
+        self.portFactory = portFactory
+        self.requests = []                  # 轮询模式按顺序发送的读取指令 Read requests sent in poll mode
+        self.ring = None
+        self.serialPort = None
+        self.reader = None
+        self.process = None
+        self.lostBytes = None
+        self.bytesRead = 0
+
+
+class ProcessPipeline:
+    __slots__ = ('ports', 'capacity', 'output', 'stopEvent', 'running', 'context')
+
+    def __init__(self, capacity=1 << 20, maxQueue=10000, context=None):
+        """
+        初始化
+        :param capacity: 每个端口的环形缓冲区大小（字节）
+        :param maxQueue: 合并输出队列长度
+        :param context: multiprocessing上下文，None为默认
+        """
+        self.context = context if context is not None else multiprocessing.get_context()
+        self.ports = {}                                 # 端口名 -> 端口 Port name -> port
+        self.capacity = capacity                        # 环形缓冲区大小 Ring size
+        self.output = self.context.Queue(maxQueue)      # 合并输出队列 Merged output queue
+        self.stopEvent = self.context.Event()           # 停止事件 Stop event
+        self.running = False
+
+    def addPort(self, portName, baud=9600, devices=(), resolverClass=None, processorClass=None, mode="poll",
+                pollReg=0x30, pollCount=41, interval=0.0, timeout=0.15, callback=None, portFactory=None):
+        """
+        添加端口
+        :param portName: 端口名
+        :param baud: 波特率
+        :param devices: [(设备地址, 设备名称)]
+        :param resolverClass: 协议解析器类，默认Protocol485Resolver
+        :param processorClass: 数据处理器类，默认JY901SDataProcessor
+        :param mode: "poll" 主站轮询，"stream" 被动接收
+        :param pollReg: 轮询起始寄存器
+        :param pollCount: 轮询寄存器个数
+        :param interval: 一轮轮询的最小周期（秒）
+        :param timeout: 每个应答的超时时间（秒）
+        :param callback: 在解析进程中调用的回调(BusSample)，需可被pickle（模块级函数）
+        :param portFactory: 串口工厂(端口, 波特率)，在主进程调用，None时按端口名打开串口或tcp://地址:端口
+        :return: 无返回
+        """
+        if resolverClass is None:
+            from lib.protocol_resolver.roles.protocol_485_resolver import Protocol485Resolver
+            resolverClass = Protocol485Resolver
+        if processorClass is None:
+            from lib.data_processor.roles.jy901s_dataProcessor import JY901SDataProcessor
+            processorClass = JY901SDataProcessor
+        port = PipelinePort(portName, baud, devices, resolverClass, processorClass, mode, pollReg, pollCount,
+                            interval, timeout, callback, portFactory)
+        if mode == "poll":
+            resolver = resolverClass()
+            try:
+                port.requests = [bytes(resolver.get_readbytes(ADDR, pollReg, pollCount)) for ADDR, _ in port.devices]
+            except TypeError:
+                # 维特协议的读取指令没有设备地址，只能被动接收 Wit read commands carry no address: stream only
+                raise ValueError("轮询模式需要Modbus协议解析器 poll mode needs a Modbus resolver: "
+                                 + resolverClass.__name__)
+        self.ports[portName] = port
+
+    def start(self):
+        """
+        启动所有端口的读取线程和解析进程
+        :return: 无返回
+        """
+        self.stopEvent.clear()
+        self.running = True
+        for port in self.ports.values():
+            try:
+                if port.portFactory is not None:
+                    port.serialPort = port.portFactory(port.portName, port.baud)
+                else:
+                    port.serialPort = openTransport(port.portName, port.baud, timeout=port.timeout)
+            except (SerialException, OSError):
+                print("打开" + port.portName + "失败")
+                continue
+            port.ring = ShmRingBuffer(capacity=self.capacity)
+            port.lostBytes = self.context.Value('q', 0)
+            port.process = self.context.Process(
+                target=decodeWorker, name="Decode-" + port.portName, daemon=True,
+                args=(port.portName, port.ring.name, port.resolverClass, port.processorClass, port.devices,
+                      port.callback, self.output, self.stopEvent, port.lostBytes))
+            port.process.start()
+            port.reader = threading.Thread(target=self.readLoop, args=(port,), name="Read-" + port.portName,
+                                           daemon=True)
+            port.reader.start()
+
+    def readLoop(self, port):
+        """
+        读取线程：只搬运字节，轮询模式下按顺序发送预先生成的读取指令
+        :param port: 端口
+        :return:
+        """
+        serialPort = port.serialPort
+        ring = port.ring
+        requests = port.requests
+        expected = port.pollCount * 2 + 5
+        while self.running:
+            try:
+                if port.mode == "stream":
+                    tlen = serialPort.inWaiting()
+                    if tlen > 0:
+                        data = serialPort.read(tlen)
+                        port.bytesRead += len(data)
+                        ring.write(data)
+                    else:
+                        time.sleep(0.001)
+                    continue
+                cycleStart = time.monotonic()
+                for cmd in requests:
+                    serialPort.write(cmd)
+                    received = 0
+                    deadline = time.monotonic() + port.timeout
+                    while received < expected and time.monotonic() < deadline:
+                        tlen = serialPort.inWaiting()
+                        if tlen > 0:
+                            data = serialPort.read(tlen)
+                            received += len(data)
+                            ring.write(data)
+                        else:
+                            time.sleep(0.0005)
+                    port.bytesRead += received
+                rest = port.interval - (time.monotonic() - cycleStart)
+                if rest > 0:
+                    time.sleep(rest)
+                elif len(requests) == 0:
+                    time.sleep(0.05)
+            except Exception as ex:
+                print(ex)
+                time.sleep(0.1)
+
+    def get(self, timeout=None):
+        """
+        从合并输出流取一个样本
+        :param timeout: 超时时间（秒）
+        :return: 样本，超时返回None
+        """
+        try:
+            return self.output.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def getStatus(self):
+        """
+        获取各端口状态
+        :return: 端口名 -> (读取字节数, 覆盖丢失字节数)
+        """
+        return {name: (port.bytesRead, port.lostBytes.value if port.lostBytes is not None else 0)
+                for name, port in self.ports.items()}
+
+    def stop(self):
+        """
+        停止读取线程和解析进程
+        :return: 无返回
+        """
+        self.running = False
+        self.stopEvent.set()
+        for port in self.ports.values():
+            if port.reader is not None:
+                port.reader.join(2)
+                port.reader = None
+            if port.process is not None:
+                port.process.join(2)
+                if port.process.is_alive():
+                    port.process.terminate()
+                port.process = None
+            if port.serialPort is not None:
+                port.serialPort.close()
+                port.serialPort = None
+            if port.ring is not None:
+                port.ring.close()
+                port.ring = None
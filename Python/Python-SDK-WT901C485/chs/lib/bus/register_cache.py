@@ -0,0 +1,172 @@
+# coding:UTF-8
+import concurrent.futures
+import threading
+import time
+
+"""
+    寄存器缓存 Register cache
+    放在设备readReg前面：按寄存器分为静态（版本号，不过期）、慢变（配置，默认10秒）、实时（数据，默认不缓存）三类，
+    在有效期内直接返回缓存的值；同时发出的相同读取只访问一次总线，其余等待同一个结果；writeReg使写入的寄存器失效，
+    save、恢复出厂、校准使所有缓存失效
+    Sits in front of the device's readReg: registers fall into static (version, never expires), slow (configuration,
+    10 s by default) and live (data, not cached by default) classes, and reads inside the TTL are answered from the
+    cache; identical concurrent reads share one bus transaction; writeReg invalidates the written register, and
+    save, factory reset or calibration invalidate everything
+"""
+
+STATIC = "static"   # 运行中不会变化 Never changes at runtime
+SLOW = "slow"       # 只有写入时变化 Changes only when written
+LIVE = "live"       # 实时数据 Live data
+
+SAVE = 0x00         # 保存/恢复出厂寄存器 Save / factory reset register
+CALSW = 0x01        # 校准寄存器 Calibration register
+
+# 寄存器分类 (起始寄存器, 结束寄存器, 类别)，其他寄存器为实时数据
+# Register classes (first, end, class); other registers are live data
+REGISTER_CLASSES = [(0x2E, 0x30, STATIC),   # 版本号 Version
+                    (0x00, 0x2E, SLOW)]     # 配置 Configuration
+DEFAULT_TTLS = {STATIC: None, SLOW: 10.0, LIVE: 0.0}    # 秒，None为不过期 Seconds, None never expires
+
+
+class RegisterCache:
+    __slots__ = ('classes', 'ttls', 'values', 'inflight', 'lock', 'generation', 'hitCount', 'missCount',
+                 'joinCount', 'invalidateCount')
+
+    def __init__(self, classes=REGISTER_CLASSES, ttls=None):
+        """
+        初始化
+        :param classes: 寄存器分类 [(起始寄存器, 结束寄存器, 类别)]，不在列表中的为实时数据
+        :param ttls: 各类别的缓存时间 {类别: 秒}，None为不过期，0为不缓存；没有给出的类别使用默认值
+        """
+        self.classes = list(classes)
+        self.ttls = dict(DEFAULT_TTLS)
+        if ttls is not None:
+            self.ttls.update(ttls)
+        self.values = {}                    # 寄存器 -> (值, 过期时间) Register -> (value, expiry)
+        self.inflight = {}                  # (起始寄存器, 个数) -> (Future, 优先级)  Reads in flight
+        self.lock = threading.Lock()
+        self.generation = 0                 # 失效计数 Bumped on every invalidation
+        self.hitCount = 0                   # 缓存命中数 Answered from the cache
+        self.missCount = 0                  # 访问总线的读取数 Reads that went to the bus
+        self.joinCount = 0                  # 合并到正在执行的读取的次数 Joined a read in flight
+        self.invalidateCount = 0            # 失效次数 Invalidations
+
+    def getClass(self, regAddr):
+        for first, end, regClass in self.classes:
+            if first <= regAddr < end:
+                return regClass
+        return LIVE
+
+    def getTtl(self, regAddr):
+        return self.ttls.get(self.getClass(regAddr), 0.0)
+
+    def read(self, regAddr, regCount, fetch, priority=None, deadline=None):
+        """
+        读取寄存器：先查缓存，再合并到正在执行的相同读取，最后才调用fetch访问总线
+        :param regAddr: 寄存器地址
+        :param regCount: 寄存器个数
+        :param fetch: 访问总线的读取函数，返回寄存器值列表，失败返回空列表或None
+        :param priority: 优先级，只合并到优先级不低于自己的读取（数值不大于自己），None为都可以合并
+        :param deadline: 截止时间（time.monotonic），合并后等到截止时间还没有结果就放弃，None为不限
+        :return: 寄存器值列表，读取失败或超过截止时间返回空列表
+        """
+        key = (regAddr, regCount)
+        with self.lock:
+            now = time.monotonic()
+            values = []
+            for reg in range(regAddr, regAddr + regCount):
+                cached = self.values.get(reg)
+                if cached is None or (cached[1] is not None and cached[1] <= now):
+                    break
+                values.append(cached[0])
+            else:
+                self.hitCount += 1
+                return values
+            inflight = self.inflight.get(key)
+            # 优先级更低的读取可能还在排队，不合并 A lower-priority read may still be queued behind others
+            joined = inflight is not None and (priority is None or inflight[1] is None or inflight[1] <= priority)
+            if joined:
+                self.joinCount += 1
+                future = inflight[0]
+            else:
+                self.missCount += 1
+                future = concurrent.futures.Future()
+                if inflight is None:
+                    self.inflight[key] = (future, priority)
+            generation = self.generation
+        if joined:
+            timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+            try:
+                return list(future.result(timeout))
+            except concurrent.futures.TimeoutError:
+                return []
+        try:
+            result = fetch()
+        except BaseException as ex:
+            future.set_exception(ex)
+            raise
+        finally:
+            with self.lock:
+                if self.inflight.get(key, (None,))[0] is future:
+                    del self.inflight[key]
+        result = [] if result is None else list(result)     # 合并的读取得到同样的结果 Joiners get the same result
+        if len(result) == regCount:
+            self.store(regAddr, result, generation)
+        future.set_result(result)
+        return list(result)
+
+    def store(self, regAddr, values, generation):
+        """
+        按寄存器类别保存读到的值
+        :param regAddr: 起始寄存器地址
+        :param values: 寄存器值列表
+        :param generation: 开始读取时的失效计数，读取期间有写入时不保存（可能是写入前的值）
+        :return: 无返回
+        """
+        now = time.monotonic()
+        with self.lock:
+            if generation != self.generation:
+                return
+            for i, value in enumerate(values):
+                ttl = self.getTtl(regAddr + i)
+                if ttl is None:
+                    self.values[regAddr + i] = (value, None)
+                elif ttl > 0:
+                    self.values[regAddr + i] = (value, now + ttl)
+
+    def invalidate(self, regAddr=None, regCount=1):
+        """
+        使缓存失效
+        :param regAddr: 起始寄存器地址，None为全部
+        :param regCount: 寄存器个数
+        :return: 无返回
+        """
+        with self.lock:
+            self.invalidateCount += 1
+            self.generation += 1
+            if regAddr is None:
+                self.values.clear()
+            else:
+                for reg in range(regAddr, regAddr + regCount):
+                    self.values.pop(reg, None)
+
+    def onWrite(self, regAddr):
+        """
+        写入寄存器后调用：保存、恢复出厂、校准可能改变所有寄存器，其他只影响写入的寄存器
+        :param regAddr: 写入的寄存器地址
+        :return: 无返回
+        """
+        if regAddr in (SAVE, CALSW):
+            self.invalidate()
+        else:
+            self.invalidate(regAddr)
+
+    def getStatus(self):
+        """
+        获取统计
+        :return: 命中数、合并数、访问总线数、命中率（命中和合并占全部读取的比例）、失效次数、缓存的寄存器数
+        """
+        total = self.hitCount + self.joinCount + self.missCount
+        return {"hits": self.hitCount, "joined": self.joinCount, "misses": self.missCount,
+                "hitRate": (self.hitCount + self.joinCount) / total if total else 0.0,
+                "invalidations": self.invalidateCount, "cached": len(self.values)}
@@ -0,0 +1,198 @@
+# coding:UTF-8
+import json
+import struct
+import threading
+import time
+from multiprocessing import resource_tracker, shared_memory
+from lib.recorder.binary_recorder import WT901C485_CHANNELS
+
+"""
+    共享内存最新值表 Shared-memory latest-value table
+    每个设备一行，保存最新一次采样的原始寄存器值。写入方用顺序锁（seqlock）保护每一行：写前序号加1成为奇数，
+    写完再加1成为偶数；读取方复制整行前后序号相同且为偶数才算读到一致的数据，否则重试。读取不需要系统调用也不需要锁
+    One row per device holding the raw registers of its latest sample. The single writer protects each row with a
+    seqlock: the sequence goes odd before the write and even after it; a reader that sees the same even sequence
+    before and after copying the row has a consistent snapshot, otherwise it retries. Reads take no system call and
+    no lock
+"""
+
+MAGIC = b"WLT1"
+HEADER = struct.Struct("<4sHHI")        # 标识, 行数, 通道数, 通道表长度 Magic, rows, channels, channel table size
+ROW_HEAD = struct.Struct("<QqH6x")      # 序号, 时间戳(纳秒), 设备ID Sequence, timestamp (ns), device id
+SEQ = struct.Struct("<Q")
+READ_TIMEOUT = 0.01                     # 行一直在写入中时最多重试多久（秒） Longest retry on a row stuck mid-write (s)
+ROW_INFO = struct.Struct("<qH6x")       # 行头中序号之后的部分 Row head after the sequence
+
+
+def align(size, boundary=64):
+    return (size + boundary - 1) // boundary * boundary
+
+
+class ShmLatestTable:
+    __slots__ = ('shm', 'owner', 'rows', 'channels', 'names', 'scales', 'rowStruct', 'rowSize', 'rowsOffset',
+                 'rowIndex', 'retryCount', 'lock')
+
+    def __init__(self, name=None, rows=32, channels=WT901C485_CHANNELS):
+        """
+        初始化
+        :param name: 共享内存名，None时新建（写入方），否则连接已有的（读取方）
+        :param rows: 最多的设备数，只在新建时使用
+        :param channels: 通道表 [(寄存器, 名称, 比例)]，只在新建时使用
+        """
+        if name is None:
+            table = json.dumps([list(channel) for channel in channels]).encode("utf-8")
+            self.channels = list(channels)
+            self.rows = rows
+            self.setLayout(len(table))
+            self.shm = shared_memory.SharedMemory(create=True, size=self.rowsOffset + rows * self.rowSize)
+            HEADER.pack_into(self.shm.buf, 0, MAGIC, rows, len(channels), len(table))
+            self.shm.buf[HEADER.size:HEADER.size + len(table)] = table
+            self.owner = True
+        else:
+            try:
+                self.shm = shared_memory.SharedMemory(name=name, track=False)   # Python 3.13+
+            except TypeError:
+                self.shm = shared_memory.SharedMemory(name=name)
+                # 读取方是独立进程，退出时不能让resource_tracker释放写入方的共享内存
+                # Readers are unrelated processes: their resource_tracker must not unlink the writer's segment
+                resource_tracker.unregister(self.shm._name, "shared_memory")
+            magic, self.rows, count, tableSize = HEADER.unpack_from(self.shm.buf, 0)
+            if magic != MAGIC:
+                self.shm.close()
+                raise ValueError("不是最新值表 not a latest-value table: " + name)
+            table = bytes(self.shm.buf[HEADER.size:HEADER.size + tableSize])
+            self.channels = [tuple(channel) for channel in json.loads(table.decode("utf-8"))]
+            self.setLayout(tableSize)
+            self.owner = False
+        self.names = [channel[1] for channel in self.channels]
+        self.scales = [channel[2] for channel in self.channels]
+        self.rowIndex = {}                  # 设备ID -> 行号 Device id -> row
+        self.retryCount = 0                 # 读取时遇到写入而重试的次数 Reads retried because of a concurrent write
+        self.lock = threading.Lock()        # 分配行用，每行只由一个线程写入 Row allocation; each row has one writer
+
+    def setLayout(self, tableSize):
+        self.rowStruct = struct.Struct("<%dh" % len(self.channels))
+        self.rowSize = align(ROW_HEAD.size + self.rowStruct.size, 8)
+        self.rowsOffset = align(HEADER.size + tableSize)
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    # region 写入 Writer
+
+    def write(self, deviceId, values, timestamp=None):
+        """
+        写入一个设备的最新值（只能有一个写入进程，同一设备只能由一个线程写入）
+        :param deviceId: 设备ID
+        :param values: 各通道的原始寄存器值
+        :param timestamp: 主机时间（纳秒），None为当前时间
+        :return: 无返回
+        """
+        row = self.rowIndex.get(deviceId)
+        if row is None:
+            with self.lock:
+                row = self.rowIndex.get(deviceId, len(self.rowIndex))
+                if row >= self.rows:
+                    raise ValueError("最新值表已满 latest-value table full")
+                self.rowIndex[deviceId] = row
+        buf = self.shm.buf
+        offset = self.rowsOffset + row * self.rowSize
+        seq = SEQ.unpack_from(buf, offset)[0]
+        SEQ.pack_into(buf, offset, seq + 1)                 # 奇数：正在写 Odd: write in progress
+        ROW_INFO.pack_into(buf, offset + SEQ.size, time.time_ns() if timestamp is None else timestamp, deviceId)
+        self.rowStruct.pack_into(buf, offset + ROW_HEAD.size, *values)
+        SEQ.pack_into(buf, offset, seq + 2)                 # 偶数：写完 Even: write complete
+
+    def writeDevice(self, deviceModel):
+        """
+        写入设备模型的最新寄存器值，可直接作为数据更新事件
+        :param deviceModel: 设备模型
+        :return: 无返回
+        """
+        registers = deviceModel.registers
+        self.write(deviceModel.ADDR, [registers[reg] for reg, _, _ in self.channels])
+
+    # endregion
+
+    # region 读取 Reader
+
+    def findRow(self, deviceId):
+        row = self.rowIndex.get(deviceId)
+        if row is not None:
+            return row
+        buf = self.shm.buf
+        for row in range(self.rows):
+            seq, _, rowDevice = ROW_HEAD.unpack_from(buf, self.rowsOffset + row * self.rowSize)
+            if seq == 0:                    # 行按顺序分配，后面没有了 Rows are used in order
+                return None
+            if rowDevice == deviceId:
+                self.rowIndex[deviceId] = row
+                return row
+        return None
+
+    def readRaw(self, deviceId, timeout=READ_TIMEOUT):
+        """
+        读取设备最新的原始寄存器值
+        :param deviceId: 设备ID
+        :param timeout: 行一直在写入中时最多重试多久（秒），写入进程在写入中途退出时序号会停在奇数
+        :return: (时间戳(纳秒), 原始值元组)，没有数据或超时返回None
+        """
+        row = self.findRow(deviceId)
+        if row is None:
+            return None
+        buf = self.shm.buf
+        offset = self.rowsOffset + row * self.rowSize
+        deadline = None
+        while True:
+            seq, timestamp, _ = ROW_HEAD.unpack_from(buf, offset)
+            if not seq & 1:
+                values = self.rowStruct.unpack_from(buf, offset + ROW_HEAD.size)
+                if SEQ.unpack_from(buf, offset)[0] == seq:
+                    return timestamp, values
+            self.retryCount += 1
+            now = time.monotonic()
+            if deadline is None:
+                deadline = now + timeout
+            elif now >= deadline:
+                return None
+
+    def read(self, deviceId):
+        """
+        读取设备最新的通道值
+        :param deviceId: 设备ID
+        :return: (时间戳(纳秒), {通道名: 值})，没有数据或超时返回None
+        """
+        raw = self.readRaw(deviceId)
+        if raw is None:
+            return None
+        timestamp, values = raw
+        return timestamp, {name: value * scale for name, scale, value in zip(self.names, self.scales, values)}
+
+    def devices(self):
+        """
+        表中的设备ID列表
+        :return:
+        """
+        result = []
+        buf = self.shm.buf
+        for row in range(self.rows):
+            seq, _, deviceId = ROW_HEAD.unpack_from(buf, self.rowsOffset + row * self.rowSize)
+            if seq == 0:
+                break
+            result.append(deviceId)
+        return result
+
+    # endregion
+
+    def close(self):
+        """
+        关闭，写入方同时释放共享内存
+        :return: 无返回
+        """
+        self.shm.close()
+        if self.owner:
+            try:
+                self.shm.unlink()
+            except FileNotFoundError:
+                pass
@@ -0,0 +1,123 @@
+# coding:UTF-8
+import struct
+from multiprocessing import shared_memory
+
+"""
+    共享内存环形缓冲区 Shared-memory ring buffer
+    单生产者单消费者，跨进程传递串口原始字节；用累计字节序号检测覆盖（消费者太慢）。生产者写数据前先发布本次写入的
+    结束序号，写完后再发布已写入序号，消费者复制后按结束序号判断复制期间哪些字节可能被覆盖
+    Single producer / single consumer byte ring across processes; cumulative byte sequence numbers detect overruns.
+    The producer publishes the end sequence of a write before copying and the write sequence after, so the consumer
+    can tell which copied bytes a write in progress may have overwritten
+"""
+
+HEADER = struct.Struct("<QQQ")  # 已写入字节序号, 容量, 正在写入的结束序号 Write sequence, capacity, reserved sequence
+SEQ = struct.Struct("<Q")
+WRITE_SEQ_OFFSET = 0
+RESERVE_SEQ_OFFSET = 16
+HEADER_SIZE = 64                # 头部占一个缓存行 Header takes one cache line
+
+
+class ShmRingBuffer:
+    __slots__ = ('shm', 'capacity', 'readSeq', 'owner', 'writeSeq', 'lostBytes')
+
+    def __init__(self, name=None, capacity=1 << 20):
+        """
+        初始化
+        :param name: 共享内存名，None时新建（生产者），否则连接已有的（消费者）
+        :param capacity: 数据区大小（字节），只在新建时使用
+        """
+        if name is None:
+            self.shm = shared_memory.SharedMemory(create=True, size=HEADER_SIZE + capacity)
+            self.capacity = capacity
+            HEADER.pack_into(self.shm.buf, 0, 0, capacity, 0)
+            self.owner = True
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+            # 子进程与主进程共用resource_tracker，只由生产者释放 Children share the tracker; only the owner unlinks
+            self.capacity = HEADER.unpack_from(self.shm.buf, 0)[1]
+            self.owner = False
+        self.writeSeq = 0       # 生产者已写入的字节序号 Producer write sequence
+        self.readSeq = 0        # 消费者已读取的字节序号 Consumer read sequence
+        self.lostBytes = 0      # 被覆盖丢失的字节数 Bytes lost to overruns
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    def getWriteSeq(self):
+        return SEQ.unpack_from(self.shm.buf, WRITE_SEQ_OFFSET)[0]
+
+    def getReserveSeq(self):
+        return SEQ.unpack_from(self.shm.buf, RESERVE_SEQ_OFFSET)[0]
+
+    def write(self, data):
+        """
+        写入数据（生产者），写满时覆盖最旧的数据
+        :param data: 字节数据
+        :return: 无返回
+        """
+        size = len(data)
+        if size == 0:
+            return
+        capacity = self.capacity
+        if size > capacity:                     # 比整个缓冲区还大只保留最后部分 Keep only the tail
+            self.writeSeq += size - capacity
+            data = data[size - capacity:]
+            size = capacity
+        buf = self.shm.buf
+        # 先发布结束序号，再覆盖旧数据 Publish the end sequence before overwriting old data
+        SEQ.pack_into(buf, RESERVE_SEQ_OFFSET, self.writeSeq + size)
+        start = self.writeSeq % capacity
+        first = min(size, capacity - start)
+        buf[HEADER_SIZE + start:HEADER_SIZE + start + first] = data[:first]
+        if first < size:                        # 回绕 Wrap around
+            buf[HEADER_SIZE:HEADER_SIZE + size - first] = data[first:]
+        self.writeSeq += size
+        SEQ.pack_into(buf, WRITE_SEQ_OFFSET, self.writeSeq)  # 数据写完后再发布序号 Publish the sequence after the data
+
+    def read(self, maxSize=None):
+        """
+        读取新数据（消费者）
+        :param maxSize: 最多读取的字节数，None为全部
+        :return: (数据, 本次检测到的丢失字节数)
+        """
+        capacity = self.capacity
+        writeSeq = self.getWriteSeq()
+        reserveSeq = self.getReserveSeq()
+        lost = 0
+        if reserveSeq - self.readSeq > capacity:    # 未读数据已经或正在被覆盖 Unread data overwritten or being overwritten
+            lost = reserveSeq - capacity - self.readSeq
+            self.readSeq = reserveSeq - capacity
+        size = max(0, writeSeq - self.readSeq)
+        if maxSize is not None:
+            size = min(size, maxSize)
+        if size == 0:
+            self.lostBytes += lost
+            return b"", lost
+        buf = self.shm.buf
+        start = self.readSeq % capacity
+        first = min(size, capacity - start)
+        data = bytes(buf[HEADER_SIZE + start:HEADER_SIZE + start + first])
+        if first < size:
+            data += bytes(buf[HEADER_SIZE:HEADER_SIZE + size - first])
+        after = self.getReserveSeq()
+        if after - self.readSeq > capacity:     # 复制期间被覆盖，丢弃被覆盖的部分 Overwritten while copying
+            overwritten = min(size, after - capacity - self.readSeq)
+            data = data[overwritten:]
+            lost += overwritten
+        self.readSeq += size
+        self.lostBytes += lost
+        return data, lost
+
+    def close(self):
+        """
+        关闭，生产者同时释放共享内存
+        :return: 无返回
+        """
+        self.shm.close()
+        if self.owner:
+            try:
+                self.shm.unlink()
+            except FileNotFoundError:
+                pass
@@ -0,0 +1,246 @@
+# coding:UTF-8
+import threading
+import time
+
+"""
+    数据停滞监视 Stall watchdog
+    按设备记录期望的采样间隔（来自回传速率寄存器0x03，或按实际收到数据的间隔学习），超过几个间隔没有数据就判为停滞。
+    停滞的设备可以从轮询中拿掉以节省总线时间，只按较慢的周期探测；一旦有应答自动恢复轮询
+    Tracks each device's expected sample interval (from the output-rate register 0x03 or learned from the observed
+    updates) and flags a stall after a few intervals without data. A stalled device can be dropped from the poll
+    schedule to save bus time and only probed at a slower cadence; it is restored as soon as it answers again
+"""
+
+RRATE = 0x03    # 回传速率寄存器 Output-rate register
+# 回传速率代码 -> 采样间隔（秒），0x0C单次回传、0x0D不回传没有固定间隔
+# Output-rate code -> sample interval (s); 0x0C (single) and 0x0D (off) have no fixed interval
+RATE_INTERVALS = {0x01: 5.0, 0x02: 2.0, 0x03: 1.0, 0x04: 0.5, 0x05: 0.2, 0x06: 0.1, 0x07: 0.05, 0x08: 0.02,
+                  0x09: 0.01, 0x0B: 0.005}
+
+
+class DeviceHealth:
+    __slots__ = ('device', 'interval', 'source', 'lastUpdate', 'updateCount', 'stalled', 'stalledSince',
+                 'lastProbe', 'stallCount', 'totalStallTime', 'polled', 'missed')
+
+    def __init__(self, device, interval, source):
+        self.device = device                # 设备模型 Device model
+        self.interval = interval            # 期望的采样间隔（秒） Expected sample interval (s)
+        self.source = source                # "rate" 来自速率寄存器，"observed" 学习得到 From register or learned
+        self.lastUpdate = time.monotonic()  # 最近一次数据（开始监视时算一次） Last data (watch start counts)
+        self.updateCount = 0                # 收到的更新数 Updates received
+        self.stalled = False                # 是否停滞 Whether stalled
+        self.stalledSince = None            # 停滞开始时间 Stall start
+        self.lastProbe = 0.0                # 最近一次探测 Last probe
+        self.stallCount = 0                 # 停滞次数 Stalls
+        self.totalStallTime = 0.0           # 停滞总时长（秒） Total stall time (s)
+        self.polled = False                 # 是否由端口轮询 Whether polled by a port worker
+        self.missed = 0                     # 上次数据之后没有应答的轮询次数 Polls unanswered since the last data
+
+
+class StallWatchdog:
+    __slots__ = ('stallFactor', 'missLimit', 'defaultInterval', 'probeInterval', 'dropStalled', 'alpha', 'health',
+                 'lock', 'onStall', 'onRestore', 'thread', 'running', 'checkInterval')
+
+    def __init__(self, stallFactor=4.0, missLimit=2, defaultInterval=0.5, probeInterval=2.0, dropStalled=True,
+                 alpha=0.1, checkInterval=0.05):
+        """
+        初始化
+        :param stallFactor: 超过几个期望间隔没有数据判为停滞
+        :param missLimit: 轮询的设备还要连续几次轮询没有应答才判为停滞（别的设备超时会拉长轮询周期）
+        :param defaultInterval: 没有速率寄存器、还没有学到间隔时使用的期望间隔（秒）
+        :param probeInterval: 停滞设备的探测周期（秒）
+        :param dropStalled: 停滞的设备是否从轮询中拿掉，只按探测周期轮询
+        :param alpha: 学习采样间隔的平滑系数
+        :param checkInterval: 后台检查线程的周期（秒），只在start后使用
+        """
+        self.stallFactor = stallFactor
+        self.missLimit = missLimit
+        self.defaultInterval = defaultInterval
+        self.probeInterval = probeInterval
+        self.dropStalled = dropStalled
+        self.alpha = alpha
+        self.health = {}                    # 设备 -> 状态 Device -> health
+        self.lock = threading.Lock()
+        self.onStall = []                   # 停滞事件 Stall callbacks (deviceModel)
+        self.onRestore = []                 # 恢复事件 Restore callbacks (deviceModel)
+        self.thread = None
+        self.running = False
+        self.checkInterval = checkInterval
+
+    # region 设备 Devices
+
+    def watch(self, deviceModel, rateCode=None):
+        """
+        开始监视设备
+        :param deviceModel: 设备模型
+        :param rateCode: 回传速率寄存器的值，None为按收到数据的间隔学习
+        :return: 无返回
+        """
+        interval = RATE_INTERVALS.get(rateCode)
+        with self.lock:
+            if deviceModel in self.health:
+                return
+            if interval is not None:
+                self.health[deviceModel] = DeviceHealth(deviceModel, interval, "rate")
+            else:
+                self.health[deviceModel] = DeviceHealth(deviceModel, self.defaultInterval, "observed")
+        deviceModel.dataProcessor.onVarChanged.append(self.onUpdate)
+
+    def unwatch(self, deviceModel):
+        with self.lock:
+            self.health.pop(deviceModel, None)
+        if self.onUpdate in deviceModel.dataProcessor.onVarChanged:
+            deviceModel.dataProcessor.onVarChanged.remove(self.onUpdate)
+
+    def setRate(self, deviceModel, rateCode):
+        """
+        按回传速率寄存器的值设置期望间隔，不认识的值改为按实际间隔学习
+        :param deviceModel: 设备模型
+        :param rateCode: 回传速率寄存器的值
+        :return: 无返回
+        """
+        interval = RATE_INTERVALS.get(rateCode)
+        with self.lock:
+            health = self.health.get(deviceModel)
+            if health is None:
+                return
+            if interval is None:
+                health.source = "observed"
+            else:
+                health.interval = interval
+                health.source = "rate"
+
+    def readRate(self, deviceModel):
+        """
+        从设备读取回传速率寄存器（设备自己打开串口时使用，总线管理器轮询的设备用setRate）
+        :param deviceModel: 设备模型
+        :return: 回传速率寄存器的值，读取失败返回None
+        """
+        values = deviceModel.readReg(RRATE, 1)
+        if not values:
+            return None
+        self.setRate(deviceModel, values[0])
+        return values[0]
+
+    # endregion
+
+    # region 检查 Checking
+
+    def onUpdate(self, deviceModel):
+        """
+        设备数据更新事件：学习采样间隔，停滞的设备恢复
+        :param deviceModel: 设备模型
+        :return: 无返回
+        """
+        now = time.monotonic()
+        restored = False
+        with self.lock:
+            health = self.health.get(deviceModel)
+            if health is None:
+                return
+            if health.stalled:
+                health.stalled = False
+                health.totalStallTime += now - health.stalledSince
+                health.stalledSince = None
+                restored = True
+            elif health.source == "observed" and health.updateCount > 0:
+                interval = now - health.lastUpdate
+                # 学习时截断偶尔的长间隔，避免一次卡顿把期望间隔拉长 Clamp outliers so one hiccup does not stretch it
+                interval = min(interval, health.interval * self.stallFactor)
+                health.interval += self.alpha * (interval - health.interval)
+            health.lastUpdate = now
+            health.updateCount += 1
+            health.missed = 0
+        if restored:
+            for fun in self.onRestore:
+                fun(deviceModel)
+
+    def check(self, now=None):
+        """
+        检查所有设备，标记停滞的设备
+        :param now: 当前时间（time.monotonic），None为现在
+        :return: 本次新停滞的设备列表
+        """
+        now = time.monotonic() if now is None else now
+        stalled = []
+        with self.lock:
+            for health in self.health.values():
+                if health.stalled or now - health.lastUpdate <= health.interval * self.stallFactor:
+                    continue
+                if not health.polled or health.missed >= self.missLimit:
+                    health.stalled = True
+                    health.stalledSince = now
+                    health.lastProbe = now
+                    health.stallCount += 1
+                    stalled.append(health.device)
+        for device in stalled:
+            for fun in self.onStall:
+                fun(device)
+        return stalled
+
+    def schedule(self, devices):
+        """
+        本轮需要轮询的设备：正常的设备，加上到了探测时间的停滞设备
+        :param devices: 端口上的设备列表
+        :return: 本轮轮询的设备列表
+        """
+        self.check()
+        now = time.monotonic()
+        result = []
+        with self.lock:
+            for device in devices:
+                health = self.health.get(device)
+                if health is None:
+                    result.append(device)
+                    continue
+                if health.stalled and self.dropStalled:
+                    if now - health.lastProbe < self.probeInterval:
+                        continue
+                    health.lastProbe = now      # 探测一次 Probe once
+                health.polled = True
+                health.missed += 1              # 有应答时清零 Cleared when it answers
+                result.append(device)
+        return result
+
+    def isStalled(self, deviceModel):
+        health = self.health.get(deviceModel)
+        return health is not None and health.stalled
+
+    # endregion
+
+    # region 后台检查 Background checking
+
+    def start(self):
+        """
+        启动后台检查线程（设备自己接收数据、没有端口工作线程时使用）
+        :return: 无返回
+        """
+        self.running = True
+        self.thread = threading.Thread(target=self.checkLoop, name="StallWatchdog", daemon=True)
+        self.thread.start()
+
+    def checkLoop(self):
+        while self.running:
+            self.check()
+            time.sleep(self.checkInterval)
+
+    def stop(self):
+        self.running = False
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    # endregion
+
+    def getStatus(self):
+        """
+        获取各设备状态
+        :return: 设备地址 -> (是否停滞, 期望间隔, 来源, 距上次数据的时间, 停滞次数, 停滞总时长)
+        """
+        now = time.monotonic()
+        with self.lock:
+            return {health.device.ADDR: (health.stalled, health.interval, health.source, now - health.lastUpdate,
+                                         health.stallCount,
+                                         health.totalStallTime + (now - health.stalledSince if health.stalled
+                                                                  else 0.0))
+                    for health in self.health.values()}
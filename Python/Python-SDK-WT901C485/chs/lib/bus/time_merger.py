@@ -0,0 +1,195 @@
+# coding:UTF-8
+import datetime
+import heapq
+import threading
+import time
+
+"""
+    按时间排序的多路合并 Time-ordered k-way merge
+    把多个端口、多个设备的样本合并成一条全局按时间排序的数据流；用堆保存一个有界的重排窗口，
+    窗口之外才输出，比窗口更晚到达的样本按配置丢弃或直接输出并计入统计
+    Merges samples from all ports and devices into one globally time-ordered stream. A heap holds a bounded
+    reorder window; samples are emitted once they fall out of the window, later arrivals are dropped or
+    passed through according to the policy and counted
+"""
+
+
+def parseChiptime(text):
+    """
+    解析设备数据中的芯片时间 "年-月-日 时:分:秒.毫秒"
+    :param text: 芯片时间字符串
+    :return: 纳秒，格式不对返回None
+    """
+    try:
+        date, clock = text.split(" ")
+        year, month, day = (int(v) for v in date.split("-"))
+        hms, millisecond = clock.split(".")
+        hour, minute, second = (int(v) for v in hms.split(":"))
+        stamp = datetime.datetime(year, month, day, hour, minute, second, tzinfo=datetime.timezone.utc)
+    except (AttributeError, ValueError):
+        return None
+    return int(stamp.timestamp()) * 1000000000 + int(millisecond) * 1000000
+
+
+class TimeMerger:
+    __slots__ = ('window', 'latePolicy', 'timeSource', 'maxPending', 'perDevice', 'listeners', 'heap', 'seq',
+                 'lock', 'newest', 'lastEmitted', 'offsets', 'emitCount', 'lateCount', 'dropCount', 'forcedCount',
+                 'maxLateness', 'deviceLateCount', 'thread', 'running')
+
+    def __init__(self, window=0.05, latePolicy="drop", timeSource="host", maxPending=100000, perDevice=False):
+        """
+        初始化
+        :param window: 重排窗口（秒），样本最多等待这么久以等待更早的样本
+        :param latePolicy: 迟到样本处理 "drop" 丢弃，"emit" 直接输出（破坏严格顺序）
+        :param timeSource: "host" 主机接收时间，"chip" 由芯片时间重建（对齐到主机时钟），也可以是函数(样本)->纳秒
+        :param maxPending: 窗口内最多缓存的样本数，超过时提前输出最早的样本
+        :param perDevice: 是否按设备统计迟到次数
+        """
+        self.window = int(window * 1000000000)  # 重排窗口 Reorder window (ns)
+        self.latePolicy = latePolicy            # 迟到处理 Late policy
+        self.timeSource = timeSource            # 时间来源 Time source
+        self.maxPending = maxPending            # 缓存上限 Pending limit
+        self.perDevice = perDevice              # 按设备统计 Per-device stats
+        self.listeners = []                     # 有序样本回调 Ordered sample callbacks
+        self.heap = []                          # (时间, 序号, 样本) (time, seq, sample)
+        self.seq = 0                            # 相同时间按到达顺序 Arrival order for equal times
+        self.lock = threading.Lock()
+        self.newest = None                      # 见过的最新时间 Newest time seen
+        self.lastEmitted = None                 # 最后输出的时间 Last emitted time
+        self.offsets = {}                       # 设备 -> 芯片时钟偏移 Device -> chip clock offset
+        self.emitCount = 0                      # 输出样本数 Emitted samples
+        self.lateCount = 0                      # 迟到样本数 Late samples
+        self.dropCount = 0                      # 丢弃的迟到样本数 Dropped late samples
+        self.forcedCount = 0                    # 因缓存满提前输出的样本数 Samples emitted early (pending full)
+        self.maxLateness = 0                    # 最大迟到时间 Largest lateness (ns)
+        self.deviceLateCount = {}               # (端口, 地址) -> 迟到次数 (port, ADDR) -> late count
+        self.thread = None
+        self.running = False
+
+    def sampleTime(self, sample):
+        """
+        获取样本的排序时间
+        :param sample: 样本
+        :return: 纳秒
+        """
+        if callable(self.timeSource):
+            return self.timeSource(sample)
+        if self.timeSource == "chip":
+            chip = parseChiptime(sample.get("Chiptime"))
+            if chip is not None:
+                # 主机时间减芯片时间的下包络作为偏移，去掉传输延迟的抖动
+                # The lower envelope of host - chip is the clock offset, free of transport jitter
+                key = (sample.portName, sample.ADDR)
+                offset = sample.timestamp - chip
+                if key not in self.offsets or offset < self.offsets[key]:
+                    self.offsets[key] = offset
+                return chip + self.offsets[key]
+        return sample.timestamp
+
+    def push(self, sample):
+        """
+        加入一个样本，输出所有已经离开重排窗口的样本
+        可以直接注册为BusManager.listeners的回调
+        :param sample: 样本 BusSample
+        :return: 无返回
+        """
+        with self.lock:
+            ts = self.sampleTime(sample)
+            if self.lastEmitted is not None and ts < self.lastEmitted:
+                lateness = self.lastEmitted - ts
+                self.lateCount += 1
+                if lateness > self.maxLateness:
+                    self.maxLateness = lateness
+                if self.perDevice:
+                    key = (sample.portName, sample.ADDR)
+                    self.deviceLateCount[key] = self.deviceLateCount.get(key, 0) + 1
+                if self.latePolicy == "emit":
+                    self.emit(sample)
+                else:
+                    self.dropCount += 1
+                return
+            heapq.heappush(self.heap, (ts, self.seq, sample))
+            self.seq += 1
+            if self.newest is None or ts > self.newest:
+                self.newest = ts
+            self.release(self.newest - self.window)
+
+    def poll(self):
+        """
+        按主机时钟输出已经离开窗口的样本，某些数据流安静时避免样本一直等待
+        只在时间来源为主机时间时有效
+        :return: 无返回
+        """
+        if self.timeSource == "host":
+            with self.lock:
+                self.release(time.time_ns() - self.window)
+
+    def flush(self):
+        """
+        输出窗口内剩余的所有样本
+        :return: 无返回
+        """
+        with self.lock:
+            while self.heap:
+                self.pop()
+
+    def release(self, watermark):
+        heap = self.heap
+        while heap and heap[0][0] <= watermark:
+            self.pop()
+        while len(heap) > self.maxPending:
+            self.forcedCount += 1
+            self.pop()
+
+    def pop(self):
+        ts, _, sample = heapq.heappop(self.heap)
+        self.lastEmitted = ts
+        self.emit(sample)
+
+    def emit(self, sample):
+        self.emitCount += 1
+        for fun in self.listeners:
+            fun(sample)
+
+    def start(self, period=0.01):
+        """
+        启动后台线程定时调用poll
+        :param period: 周期（秒）
+        :return: 无返回
+        """
+        if self.running:
+            return
+        self.running = True
+
+        def loop():
+            while self.running:
+                time.sleep(period)
+                self.poll()
+
+        self.thread = threading.Thread(target=loop, name="TimeMerger", daemon=True)
+        self.thread.start()
+
+    def stop(self, flush=True):
+        """
+        停止后台线程
+        :param flush: 是否输出剩余样本
+        :return: 无返回
+        """
+        self.running = False
+        if self.thread is not None:
+            self.thread.join(1)
+            self.thread = None
+        if flush:
+            self.flush()
+
+    def getStatus(self):
+        """
+        获取统计
+        :return: 统计字典
+        """
+        with self.lock:
+            status = {"pending": len(self.heap), "emitted": self.emitCount, "late": self.lateCount,
+                      "dropped": self.dropCount, "forced": self.forcedCount, "maxLateness": self.maxLateness / 1e9}
+            if self.perDevice:
+                status["deviceLate"] = dict(self.deviceLateCount)
+        return status
@@ -0,0 +1,236 @@
+# coding:UTF-8
+import datetime
+import json
+import time
+
+"""
+    配置快照 Configuration snapshot
+    一次读出设备的全部配置寄存器（Modbus一条指令读完，维特协议每次4个），保存为带版本号的文件；恢复或套用到其他设备时
+    先读出当前配置，只写不同的寄存器：连续的寄存器用一条0x10指令写入，整个过程只解锁和保存一次，最后读回校验，
+    批量写入不被接受的寄存器再逐个补写。地址、波特率、校准偏移是每个设备自己的，默认不复制
+    Reads a device's whole configuration register map in one go (a single Modbus request; 4 registers per request
+    on the Wit protocol) and stores it as a versioned file. Restoring it, or cloning it onto other devices, first
+    reads the current configuration and writes only the registers that differ: contiguous registers go in one
+    0x10 request, the whole change needs one unlock and one save, and a final read-back verifies it, falling back to
+    single writes for registers a batched write did not take. Address, baud rate and calibration offsets belong to
+    each device and are not copied by default
+"""
+
+FORMAT = "wit-config"       # 文件格式 File format
+FORMAT_VERSION = 1          # 文件格式版本 File format version
+
+CONFIG_FIRST = 0x02         # 第一个配置寄存器（0x00保存、0x01校准是指令） First config register (0x00/0x01 are commands)
+CONFIG_END = 0x30           # 配置寄存器结束（含版本号） End of the config registers (version included)
+VERSION_REGS = (0x2E, 0x2F)                 # 版本号 Version
+READ_ONLY = {0x27, 0x2E, 0x2F}              # 读寄存器指令、版本号 Wit read command, version
+DEVICE_SPECIFIC = {0x04, 0x1A} | set(range(0x05, 0x0E))    # 波特率、地址、加计/角速度/磁场偏移 Baud, address, offsets
+MERGE_GAP = 2               # 相隔不超过几个寄存器时合并成一次写入 Merge writes separated by at most this many registers
+
+
+class ConfigSnapshot:
+    __slots__ = ('registers', 'firmware', 'deviceName', 'ADDR', 'protocol', 'created')
+
+    def __init__(self, registers, firmware=None, deviceName="", ADDR=None, protocol="", created=None):
+        """
+        初始化
+        :param registers: 寄存器 -> 值（无符号16位）
+        :param firmware: 版本号寄存器的值
+        :param deviceName: 设备名
+        :param ADDR: 设备地址
+        :param protocol: 协议解析器名
+        :param created: 创建时间（ISO格式），None为现在
+        """
+        self.registers = dict(registers)
+        self.firmware = firmware
+        self.deviceName = deviceName
+        self.ADDR = ADDR
+        self.protocol = protocol
+        self.created = datetime.datetime.now().isoformat(timespec="seconds") if created is None else created
+
+    def save(self, fileName):
+        """
+        保存为文件
+        :param fileName: 文件名
+        :return: 无返回
+        """
+        content = {"format": FORMAT, "version": FORMAT_VERSION, "created": self.created,
+                   "device": {"name": self.deviceName, "addr": self.ADDR, "protocol": self.protocol},
+                   "firmware": self.firmware,
+                   "registers": {"0x%02X" % reg: value for reg, value in sorted(self.registers.items())}}
+        with open(fileName, "w", encoding="utf-8") as f:
+            json.dump(content, f, indent=2, ensure_ascii=False)
+
+
+def loadSnapshot(fileName):
+    """
+    读取快照文件
+    :param fileName: 文件名
+    :return: 配置快照，格式或版本不对时抛出ValueError
+    """
+    with open(fileName, "r", encoding="utf-8") as f:
+        content = json.load(f)
+    if content.get("format") != FORMAT:
+        raise ValueError("不是配置快照文件 not a config snapshot: " + fileName)
+    if content.get("version", 0) > FORMAT_VERSION:
+        raise ValueError("不支持的快照版本 unsupported snapshot version: " + str(content.get("version")))
+    device = content.get("device", {})
+    return ConfigSnapshot({int(reg, 16): value for reg, value in content["registers"].items()},
+                          content.get("firmware"), device.get("name", ""), device.get("addr"),
+                          device.get("protocol", ""), content.get("created"))
+
+
+def readConfig(device, first=CONFIG_FIRST, end=CONFIG_END, retries=2):
+    """
+    读出设备当前的配置寄存器（不使用缓存）
+    :param device: 设备模型
+    :param first: 起始寄存器
+    :param end: 结束寄存器（不含）
+    :param retries: 没有应答时的重试次数
+    :return: 寄存器 -> 值（无符号16位），读取失败抛出IOError
+    """
+    count = end - first
+    if device.registerCache is not None:
+        device.registerCache.invalidate(first, count)
+    values = device.readReg(first, count, retries=retries)
+    if values is None or len(values) < count:
+        raise IOError("读取配置失败 config read failed: 0x%02X" % device.ADDR)
+    return {first + i: values[i] & 0xffff for i in range(count)}
+
+
+def snapshot(device, fileName=None):
+    """
+    读取设备的全部配置
+    :param device: 设备模型
+    :param fileName: 文件名，不为None时保存
+    :return: 配置快照
+    """
+    registers = readConfig(device)
+    result = ConfigSnapshot(registers, [registers.get(reg) for reg in VERSION_REGS], device.deviceName,
+                            device.ADDR, type(device.protocolResolver).__name__)
+    if fileName is not None:
+        result.save(fileName)
+    return result
+
+
+def diffConfig(current, target, exclude=DEVICE_SPECIFIC):
+    """
+    比较配置
+    :param current: 当前配置 寄存器 -> 值
+    :param target: 目标配置 寄存器 -> 值
+    :param exclude: 不比较的寄存器
+    :return: 需要写入的寄存器 -> 值
+    """
+    return {reg: value & 0xffff for reg, value in target.items()
+            if reg not in READ_ONLY and reg not in exclude and current.get(reg) != value & 0xffff}
+
+
+def groupWrites(changes, current=None, exclude=DEVICE_SPECIFIC):
+    """
+    把要写入的寄存器分成连续的段，间隔很小时用当前值补上合并成一段
+    :param changes: 寄存器 -> 值
+    :param current: 当前配置，None时只合并相邻的寄存器
+    :param exclude: 不能用来补间隔的寄存器
+    :return: [(起始寄存器, 值列表)]
+    """
+    runs = []
+    for reg in sorted(changes):
+        if runs:
+            start, values = runs[-1]
+            gap = range(start + len(values), reg)
+            if len(gap) == 0 or (current is not None and len(gap) <= MERGE_GAP and
+                                 all(r in current and r not in exclude and r not in READ_ONLY for r in gap)):
+                values.extend(current[r] for r in gap)
+                values.append(changes[reg])
+                continue
+        runs.append((reg, [changes[reg]]))
+    return runs
+
+
+def applyDiff(device, changes, current=None, exclude=DEVICE_SPECIFIC, settle=0.1, verify=True):
+    """
+    写入配置变化：解锁一次，连续的寄存器批量写入，保存一次，然后读回校验
+    :param device: 设备模型
+    :param changes: 寄存器 -> 值
+    :param current: 当前配置，用于合并有小间隔的写入，None为只合并相邻的寄存器
+    :param exclude: 不能用来补间隔的寄存器
+    :param settle: 解锁后和保存前的等待时间（秒）
+    :param verify: 是否读回校验
+    :return: 统计：写入的寄存器数、写入指令数、是否校验通过、校验不一致的寄存器
+    """
+    report = {"changed": len(changes), "writes": 0, "verified": None, "failed": []}
+    if not changes:
+        return report
+    runs = groupWrites(changes, current, exclude)
+    device.unlock()
+    time.sleep(settle)
+    for start, values in runs:
+        device.writeRegs(start, values)
+        report["writes"] += 1
+    time.sleep(settle)
+    device.save()
+    if not verify:
+        return report
+    failed = verifyConfig(device, changes)
+    if failed and hasattr(device.protocolResolver, "writeRegs"):
+        # 设备不接受0x10批量写入时逐个补写，单个寄存器的段也是用0x10写的
+        # Fall back to single writes if 0x10 was not taken; one-register runs were sent as 0x10 too
+        device.unlock()
+        time.sleep(settle)
+        for reg in failed:
+            device.writeReg(reg, changes[reg])
+            report["writes"] += 1
+        time.sleep(settle)
+        device.save()
+        failed = verifyConfig(device, changes)
+    report["verified"] = not failed
+    report["failed"] = failed
+    return report
+
+
+def verifyConfig(device, changes):
+    """
+    读回校验
+    :param device: 设备模型
+    :param changes: 寄存器 -> 期望值
+    :return: 不一致的寄存器列表
+    """
+    first = min(changes)
+    current = readConfig(device, first, max(changes) + 1)
+    return [reg for reg in sorted(changes) if current.get(reg) != changes[reg]]
+
+
+def restore(device, config, exclude=DEVICE_SPECIFIC, settle=0.1, verify=True):
+    """
+    把快照恢复（或复制）到设备，只写不同的寄存器
+    :param device: 设备模型
+    :param config: 配置快照
+    :param exclude: 不复制的寄存器，恢复同一个设备的备份时可以传空集合
+    :param settle: 解锁后和保存前的等待时间（秒）
+    :param verify: 是否读回校验
+    :return: 统计，见applyDiff
+    """
+    current = readConfig(device)
+    changes = diffConfig(current, config.registers, exclude)
+    report = applyDiff(device, changes, current, exclude, settle, verify)
+    report["firmwareMatch"] = config.firmware is None or \
+        list(config.firmware) == [current.get(reg) for reg in VERSION_REGS]
+    return report
+
+
+def commission(devices, config, exclude=DEVICE_SPECIFIC, settle=0.1, verify=True):
+    """
+    把同一份配置套用到多个设备
+    :param devices: 设备模型列表
+    :param config: 配置快照
+    :param exclude: 不复制的寄存器
+    :param settle: 解锁后和保存前的等待时间（秒）
+    :param verify: 是否读回校验
+    :return: 设备地址 -> 统计，读取失败的设备为错误信息
+    """
+    reports = {}
+    for device in devices:
+        try:
+            reports[device.ADDR] = restore(device, config, exclude, settle, verify)
+        except IOError as ex:
+            reports[device.ADDR] = {"error": str(ex)}
+    return reports
@@ -8,7 +8,11 @@ class IDataProcessor(metaclass=ABCMeta):
     :param metaclass:
     :return:
     """
-    onVarChanged = []
+    # 数据更新事件按实例保存 Update listeners are kept per instance
+    __slots__ = ('onVarChanged',)
+
+    def __init__(self):
+        self.onVarChanged = []
 
     @abstractmethod
     def onOpen(self, deviceModel):
@@ -18,6 +22,5 @@ class IDataProcessor(metaclass=ABCMeta):
     def onClose(self):
         pass
 
-    @staticmethod
-    def onUpdate(*args):
-        pass
\ No newline at end of file
+    def onUpdate(self, *args):
+        pass
@@ -0,0 +1,118 @@
+# coding:UTF-8
+import time
+from lib.data_processor.interface.i_data_processor import IDataProcessor
+
+"""
+    死区过滤数据处理器 Deadband filter data processor
+    包装另一个数据处理器，只有数据有明显变化时才转发更新事件
+    Wraps another data processor and only forwards updates that changed meaningfully
+"""
+
+
+class DeadbandDataProcessor(IDataProcessor):
+    __slots__ = ('dataProcessor', 'minInterval', 'maxSilence', 'deadbands', 'lastValues', 'lastEmitTime',
+                 'passCount', 'dropCount')
+
+    def __init__(self, dataProcessor, minInterval=0.0, maxSilence=None):
+        """
+        初始化
+        :param dataProcessor: 被包装的数据处理器
+        :param minInterval: 两次转发的最小间隔（秒）
+        :param maxSilence: 最长静默时间（秒），超过后即使没有变化也转发一次（心跳），None为不启用
+        """
+        self.dataProcessor = dataProcessor  # 被包装的数据处理器 Wrapped data processor
+        self.minInterval = minInterval      # 最小间隔 Minimum interval
+        self.maxSilence = maxSilence        # 心跳间隔 Heartbeat interval
+        self.deadbands = {}                 # 死区配置 key -> (绝对值, 相对值) Deadband config
+        self.lastValues = {}                # 上次转发的数据 Last forwarded values
+        self.lastEmitTime = None            # 上次转发时间 Last forward time
+        self.passCount = 0                  # 转发次数 Forwarded update count
+        self.dropCount = 0                  # 过滤次数 Suppressed update count
+
+    @property
+    def onVarChanged(self):
+        """
+        数据更新事件列表，与被包装的数据处理器共用
+        :return:
+        """
+        return self.dataProcessor.onVarChanged
+
+    def setDeadband(self, key, absolute=0.0, relative=0.0):
+        """
+        设置字段死区
+        :param key: 数据key
+        :param absolute: 绝对死区，变化量超过该值才算变化
+        :param relative: 相对死区，变化量超过上次值的该比例才算变化
+        :return: 无返回
+        """
+        self.deadbands[key] = (abs(absolute), abs(relative))
+
+    def removeDeadband(self, key):
+        """
+        删除字段死区
+        :param key: 数据key
+        :return: 无返回
+        """
+        if key in self.deadbands:
+            del self.deadbands[key]
+        if key in self.lastValues:
+            del self.lastValues[key]
+
+    def reset(self):
+        """
+        清除上次转发的状态，下一次更新一定会转发
+        :return: 无返回
+        """
+        self.lastValues = {}
+        self.lastEmitTime = None
+
+    def onOpen(self, deviceModel):
+        self.reset()
+        self.dataProcessor.onOpen(deviceModel)
+
+    def onClose(self):
+        self.dataProcessor.onClose()
+
+    def isChanged(self, deviceModel):
+        """
+        判断数据是否超出死区
+        :param deviceModel: 设备模型
+        :return: 是否有变化
+        """
+        if len(self.deadbands) == 0:    # 未配置死区，任何更新都算变化 No deadband configured, every update counts
+            return True
+        for key, (absolute, relative) in self.deadbands.items():
+            value = deviceModel.getDeviceData(key)
+            if key not in self.lastValues:
+                return True
+            lastValue = self.lastValues[key]
+            if not isinstance(value, (int, float)) or not isinstance(lastValue, (int, float)):
+                if value != lastValue:  # 非数值数据比较是否相等 Non-numeric data compares equality
+                    return True
+                continue
+            threshold = max(absolute, relative * abs(lastValue))
+            if abs(value - lastValue) > threshold:
+                return True
+        return False
+
+    def onUpdate(self, deviceModel):
+        """
+        数据更新时，过滤后再转发给被包装的数据处理器
+        :param deviceModel: 设备模型
+        :return: 无返回
+        """
+        now = time.monotonic()
+        if self.lastEmitTime is not None:
+            elapsed = now - self.lastEmitTime
+            if elapsed < self.minInterval:          # 未到最小间隔 Minimum interval not reached
+                self.dropCount += 1
+                return
+            heartbeat = self.maxSilence is not None and elapsed >= self.maxSilence
+            if not heartbeat and not self.isChanged(deviceModel):
+                self.dropCount += 1
+                return
+        for key in self.deadbands:                  # 记录本次转发的数据 Record the forwarded values
+            self.lastValues[key] = deviceModel.getDeviceData(key)
+        self.lastEmitTime = now
+        self.passCount += 1
+        self.dataProcessor.onUpdate(deviceModel)
@@ -7,14 +7,14 @@ from lib.data_processor.interface.i_data_processor import IDataProcessor
 
 
 class WT53R485DataProcessor(IDataProcessor):
-    onVarChanged = []
+    __slots__ = ()
+
     def onOpen(self, deviceModel):
         pass
 
     def onClose(self):
         pass
 
-    @staticmethod
-    def onUpdate(*args):
-        for fun in WT53R485DataProcessor.onVarChanged:
-            fun(*args)
\ No newline at end of file
+    def onUpdate(self, *args):
+        for fun in self.onVarChanged:
+            fun(*args)
@@ -1,21 +1,32 @@
 # coding:UTF-8
+import array
+import sys
 import threading
 import _thread
-import time
 import struct
-import serial
 from serial import SerialException
+from lib.bus.command_queue import CommandQueue, CONTROL, CONFIG
+from lib.bus.register_cache import RegisterCache, CALSW
+from lib.recorder.raw_capture import RawCapture
+from lib.transport.connection_supervisor import ConnectionSupervisor
+from lib.transport.rtt_estimator import RttEstimator, wireTime
+from lib.transport.transport import openTransport
 '''
     串口配置
 '''
 
+REGSIZE = 0x90      # 寄存器个数 Number of registers
+
 
 class SerialConfig:
-    # 端口
-    portName = ''
+    __slots__ = ('portName', 'baud')
+
+    def __init__(self, portName='', baud=9600):
+        # 端口
+        self.portName = portName
 
-    # 波特率
-    baud = 9600
+        # 波特率
+        self.baud = baud
 
 '''
 设备模型
@@ -23,39 +34,70 @@ class SerialConfig:
 
 
 class DeviceModel:
-    # 设备名称
-    deviceName = "我的设备"
+    # 所有状态按实例保存，同一进程可运行多个设备 All state is per instance so many devices can share a process
+    __slots__ = ('deviceName', 'ADDR', 'deviceData', 'isOpen', 'serialPort', 'serialConfig', 'portFactory',
+                 'dataUpdateListener', 'dataProcessor', 'protocolResolver', 'registers', 'rawCapture', 'connection',
+                 'readerThread', 'readerLock', 'rtt', 'commandQueue',
+                 'registerCache')
 
-    #设备ID
-    ADDR = 0x50
+    def __init__(self, deviceName, protocolResolver, dataProcessor, dataUpdateListener):
+        print("初始化设备模型")
+        # 设备名称
+        self.deviceName = deviceName
 
-    # 设备数据字典
-    deviceData = {}
+        # 设备ID
+        self.ADDR = 0x50
 
-    # 是否卡开
-    isOpen = False
+        # 设备数据字典
+        self.deviceData = {}
 
-    # 串口
-    serialPort = None
+        # 原始寄存器映像（有符号16位），协议解析器收到数据时更新  Raw register image (int16), updated by the resolvers
+        self.registers = array.array('h', bytes(REGSIZE * 2))
 
-    # 串口配置
-    serialConfig = SerialConfig()
+        # 是否打开
+        self.isOpen = False
 
-    # 更新触发器
-    dataUpdateListener = ""
+        # 串口
+        self.serialPort = None
 
-    # 数据解析器
-    dataProcessor = None
+        # 串口配置
+        self.serialConfig = SerialConfig()
 
-    # 协议解析器
-    protocolResolver = None
+        # 串口工厂，参数为(端口, 波特率)，None时按端口名打开串口或tcp://地址:端口  Port factory (portName, baud);
+        # when None the port name selects a serial port or tcp://host:port
+        self.portFactory = None
 
-    def __init__(self, deviceName, protocolResolver, dataProcessor, dataUpdateListener):
-        print("初始化设备模型")
-        self.deviceName = deviceName
-        self.protocolResolver = protocolResolver
-        self.dataProcessor = dataProcessor
+        # 更新触发器
         self.dataUpdateListener = dataUpdateListener
+
+        # 数据解析器
+        self.dataProcessor = dataProcessor
+
+        # 协议解析器
+        self.protocolResolver = protocolResolver
+
+        # 原始字节记录，None为不记录  Raw byte capture, None when off
+        self.rawCapture = None
+
+        # 连接监控：断线重连和断线时长统计  Connection supervisor: reconnects and downtime metrics
+        self.connection = ConnectionSupervisor()
+
+        # 读取线程，断线重连时继续使用同一个线程  Reader thread, kept across reconnects
+        self.readerThread = None
+        self.readerLock = threading.Lock()
+
+        # 应答时间估计，用于读取寄存器和轮询的超时  Round-trip estimate for register read and poll timeouts
+        self.rtt = RttEstimator()
+
+        # 总线指令队列：读写、校准和轮询按优先级轮流使用总线，挂到端口工作线程时换成端口的队列
+        # Bus command queue: reads, writes, calibration and polls take turns by priority; replaced by the port's
+        # queue when attached to a port worker
+        self.commandQueue = CommandQueue()
+
+        # 寄存器缓存：配置和版本号在有效期内不再访问总线，相同的读取合并，None为不缓存
+        # Register cache: config and version reads inside their TTL skip the bus and identical reads are merged;
+        # None turns it off
+        self.registerCache = RegisterCache()
         # _thread.start_new_thread(self.readDataTh, ("Data-Received-Thread", 10, ))
 
     def setDeviceData(self, key, value):
@@ -78,6 +120,29 @@ class DeviceModel:
         else:
             return None
 
+    def setRegisters(self, regAddr, dataBytes, bigEndian=False):
+        """
+        更新原始寄存器映像
+        :param regAddr: 起始寄存器地址
+        :param dataBytes: 寄存器数据，每个寄存器2字节
+        :param bigEndian: 数据是否为大端（Modbus为大端，维特协议为小端）
+        :return: 无返回
+        """
+        values = array.array('h', bytes(dataBytes))
+        if bigEndian != (sys.byteorder == "big"):
+            values.byteswap()
+        count = min(len(values), REGSIZE - regAddr)
+        self.registers[regAddr:regAddr + count] = values[:count]
+
+    def getRegisters(self, regAddr, regCount):
+        """
+        获得原始寄存器值
+        :param regAddr: 起始寄存器地址
+        :param regCount: 寄存器个数
+        :return: 有符号16位寄存器值列表
+        """
+        return self.registers[regAddr:regAddr + regCount].tolist()
+
     def removeDeviceData(self, key):
         """
         删除设备数据
@@ -100,12 +165,63 @@ class DeviceModel:
                     if (tlen>0):
                         data = self.serialPort.read(tlen)
                         self.onDataReceived(data)
+                except (SerialException, OSError) as ex:
+                    self.reconnect(ex)          # 端口断开，在本线程重连 Port lost: reconnect on this thread
                 except Exception as ex:
                     print(ex)
             else:
-                time.sleep(0.1)
-                print("暂停")
-                break
+                with self.readerLock:
+                    if not self.isOpen:         # 用户关闭了设备 Closed by the user
+                        self.readerThread = None
+                        print("暂停")
+                        break
+
+    def reconnect(self, error):
+        """
+        端口断开后按退避间隔重新打开，直到成功或用户关闭设备
+        :param error: 断开的原因
+        :return: 是否重连成功
+        """
+        with self.readerLock:
+            if not self.isOpen or not self.connection.wanted:  # 用户正在关闭或重新打开 Closing or reopening
+                return False
+            print("端口断开 port lost: " + self.serialConfig.portName + " " + str(error))
+            self.isOpen = False
+            self.connection.markDown(error)
+            self.closePort()
+        while self.connection.waitRetry():
+            try:
+                port = self.openPort()
+            except (SerialException, OSError) as ex:
+                self.connection.lastError = str(ex)
+                continue
+            with self.readerLock:
+                if not self.connection.wanted or self.isOpen:  # 等待期间用户关闭或重新打开了设备
+                    port.close()                                # Closed or reopened by the user meanwhile
+                    return self.isOpen
+                self.serialPort = port
+                self.connection.markUp()
+                self.isOpen = True
+            print("端口已恢复 port restored: " + self.serialConfig.portName)
+            return True
+        return False
+
+    def openPort(self):
+        """
+        按串口配置打开端口
+        :return: 端口
+        """
+        if self.portFactory is not None:
+            return self.portFactory(self.serialConfig.portName, self.serialConfig.baud)
+        return openTransport(self.serialConfig.portName, self.serialConfig.baud, timeout=0.5)
+
+    def closePort(self):
+        port = self.serialPort
+        if port is not None:
+            try:
+                port.close()
+            except (SerialException, OSError):
+                pass
 
     def openDevice(self):
         """
@@ -113,25 +229,38 @@ class DeviceModel:
         :return: 无返回
         """
 
-        # 先关闭端口
-        self.closeDevice()
+        # 先关闭端口，读取线程继续使用
+        with self.readerLock:
+            self.isOpen = False
+            self.closePort()
+        self.connection.name = self.serialConfig.portName
+        self.commandQueue.name = self.serialConfig.portName
+        self.commandQueue.baud = self.serialConfig.baud
         try:
-            self.serialPort = serial.Serial(self.serialConfig.portName, self.serialConfig.baud, timeout=0.5)
-            self.isOpen = True
-            t = threading.Thread(target=self.readDataTh, args=("Data-Received-Thread",10,))          # 开启一个线程接收数据
-            t.start()
+            port = self.openPort()
         except SerialException:
-            print("打开" + self.serialConfig.portName + self.serialConfig.baud + "失败")
+            print("打开" + self.serialConfig.portName + str(self.serialConfig.baud) + "失败")
+            return
+        with self.readerLock:
+            self.serialPort = port
+            self.connection.acquire()
+            self.connection.markUp()
+            self.isOpen = True
+            if self.readerThread is None:       # 开启一个线程接收数据，已有时继续使用
+                self.readerThread = threading.Thread(target=self.readDataTh, args=("Data-Received-Thread", 10,))
+                self.readerThread.start()
 
     def closeDevice(self):
         """
         关闭设备
         :return: 无返回
         """
-        if self.serialPort is not None:
-            self.serialPort.close()
-            print("端口关闭了")
-        self.isOpen = False
+        with self.readerLock:
+            self.connection.release()
+            self.isOpen = False
+            if self.serialPort is not None:
+                self.closePort()
+                print("端口关闭了")
         print("设备关闭了")
 
     def onDataReceived(self, data):
@@ -140,9 +269,34 @@ class DeviceModel:
         :param data: 收到的数据
         :return: 无返回
         """
+        if self.rawCapture is not None:
+            self.rawCapture.write(data)
         if self.protocolResolver is not None:
             self.protocolResolver.passiveReceiveData(data, self)
 
+    def startRawCapture(self, fileName, indexInterval=0.1):
+        """
+        开始记录串口原始字节
+        :param fileName: 记录文件名
+        :param indexInterval: 索引间隔（秒）
+        :return: 原始字节记录
+        """
+        self.stopRawCapture()
+        capture = RawCapture(fileName, indexInterval)
+        capture.open()
+        self.rawCapture = capture
+        return capture
+
+    def stopRawCapture(self):
+        """
+        停止记录串口原始字节
+        :return: 无返回
+        """
+        capture = self.rawCapture
+        self.rawCapture = None
+        if capture is not None:
+            capture.close()
+
     def get_int(self,dataBytes):
         """
         int转换有符号整形   = C# BitConverter.ToInt16
@@ -161,35 +315,81 @@ class DeviceModel:
         return  int.from_bytes(dataBytes, "little")
 
 
-    def sendData(self, data):
+    def sendData(self, data, priority=CONFIG):
         """
         发送数据
+        :param data: 要发送的数据
+        :param priority: 优先级 CONTROL/CONFIG/POLL
         :return: 是否发送成功
         """
         if self.protocolResolver is not None:
-            self.protocolResolver.sendData(data, self)
+            self.commandQueue.run(lambda: self.protocolResolver.sendData(data, self), priority)
 
-    def readReg(self, regAddr,regCount):
+    def readReg(self, regAddr, regCount, priority=CONFIG, deadline=None, retries=0):
         """
         读取寄存器
         :param regAddr: 寄存器地址
         :param regCount: 寄存器个数
-        :return:
+        :param priority: 优先级 CONTROL/CONFIG/POLL，循环读取数据时用POLL，不会挡住配置读写
+        :param deadline: 截止时间（time.monotonic），排队超过就放弃返回空列表，None为不限
+        :param retries: 没有应答时最多重试的次数（受重试预算限制）
+        :return: 寄存器值列表，没有应答、取消或超过截止时间返回空列表
         """
-        if self.protocolResolver is not None:
-            return self.protocolResolver.readReg(regAddr,regCount, self)
-        else:
-            return none
+        if self.protocolResolver is None:
+            return []
+
+        def fetch():
+            values = self.commandQueue.run(lambda: self.protocolResolver.readReg(regAddr, regCount, self), priority,
+                                           deadline, retries)
+            return [] if values is None else values     # 与应答超时一样 Same as a response timeout
+        if self.registerCache is None:
+            return fetch()
+        return self.registerCache.read(regAddr, regCount, fetch, priority, deadline)
 
-    def writeReg(self, regAddr,sValue):
+    def writeReg(self, regAddr, sValue, priority=CONFIG, deadline=None):
         """
         写入寄存器
         :param regAddr: 寄存器地址
         :param sValue: 写入值
+        :param priority: 优先级 CONTROL/CONFIG/POLL
+        :param deadline: 截止时间（time.monotonic），排队超过就放弃，None为不限
         :return:
         """
         if self.protocolResolver is not None:
-            self.protocolResolver.writeReg(regAddr,sValue, self)
+            self.commandQueue.run(lambda: self.protocolResolver.writeReg(regAddr, sValue, self), priority, deadline,
+                                  busyFor=self.getEchoTime())
+            if self.registerCache is not None:
+                self.registerCache.onWrite(regAddr)     # 写入的寄存器失效 Invalidate the written register
+
+    def writeRegs(self, regAddr, values, priority=CONFIG, deadline=None):
+        """
+        写入多个连续寄存器，协议支持时一条指令写完，否则逐个写入
+        :param regAddr: 起始寄存器地址
+        :param values: 写入值列表
+        :param priority: 优先级 CONTROL/CONFIG/POLL
+        :param deadline: 截止时间（time.monotonic），排队超过就放弃，None为不限
+        :return:
+        """
+        if self.protocolResolver is None:
+            return
+        if not hasattr(self.protocolResolver, "writeRegs"):
+            for i, value in enumerate(values):
+                self.writeReg(regAddr + i, value, priority, deadline)
+            return
+        self.commandQueue.run(lambda: self.protocolResolver.writeRegs(regAddr, values, self), priority, deadline,
+                              busyFor=self.getEchoTime())
+        if self.registerCache is not None:
+            if regAddr <= CALSW:                            # 含保存或校准 Includes save or calibration
+                self.registerCache.invalidate()
+            else:
+                self.registerCache.invalidate(regAddr, len(values))
+
+    def getEchoTime(self):
+        """
+        写入指令后设备回显的时间，期间总线不能发送下一条指令
+        :return: 秒
+        """
+        return wireTime(self.serialConfig.baud, 0, 8)
 
     def unlock(self):
         """
@@ -197,7 +397,7 @@ class DeviceModel:
         :return:
         """
         if self.protocolResolver is not None:
-            self.protocolResolver.unlock(self)
+            self.commandQueue.run(lambda: self.protocolResolver.unlock(self), CONTROL, busyFor=self.getEchoTime())
 
     def save(self):
         """
@@ -205,11 +405,13 @@ class DeviceModel:
         :return:
         """
         if self.protocolResolver is not None:
-            self.protocolResolver.save(self)
+            self.commandQueue.run(lambda: self.protocolResolver.save(self), CONTROL, busyFor=self.getEchoTime())
+            if self.registerCache is not None:
+                self.registerCache.invalidate()         # 保存后全部重新读取 Re-read everything after a save
 
     def AccelerationCalibration(self):
         """
-        加计校准
+        加计校准（解锁和校准指令按控制优先级排队，等待校准期间不占用总线）
         :return:
         """
         if self.protocolResolver is not None:
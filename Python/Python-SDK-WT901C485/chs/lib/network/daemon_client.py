@@ -0,0 +1,95 @@
+# coding:UTF-8
+import json
+import socket
+from lib.bus.shm_latest_table import ShmLatestTable
+from lib.network.port_daemon import DEFAULT_SOCKET
+
+"""
+    端口守护进程客户端 Port daemon client
+    通过Unix域套接字读写寄存器，通过共享内存读取最新值，不占用串口
+    Reads and writes registers over the Unix domain socket and reads the latest values from shared memory,
+    without touching the serial port
+"""
+
+
+class DaemonClient:
+    __slots__ = ('socketPath', 'timeout', 'sock', 'stream', 'table')
+
+    def __init__(self, socketPath=DEFAULT_SOCKET, timeout=5.0):
+        """
+        初始化
+        :param socketPath: Unix域套接字路径
+        :param timeout: 请求超时（秒）
+        """
+        self.socketPath = socketPath
+        self.timeout = timeout
+        self.sock = None
+        self.stream = None
+        self.table = None                   # 共享内存最新值表 Shared-memory latest-value table
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socketPath)
+        self.stream = self.sock.makefile("rwb")
+
+    def call(self, request):
+        """
+        发送请求并等待应答
+        :param request: 请求
+        :return: 应答，失败时抛出IOError
+        """
+        if self.sock is None:
+            self.connect()
+        self.stream.write(json.dumps(request).encode("utf-8") + b"\n")
+        self.stream.flush()
+        line = self.stream.readline()
+        if not line:
+            raise IOError("守护进程已断开 daemon closed the connection")
+        response = json.loads(line.decode("utf-8"))
+        if not response.get("ok"):
+            raise IOError(response.get("error"))
+        return response
+
+    def readReg(self, address, regAddr, regCount=1, portName=None):
+        """
+        读取寄存器
+        :param address: 设备地址
+        :param regAddr: 寄存器地址
+        :param regCount: 寄存器个数
+        :param portName: 端口名，None时由守护进程按地址查找
+        :return: 有符号16位寄存器值列表
+        """
+        return self.call({"op": "read", "addr": address, "reg": regAddr, "count": regCount, "port": portName})["values"]
+
+    def writeReg(self, address, regAddr, sValue, portName=None):
+        """
+        写入寄存器
+        :param address: 设备地址
+        :param regAddr: 寄存器地址
+        :param sValue: 写入值
+        :param portName: 端口名，None时由守护进程按地址查找
+        :return: 无返回
+        """
+        self.call({"op": "write", "addr": address, "reg": regAddr, "value": sValue, "port": portName})
+
+    def getStatus(self):
+        return self.call({"op": "status"})
+
+    def openTable(self):
+        """
+        连接共享内存最新值表
+        :return: 最新值表，读取不经过守护进程
+        """
+        if self.table is None:
+            self.table = ShmLatestTable(self.call({"op": "hello"})["table"])
+        return self.table
+
+    def close(self):
+        if self.table is not None:
+            self.table.close()
+            self.table = None
+        if self.sock is not None:
+            self.stream.close()
+            self.sock.close()
+            self.sock = None
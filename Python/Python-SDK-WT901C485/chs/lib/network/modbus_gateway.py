@@ -0,0 +1,357 @@
+# coding:UTF-8
+import asyncio
+import concurrent.futures
+import struct
+import threading
+import time
+import serial
+from lib.transport.transport import openTransport
+from lib.utils.crc_utils import append_crc, check_crc
+
+"""
+    Modbus TCP网关 Modbus TCP gateway
+    asyncio实现的Modbus TCP服务，把单元ID映射到本机各条RS-485总线上的RTU设备。每条总线一个单线程执行器，
+    同一总线上的指令串行执行；相同的读取指令正在执行时，后来的请求直接等待同一个结果；变化慢的寄存器（配置）
+    在TTL内直接从缓存应答，多个客户端轮询不会成倍增加总线负载。写入指令使对应寄存器的缓存失效
+    An asyncio Modbus TCP server mapping unit ids to RTU devices on the local RS-485 buses. Each bus has a
+    single-thread executor, so transactions on one bus are serialised; an identical read already in flight is
+    joined instead of repeated, and slow (configuration) registers are answered from a TTL cache, so N clients
+    polling do not multiply bus load. Writes invalidate the cached registers they touch
+"""
+
+MBAP = struct.Struct(">HHHB")           # 事务号, 协议号, 长度, 单元ID Transaction, protocol, length, unit
+READ_FUNCTIONS = (0x03, 0x04)
+WRITE_FUNCTIONS = (0x06, 0x10)
+ILLEGAL_FUNCTION = 0x01
+ILLEGAL_ADDRESS = 0x02
+PATH_UNAVAILABLE = 0x0A
+TARGET_FAILED = 0x0B
+# 缓存时间 (起始寄存器, 结束寄存器, 秒)，其他寄存器不缓存  Cache TTLs (first, end, seconds); others are not cached
+DEFAULT_TTL = [(0x00, 0x30, 5.0)]
+
+
+class GatewayBus:
+    __slots__ = ('name', 'portName', 'baud', 'timeout', 'portFactory', 'serialPort', 'executor', 'transactionCount',
+                 'timeoutCount')
+
+    def __init__(self, name, portName, baud=9600, timeout=0.2, portFactory=None):
+        """
+        初始化
+        :param name: 总线名
+        :param portName: 串口名
+        :param baud: 波特率
+        :param timeout: 应答超时（秒）
+        :param portFactory: 串口工厂(端口, 波特率)，None时按端口名打开串口或tcp://地址:端口
+        """
+        self.name = name
+        self.portName = portName
+        self.baud = baud
+        self.timeout = timeout
+        self.portFactory = portFactory
+        self.serialPort = None
+        self.executor = concurrent.futures.ThreadPoolExecutor(1, thread_name_prefix="GatewayBus")  # 串行执行 Serialised
+        self.transactionCount = 0           # 总线事务数 Bus transactions
+        self.timeoutCount = 0               # 超时次数 Timeouts
+
+    def open(self):
+        if self.serialPort is None:
+            if self.portFactory is not None:
+                self.serialPort = self.portFactory(self.portName, self.baud)
+            else:
+                self.serialPort = openTransport(self.portName, self.baud, timeout=self.timeout)
+
+    def transact(self, request, responseLength):
+        """
+        执行一次RTU事务（在总线的执行器线程中调用）
+        :param request: 不含CRC的RTU指令（地址+PDU）
+        :param responseLength: 正常应答的长度（含CRC）
+        :return: 应答的地址+PDU（不含CRC），超时或校验失败返回None
+        """
+        self.open()
+        port = self.serialPort
+        self.transactionCount += 1
+        port.flushInput()
+        port.write(append_crc(request))
+        head = port.read(3)
+        if len(head) == 3 and head[1] & 0x80:   # 异常应答 Exception response
+            response = head + port.read(2)
+        else:
+            response = head + port.read(responseLength - 3)
+        if len(response) < 5 or not check_crc(response) or response[0] != request[0]:
+            self.timeoutCount += 1
+            return None
+        return response[:-2]
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+        if self.serialPort is not None:
+            self.serialPort.close()
+            self.serialPort = None
+
+
+class ModbusGateway:
+    __slots__ = ('host', 'port', 'cacheTtl', 'buses', 'units', 'cache', 'inflight', 'generation', 'loop', 'server',
+                 'task', 'writers', 'thread', 'started', 'error', 'requestCount', 'cacheHits', 'coalescedCount')
+
+    def __init__(self, host="0.0.0.0", port=502, cacheTtl=DEFAULT_TTL):
+        """
+        初始化
+        :param host: 监听地址
+        :param port: 监听端口
+        :param cacheTtl: 缓存时间 [(起始寄存器, 结束寄存器, 秒)]，不在列表中的寄存器不缓存
+        """
+        self.host = host
+        self.port = port
+        self.cacheTtl = list(cacheTtl)
+        self.buses = {}                     # 总线名 -> 总线 Bus name -> bus
+        self.units = {}                     # 单元ID -> (总线, RTU地址) Unit id -> (bus, RTU address)
+        self.cache = {}                     # (总线名, 地址, 功能码, 寄存器) -> (值, 过期时间) Register cache
+        self.inflight = {}                  # 正在执行的读取 -> Future  Reads in flight
+        self.generation = 0                 # 写入计数 Bumped on every write
+        self.loop = None
+        self.server = None
+        self.task = None                    # 服务任务 Serving task
+        self.writers = set()                # 客户端连接 Client connections
+        self.thread = None
+        self.started = threading.Event()
+        self.error = None                   # 启动失败的异常 Exception that stopped the server from starting
+        self.requestCount = 0               # 收到的请求数 Requests received
+        self.cacheHits = 0                  # 缓存命中数 Answered from cache
+        self.coalescedCount = 0             # 合并到正在执行的读取的请求数 Joined an in-flight read
+
+    def addBus(self, name, portName, baud=9600, timeout=0.2, portFactory=None):
+        """
+        添加总线
+        :param name: 总线名
+        :param portName: 串口名
+        :param baud: 波特率
+        :param timeout: 应答超时（秒）
+        :param portFactory: 串口工厂(端口, 波特率)
+        :return: 总线
+        """
+        bus = GatewayBus(name, portName, baud, timeout, portFactory)
+        self.buses[name] = bus
+        return bus
+
+    def mapUnit(self, unitId, busName, address=None):
+        """
+        把Modbus TCP单元ID映射到总线上的RTU设备
+        :param unitId: 单元ID
+        :param busName: 总线名
+        :param address: RTU地址，None与单元ID相同
+        :return: 无返回
+        """
+        self.units[unitId] = (self.buses[busName], unitId if address is None else address)
+
+    def ttl(self, regAddr):
+        for first, end, seconds in self.cacheTtl:
+            if first <= regAddr < end:
+                return seconds
+        return 0
+
+    # region 请求处理 Request handling
+
+    async def handleRequest(self, unitId, pdu):
+        """
+        处理一个请求
+        :param unitId: 单元ID
+        :param pdu: 请求PDU
+        :return: 应答PDU
+        """
+        self.requestCount += 1
+        func = pdu[0]
+        target = self.units.get(unitId)
+        if target is None:
+            return bytes([func | 0x80, PATH_UNAVAILABLE])
+        bus, address = target
+        if func in READ_FUNCTIONS:
+            if len(pdu) != 5:
+                return bytes([func | 0x80, ILLEGAL_ADDRESS])
+            regAddr, regCount = struct.unpack(">HH", pdu[1:5])
+            if not 1 <= regCount <= 125:
+                return bytes([func | 0x80, ILLEGAL_ADDRESS])
+            return await self.read(bus, address, func, regAddr, regCount)
+        if func in WRITE_FUNCTIONS:
+            if len(pdu) < 5:
+                return bytes([func | 0x80, ILLEGAL_ADDRESS])
+            regAddr, regCount = struct.unpack(">HH", pdu[1:5])
+            if func == 0x06:
+                regCount = 1
+            response = await self.transact(bus, bytes([address]) + pdu, 8)
+            self.generation += 1
+            for reg in range(regAddr, regAddr + regCount):  # 写入后缓存失效 Invalidate written registers
+                for readFunc in READ_FUNCTIONS:
+                    self.cache.pop((bus.name, address, readFunc, reg), None)
+            return response
+        return bytes([func | 0x80, ILLEGAL_FUNCTION])
+
+    async def read(self, bus, address, func, regAddr, regCount):
+        """
+        读取寄存器：先查缓存，再合并到正在执行的相同读取，最后才访问总线
+        :return: 应答PDU
+        """
+        now = time.monotonic()
+        values = []
+        for reg in range(regAddr, regAddr + regCount):
+            cached = self.cache.get((bus.name, address, func, reg))
+            if cached is None or cached[1] < now:
+                break
+            values.append(cached[0])
+        else:
+            self.cacheHits += 1
+            return bytes([func, regCount * 2]) + b"".join(struct.pack(">H", value) for value in values)
+        # 写入之后的请求不合并到写入之前开始的读取 A read issued after a write never joins one started before it
+        key = (bus.name, address, func, regAddr, regCount, self.generation)
+        task = self.inflight.get(key)
+        if task is not None:
+            self.coalescedCount += 1
+        else:
+            # 总线读取不属于任何一个客户端，发起的客户端断开时合并进来的请求照样得到应答
+            # The bus read belongs to no client, so joined requests are answered even if the first client leaves
+            task = self.loop.create_task(self.fetch(bus, address, func, regAddr, regCount, self.generation))
+            self.inflight[key] = task
+            task.add_done_callback(lambda done: self.inflight.pop(key, None))
+        try:
+            return await asyncio.shield(task)
+        except asyncio.CancelledError:
+            if not task.cancelled():        # 本请求被取消 This request was cancelled
+                raise
+            return bytes([func | 0x80, TARGET_FAILED])
+
+    async def fetch(self, bus, address, func, regAddr, regCount, generation):
+        """
+        访问总线读取寄存器并更新缓存
+        :param generation: 发起读取时的写入计数
+        :return: 应答PDU
+        """
+        response = await self.transact(bus, bytes([address]) + struct.pack(">BHH", func, regAddr, regCount),
+                                       5 + regCount * 2)
+        # 读取期间有写入时不缓存（可能是写入前的值） Not cached if a write finished meanwhile: it may predate the write
+        if generation == self.generation and not response[0] & 0x80 and len(response) == 2 + regCount * 2:
+            expires = time.monotonic()
+            for i in range(regCount):
+                ttl = self.ttl(regAddr + i)
+                if ttl > 0:
+                    value = struct.unpack_from(">H", response, 2 + i * 2)[0]
+                    self.cache[(bus.name, address, func, regAddr + i)] = (value, expires + ttl)
+        return response
+
+    async def transact(self, bus, request, responseLength):
+        """
+        在总线的执行器中执行RTU事务
+        :return: 应答PDU，超时返回网关异常应答
+        """
+        try:
+            response = await self.loop.run_in_executor(bus.executor, bus.transact, request, responseLength)
+        except (OSError, serial.SerialException):
+            response = None
+        if response is None:
+            return bytes([request[1] | 0x80, TARGET_FAILED])
+        return response[1:]
+
+    async def handleClient(self, reader, writer):
+        """
+        处理一个Modbus TCP连接，请求可以流水线发送，应答按完成顺序返回
+        :param reader: 读取流
+        :param writer: 写入流
+        :return:
+        """
+        lock = asyncio.Lock()
+
+        async def answer(transaction, unitId, pdu):
+            try:
+                response = await self.handleRequest(unitId, pdu)
+            except Exception:
+                response = bytes([pdu[0] | 0x80, TARGET_FAILED])
+            async with lock:
+                writer.write(MBAP.pack(transaction, 0, len(response) + 1, unitId) + response)
+                await writer.drain()
+
+        tasks = set()
+        self.writers.add(writer)
+        try:
+            while True:
+                head = await reader.readexactly(MBAP.size)
+                transaction, protocol, length, unitId = MBAP.unpack(head)
+                if protocol != 0 or not 2 <= length <= 254:     # 至少单元ID和功能码 Unit id and function at least
+                    break
+                pdu = await reader.readexactly(length - 1)
+                task = self.loop.create_task(answer(transaction, unitId, pdu))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+        except (asyncio.IncompleteReadError, ConnectionError, asyncio.CancelledError):
+            pass                            # 客户端断开或网关停止 Client left or gateway stopping
+        finally:
+            for task in list(tasks):
+                task.cancel()
+            self.writers.discard(writer)
+            writer.close()
+
+    # endregion
+
+    # region 启动停止 Start and stop
+
+    async def serve(self):
+        """
+        在当前事件循环中运行服务，直到被取消
+        :return:
+        """
+        self.loop = asyncio.get_running_loop()
+        self.task = asyncio.current_task()
+        try:
+            self.server = await asyncio.start_server(self.handleClient, self.host, self.port)
+        except Exception as ex:             # 如端口被占用或没有权限 E.g. port in use or not permitted
+            self.error = ex
+            self.started.set()
+            return
+        self.port = self.server.sockets[0].getsockname()[1]
+        self.started.set()
+        try:
+            await self.server.serve_forever()
+        except asyncio.CancelledError:
+            pass
+        finally:
+            self.server.close()
+            for writer in list(self.writers):
+                writer.close()
+
+    def start(self):
+        """
+        在后台线程中运行服务，监听失败时抛出异常
+        :return: 无返回
+        """
+        self.error = None
+        self.started.clear()
+        self.thread = threading.Thread(target=self.run, name="ModbusGateway", daemon=True)
+        self.thread.start()
+        self.started.wait()
+        if self.error is not None:
+            self.thread.join()
+            self.thread = None
+            raise self.error
+
+    def run(self):
+        asyncio.run(self.serve())
+
+    def stop(self):
+        """
+        停止服务并关闭所有总线
+        :return: 无返回
+        """
+        if self.loop is not None and self.task is not None:
+            self.loop.call_soon_threadsafe(self.task.cancel)
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        for bus in self.buses.values():
+            bus.close()
+
+    def getStatus(self):
+        """
+        获取状态
+        :return: 请求数、缓存命中数、合并数、各总线事务数和超时次数
+        """
+        return {"requests": self.requestCount, "cacheHits": self.cacheHits, "coalesced": self.coalescedCount,
+                "buses": {name: (bus.transactionCount, bus.timeoutCount) for name, bus in self.buses.items()}}
+
+    # endregion
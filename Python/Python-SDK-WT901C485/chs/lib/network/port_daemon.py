@@ -0,0 +1,183 @@
+# coding:UTF-8
+import json
+import os
+import socket
+import struct
+import threading
+from lib.bus.shm_latest_table import ShmLatestTable
+from lib.recorder.binary_recorder import WT901C485_CHANNELS
+from lib.utils.crc_utils import append_crc, check_crc
+
+"""
+    端口守护进程 Port daemon
+    守护进程独占所有串口（BusManager），最新采样写入共享内存最新值表，其他进程直接读取，不需要系统调用；
+    读写寄存器的指令通过Unix域套接字发来（每行一个JSON），由端口工作线程插在轮询之间执行，总线只有一个主站
+    The daemon owns every serial port (through a BusManager) and publishes the latest samples to a shared-memory
+    latest-value table that other processes read without system calls. Register read/write requests arrive over a
+    Unix domain socket (one JSON object per line) and are run by the port workers between polls, so the bus has a
+    single master
+"""
+
+DEFAULT_SOCKET = "/tmp/wit-port-daemon.sock"
+
+
+class PortDaemon:
+    __slots__ = ('manager', 'socketPath', 'table', 'tableRows', 'channels', 'server', 'thread', 'running',
+                 'clients', 'lock', 'requestCount', 'errorCount')
+
+    def __init__(self, manager, socketPath=DEFAULT_SOCKET, tableRows=32, channels=WT901C485_CHANNELS):
+        """
+        初始化
+        :param manager: 总线管理器（端口和设备已添加）
+        :param socketPath: Unix域套接字路径
+        :param tableRows: 最新值表的行数（最多的设备数）
+        :param channels: 最新值表的通道表 [(寄存器, 名称, 比例)]
+        """
+        self.manager = manager
+        self.socketPath = socketPath
+        self.table = None                   # 最新值表 Latest-value table
+        self.tableRows = tableRows
+        self.channels = channels
+        self.server = None
+        self.thread = None
+        self.running = False
+        self.clients = []                   # 客户端连接 Client connections
+        self.lock = threading.Lock()
+        self.requestCount = 0               # 收到的指令数 Requests received
+        self.errorCount = 0                 # 失败的指令数 Failed requests
+
+    def start(self):
+        """
+        创建最新值表，启动所有端口，开始监听
+        :return: 无返回
+        """
+        self.table = ShmLatestTable(rows=self.tableRows, channels=self.channels)
+        for worker in self.manager.workers.values():
+            for device in list(worker.devices):
+                device.dataProcessor.onVarChanged.append(self.table.writeDevice)
+        self.manager.start()
+        if os.path.exists(self.socketPath):     # 上次异常退出留下的 Left by an unclean exit
+            os.unlink(self.socketPath)
+        self.server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.server.bind(self.socketPath)
+        self.server.listen(16)
+        self.server.settimeout(0.1)         # 定时检查是否停止 Check for stop periodically
+        self.running = True
+        self.thread = threading.Thread(target=self.acceptLoop, name="PortDaemon", daemon=True)
+        self.thread.start()
+
+    def addDevice(self, portName, device):
+        """
+        运行中添加设备
+        :param portName: 端口名
+        :param device: 设备模型
+        :return: 无返回
+        """
+        if self.table is not None:
+            device.dataProcessor.onVarChanged.append(self.table.writeDevice)
+        self.manager.addDevice(portName, device)
+
+    def acceptLoop(self):
+        while self.running:
+            try:
+                sock, _ = self.server.accept()
+            except socket.timeout:
+                continue
+            except OSError:
+                break
+            sock.settimeout(None)
+            with self.lock:
+                self.clients.append(sock)
+            threading.Thread(target=self.clientLoop, args=(sock,), name="PortDaemon-Client", daemon=True).start()
+
+    def clientLoop(self, sock):
+        """
+        处理一个客户端：每行一个请求，按顺序应答
+        :param sock: 客户端连接
+        :return:
+        """
+        stream = sock.makefile("rwb")
+        try:
+            for line in stream:
+                try:
+                    response = self.handleRequest(json.loads(line.decode("utf-8")))
+                except Exception as ex:
+                    self.errorCount += 1
+                    response = {"ok": False, "error": str(ex) or type(ex).__name__}
+                stream.write(json.dumps(response).encode("utf-8") + b"\n")
+                stream.flush()
+        except OSError:
+            pass
+        with self.lock:
+            if sock in self.clients:
+                self.clients.remove(sock)
+        stream.close()
+        sock.close()
+
+    def handleRequest(self, request):
+        """
+        处理一个请求
+        :param request: {"op": "hello"|"read"|"write"|"status", ...}
+        :return: 应答
+        """
+        self.requestCount += 1
+        op = request.get("op")
+        if op == "hello":
+            return {"ok": True, "table": self.table.name, "ports": list(self.manager.workers),
+                    "devices": {name: [device.ADDR for device in worker.devices]
+                                for name, worker in self.manager.workers.items()}}
+        if op == "status":
+            return {"ok": True, "ports": self.manager.getStatus(), "requests": self.requestCount,
+                    "errors": self.errorCount}
+        if op not in ("read", "write"):
+            raise ValueError("未知请求 unknown op: %s" % op)
+        address = int(request["addr"])
+        regAddr = int(request["reg"])
+        portName = request.get("port") or self.manager.findPort(address)
+        if portName is None:
+            raise ValueError("没有找到设备 device not found: 0x%02x" % address)
+        if op == "read":
+            regCount = int(request.get("count", 1))
+            frame = append_crc(struct.pack(">BBHH", address, 0x03, regAddr, regCount))
+            responseLength = regCount * 2 + 5
+        else:
+            frame = append_crc(struct.pack(">BBHH", address, 0x06, regAddr, int(request["value"]) & 0xffff))
+            responseLength = 8
+        response = self.manager.request(portName, frame, responseLength, request.get("timeout")).result()
+        if not check_crc(response):
+            raise ValueError("应答校验失败 bad response CRC")
+        if response[1] & 0x80:
+            raise ValueError("设备异常应答 device exception 0x%02x" % response[2])
+        if op == "read":
+            return {"ok": True, "values": list(struct.unpack(">%dh" % regCount, response[3:3 + regCount * 2]))}
+        return {"ok": True}
+
+    def stop(self):
+        """
+        停止监听和所有端口，释放最新值表
+        :return: 无返回
+        """
+        self.running = False
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        if self.server is not None:
+            self.server.close()
+            self.server = None
+            if os.path.exists(self.socketPath):
+                os.unlink(self.socketPath)
+        with self.lock:
+            clients = list(self.clients)
+        for sock in clients:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        self.manager.stop()
+        if self.table is not None:
+            for worker in self.manager.workers.values():
+                for device in worker.devices:
+                    if self.table.writeDevice in device.dataProcessor.onVarChanged:
+                        device.dataProcessor.onVarChanged.remove(self.table.writeDevice)
+            self.table.close()
+            self.table = None
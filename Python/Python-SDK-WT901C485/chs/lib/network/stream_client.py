@@ -0,0 +1,96 @@
+# coding:UTF-8
+import json
+import socket
+from lib.bus.bus_sample import BusSample
+from lib.network.stream_protocol import HELLO, SAMPLES, SUBSCRIBE, FrameReader, decodeSamples, encodeJson
+
+"""
+    数据流客户端 Stream client
+    连接分发服务，订阅设备和通道，把收到的帧还原成BusSample（数据为换算后的通道值）
+    Connects to the fan-out server, subscribes by device and field and turns frames back into
+    BusSample records (data holds the scaled channel values)
+"""
+
+
+class StreamClient:
+    __slots__ = ('host', 'port', 'devices', 'fields', 'timeout', 'sock', 'reader', 'channels', 'portName',
+                 'samples', 'sampleCount')
+
+    def __init__(self, host="127.0.0.1", port=9901, devices=None, fields=None, timeout=None):
+        """
+        初始化
+        :param host: 服务地址
+        :param port: 服务端口
+        :param devices: 订阅的设备ID列表，None为全部
+        :param fields: 订阅的通道名列表，None为全部
+        :param timeout: 接收超时（秒），None为一直等待
+        """
+        self.host = host
+        self.port = port
+        self.devices = devices
+        self.fields = fields
+        self.timeout = timeout
+        self.sock = None
+        self.reader = FrameReader()
+        self.channels = []                  # 服务端的通道表 Server channel table
+        self.portName = "%s:%d" % (host, port)
+        self.samples = []                   # 已解码未取走的样本 Decoded samples not yet returned
+        self.sampleCount = 0                # 收到的样本数 Samples received
+
+    def connect(self):
+        """
+        连接并发送订阅，等待服务端的通道表
+        :return: 无返回
+        """
+        self.sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.sock.sendall(encodeJson(SUBSCRIBE, {"devices": self.devices, "fields": self.fields}))
+        while not self.channels:
+            if not self.receive():
+                raise ConnectionError("连接已断开 connection closed")
+
+    def receive(self):
+        """
+        接收一次数据并解码
+        :return: 连接是否仍然有效
+        """
+        data = self.sock.recv(1 << 16)
+        if not data:
+            return False
+        for kind, body in self.reader.feed(data):
+            if kind == HELLO:
+                self.channels = json.loads(body.decode("utf-8"))
+            elif kind == SAMPLES:
+                indexes, rows = decodeSamples(body)
+                channels = [self.channels[i] for i in indexes]
+                for timestamp, deviceId, values in rows:
+                    if self.devices is not None and deviceId not in self.devices:
+                        continue        # 订阅生效前收到的数据 Data sent before the subscription took effect
+                    data = {name: value * scale for (_, name, scale), value in zip(channels, values)}
+                    self.samples.append(BusSample(timestamp, self.portName, deviceId, "", data))
+        return True
+
+    def read(self):
+        """
+        读取样本，没有样本时等待
+        :return: 样本列表，连接断开返回None
+        """
+        while not self.samples:
+            if not self.receive():
+                return None
+        samples, self.samples = self.samples, []
+        self.sampleCount += len(samples)
+        return samples
+
+    def __iter__(self):
+        while True:
+            samples = self.read()
+            if samples is None:
+                return
+            for sample in samples:
+                yield sample
+
+    def close(self):
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
@@ -0,0 +1,100 @@
+# coding:UTF-8
+import json
+import struct
+
+"""
+    数据流协议 Stream protocol
+    每帧：长度（uint32，不含自身）、类型（uint8）、内容，小端。
+    HELLO（服务端->客户端）：JSON通道表 [[寄存器, 名称, 换算系数], ...]
+    SUBSCRIBE（客户端->服务端）：JSON {"devices": [设备ID] 或 null, "fields": [通道名] 或 null}
+    SAMPLES（服务端->客户端）：采样数（uint16）、通道数（uint8）、通道序号（uint8 * 通道数），
+    然后每个采样：主机时间（int64纳秒）、设备ID（uint16）、原始寄存器值（int16 * 通道数）
+    Each frame: length (uint32, excluding itself), type (uint8), body, little-endian.
+    HELLO (server -> client): JSON channel table [[register, name, scale], ...]
+    SUBSCRIBE (client -> server): JSON {"devices": [ids] or null, "fields": [names] or null}
+    SAMPLES (server -> client): sample count (uint16), channel count (uint8), channel indexes (uint8 each),
+    then per sample: host time (int64 ns), device id (uint16), raw register values (int16 each)
+"""
+
+HELLO = 1
+SUBSCRIBE = 2
+SAMPLES = 3
+FRAME_HEAD = struct.Struct("<IB")       # 长度, 类型 Length, type
+SAMPLES_HEAD = struct.Struct("<HB")     # 采样数, 通道数 Samples, channels
+SAMPLE_HEAD = struct.Struct("<qH")      # 时间, 设备ID Timestamp, device id
+MAX_SAMPLES = 0xffff
+
+
+def encodeFrame(kind, body):
+    """
+    编码一帧
+    :param kind: 帧类型
+    :param body: 内容
+    :return: 字节
+    """
+    return FRAME_HEAD.pack(len(body) + 1, kind) + body
+
+
+def encodeJson(kind, value):
+    return encodeFrame(kind, json.dumps(value).encode("utf-8"))
+
+
+def encodeSamples(rows, indexes):
+    """
+    编码一批采样
+    :param rows: [(时间, 设备ID, 全部通道的原始值)]，最多65535条
+    :param indexes: 要发送的通道序号
+    :return: 一帧
+    """
+    record = struct.Struct("<qH%dh" % len(indexes))
+    body = bytearray(SAMPLES_HEAD.pack(len(rows), len(indexes)))
+    body += bytes(indexes)
+    for timestamp, deviceId, values in rows:
+        body += record.pack(timestamp, deviceId, *[values[i] for i in indexes])
+    return encodeFrame(SAMPLES, body)
+
+
+def decodeSamples(body):
+    """
+    解码一批采样
+    :param body: SAMPLES帧的内容
+    :return: (通道序号列表, [(时间, 设备ID, 原始值元组)])
+    """
+    count, channelCount = SAMPLES_HEAD.unpack_from(body, 0)
+    offset = SAMPLES_HEAD.size
+    indexes = list(body[offset:offset + channelCount])
+    offset += channelCount
+    record = struct.Struct("<qH%dh" % channelCount)
+    rows = []
+    for values in record.iter_unpack(body[offset:offset + count * record.size]):
+        rows.append((values[0], values[1], values[2:]))
+    return indexes, rows
+
+
+class FrameReader:
+    __slots__ = ('buffer',)
+
+    def __init__(self):
+        """
+        从字节流中切分帧，数据可以任意切分后送入
+        """
+        self.buffer = bytearray()
+
+    def feed(self, data):
+        """
+        送入数据
+        :param data: 字节
+        :return: [(帧类型, 内容)]
+        """
+        self.buffer += data
+        frames = []
+        offset = 0
+        while len(self.buffer) - offset >= FRAME_HEAD.size:
+            length, kind = FRAME_HEAD.unpack_from(self.buffer, offset)
+            end = offset + 4 + length
+            if end > len(self.buffer):
+                break
+            frames.append((kind, bytes(self.buffer[offset + FRAME_HEAD.size:end])))
+            offset = end
+        del self.buffer[:offset]
+        return frames
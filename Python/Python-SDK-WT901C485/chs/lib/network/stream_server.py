@@ -0,0 +1,273 @@
+# coding:UTF-8
+import collections
+import json
+import socket
+import threading
+import time
+from lib.network.stream_protocol import HELLO, MAX_SAMPLES, SUBSCRIBE, FrameReader, encodeJson, encodeSamples
+from lib.recorder.binary_recorder import JY901S_CHANNELS
+
+"""
+    数据流分发服务 Stream fan-out server
+    一个进程独占串口和设备模型，把采样通过TCP分发给多个本机或局域网客户端。采样按固定间隔成批编码，
+    相同订阅的客户端共用同一份编码结果；每个客户端有自己的有界发送队列，发送线程用memoryview和sendmsg
+    直接发送编码好的数据，不再拷贝。发送跟不上的客户端丢弃最旧的批次（或断开连接）
+    One process owns the serial ports and device models and streams samples to many local or LAN clients
+    over TCP. Samples are encoded in batches at a fixed interval, once per distinct subscription; every client
+    has its own bounded send queue, and its sender thread hands the encoded batches to sendmsg as memoryviews
+    without copying. Slow consumers lose their oldest batches (or are disconnected)
+"""
+
+IOV_MAX = 512       # 每次sendmsg最多的缓冲区数 Buffers per sendmsg call
+
+
+class StreamClientConnection:
+    __slots__ = ('sock', 'address', 'devices', 'fields', 'frames', 'condition', 'running', 'dropCount',
+                 'sentBytes', 'sentFrames')
+
+    def __init__(self, sock, address, maxQueue):
+        """
+        初始化
+        :param sock: 客户端套接字
+        :param address: 客户端地址
+        :param maxQueue: 发送队列最多缓存的批次数
+        """
+        self.sock = sock
+        self.address = address
+        self.devices = None                 # 订阅的设备，None为全部 Subscribed devices, None for all
+        self.fields = None                  # 订阅的通道序号，None为全部 Subscribed channel indexes, None for all
+        self.frames = collections.deque(maxlen=maxQueue)    # 发送队列 Send queue
+        self.condition = threading.Condition()
+        self.running = True
+        self.dropCount = 0                  # 丢弃的批次数 Dropped batches
+        self.sentBytes = 0                  # 发送字节数 Bytes sent
+        self.sentFrames = 0                 # 发送帧数 Frames sent
+
+    def enqueue(self, frame):
+        """
+        放入发送队列，满了丢弃最旧的
+        :param frame: memoryview
+        :return: 是否丢弃了旧数据
+        """
+        with self.condition:
+            dropped = len(self.frames) == self.frames.maxlen
+            if dropped:
+                self.dropCount += 1
+            self.frames.append(frame)
+            self.condition.notify()
+        return dropped
+
+    def sendLoop(self):
+        """
+        发送线程：一次取出队列中所有帧，用sendmsg分散写，部分发送时只切片memoryview
+        :return:
+        """
+        try:
+            while True:
+                with self.condition:
+                    while self.running and not self.frames:
+                        self.condition.wait()
+                    if not self.running:
+                        break
+                    frames = list(self.frames)
+                    self.frames.clear()
+                if hasattr(self.sock, "sendmsg"):
+                    while frames:
+                        sent = self.sock.sendmsg(frames[:IOV_MAX])
+                        self.sentBytes += sent
+                        while frames and sent >= len(frames[0]):
+                            sent -= len(frames[0])
+                            frames.pop(0)
+                            self.sentFrames += 1
+                        if frames and sent:
+                            frames[0] = frames[0][sent:]
+                else:
+                    for frame in frames:
+                        self.sock.sendall(frame)
+                        self.sentBytes += len(frame)
+                        self.sentFrames += 1
+        except OSError:
+            pass
+        self.close()
+
+    def close(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify()
+        try:
+            # 先shutdown，阻塞在recv/sendmsg中的线程才会返回 Shut down first to wake threads blocked in recv/sendmsg
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        try:
+            self.sock.close()
+        except OSError:
+            pass
+
+
+class StreamServer:
+    __slots__ = ('host', 'port', 'channels', 'names', 'batchInterval', 'maxQueue', 'dropPolicy', 'deviceIds',
+                 'pending', 'lock', 'clients', 'server', 'running', 'threads', 'sampleCount', 'batchCount')
+
+    def __init__(self, host="0.0.0.0", port=9901, channels=JY901S_CHANNELS, batchInterval=0.02, maxQueue=256,
+                 dropPolicy="oldest"):
+        """
+        初始化
+        :param host: 监听地址
+        :param port: 监听端口
+        :param channels: 通道定义 [(寄存器, 名称, 换算系数)]
+        :param batchInterval: 成批发送的间隔（秒）
+        :param maxQueue: 每个客户端最多缓存的批次数
+        :param dropPolicy: 客户端队列满时 "oldest" 丢弃最旧的批次，"disconnect" 断开连接
+        """
+        self.host = host
+        self.port = port
+        self.channels = list(channels)
+        self.names = {name: i for i, (_, name, _) in enumerate(self.channels)}
+        self.batchInterval = batchInterval
+        self.maxQueue = maxQueue
+        self.dropPolicy = dropPolicy
+        self.deviceIds = {}                 # 设备 -> 设备ID，默认用设备地址 Device -> id, ADDR by default
+        self.pending = []                   # 待发送的采样 Samples waiting for the next batch
+        self.lock = threading.Lock()
+        self.clients = []                   # 已连接的客户端 Connected clients
+        self.server = None
+        self.running = False
+        self.threads = []
+        self.sampleCount = 0                # 采样数 Samples
+        self.batchCount = 0                 # 批次数 Batches
+
+    def setDeviceId(self, deviceModel, deviceId):
+        self.deviceIds[deviceModel] = deviceId
+
+    def start(self):
+        """
+        开始监听并启动分发线程
+        :return: 无返回
+        """
+        self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.server.bind((self.host, self.port))
+        self.port = self.server.getsockname()[1]
+        self.server.listen(16)
+        self.running = True
+        self.threads = [threading.Thread(target=self.acceptLoop, name="StreamServer.accept", daemon=True),
+                        threading.Thread(target=self.batchLoop, name="StreamServer.batch", daemon=True)]
+        for thread in self.threads:
+            thread.start()
+
+    def write(self, deviceModel, timestamp=None):
+        """
+        加入一个采样，可直接在数据更新事件中调用
+        :param deviceModel: 设备模型
+        :param timestamp: 主机时间（纳秒），None为当前时间
+        :return: 无返回
+        """
+        registers = deviceModel.registers
+        row = (time.time_ns() if timestamp is None else timestamp,
+               self.deviceIds.get(deviceModel, deviceModel.ADDR),
+               tuple(registers[reg] for reg, _, _ in self.channels))
+        with self.lock:
+            self.pending.append(row)
+            self.sampleCount += 1
+
+    def acceptLoop(self):
+        while self.running:
+            try:
+                sock, address = self.server.accept()
+            except OSError:
+                break
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            client = StreamClientConnection(sock, address, self.maxQueue)
+            client.enqueue(memoryview(encodeJson(HELLO, self.channels)))
+            with self.lock:
+                self.clients.append(client)
+            threading.Thread(target=client.sendLoop, name="StreamServer.send", daemon=True).start()
+            threading.Thread(target=self.receiveLoop, args=(client,), name="StreamServer.receive",
+                             daemon=True).start()
+
+    def receiveLoop(self, client):
+        """
+        接收客户端的订阅
+        :param client: 客户端连接
+        :return:
+        """
+        reader = FrameReader()
+        try:
+            while client.running:
+                data = client.sock.recv(4096)
+                if not data:
+                    break
+                for kind, body in reader.feed(data):
+                    if kind != SUBSCRIBE:
+                        continue
+                    request = json.loads(body.decode("utf-8"))
+                    devices = request.get("devices")
+                    fields = request.get("fields")
+                    client.devices = None if devices is None else frozenset(devices)
+                    client.fields = None if fields is None else tuple(self.names[name] for name in fields
+                                                                      if name in self.names)
+        except (OSError, ValueError):
+            pass
+        client.close()
+        with self.lock:
+            if client in self.clients:
+                self.clients.remove(client)
+
+    def batchLoop(self):
+        """
+        分发线程：按间隔取出采样，每种订阅编码一次，放入各客户端的发送队列
+        :return:
+        """
+        allFields = tuple(range(len(self.channels)))
+        while self.running:
+            time.sleep(self.batchInterval)
+            with self.lock:
+                rows, self.pending = self.pending, []
+                clients = list(self.clients)
+            if not rows or not clients:
+                continue
+            self.batchCount += 1
+            encoded = {}                    # 订阅 -> 编码好的帧 Subscription -> encoded frames
+            for client in clients:
+                key = (client.devices, client.fields)
+                frames = encoded.get(key)
+                if frames is None:
+                    selected = rows if client.devices is None else [row for row in rows if row[1] in client.devices]
+                    indexes = allFields if client.fields is None else client.fields
+                    frames = [memoryview(encodeSamples(selected[i:i + MAX_SAMPLES], indexes))
+                              for i in range(0, len(selected), MAX_SAMPLES)]
+                    encoded[key] = frames
+                for frame in frames:
+                    if client.enqueue(frame) and self.dropPolicy == "disconnect":
+                        client.close()
+                        break
+
+    def getStatus(self):
+        """
+        获取各客户端状态
+        :return: 客户端地址 -> (队列中的批次数, 丢弃的批次数, 发送字节数)
+        """
+        with self.lock:
+            return {client.address: (len(client.frames), client.dropCount, client.sentBytes)
+                    for client in self.clients}
+
+    def stop(self):
+        """
+        停止服务，断开所有客户端
+        :return: 无返回
+        """
+        self.running = False
+        if self.server is not None:
+            try:
+                self.server.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            self.server.close()
+        with self.lock:
+            clients, self.clients = self.clients, []
+        for client in clients:
+            client.close()
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
@@ -7,6 +7,7 @@ from abc import abstractmethod, ABCMeta
 
 
 class IProtocolResolver(metaclass=ABCMeta):
+    __slots__ = ()
 
     @abstractmethod
     def setConfig(self, config):
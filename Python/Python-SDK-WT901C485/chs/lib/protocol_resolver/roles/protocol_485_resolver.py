@@ -1,6 +1,7 @@
 # coding:UTF-8
 import time
 import datetime
+from lib.bus.command_queue import CONTROL
 from lib.protocol_resolver.interface.i_protocol_resolver import IProtocolResolver
 
 """
@@ -49,13 +50,18 @@ class Protocol485Resolver(IProtocolResolver):
         0x44, 0x84, 0x85, 0x45, 0x87, 0x47, 0x46, 0x86, 0x82, 0x42, 0x43, 0x83, 0x41, 0x81, 0x80,
         0x40]
     # endregion  计算CRC
-    TempBytes = []        # 临时数据列表 Temporary Data List
     PackSize = 87         # 一包数据大小 Size of a packet of data
     gyroRange = 2000.0    # 角速度量程 Angular velocity range
     accRange = 16.0       # 加速度量程 Acceleration range
     angleRange = 180.0    # 角度量程 Angle range
-    TempFindValues = []   # 读取指定寄存器返回的数据 Read the data returned by the specified register
-    TempReadRegCount = 0  # 读取寄存器个数 Read the number of registers
+
+    # 解析状态按实例保存，多个设备互不干扰 Parse state is per instance so devices do not interfere
+    __slots__ = ('TempBytes', 'TempFindValues', 'TempReadRegCount')
+
+    def __init__(self):
+        self.TempBytes = []         # 临时数据列表 Temporary Data List
+        self.TempFindValues = []    # 读取指定寄存器返回的数据 Read the data returned by the specified register
+        self.TempReadRegCount = 0   # 读取寄存器个数 Read the number of registers
 
     def get_crc(self, datas, dlen):
         """
@@ -86,7 +92,6 @@ class Protocol485Resolver(IProtocolResolver):
         :param deviceModel: 设备模型
         :return:
         """
-        global TempBytes
         for val in data:
             self.TempBytes.append(val)
             if (self.TempBytes[0] != deviceModel.ADDR):     # 开头的字节不等于设备ID The starting byte is not equal to the device ID
@@ -149,6 +154,24 @@ class Protocol485Resolver(IProtocolResolver):
         tempBytes[7] = tempCrc & 0xff
         return tempBytes
 
+    def get_writesbytes(self, devid, regAddr, values):
+        """
+        获取写入多个寄存器的指令（功能码0x10）
+        :param devid: 设备ID
+        :param regAddr: 起始寄存器地址
+        :param values: 写入值列表
+        :return:
+        """
+        tempBytes = [devid, 0x10, regAddr >> 8, regAddr & 0xff, len(values) >> 8, len(values) & 0xff,
+                     len(values) * 2]   # 设备ID、功能码、起始寄存器、寄存器个数、字节数 Id, function, start, count, bytes
+        for value in values:
+            tempBytes.append((value >> 8) & 0xff)   # 寄存器数值——高位 Register Value - High Bit
+            tempBytes.append(value & 0xff)          # 寄存器数值——低位 Register Value - low Bit
+        tempCrc = self.get_crc(tempBytes, len(tempBytes))  # 获取CRC校验 Obtain CRC verification
+        tempBytes.append(tempCrc >> 8)
+        tempBytes.append(tempCrc & 0xff)
+        return tempBytes
+
     def get_data(self, datahex, deviceModel):
         """
         结算数据
@@ -158,6 +181,7 @@ class Protocol485Resolver(IProtocolResolver):
         """
         tempReg = 0x30      # 起始寄存器 Start register
         dlen = int(datahex[2] / 2)  # 寄存器个数 Number of registers
+        deviceModel.setRegisters(tempReg, datahex[3:3 + dlen * 2], True)   # 原始寄存器映像 Raw register image
         tempVals = []       # 临时数组 Temporary array
         for i in range(0, dlen):
             tempIndex = 3 + i * 2   # 获取当前数据索引 Get current data index
@@ -229,11 +253,18 @@ class Protocol485Resolver(IProtocolResolver):
         self.TempFindValues = []   # 清除数据 Clear data
         self.TempReadRegCount = regCount
         tempBytes = self.get_readbytes(deviceModel.ADDR, regAddr, regCount)  # 获取读取的指令 Get cmd
+        baud = deviceModel.serialConfig.baud
+        responseLength = regCount * 2 + 5
+        # 按应答时间估计设置超时，最长为原来的150毫秒 Timeout from the RTT estimate, at most the old 150 ms
+        timeout = deviceModel.rtt.timeout(baud, len(tempBytes), responseLength, 0.15)
+        start = time.monotonic()
         success_bytes = deviceModel.serialPort.write(tempBytes)  # 写入数据 Write data
-        for i in range(0, 15):     # 设置超时1秒 Set timeout of 1 second
-            time.sleep(0.01)       # 休眠10毫秒 sleep 100ms
-            if len(self.TempFindValues) > 0:   # 已返回所找查的寄存器的值 The value of the searched register has been returned
-                break
+        while len(self.TempFindValues) == 0:   # 等待返回所找查的寄存器的值 Wait for the register values
+            if time.monotonic() - start >= timeout:
+                deviceModel.rtt.onTimeout()
+                return self.TempFindValues
+            time.sleep(0.001)
+        deviceModel.rtt.update(time.monotonic() - start, baud, len(tempBytes), responseLength)
         return self.TempFindValues
 
     def writeReg(self, regAddr, sValue, deviceModel):
@@ -247,6 +278,17 @@ class Protocol485Resolver(IProtocolResolver):
         tempBytes = self.get_writebytes(deviceModel.ADDR, regAddr, sValue)  # 获取写入指令 Get cmd
         success_bytes = deviceModel.serialPort.write(tempBytes)  # 写入寄存器 Write reg
 
+    def writeRegs(self, regAddr, values, deviceModel):
+        """
+        一次写入多个连续寄存器
+        :param regAddr: 起始寄存器地址
+        :param values: 写入值列表
+        :param deviceModel: 设备模型
+        :return:
+        """
+        tempBytes = self.get_writesbytes(deviceModel.ADDR, regAddr, values)  # 获取写入指令 Get cmd
+        success_bytes = deviceModel.serialPort.write(tempBytes)  # 写入寄存器 Write reg
+
     def get_find(self, datahex, deviceModel):
         """
         读取指定寄存器结算
@@ -285,10 +327,9 @@ class Protocol485Resolver(IProtocolResolver):
         :param deviceModel: 设备模型
         :return:
         """
-        self.unlock(deviceModel)  # 解锁 Unlock
+        deviceModel.unlock()  # 解锁 Unlock
         time.sleep(0.1)  # 休眠100毫秒  Sleep 100ms
-        tempBytes = self.get_writebytes(deviceModel.ADDR, 0x01, 0x01)  # 获取写入指令 Get cmd
-        success_bytes = deviceModel.serialPort.write(tempBytes)        # 写入寄存器 Write Register
+        deviceModel.writeReg(0x01, 0x01, CONTROL)  # 写入加计校准指令 Write the acceleration calibration command
         time.sleep(5.5)  # 休眠5500毫秒 Sleep 5500ms
 
     def BeginFiledCalibration(self, deviceModel):
@@ -297,10 +338,9 @@ class Protocol485Resolver(IProtocolResolver):
         :param deviceModel: 设备模型
         :return:
         """
-        self.unlock(deviceModel)  # 解锁 Unlock
+        deviceModel.unlock()      # 解锁 Unlock
         time.sleep(0.1)           # 休眠100毫秒 Sleep 100ms
-        tempBytes = self.get_writebytes(deviceModel.ADDR, 0x01, 0x07)  # 获取写入指令 磁场校准 Obtain write command magnetic field calibration
-        success_bytes = deviceModel.serialPort.write(tempBytes)        # 写入寄存器 Write Register
+        deviceModel.writeReg(0x01, 0x07, CONTROL)  # 写入磁场校准指令 Write the magnetic field calibration command
 
     def EndFiledCalibration(self, deviceModel):
         """
@@ -308,6 +348,6 @@ class Protocol485Resolver(IProtocolResolver):
         :param deviceModel: 设备模型
         :return:
         """
-        self.unlock(deviceModel)    # 解锁 Unlock
+        deviceModel.unlock()        # 解锁 Unlock
         time.sleep(0.1)             # 休眠100毫秒 Sleep 100ms
-        self.save(deviceModel)      # 保存 Save
+        deviceModel.save()          # 保存 Save
@@ -1,5 +1,6 @@
 # coding:UTF-8
 import time
+from lib.bus.command_queue import CONTROL
 from lib.protocol_resolver.interface.i_protocol_resolver import IProtocolResolver
 
 """
@@ -7,12 +8,20 @@ from lib.protocol_resolver.interface.i_protocol_resolver import IProtocolResolve
 """
 
 class WitProtocolResolver(IProtocolResolver):
-    TempBytes = []          # 临时数据列表 Temporary Data List
     PackSize = 11           # 一包数据大小 Size of a packet of data
     gyroRange = 2000.0      # 角速度量程 Angular velocity range
     accRange = 16.0         # 加速度量程 Acceleration range
     angleRange = 180.0      # 角度量程  Angle range
-    TempFindValues = []     # 读取指定寄存器返回的数据  Read the data returned by the specified register
+    # 数据包 -> (起始寄存器, 寄存器个数)  Packet -> (start register, register count)
+    PacketRegisters = {0x50: (0x30, 4), 0x51: (0x34, 3), 0x52: (0x37, 3), 0x53: (0x3D, 3), 0x54: (0x3A, 3),
+                       0x55: (0x41, 4), 0x56: (0x45, 4), 0x57: (0x49, 4), 0x58: (0x4D, 4), 0x59: (0x51, 4)}
+
+    # 解析状态按实例保存，多个设备互不干扰 Parse state is per instance so devices do not interfere
+    __slots__ = ('TempBytes', 'TempFindValues')
+
+    def __init__(self):
+        self.TempBytes = []         # 临时数据列表 Temporary Data List
+        self.TempFindValues = []    # 读取指定寄存器返回的数据  Read the data returned by the specified register
 
     def setConfig(self, deviceModel):
         pass
@@ -26,7 +35,6 @@ class WitProtocolResolver(IProtocolResolver):
         :param deviceModel: 设备模型
         :return:
         """
-        global TempBytes
         for val in data:
             self.TempBytes.append(val)
             if (self.TempBytes[0]!=0x55):                   #非标识符0x55开头的 Not starting with identifier 0x55
@@ -41,6 +49,7 @@ class WitProtocolResolver(IProtocolResolver):
                 for i in range(0,self.PackSize-1):
                     CheckSum+=self.TempBytes[i]
                 if (CheckSum&0xff==self.TempBytes[self.PackSize-1]):    # 校验和通过  Checksum passed
+                    self.set_registers(self.TempBytes, deviceModel)     # 原始寄存器映像 Raw register image
                     if (self.TempBytes[1] == 0x50):                     # 芯片时间包 Chip Time Packet
                         self.get_chiptime(self.TempBytes, deviceModel)  # 结算芯片时间数据 Settlement chip time data
                     elif (self.TempBytes[1]==0x51):                     # 加速度包 Acceleration package
@@ -67,6 +76,20 @@ class WitProtocolResolver(IProtocolResolver):
                 else:                                        # 校验和未通过 Checksum failed
                     del self.TempBytes[0]                    # 去除第一个字节 Remove the first byte
 
+    def set_registers(self, datahex, deviceModel):
+        """
+        把数据包的原始值写入设备的寄存器映像
+        :param datahex: 原始始数据包
+        :param deviceModel: 设备模型
+        :return:
+        """
+        regs = self.PacketRegisters.get(datahex[1])
+        if regs is None:
+            return
+        deviceModel.setRegisters(regs[0], datahex[2:2 + regs[1] * 2])
+        if datahex[1] == 0x51:                                  # 加速度包带温度 The acceleration packet carries the temperature
+            deviceModel.setRegisters(0x40, datahex[8:10])
+
     def get_readbytes(self,regAddr):
         """
         获取读取的指令
@@ -269,19 +292,26 @@ class WitProtocolResolver(IProtocolResolver):
         readCount = int(regCount/4)           # 根据寄存器个数获取读取次数 Obtain the number of reads based on the number of registers
         if (regCount % 4>0):
             readCount+=1
+        baud = deviceModel.serialConfig.baud
         for n in range(0,readCount):
             self.TempFindValues = []  # 清除数据 Clear data
             tempBytes = self.get_readbytes(regAddr + n * 4)             # 获取读取的指令 Get read instructions
+            # 按应答时间估计设置超时，最长为原来的1秒 Timeout from the RTT estimate, at most the old 1 second
+            timeout = deviceModel.rtt.timeout(baud, len(tempBytes), 11, 1.0)
+            start = time.monotonic()
             success_bytes = deviceModel.serialPort.write(tempBytes)     # 写入数据 Write data
-            for i in range(0,20):   # 设置超时1秒 Set timeout of 1 second
-                time.sleep(0.05)    # 休眠50毫秒 Sleep for 50 milliseconds
+            while time.monotonic() - start < timeout:
+                time.sleep(0.001)
                 if (len(self.TempFindValues)>0):    # 已返回所找查的寄存器的值 The value of the searched register has been returned
+                    deviceModel.rtt.update(time.monotonic() - start, baud, len(tempBytes), 11)
                     for j in range(0,len(self.TempFindValues)):
                         if (len(tempResults) < regCount):
                             tempResults.append(self.TempFindValues[j])
                         else:
                             break
                     break
+            else:
+                deviceModel.rtt.onTimeout()
         return tempResults
 
     def writeReg(self, regAddr,sValue, deviceModel):
@@ -317,10 +347,9 @@ class WitProtocolResolver(IProtocolResolver):
         :param deviceModel: 设备模型
         :return:
         """
-        self.unlock(deviceModel)                                         # 解锁 Unlock
+        deviceModel.unlock()                                             # 解锁 Unlock
         time.sleep(0.1)                                                  # 休眠100毫秒 Sleep for 100 milliseconds
-        tempBytes = self.get_writebytes(0x01, 0x01)                      # 获取写入指令 Get Write Instructions
-        success_bytes = deviceModel.serialPort.write(tempBytes)          # 写入寄存器 Write Register
+        deviceModel.writeReg(0x01, 0x01, CONTROL)                        # 写入加计校准指令 Write the acceleration calibration command
         time.sleep(5.5)                                                  # 休眠5500毫秒 Sleep for 5500 milliseconds
 
     def BeginFiledCalibration(self,deviceModel):
@@ -329,10 +358,9 @@ class WitProtocolResolver(IProtocolResolver):
         :param deviceModel: 设备模型
         :return:
         """
-        self.unlock(deviceModel)                                         # 解锁 Unlock
+        deviceModel.unlock()                                             # 解锁 Unlock
         time.sleep(0.1)                                                  # 休眠100毫秒 Sleep for 100 milliseconds
-        tempBytes = self.get_writebytes(0x01, 0x07)                      # 获取写入指令 磁场校准 Obtain write command magnetic field calibration
-        success_bytes = deviceModel.serialPort.write(tempBytes)          # 写入寄存器 Write Register
+        deviceModel.writeReg(0x01, 0x07, CONTROL)                        # 写入磁场校准指令 Write the magnetic field calibration command
 
 
     def EndFiledCalibration(self,deviceModel):
@@ -341,9 +369,9 @@ class WitProtocolResolver(IProtocolResolver):
         :param deviceModel: 设备模型
         :return:
         """
-        self.unlock(deviceModel)                                         # 解锁 Unlock
+        deviceModel.unlock()                                             # 解锁 Unlock
         time.sleep(0.1)                                                  # 休眠100毫秒  Sleep for 100 milliseconds
-        self.save(deviceModel)                                           # 保存 Save
+        deviceModel.save()                                               # 保存 Save
 
     def get_find(self,datahex, deviceModel):
         """
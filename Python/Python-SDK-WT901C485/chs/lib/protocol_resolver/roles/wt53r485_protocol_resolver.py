@@ -49,11 +49,15 @@ class WT53RProtocol485Resolver(IProtocolResolver):
         0x44, 0x84, 0x85, 0x45, 0x87, 0x47, 0x46, 0x86, 0x82, 0x42, 0x43, 0x83, 0x41, 0x81, 0x80,
         0x40]
     # endregion  计算CRC
-    TempBytes = []          # 临时数据列表 Temporary Data List
     PackSize = 9            # 一包数据大小 Size of a packet of data
 
-    TempFindValues = []     # 读取指定寄存器返回的数据 Read the data returned by the specified register
-    TempReadRegCount = 0    # 读取寄存器个数 Read the number of registers
+    # 解析状态按实例保存，多个设备互不干扰 Parse state is per instance so devices do not interfere
+    __slots__ = ('TempBytes', 'TempFindValues', 'TempReadRegCount')
+
+    def __init__(self):
+        self.TempBytes = []         # 临时数据列表 Temporary Data List
+        self.TempFindValues = []    # 读取指定寄存器返回的数据 Read the data returned by the specified register
+        self.TempReadRegCount = 0   # 读取寄存器个数 Read the number of registers
 
     def get_crc(self, datas, dlen):
         """
@@ -78,7 +82,6 @@ class WT53RProtocol485Resolver(IProtocolResolver):
         success_bytes = deviceModel.serialPort.write(sendData)
 
     def passiveReceiveData(self, data, deviceModel):
-        global TempBytes
         tempdata = bytes.fromhex(data.hex())            # 将收到的数据转为16进制数组 Convert the received data into a hexadecimal array
         for val in tempdata:
             self.TempBytes.append(val)
@@ -151,6 +154,7 @@ class WT53RProtocol485Resolver(IProtocolResolver):
         tempReg = 0x34              # 起始寄存器 Start register
         dlen = int(datahex[2] / 2)  # 寄存器个数 Number of registers
         tempVals = []               # 临时数组 Temp array
+        deviceModel.setRegisters(tempReg, datahex[3:3 + dlen * 2], True)   # 原始寄存器映像 Raw register image
         for i in range(0, dlen):
             tempIndex = 3 + i * 2   # 获取当前数据索引 Get current data index
             tempVal = datahex[tempIndex] << 8 | datahex[tempIndex + 1]
@@ -0,0 +1,87 @@
+# coding:UTF-8
+import gzip
+import lzma
+import os
+import numpy as np
+from lib.recorder.binary_recorder import CHANNEL, HEADER, MAGIC
+
+"""
+    二进制记录读取 Binary record reader
+    把记录文件直接映射成NumPy结构化数组，不需要逐行解析；滚动记录器压缩过的分段（.gz、.xz）解压到内存
+    Maps a record file straight into a NumPy structured array, no parsing. Segments compressed by the
+    rotating recorder (.gz, .xz) are decompressed into memory instead
+"""
+
+OPENERS = {".gz": gzip.open, ".xz": lzma.open}
+
+
+def openRecordFile(fileName):
+    """
+    打开记录文件，按扩展名解压
+    :param fileName: 文件名
+    :return: 二进制文件对象
+    """
+    return OPENERS.get(os.path.splitext(fileName)[1], open)(fileName, "rb")
+
+
+class BinaryRecord:
+    __slots__ = ('fileName', 'version', 'channels', 'scales', 'dtype', 'records')
+
+    def __init__(self, fileName):
+        """
+        打开记录文件
+        :param fileName: 文件名
+        """
+        self.fileName = fileName
+        compressed = os.path.splitext(fileName)[1] in OPENERS
+        with openRecordFile(fileName) as f:
+            head = f.read(HEADER.size)
+            if len(head) < HEADER.size:
+                raise ValueError("不是二进制记录文件 not a record file: " + fileName)
+            magic, self.version, headerSize, recordSize, count = HEADER.unpack(head)
+            if magic != MAGIC:
+                raise ValueError("不是二进制记录文件 not a record file: " + fileName)
+            self.channels = []      # [(寄存器, 名称, 换算系数)] [(register, name, scale)]
+            for _ in range(count):
+                reg, name, scale = CHANNEL.unpack(f.read(CHANNEL.size))
+                self.channels.append((reg, name.rstrip(b"\x00").decode("ascii"), scale))
+            # 压缩文件不能映射，记录部分整段解压 A compressed file cannot be mapped, so its records are read whole
+            data = f.read() if compressed else None
+        self.scales = {name: scale for _, name, scale in self.channels}
+        self.dtype = np.dtype([("timestamp", "<i8"), ("device", "<u2")]
+                              + [(name, "<i2") for _, name, _ in self.channels])
+        if self.dtype.itemsize != recordSize:
+            raise ValueError("记录长度不符 record size mismatch")
+        if compressed:
+            length = len(data) // recordSize
+            self.records = np.frombuffer(data, dtype=self.dtype, count=length)
+            return
+        # 写入中的文件末尾可能有半条记录 A file being written may end with a partial record
+        length = (os.path.getsize(fileName) - headerSize) // recordSize
+        self.records = np.memmap(fileName, dtype=self.dtype, mode="r", offset=headerSize, shape=(length,)) \
+            if length > 0 else np.zeros(0, dtype=self.dtype)
+
+    def __len__(self):
+        return len(self.records)
+
+    def get(self, name, device=None):
+        """
+        获取换算后的通道数据
+        :param name: 通道名称
+        :param device: 设备ID，None为所有设备
+        :return: float64数组
+        """
+        records = self.records if device is None else self.records[self.records["device"] == device]
+        return records[name] * self.scales[name]
+
+    def getInt32(self, lowName, highName, device=None):
+        """
+        获取由两个寄存器组成的32位数据（如经纬度）
+        :param lowName: 低16位通道名称
+        :param highName: 高16位通道名称
+        :param device: 设备ID，None为所有设备
+        :return: int64数组
+        """
+        records = self.records if device is None else self.records[self.records["device"] == device]
+        low = records[lowName].astype(np.int64) & 0xffff
+        return (records[highName].astype(np.int64) << 16) | low
@@ -0,0 +1,195 @@
+# coding:UTF-8
+import struct
+import sys
+import threading
+import time
+
+"""
+    二进制数据记录器 Binary recorder
+    每条记录定长、小端：主机时间（纳秒，int64）、设备ID（uint16）、若干原始寄存器值（int16）；
+    文件头记录每个通道的寄存器地址、名称和换算系数。记录先写入内存块，由后台线程双缓冲整块写盘；
+    磁盘卡住时正在填充的块最多增长到bufferLimit，之后的记录丢弃并计数
+    Fixed-size little-endian records: host time (ns, int64), device id (uint16) and raw int16 registers.
+    The header lists each channel's register, name and scale factor. Records go into an in-memory block
+    that a background thread writes out in large chunks (double buffered). If the disk stalls, the block being
+    filled stops growing at bufferLimit and further records are dropped and counted
+"""
+
+MAGIC = b"WITREC\x00\x00"
+VERSION = 1
+HEADER = struct.Struct("<8sHHHH")    # 标识, 版本, 文件头长度, 记录长度, 通道数 Magic, version, header size, record size, channels
+CHANNEL = struct.Struct("<H16sd")    # 寄存器, 名称, 换算系数 Register, name, scale
+RECORD_HEAD = struct.Struct("<qH")   # 时间, 设备ID Timestamp, device id
+
+# 通道定义 (寄存器, 名称, 换算系数)，物理量 = 原始值 * 换算系数  Channels (register, name, scale): value = raw * scale
+CHIPTIME_CHANNELS = [(0x30, "YYMM", 1.0), (0x31, "DDHH", 1.0), (0x32, "MMSS", 1.0), (0x33, "MS", 1.0)]
+WT901C485_CHANNELS = CHIPTIME_CHANNELS + [
+    (0x34, "accX", 16.0 / 32768), (0x35, "accY", 16.0 / 32768), (0x36, "accZ", 16.0 / 32768),
+    (0x37, "gyroX", 2000.0 / 32768), (0x38, "gyroY", 2000.0 / 32768), (0x39, "gyroZ", 2000.0 / 32768),
+    (0x3A, "magX", 1.0), (0x3B, "magY", 1.0), (0x3C, "magZ", 1.0),
+    (0x3D, "angleX", 180.0 / 32768), (0x3E, "angleY", 180.0 / 32768), (0x3F, "angleZ", 180.0 / 32768),
+    (0x40, "temperature", 0.01)]
+JY901S_CHANNELS = WT901C485_CHANNELS + [
+    (0x49, "lonL", 1.0), (0x4A, "lonH", 1.0), (0x4B, "latL", 1.0), (0x4C, "latH", 1.0),
+    (0x4D, "Height", 0.1), (0x4E, "Yaw", 0.01), (0x4F, "SpeedL", 1.0), (0x50, "SpeedH", 1.0),
+    (0x51, "q1", 1.0 / 32768), (0x52, "q2", 1.0 / 32768), (0x53, "q3", 1.0 / 32768), (0x54, "q4", 1.0 / 32768)]
+WTVB01_CHANNELS = [
+    (0x3A, "vX", 1.0), (0x3B, "vY", 1.0), (0x3C, "vZ", 1.0),
+    (0x3D, "adX", 180.0 / 32768), (0x3E, "adY", 180.0 / 32768), (0x3F, "adZ", 180.0 / 32768),
+    (0x40, "temperature", 0.01), (0x41, "dX", 1.0), (0x42, "dY", 1.0), (0x43, "dZ", 1.0),
+    (0x44, "hzX", 1.0), (0x45, "hzY", 1.0), (0x46, "hzZ", 1.0)]
+WT53R_CHANNELS = [(0x34, "distance", 1.0), (0x35, "status", 1.0)]
+
+
+def registerRanges(channels):
+    """
+    把通道寄存器合并成连续区间，写记录时按区间整段拷贝
+    :param channels: 通道定义
+    :return: [(起始寄存器, 结束寄存器)]
+    """
+    ranges = []
+    for reg, _, _ in channels:
+        if ranges and ranges[-1][1] == reg:
+            ranges[-1][1] = reg + 1
+        else:
+            ranges.append([reg, reg + 1])
+    return [(start, end) for start, end in ranges]
+
+
+class BinaryRecorder:
+    __slots__ = ('fileName', 'channels', 'ranges', 'recordSize', 'blockSize', 'flushInterval', 'deviceIds',
+                 'file', 'active', 'pending', 'spare', 'lock', 'condition', 'thread', 'running', 'recordCount',
+                 'bytesWritten', 'swap', 'wallStart', 'monotonicStart', 'firstTimestamp', 'lastTimestamp',
+                 'bufferLimit', 'dropCount')
+
+    def __init__(self, fileName, channels=WT901C485_CHANNELS, blockSize=1 << 20, flushInterval=1.0,
+                 bufferLimit=None):
+        """
+        初始化
+        :param fileName: 文件名
+        :param channels: 通道定义 [(寄存器, 名称, 换算系数)]
+        :param blockSize: 写盘块大小（字节）
+        :param flushInterval: 块未满时最长多久写一次盘（秒）
+        :param bufferLimit: 写盘线程还在写上一块时，正在填充的块的最大字节数，None为块大小的8倍
+        """
+        self.fileName = fileName
+        self.channels = list(channels)
+        self.ranges = registerRanges(self.channels)
+        self.recordSize = RECORD_HEAD.size + 2 * len(self.channels)
+        self.blockSize = blockSize
+        self.flushInterval = flushInterval
+        self.deviceIds = {}                 # 设备 -> 设备ID，默认用设备地址 Device -> id, ADDR by default
+        self.file = None
+        self.active = bytearray()           # 正在填充的块 Block being filled
+        self.pending = None                 # 等待写盘的块 Block waiting for the writer
+        self.spare = bytearray()            # 写完回收的块 Block returned by the writer
+        self.lock = threading.Lock()
+        self.condition = threading.Condition(self.lock)
+        self.thread = None
+        self.running = False
+        self.recordCount = 0                # 记录条数 Records
+        self.bytesWritten = 0               # 已写盘字节数 Bytes on disk
+        self.swap = sys.byteorder != "little"   # 大端主机需要转换字节序 Big-endian hosts must swap
+        # 主机时间由单调时钟推算，系统时间被调整时记录仍按时间顺序 Host time follows the monotonic clock, so a
+        # wall-clock step cannot put records out of order
+        self.wallStart = time.time_ns()
+        self.monotonicStart = time.monotonic_ns()
+        self.firstTimestamp = None          # 第一条记录的时间 Timestamp of the first record
+        self.lastTimestamp = None           # 最后一条记录的时间 Timestamp of the last record
+        self.bufferLimit = 8 * blockSize if bufferLimit is None else bufferLimit
+        self.dropCount = 0                  # 缓冲满丢弃的记录数 Records dropped while the buffer was full
+
+    def open(self):
+        """
+        创建文件、写文件头并启动写盘线程
+        :return: 无返回
+        """
+        self.file = open(self.fileName, "wb")
+        header = bytearray(HEADER.pack(MAGIC, VERSION, HEADER.size + CHANNEL.size * len(self.channels),
+                                       self.recordSize, len(self.channels)))
+        for reg, name, scale in self.channels:
+            header += CHANNEL.pack(reg, name.encode("ascii"), scale)
+        self.file.write(header)
+        self.bytesWritten = len(header)
+        self.running = True
+        self.thread = threading.Thread(target=self.writeLoop, name="BinaryRecorder", daemon=True)
+        self.thread.start()
+
+    def setDeviceId(self, deviceModel, deviceId):
+        """
+        指定设备ID（多条总线上地址相同的设备需要区分时使用）
+        :param deviceModel: 设备模型
+        :param deviceId: 设备ID (0~65535)
+        :return: 无返回
+        """
+        self.deviceIds[deviceModel] = deviceId
+
+    def write(self, deviceModel, timestamp=None):
+        """
+        记录设备当前的寄存器映像，可直接在数据更新事件中调用
+        :param deviceModel: 设备模型
+        :param timestamp: 主机时间（纳秒），None为当前时间；自己给出时需按时间顺序，查询按时间二分查找
+        :return: 无返回
+        """
+        registers = deviceModel.registers
+        record = bytearray(RECORD_HEAD.size)
+        for start, end in self.ranges:
+            values = registers[start:end]
+            if self.swap:
+                values.byteswap()
+            record += values.tobytes()
+        with self.lock:
+            # 在锁内取时间，多个端口线程同时写入时记录仍按时间顺序 Stamp under the lock so records from
+            # several port threads land in time order
+            if timestamp is None:
+                timestamp = self.wallStart + time.monotonic_ns() - self.monotonicStart
+            if len(self.active) >= self.bufferLimit:   # 磁盘跟不上 The disk cannot keep up
+                self.dropCount += 1
+                return
+            RECORD_HEAD.pack_into(record, 0, timestamp, self.deviceIds.get(deviceModel, deviceModel.ADDR))
+            self.active += record
+            self.recordCount += 1
+            if self.firstTimestamp is None:
+                self.firstTimestamp = timestamp
+            self.lastTimestamp = timestamp
+            if len(self.active) >= self.blockSize and self.pending is None:
+                self.pending, self.active, self.spare = self.active, self.spare, None
+                self.condition.notify()
+
+    def writeLoop(self):
+        """
+        写盘线程：等待写满的块，或者超时后取出未满的块
+        :return:
+        """
+        while True:
+            with self.lock:
+                if self.pending is None and self.running:
+                    self.condition.wait(self.flushInterval)
+                if self.pending is None and len(self.active) > 0:
+                    self.pending, self.active, self.spare = self.active, self.spare, None
+                block = self.pending
+                running = self.running
+            if block is not None:
+                self.file.write(block)
+                self.bytesWritten += len(block)
+                block.clear()
+                with self.lock:
+                    self.pending = None
+                    self.spare = block
+            elif not running:
+                break
+
+    def close(self):
+        """
+        写完剩余数据并关闭文件
+        :return: 无返回
+        """
+        if self.file is None:
+            return
+        with self.lock:
+            self.running = False
+            self.condition.notify()
+        self.thread.join()
+        self.thread = None
+        self.file.close()
+        self.file = None
@@ -0,0 +1,347 @@
+# coding:UTF-8
+import bisect
+import datetime
+import json
+import math
+import os
+import queue
+import threading
+import time
+import numpy as np
+from lib.recorder.binary_recorder import WT901C485_CHANNELS
+
+"""
+    按列分块存储 Columnar chunked storage
+    每个设备按固定时长分块，每块每个通道一个NumPy文件（压缩的.npz或原始的.npy），清单文件记录每块每个通道的
+    最小值、最大值和平均值。块文件先写临时文件、fsync后改名，清单一行一块追加并fsync，中途崩溃不会留下损坏的数据。
+    每次写盘有自己的序号，flush后同一时间段的数据或时钟回拨后重新打开的旧时间段写成新的文件，不会覆盖已有的块。
+    查询时先用每块的统计值跳过不需要的块
+    Per device, fixed-duration chunks with one NumPy file per channel per chunk (compressed .npz or raw .npy).
+    A manifest holds min/max/mean per channel per chunk. Chunk files are written to a temp file, fsynced and
+    renamed; the manifest gets one fsynced line per chunk, so a crash never leaves corrupt data behind. Each write
+    has its own sequence number, so more data for a window after a flush, or a past window reopened by a clock
+    step, goes to new files instead of replacing an existing chunk. Queries use the per-chunk statistics to skip
+    chunks they do not need
+"""
+
+MANIFEST = "manifest.jsonl"
+
+
+def toNs(value):
+    """
+    时间转换为纳秒
+    :param value: 纳秒整数、秒（float）或datetime
+    :return: 纳秒
+    """
+    if value is None:
+        return None
+    if isinstance(value, datetime.datetime):
+        return int(value.timestamp() * 1000000) * 1000
+    if isinstance(value, float):
+        return int(value * 1000000000)
+    return int(value)
+
+
+def chunkFileName(chunkStart, sequence, name, fileFormat):
+    """
+    块文件名
+    :param chunkStart: 块开始时间（纳秒）
+    :param sequence: 写盘序号，None为旧版本没有序号的文件
+    :param name: 通道名
+    :param fileFormat: "npz" 或 "npy"
+    :return: 文件名
+    """
+    if sequence is None:
+        return "%d_%s.%s" % (chunkStart, name, fileFormat)
+    return "%d_%06d_%s.%s" % (chunkStart, sequence, name, fileFormat)
+
+
+class ColumnarStore:
+    __slots__ = ('directory', 'channels', 'chunkDuration', 'compress', 'buffers', 'lock', 'tasks', 'thread',
+                 'chunkCount', 'deviceIds', 'sequence')
+
+    def __init__(self, directory, channels=WT901C485_CHANNELS, chunkDuration=60.0, compress=True):
+        """
+        初始化
+        :param directory: 存储目录
+        :param channels: 通道定义 [(寄存器, 名称, 换算系数)]
+        :param chunkDuration: 每块时长（秒）
+        :param compress: True 每个通道一个压缩的.npz，False 为原始的.npy
+        """
+        self.directory = directory
+        self.channels = list(channels)
+        self.chunkDuration = int(chunkDuration * 1000000000)   # 每块时长 Chunk duration (ns)
+        self.compress = compress
+        self.buffers = {}                   # 设备ID -> [块开始时间, 时间列表, 原始寄存器列表] Device -> open chunk
+        self.lock = threading.Lock()
+        self.tasks = queue.Queue()          # 待写盘的块 Chunks waiting for the writer
+        self.thread = None
+        self.chunkCount = 0                 # 已写入的块数 Chunks written
+        self.deviceIds = {}                 # 设备 -> 设备ID，默认用设备地址 Device -> id, ADDR by default
+        self.sequence = 0                   # 下一次写盘的序号 Sequence number of the next chunk write
+
+    def open(self):
+        """
+        创建目录并启动写盘线程，写盘序号接着清单里最大的序号
+        :return: 无返回
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        self.sequence = max((entry.get("seq", -1) for entries in ColumnarReader(self.directory).chunks.values()
+                             for entry in entries), default=-1) + 1
+        self.thread = threading.Thread(target=self.writeLoop, name="ColumnarStore", daemon=True)
+        self.thread.start()
+
+    def setDeviceId(self, deviceModel, deviceId):
+        self.deviceIds[deviceModel] = deviceId
+
+    def write(self, deviceModel, timestamp=None):
+        """
+        记录设备当前的寄存器映像，可直接在数据更新事件中调用
+        :param deviceModel: 设备模型
+        :param timestamp: 主机时间（纳秒），None为当前时间
+        :return: 无返回
+        """
+        if timestamp is None:
+            timestamp = time.time_ns()
+        deviceId = self.deviceIds.get(deviceModel, deviceModel.ADDR)
+        registers = deviceModel.registers
+        values = [registers[reg] for reg, _, _ in self.channels]
+        chunkStart = timestamp - timestamp % self.chunkDuration
+        with self.lock:
+            buffer = self.buffers.get(deviceId)
+            if buffer is None or buffer[0] != chunkStart:
+                if buffer is not None:
+                    self.tasks.put((deviceId,) + tuple(buffer))     # 换块，旧块交给写盘线程 Hand the old chunk over
+                buffer = [chunkStart, [], []]
+                self.buffers[deviceId] = buffer
+            buffer[1].append(timestamp)
+            buffer[2].append(values)
+
+    def writeLoop(self):
+        while True:
+            task = self.tasks.get()
+            if task is None:
+                break
+            try:
+                self.writeChunk(*task)
+            except Exception as ex:
+                print(ex)
+
+    def writeChunk(self, deviceId, chunkStart, timestamps, values):
+        """
+        写入一块：每个通道一个文件，最后追加清单
+        :return: 无返回
+        """
+        folder = os.path.join(self.directory, "%02x" % deviceId)
+        os.makedirs(folder, exist_ok=True)
+        sequence = self.sequence
+        self.sequence += 1
+        timestamps = np.array(timestamps, dtype="<i8")
+        order = np.argsort(timestamps, kind="stable")      # 时钟回拨时按时间排序 Sort after clock steps
+        timestamps = timestamps[order]
+        raw = np.array(values, dtype="<i2").reshape(len(values), len(self.channels))[order]
+        columns = {"timestamp": timestamps}
+        stats = {}
+        for i, (_, name, scale) in enumerate(self.channels):
+            columns[name] = np.ascontiguousarray(raw[:, i])
+            scaled = raw[:, i] * scale
+            stats[name] = [float(scaled.min()), float(scaled.max()), float(scaled.mean())]
+        extension = ".npz" if self.compress else ".npy"
+        for name, column in columns.items():
+            path = os.path.join(folder, chunkFileName(chunkStart, sequence, name, extension[1:]))
+            temp = path + ".tmp"
+            with open(temp, "wb") as f:
+                if self.compress:
+                    np.savez_compressed(f, data=column)
+                else:
+                    np.save(f, column)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp, path)                  # 原子替换 Atomic rename
+        entry = {"device": deviceId, "start": chunkStart, "end": chunkStart + self.chunkDuration, "seq": sequence,
+                 "first": int(timestamps[0]), "last": int(timestamps[-1]), "count": len(timestamps),
+                 "format": extension[1:], "scales": {name: scale for _, name, scale in self.channels},
+                 "stats": stats}
+        with open(os.path.join(self.directory, MANIFEST), "a") as f:
+            f.write(json.dumps(entry) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        self.chunkCount += 1
+
+    def flush(self):
+        """
+        把所有未满的块交给写盘线程
+        :return: 无返回
+        """
+        with self.lock:
+            for deviceId, buffer in self.buffers.items():
+                self.tasks.put((deviceId,) + tuple(buffer))
+            self.buffers = {}
+
+    def close(self):
+        """
+        写完所有数据并停止写盘线程
+        :return: 无返回
+        """
+        self.flush()
+        if self.thread is not None:
+            self.tasks.put(None)
+            self.thread.join()
+            self.thread = None
+
+
+class ColumnarReader:
+    __slots__ = ('directory', 'chunks', 'starts')
+
+    def __init__(self, directory):
+        """
+        读取清单，忽略崩溃时写了一半的最后一行
+        :param directory: 存储目录
+        """
+        self.directory = directory
+        self.chunks = {}                    # 设备ID -> 按时间排序的块 Device -> chunks sorted by time
+        path = os.path.join(directory, MANIFEST)
+        if os.path.exists(path):
+            with open(path) as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue
+                    self.chunks.setdefault(entry["device"], []).append(entry)
+        for entries in self.chunks.values():
+            entries.sort(key=lambda entry: (entry["start"], entry["first"]))
+        self.starts = {device: [entry["start"] for entry in entries] for device, entries in self.chunks.items()}
+
+    def devices(self):
+        return sorted(self.chunks)
+
+    def findChunks(self, device, start=None, end=None):
+        """
+        查找与时间范围重叠的块
+        :param device: 设备ID
+        :param start: 开始时间
+        :param end: 结束时间（不含）
+        :return: 块列表
+        """
+        entries = self.chunks.get(device, [])
+        start, end = toNs(start), toNs(end)
+        first = 0
+        if start is not None:
+            # 同一时间段可能有多次写盘，从这个时间段的第一块开始 A window may hold several writes: start at its first
+            starts = self.starts[device]
+            first = max(bisect.bisect_right(starts, start) - 1, 0)
+            first = bisect.bisect_left(starts, starts[first]) if starts else 0
+        result = []
+        for entry in entries[first:]:
+            if end is not None and entry["first"] >= end:
+                break
+            if start is not None and entry["last"] < start:
+                continue
+            result.append(entry)
+        return result
+
+    def covered(self, entry, start, end):
+        """块是否整块落在时间范围内 Whether the whole chunk lies inside the range"""
+        return (start is None or entry["first"] >= start) and (end is None or entry["last"] < end)
+
+    def loadColumn(self, device, entry, name):
+        path = os.path.join(self.directory, "%02x" % device,
+                            chunkFileName(entry["start"], entry.get("seq"), name, entry["format"]))
+        if entry["format"] == "npz":
+            with np.load(path) as data:
+                return data["data"]
+        return np.load(path, mmap_mode="r")
+
+    def loadChunk(self, device, entry, fields, start, end):
+        """
+        读取一块的指定通道，裁剪到时间范围并换算
+        :return: 通道名 -> 数组
+        """
+        timestamps = self.loadColumn(device, entry, "timestamp")
+        lo, hi = 0, len(timestamps)
+        if start is not None:
+            lo = int(np.searchsorted(timestamps, start, "left"))
+        if end is not None:
+            hi = int(np.searchsorted(timestamps, end, "left"))
+        result = {"timestamp": np.asarray(timestamps[lo:hi])}
+        for name in fields:
+            result[name] = self.loadColumn(device, entry, name)[lo:hi] * entry["scales"][name]
+        return result
+
+    def query(self, device, fields, start=None, end=None):
+        """
+        读取时间范围内的数据
+        :param device: 设备ID
+        :param fields: 通道名列表
+        :param start: 开始时间（纳秒、秒或datetime）
+        :param end: 结束时间（不含）
+        :return: 通道名 -> 数组，另有 "timestamp"
+        """
+        start, end = toNs(start), toNs(end)
+        parts = [self.loadChunk(device, entry, fields, start, end) for entry in self.findChunks(device, start, end)]
+        names = ["timestamp"] + list(fields)
+        if not parts:
+            return {name: np.zeros(0, dtype="<i8" if name == "timestamp" else float) for name in names}
+        return {name: np.concatenate([part[name] for part in parts]) for name in names}
+
+    def aggregate(self, device, field, agg="max", start=None, end=None):
+        """
+        统计时间范围内一个通道的最小值、最大值或平均值；整块落在范围内的块直接用清单里的统计值，不读文件
+        :param device: 设备ID
+        :param field: 通道名
+        :param agg: "min"、"max" 或 "mean"
+        :param start: 开始时间
+        :param end: 结束时间（不含）
+        :return: 统计值，没有数据返回None
+        """
+        start, end = toNs(start), toNs(end)
+        index = {"min": 0, "max": 1, "mean": 2}[agg]
+        values, counts = [], []
+        for entry in self.findChunks(device, start, end):
+            if self.covered(entry, start, end):
+                values.append(entry["stats"][field][index])
+                counts.append(entry["count"])
+                continue
+            column = self.loadChunk(device, entry, [field], start, end)[field]
+            if len(column) == 0:
+                continue
+            values.append(float({"min": column.min, "max": column.max, "mean": column.mean}[agg]()))
+            counts.append(len(column))
+        if not values:
+            return None
+        if agg == "min":
+            return min(values)
+        if agg == "max":
+            return max(values)
+        return sum(v * c for v, c in zip(values, counts)) / sum(counts)
+
+    def maxMagnitude(self, device, fields=("accX", "accY", "accZ"), start=None, end=None):
+        """
+        时间范围内向量模的最大值（如最大|acc|）。先用每块统计值算出上界，按上界从大到小读块，
+        上界不超过已找到的最大值时停止
+        :param device: 设备ID
+        :param fields: 向量的各个分量
+        :param start: 开始时间
+        :param end: 结束时间（不含）
+        :return: (最大值, 时间)，没有数据返回None
+        """
+        start, end = toNs(start), toNs(end)
+        candidates = []
+        for entry in self.findChunks(device, start, end):
+            bound = math.sqrt(sum(max(abs(entry["stats"][name][0]), abs(entry["stats"][name][1])) ** 2
+                                  for name in fields))
+            candidates.append((bound, entry))
+        candidates.sort(key=lambda item: -item[0])
+        best = None
+        for bound, entry in candidates:
+            if best is not None and bound <= best[0]:
+                break                               # 剩下的块不可能更大 No remaining chunk can beat it
+            data = self.loadChunk(device, entry, fields, start, end)
+            if len(data["timestamp"]) == 0:
+                continue
+            magnitude = np.sqrt(sum(data[name] ** 2 for name in fields))
+            i = int(np.argmax(magnitude))
+            if best is None or magnitude[i] > best[0]:
+                best = (float(magnitude[i]), int(data["timestamp"][i]))
+        return best
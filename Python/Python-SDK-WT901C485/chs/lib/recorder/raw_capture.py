@@ -0,0 +1,220 @@
+# coding:UTF-8
+import array
+import bisect
+import gzip
+import io
+import lzma
+import os
+import struct
+import threading
+import time
+
+"""
+    原始字节记录 Raw byte capture
+    把串口每次read()得到的数据块原样追加到记录文件，带单调时钟时间；另有稀疏索引文件每隔N毫秒记录一次偏移，
+    可以按时间二分查找，回放时把数据块按原顺序交给任意协议解析器，解析结果与实时解析完全一致
+    Appends every serial read() chunk verbatim with a monotonic timestamp; a sparse index file stores an offset
+    every N ms so a time can be found by binary search. Replaying the chunks in order through any resolver
+    reproduces the live decode exactly
+    压缩的记录（.gz、.xz，如ROS节点关闭的分段）解压到内存，扫描一遍重建索引
+    Compressed captures (.gz, .xz, such as the segments the ROS nodes close) are decompressed into memory and
+    indexed by a scan
+"""
+
+MAGIC = b"WITRAW\x00\x00"
+VERSION = 1
+FILE_HEADER = struct.Struct("<8sHqq")   # 标识, 版本, 开始时的主机时间, 开始时的单调时钟 Magic, version, wall ns, monotonic ns
+CHUNK = struct.Struct("<qI")            # 单调时钟时间, 数据长度 Monotonic ns, length
+INDEX = struct.Struct("<qQ")            # 单调时钟时间, 文件偏移 Monotonic ns, file offset
+OPENERS = {".gz": gzip.open, ".xz": lzma.open}
+
+
+class RawCapture:
+    __slots__ = ('fileName', 'indexInterval', 'file', 'indexFile', 'offset', 'lastIndexTime', 'lock',
+                 'chunkCount', 'byteCount')
+
+    def __init__(self, fileName, indexInterval=0.1):
+        """
+        初始化
+        :param fileName: 记录文件名，索引文件为文件名加.idx
+        :param indexInterval: 索引间隔（秒）
+        """
+        self.fileName = fileName
+        self.indexInterval = int(indexInterval * 1000000000)   # 索引间隔 Index interval (ns)
+        self.file = None
+        self.indexFile = None
+        self.offset = 0                 # 下一个数据块的偏移 Offset of the next chunk
+        self.lastIndexTime = None       # 上一个索引的时间 Time of the last index entry
+        self.lock = threading.Lock()
+        self.chunkCount = 0             # 数据块数 Chunks
+        self.byteCount = 0              # 数据字节数 Payload bytes
+
+    def open(self):
+        """
+        创建记录文件和索引文件
+        :return: 无返回
+        """
+        self.file = open(self.fileName, "wb")
+        self.indexFile = open(self.fileName + ".idx", "wb")
+        self.file.write(FILE_HEADER.pack(MAGIC, VERSION, time.time_ns(), time.monotonic_ns()))
+        self.offset = FILE_HEADER.size
+        self.lastIndexTime = None
+
+    def write(self, data, timestamp=None):
+        """
+        追加一个数据块
+        :param data: 串口读到的数据
+        :param timestamp: 单调时钟时间（纳秒），None为当前时间
+        :return: 无返回
+        """
+        if timestamp is None:
+            timestamp = time.monotonic_ns()
+        with self.lock:
+            if self.file is None:
+                return
+            if self.lastIndexTime is None or timestamp - self.lastIndexTime >= self.indexInterval:
+                self.indexFile.write(INDEX.pack(timestamp, self.offset))
+                self.lastIndexTime = timestamp
+            self.file.write(CHUNK.pack(timestamp, len(data)))
+            self.file.write(data)
+            self.offset += CHUNK.size + len(data)
+            self.chunkCount += 1
+            self.byteCount += len(data)
+
+    def flush(self):
+        with self.lock:
+            if self.file is not None:
+                self.file.flush()
+                self.indexFile.flush()
+
+    def close(self):
+        """
+        关闭文件
+        :return: 无返回
+        """
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.indexFile.close()
+                self.file = None
+                self.indexFile = None
+
+
+class RawCaptureReader:
+    __slots__ = ('fileName', 'wallStart', 'monotonicStart', 'indexTimes', 'indexOffsets', 'size', 'data')
+
+    def __init__(self, fileName):
+        """
+        打开记录文件，没有索引文件或文件是压缩的时扫描一遍重建索引
+        :param fileName: 记录文件名（.gz、.xz为压缩的记录）
+        """
+        self.fileName = fileName
+        opener = OPENERS.get(os.path.splitext(fileName)[1])
+        self.data = None                        # 解压后的记录 Decompressed capture
+        if opener is not None:
+            with opener(fileName, "rb") as f:
+                self.data = f.read()
+        with self.openFile() as f:
+            header = f.read(FILE_HEADER.size)
+        if len(header) < FILE_HEADER.size or header[:len(MAGIC)] != MAGIC:
+            raise ValueError("不是原始字节记录文件 not a raw capture file: " + fileName)
+        magic, version, self.wallStart, self.monotonicStart = FILE_HEADER.unpack(header)
+        self.size = os.path.getsize(fileName) if self.data is None else len(self.data)
+        self.indexTimes = array.array('q')      # 索引时间 Index times
+        self.indexOffsets = array.array('q')    # 索引偏移 Index offsets
+        if self.data is None and os.path.exists(fileName + ".idx"):
+            with open(fileName + ".idx", "rb") as f:
+                data = f.read()
+            for timestamp, offset in INDEX.iter_unpack(data[:len(data) - len(data) % INDEX.size]):
+                self.indexTimes.append(timestamp)
+                self.indexOffsets.append(offset)
+        else:
+            self.buildIndex()
+
+    def openFile(self):
+        return open(self.fileName, "rb") if self.data is None else io.BytesIO(self.data)
+
+    def buildIndex(self, indexInterval=0.1):
+        """
+        扫描记录文件重建内存中的索引
+        :param indexInterval: 索引间隔（秒）
+        :return: 无返回
+        """
+        interval = int(indexInterval * 1000000000)
+        self.indexTimes = array.array('q')
+        self.indexOffsets = array.array('q')
+        lastTime = None
+        for timestamp, offset, _ in self.scan(FILE_HEADER.size, readData=False):
+            if lastTime is None or timestamp - lastTime >= interval:
+                self.indexTimes.append(timestamp)
+                self.indexOffsets.append(offset)
+                lastTime = timestamp
+
+    def scan(self, offset, readData=True):
+        """
+        从指定偏移开始顺序读取数据块，末尾不完整的数据块被忽略
+        :param offset: 文件偏移
+        :param readData: 是否读取数据
+        :return: 迭代 (单调时钟时间, 偏移, 数据)
+        """
+        with self.openFile() as f:
+            f.seek(offset)
+            while offset + CHUNK.size <= self.size:
+                timestamp, length = CHUNK.unpack(f.read(CHUNK.size))
+                if offset + CHUNK.size + length > self.size:
+                    break
+                if readData:
+                    data = f.read(length)
+                else:
+                    data = None
+                    f.seek(length, os.SEEK_CUR)
+                yield timestamp, offset, data
+                offset += CHUNK.size + length
+
+    def seek(self, timestamp):
+        """
+        查找不晚于指定时间的最近索引偏移，O(log n)
+        :param timestamp: 单调时钟时间（纳秒）
+        :return: 文件偏移
+        """
+        i = bisect.bisect_right(self.indexTimes, timestamp) - 1
+        if i < 0:
+            return FILE_HEADER.size
+        return self.indexOffsets[i]
+
+    def toMonotonic(self, wallTime):
+        """
+        主机时间转换为记录中的单调时钟时间
+        :param wallTime: 主机时间（纳秒，time.time_ns）
+        :return: 单调时钟时间（纳秒）
+        """
+        return wallTime - self.wallStart + self.monotonicStart
+
+    def chunks(self, start=None, end=None):
+        """
+        读取时间范围内的数据块
+        :param start: 开始时间（单调时钟纳秒），None为从头开始
+        :param end: 结束时间（单调时钟纳秒，不含），None为到结尾
+        :return: 迭代 (单调时钟时间, 数据)
+        """
+        offset = FILE_HEADER.size if start is None else self.seek(start)
+        for timestamp, _, data in self.scan(offset):
+            if start is not None and timestamp < start:
+                continue
+            if end is not None and timestamp >= end:
+                break
+            yield timestamp, data
+
+    def replay(self, deviceModel, start=None, end=None):
+        """
+        把数据块按原顺序交给设备模型的协议解析器
+        :param deviceModel: 设备模型
+        :param start: 开始时间（单调时钟纳秒）
+        :param end: 结束时间（单调时钟纳秒）
+        :return: 回放的数据块数
+        """
+        count = 0
+        for _, data in self.chunks(start, end):
+            deviceModel.onDataReceived(data)
+            count += 1
+        return count
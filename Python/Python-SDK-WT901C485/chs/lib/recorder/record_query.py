@@ -0,0 +1,192 @@
+# coding:UTF-8
+import json
+import os
+import re
+import numpy as np
+from lib.recorder import columnar_store, rotating_recorder
+from lib.recorder.binary_reader import BinaryRecord
+from lib.recorder.columnar_store import ColumnarReader, toNs
+
+"""
+    按时间范围查询记录 Time-range query over recordings
+    二进制记录是定长记录、按主机时间顺序写入，时间列本身就是索引：在内存映射上二分查找只读取O(log n)个页面，
+    再只映射范围内的记录分块向量化解码；滚动记录器目录按其清单逐个分段查询（压缩的分段先解压），
+    按列存储目录则交给其块清单。可选按固定时间间隔降采样（mean/min/max等），
+    分块计算部分结果再合并，内存占用与范围长度无关
+    Binary records are fixed-size and written in host-time order, so the timestamp column is the index:
+    a binary search on the memory map touches O(log n) pages, then only the records inside the range are
+    decoded, block by block and vectorised. Rotating recorder directories are walked segment by segment through
+    their manifest (compressed segments are decompressed); columnar store directories use their chunk manifest.
+    Optional fixed-interval downsampling (mean/min/max/...) is computed per block and merged, so memory
+    does not grow with the range
+"""
+
+UNITS = {"ns": 1, "us": 1000, "ms": 1000000, "s": 1000000000, "m": 60000000000, "min": 60000000000,
+         "h": 3600000000000, "d": 86400000000000}
+AGGREGATES = ("mean", "min", "max", "first", "last", "count")
+
+
+def parseDuration(text):
+    """
+    解析时间间隔，如 "100ms"、"1s"、"5min"、"2h"，数字为秒
+    :param text: 时间间隔
+    :return: 纳秒
+    """
+    if isinstance(text, (int, float)):
+        return int(text * 1000000000)
+    match = re.fullmatch(r"\s*([0-9.]+)\s*([a-z]*)\s*", text)
+    if match is None or match.group(2) not in UNITS and match.group(2) != "":
+        raise ValueError("无效的时间间隔 invalid duration: " + text)
+    return int(float(match.group(1)) * UNITS[match.group(2) or "s"])
+
+
+def binAggregate(bins, columns):
+    """
+    把已按时间排序的数据按时间段合并成部分结果
+    :param bins: 每条数据的时间段编号（不减）
+    :param columns: 通道名 -> 数组
+    :return: (时间段编号, 数量, 通道名 -> {sum, min, max, first, last})
+    """
+    starts = np.flatnonzero(np.r_[True, bins[1:] != bins[:-1]])
+    ends = np.r_[starts[1:], len(bins)]
+    parts = {}
+    for name, column in columns.items():
+        parts[name] = {"sum": np.add.reduceat(column, starts), "min": np.minimum.reduceat(column, starts),
+                       "max": np.maximum.reduceat(column, starts), "first": column[starts],
+                       "last": column[ends - 1]}
+    return bins[starts], ends - starts, parts
+
+
+def mergeAggregates(blocks, fields, agg):
+    """
+    合并各分块的部分结果（相邻分块可能共享一个时间段）
+    :param blocks: binAggregate的结果列表
+    :param fields: 通道名列表
+    :param agg: 统计方式
+    :return: (时间段编号, 通道名 -> 统计值)
+    """
+    bins = np.concatenate([block[0] for block in blocks])
+    counts = np.concatenate([block[1] for block in blocks])
+    starts = np.flatnonzero(np.r_[True, bins[1:] != bins[:-1]])
+    ends = np.r_[starts[1:], len(bins)]
+    total = np.add.reduceat(counts, starts)
+    result = {}
+    for name in fields:
+        if agg == "count":
+            result[name] = total
+            continue
+        part = np.concatenate([block[2][name][agg if agg != "mean" else "sum"] for block in blocks])
+        if agg == "mean":
+            result[name] = np.add.reduceat(part, starts) / total
+        elif agg == "min":
+            result[name] = np.minimum.reduceat(part, starts)
+        elif agg == "max":
+            result[name] = np.maximum.reduceat(part, starts)
+        elif agg == "first":
+            result[name] = part[starts]
+        else:
+            result[name] = part[ends - 1]
+    return bins[starts], result
+
+
+def iterRecordBlocks(record, device, fields, start, end, blockSize):
+    """
+    按块读取一个二进制记录文件中时间范围内的数据
+    :return: 迭代 (时间数组, 通道名 -> 换算后的数组)
+    """
+    for name in fields:
+        if name not in record.scales:
+            raise KeyError("记录中没有通道 no such channel: " + name)
+    timestamps = record.records["timestamp"]
+    # 二分查找只访问O(log n)条记录 The binary search touches O(log n) records
+    lo = 0 if start is None else int(np.searchsorted(timestamps, start, "left"))
+    hi = len(timestamps) if end is None else int(np.searchsorted(timestamps, end, "left"))
+    for offset in range(lo, hi, blockSize):
+        block = record.records[offset:min(offset + blockSize, hi)]
+        if device is not None:
+            block = block[block["device"] == device]
+        if len(block) == 0:
+            continue
+        yield np.array(block["timestamp"]), {name: block[name] * record.scales[name] for name in fields}
+
+
+def iterSegments(directory, start, end):
+    """
+    按滚动记录器的清单列出时间范围内的分段，已关闭的分段按first/last跳过
+    :param directory: 滚动记录器目录
+    :return: 迭代分段文件路径
+    """
+    with open(os.path.join(directory, rotating_recorder.MANIFEST)) as f:
+        segments = json.load(f)["segments"]
+    for segment in segments:
+        if segment["state"] == "closed" and "last" in segment:
+            if segment["last"] is None:                 # 空分段 Empty segment
+                continue
+            if (start is not None and segment["last"] < start) or (end is not None and segment["first"] >= end):
+                continue
+        path = os.path.join(directory, segment["file"])
+        if not os.path.exists(path):
+            # 读清单之后分段被压缩或删除 Compressed or deleted since the manifest was read
+            path = next((path + extension for extension in rotating_recorder.EXTENSIONS.values()
+                         if extension and os.path.exists(path + extension)), None)
+        if path is not None:
+            yield path
+
+
+def iterBlocks(path, device, fields, start, end, blockSize):
+    """
+    按块读取时间范围内的数据
+    :return: 迭代 (时间数组, 通道名 -> 换算后的数组)
+    """
+    if os.path.isdir(path):
+        if os.path.exists(os.path.join(path, rotating_recorder.MANIFEST)):     # 滚动记录器 Rotating recorder
+            for segment in iterSegments(path, start, end):
+                yield from iterRecordBlocks(BinaryRecord(segment), device, fields, start, end, blockSize)
+            return
+        if not os.path.exists(os.path.join(path, columnar_store.MANIFEST)):
+            raise ValueError("不是记录目录 not a recording directory: " + path)
+        reader = ColumnarReader(path)               # 按列存储 Columnar store
+        for entry in reader.findChunks(device, start, end):
+            data = reader.loadChunk(device, entry, fields, start, end)
+            timestamps = data.pop("timestamp")
+            yield timestamps, data
+        return
+    yield from iterRecordBlocks(BinaryRecord(path), device, fields, start, end, blockSize)
+
+
+def query(path, device=0x50, fields=("angleX",), start=None, end=None, every=None, agg="mean", blockSize=1 << 20):
+    """
+    查询时间范围内的数据
+    :param path: 二进制记录文件（.bin、.bin.gz、.bin.xz）、滚动记录器目录或按列存储目录
+    :param device: 设备ID，None为所有设备（仅二进制记录）
+    :param fields: 通道名列表
+    :param start: 开始时间（纳秒、秒或datetime），None为从头开始
+    :param end: 结束时间（不含），None为到结尾
+    :param every: 降采样间隔（如 "100ms"），None为不降采样
+    :param agg: 降采样统计方式 mean、min、max、first、last、count
+    :param blockSize: 每次解码的记录数
+    :return: 通道名 -> 数组，另有 "timestamp"（降采样时为时间段开始时间）
+    """
+    fields = list(fields)
+    start, end = toNs(start), toNs(end)
+    if every is None:
+        parts = list(iterBlocks(path, device, fields, start, end, blockSize))
+        if not parts:
+            result = {name: np.zeros(0) for name in fields}
+            result["timestamp"] = np.zeros(0, dtype=np.int64)
+            return result
+        result = {name: np.concatenate([part[1][name] for part in parts]) for name in fields}
+        result["timestamp"] = np.concatenate([part[0] for part in parts])
+        return result
+    if agg not in AGGREGATES:
+        raise ValueError("无效的统计方式 invalid aggregate: " + agg)
+    interval = parseDuration(every)
+    blocks = [binAggregate(timestamps // interval, columns)
+              for timestamps, columns in iterBlocks(path, device, fields, start, end, blockSize)]
+    if not blocks:
+        result = {name: np.zeros(0) for name in fields}
+        result["timestamp"] = np.zeros(0, dtype=np.int64)
+        return result
+    bins, result = mergeAggregates(blocks, fields, agg)
+    result["timestamp"] = bins * interval
+    return result
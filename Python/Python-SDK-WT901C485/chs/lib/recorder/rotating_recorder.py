@@ -0,0 +1,242 @@
+# coding:UTF-8
+import datetime
+import gzip
+import json
+import lzma
+import os
+import queue
+import shutil
+import threading
+import time
+from lib.recorder.binary_recorder import BinaryRecorder, WT901C485_CHANNELS
+
+"""
+    滚动记录器 Rotating recorder
+    按大小或时长把二进制记录分成多个分段文件。换段时只新建文件，旧分段的关闭、压缩（gzip或lzma）、
+    超出保留空间或保留时间的旧分段删除都在后台线程中完成，不占用接收线程。清单文件记录每个分段的时间范围、
+    记录条数和大小（first/last为分段内第一条和最后一条记录的时间，查询据此跳过分段），
+    每次更新都先写临时文件再原子替换
+    Splits binary records into segment files by size or duration. Rolling only opens a new file; closing,
+    compressing (gzip or lzma) and deleting segments beyond the retention budget or age all happen on a
+    background thread, never on the receive path. A manifest lists every segment's time range, record count
+    and size (first/last are the timestamps of its first and last record, so queries can skip it) and is
+    replaced atomically on every update
+"""
+
+MANIFEST = "manifest.json"
+EXTENSIONS = {None: "", "gzip": ".gz", "lzma": ".xz"}
+
+
+class RotatingRecorder:
+    __slots__ = ('directory', 'prefix', 'channels', 'maxBytes', 'maxDuration', 'compression', 'retentionBytes',
+                 'retentionAge', 'blockSize', 'flushInterval', 'deviceIds', 'recorder', 'segment', 'segmentStart',
+                 'segments', 'sequence', 'lock', 'tasks', 'thread', 'deletedCount')
+
+    def __init__(self, directory, prefix="wit", channels=WT901C485_CHANNELS, maxBytes=64 << 20, maxDuration=3600,
+                 compression="gzip", retentionBytes=1 << 30, retentionAge=None, blockSize=1 << 20,
+                 flushInterval=1.0):
+        """
+        初始化
+        :param directory: 记录目录
+        :param prefix: 文件名前缀
+        :param channels: 通道定义 [(寄存器, 名称, 换算系数)]
+        :param maxBytes: 每个分段的最大字节数，None为不限
+        :param maxDuration: 每个分段的最长时间（秒），None为不限
+        :param compression: 关闭的分段用 "gzip"、"lzma" 压缩，None为不压缩
+        :param retentionBytes: 所有分段的总字节数上限，超出时删除最旧的分段，None为不限
+        :param retentionAge: 分段最长保留时间（秒），None为不限
+        :param blockSize: 写盘块大小（字节）
+        :param flushInterval: 块未满时最长多久写一次盘（秒）
+        """
+        self.directory = directory
+        self.prefix = prefix
+        self.channels = list(channels)
+        self.maxBytes = maxBytes
+        self.maxDuration = maxDuration
+        self.compression = compression
+        self.retentionBytes = retentionBytes
+        self.retentionAge = retentionAge
+        self.blockSize = blockSize
+        self.flushInterval = flushInterval
+        self.deviceIds = {}                 # 设备 -> 设备ID Device -> id
+        self.recorder = None                # 当前分段的记录器 Recorder of the current segment
+        self.segment = None                 # 当前分段的清单项 Manifest entry of the current segment
+        self.segmentStart = 0               # 当前分段开始时间（单调时钟） Current segment start (monotonic)
+        self.segments = []                  # 清单 Manifest entries, oldest first
+        self.sequence = 0                   # 分段序号 Segment sequence number
+        self.lock = threading.Lock()
+        self.tasks = queue.Queue()          # 待关闭的分段 Segments waiting to be closed
+        self.thread = None
+        self.deletedCount = 0               # 因保留策略删除的分段数 Segments deleted by retention
+
+    def open(self):
+        """
+        创建目录、读取已有清单、开始第一个分段并启动后台线程
+        :return: 无返回
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, MANIFEST)
+        if os.path.exists(path):
+            with open(path) as f:
+                self.segments = json.load(f)["segments"]
+            for segment in self.segments:
+                if segment["state"] == "open":      # 上次异常退出，保留未压缩的文件 Left open by a crash, kept as is
+                    segment["state"] = "closed"
+                    segment["size"] = os.path.getsize(os.path.join(self.directory, segment["file"])) \
+                        if os.path.exists(os.path.join(self.directory, segment["file"])) else 0
+            self.sequence = max([segment["sequence"] for segment in self.segments] + [0])
+        self.thread = threading.Thread(target=self.closeLoop, name="RotatingRecorder", daemon=True)
+        self.thread.start()
+        with self.lock:
+            self.startSegment()
+        self.tasks.put((None, None))        # 写入初始清单 Write the initial manifest
+
+    def setDeviceId(self, deviceModel, deviceId):
+        """
+        指定设备ID（多条总线上地址相同的设备需要区分时使用）
+        :param deviceModel: 设备模型
+        :param deviceId: 设备ID (0~65535)
+        :return: 无返回
+        """
+        with self.lock:
+            self.deviceIds[deviceModel] = deviceId
+            if self.recorder is not None:
+                self.recorder.setDeviceId(deviceModel, deviceId)
+
+    def startSegment(self):
+        """
+        开始新分段，需持有锁
+        :return: 无返回
+        """
+        self.sequence += 1
+        name = "%s_%s_%04d.bin" % (self.prefix, datetime.datetime.now().strftime('%Y%m%d%H%M%S'), self.sequence)
+        self.recorder = BinaryRecorder(os.path.join(self.directory, name), self.channels, self.blockSize,
+                                       self.flushInterval)
+        self.recorder.deviceIds.update(self.deviceIds)
+        self.recorder.open()
+        self.segmentStart = time.monotonic()
+        self.segment = {"file": name, "sequence": self.sequence, "state": "open", "start": time.time_ns(),
+                        "end": None, "records": 0, "bytes": 0, "size": 0}
+        self.segments.append(self.segment)
+
+    def write(self, deviceModel, timestamp=None):
+        """
+        记录设备当前的寄存器映像，可直接在数据更新事件中调用；分段写满或到时间时换段
+        :param deviceModel: 设备模型
+        :param timestamp: 主机时间（纳秒），None为当前时间
+        :return: 无返回
+        """
+        with self.lock:
+            recorder = self.recorder
+            if recorder is None:
+                return
+            size = recorder.recordSize * recorder.recordCount
+            if (self.maxBytes is not None and size >= self.maxBytes) or \
+                    (self.maxDuration is not None and time.monotonic() - self.segmentStart >= self.maxDuration):
+                self.tasks.put((recorder, self.segment))   # 后台关闭和压缩 Closed in the background
+                self.startSegment()
+                recorder = self.recorder
+            recorder.write(deviceModel, timestamp)
+
+    def closeLoop(self):
+        """
+        后台线程：关闭分段、压缩、按保留策略删除、更新清单
+        :return:
+        """
+        while True:
+            task = self.tasks.get()
+            if task is None:
+                break
+            recorder, segment = task
+            try:
+                if recorder is not None:
+                    self.closeSegment(recorder, segment)
+                self.applyRetention()
+                self.writeManifest()
+            except Exception as ex:
+                print(ex)
+
+    def closeSegment(self, recorder, segment):
+        """
+        关闭分段并压缩
+        :param recorder: 分段的记录器
+        :param segment: 清单项
+        :return: 无返回
+        """
+        recorder.close()
+        path = os.path.join(self.directory, segment["file"])
+        segment["end"] = time.time_ns()
+        segment["records"] = recorder.recordCount
+        segment["bytes"] = recorder.bytesWritten
+        segment["first"] = recorder.firstTimestamp
+        segment["last"] = recorder.lastTimestamp
+        if self.compression is not None:
+            target = path + EXTENSIONS[self.compression]
+            opener = gzip.open if self.compression == "gzip" else lzma.open
+            with open(path, "rb") as source, opener(target + ".tmp", "wb") as output:
+                shutil.copyfileobj(source, output, 1 << 20)
+            os.replace(target + ".tmp", target)
+            os.remove(path)
+            segment["file"] += EXTENSIONS[self.compression]
+            path = target
+        segment["size"] = os.path.getsize(path)
+        segment["state"] = "closed"
+
+    def applyRetention(self):
+        """
+        删除超出保留空间或保留时间的最旧分段（不删除正在写的分段）
+        :return: 无返回
+        """
+        with self.lock:
+            closed = [segment for segment in self.segments if segment["state"] == "closed"]
+            total = sum(segment["size"] for segment in closed)
+        now = time.time_ns()
+        for segment in closed:
+            expired = self.retentionAge is not None and now - (segment["end"] or segment["start"]) > self.retentionAge * 1000000000
+            if not expired and (self.retentionBytes is None or total <= self.retentionBytes):
+                break
+            path = os.path.join(self.directory, segment["file"])
+            if os.path.exists(path):
+                os.remove(path)
+            total -= segment["size"]
+            self.deletedCount += 1
+            with self.lock:
+                self.segments.remove(segment)
+
+    def writeManifest(self):
+        """
+        原子替换清单文件
+        :return: 无返回
+        """
+        with self.lock:
+            text = json.dumps({"channels": self.channels, "segments": self.segments}, indent=1)
+        path = os.path.join(self.directory, MANIFEST)
+        with open(path + ".tmp", "w") as f:
+            f.write(text)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(path + ".tmp", path)
+
+    def getStatus(self):
+        """
+        获取状态
+        :return: 分段数、总字节数、等待关闭的分段数、删除的分段数
+        """
+        with self.lock:
+            return {"segments": len(self.segments), "size": sum(segment["size"] for segment in self.segments),
+                    "pending": self.tasks.qsize(), "deleted": self.deletedCount}
+
+    def close(self):
+        """
+        关闭当前分段，等待后台线程处理完并退出
+        :return: 无返回
+        """
+        with self.lock:
+            recorder, segment = self.recorder, self.segment
+            self.recorder = None
+        if recorder is not None:
+            self.tasks.put((recorder, segment))
+        if self.thread is not None:
+            self.tasks.put(None)
+            self.thread.join()
+            self.thread = None
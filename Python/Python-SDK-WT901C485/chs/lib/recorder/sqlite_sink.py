@@ -0,0 +1,204 @@
+# coding:UTF-8
+import queue
+import sqlite3
+import threading
+import time
+from lib.recorder.binary_recorder import WT53R_CHANNELS, WT901C485_CHANNELS, WTVB01_CHANNELS
+
+"""
+    SQLite时序数据存储 SQLite time-series sink
+    作为数据更新事件的监听器，把采样放入有界队列，由专用线程成批用executemany写入WAL模式的SQLite数据库。
+    每种设备类型一张表，另有1秒和1分钟的汇总表（最小值、最大值、平均值），每批写入时增量更新。
+    队列满时丢弃新采样并计数，getStatus报告队列积压时间
+    A data-update listener that puts samples on a bounded queue; a dedicated thread writes them in batches
+    with executemany into an SQLite database in WAL mode. One table per device type, plus 1 s and 1 min
+    rollup tables (min/max/mean) updated incrementally with every batch. When the queue is full new samples
+    are dropped and counted; getStatus reports the queue lag
+"""
+
+DEVICE_TYPES = {"WT901C485": WT901C485_CHANNELS, "WTVB01": WTVB01_CHANNELS, "WT53R": WT53R_CHANNELS}
+ROLLUPS = {"1s": 1000000000, "1m": 60000000000}
+
+
+class SqliteSink:
+    __slots__ = ('fileName', 'deviceTypes', 'batchSize', 'flushInterval', 'queue', 'devices', 'thread',
+                 'writtenCount', 'droppedCount', 'batchCount', 'lag', 'maxLag')
+
+    def __init__(self, fileName, deviceTypes=None, batchSize=2000, maxQueue=100000, flushInterval=0.5):
+        """
+        初始化
+        :param fileName: 数据库文件名
+        :param deviceTypes: 设备类型 -> 通道定义 [(寄存器, 名称, 换算系数)]，默认WT901C485、WTVB01、WT53R
+        :param batchSize: 每批最多写入的采样数
+        :param maxQueue: 队列最大长度
+        :param flushInterval: 批未满时最长多久写一次（秒）
+        """
+        self.fileName = fileName
+        self.deviceTypes = dict(DEVICE_TYPES if deviceTypes is None else deviceTypes)
+        self.batchSize = batchSize
+        self.flushInterval = flushInterval
+        self.queue = queue.Queue(maxQueue)
+        self.devices = {}                   # 设备 -> (设备类型, 设备ID) Device -> (type, id)
+        self.thread = None
+        self.writtenCount = 0               # 已写入采样数 Samples written
+        self.droppedCount = 0               # 队列满丢弃的采样数 Samples dropped on a full queue
+        self.batchCount = 0                 # 写入批数 Batches written
+        self.lag = 0.0                      # 最近一批最早采样的排队时间（秒） Queue time of the oldest sample in the last batch
+        self.maxLag = 0.0                   # 最大排队时间（秒） Worst queue time
+
+    def addDevice(self, deviceModel, deviceType="WT901C485", deviceId=None):
+        """
+        指定设备的类型和ID，未指定的设备按WT901C485、设备地址记录
+        :param deviceModel: 设备模型
+        :param deviceType: 设备类型
+        :param deviceId: 设备ID，None为设备地址
+        :return: 无返回
+        """
+        if deviceType not in self.deviceTypes:
+            raise KeyError("未知的设备类型 unknown device type: " + deviceType)
+        self.devices[deviceModel] = (deviceType, deviceModel.ADDR if deviceId is None else deviceId)
+
+    def open(self):
+        """
+        创建数据库表并启动写入线程
+        :return: 无返回
+        """
+        connection = self.connect()
+        connection.close()
+        self.thread = threading.Thread(target=self.writeLoop, name="SqliteSink", daemon=True)
+        self.thread.start()
+
+    def connect(self):
+        """
+        打开数据库，使用WAL模式，建表
+        :return: 数据库连接
+        """
+        connection = sqlite3.connect(self.fileName)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")        # WAL模式下提交时不等待fsync Commit without fsync in WAL
+        for deviceType, channels in self.deviceTypes.items():
+            columns = ", ".join('"%s" REAL' % name for _, name, _ in channels)
+            connection.execute('CREATE TABLE IF NOT EXISTS "%s" (ts INTEGER, device INTEGER, %s)'
+                               % (deviceType, columns))
+            connection.execute('CREATE INDEX IF NOT EXISTS "%s_device_ts" ON "%s" (device, ts)'
+                               % (deviceType, deviceType))
+            for suffix in ROLLUPS:
+                columns = ", ".join('"{0}_min" REAL, "{0}_max" REAL, "{0}_mean" REAL'.format(name)
+                                    for _, name, _ in channels)
+                connection.execute('CREATE TABLE IF NOT EXISTS "%s_%s" (bucket INTEGER, device INTEGER, '
+                                   'count INTEGER, %s, PRIMARY KEY (device, bucket))' % (deviceType, suffix, columns))
+        connection.commit()
+        return connection
+
+    def write(self, deviceModel, timestamp=None):
+        """
+        把设备当前的寄存器映像放入队列，可直接在数据更新事件中调用
+        :param deviceModel: 设备模型
+        :param timestamp: 主机时间（纳秒），None为当前时间
+        :return: 无返回
+        """
+        deviceType, deviceId = self.devices.get(deviceModel) or ("WT901C485", deviceModel.ADDR)
+        registers = deviceModel.registers
+        values = [registers[reg] * scale for reg, _, scale in self.deviceTypes[deviceType]]
+        try:
+            self.queue.put_nowait((deviceType, time.time_ns() if timestamp is None else timestamp, deviceId,
+                                   values, time.monotonic()))
+        except queue.Full:
+            self.droppedCount += 1
+
+    def writeLoop(self):
+        """
+        写入线程：攒够一批或超时后写入
+        :return:
+        """
+        connection = self.connect()
+        running = True
+        while running:
+            batch = []
+            deadline = time.monotonic() + self.flushInterval
+            while len(batch) < self.batchSize:
+                try:
+                    item = self.queue.get(timeout=max(deadline - time.monotonic(), 0))
+                except queue.Empty:
+                    break
+                if item is None:
+                    running = False
+                    break
+                batch.append(item)
+            if batch:
+                try:
+                    self.writeBatch(connection, batch)
+                except sqlite3.Error as ex:
+                    print(ex)
+        connection.close()
+
+    def writeBatch(self, connection, batch):
+        """
+        在一个事务中写入一批采样并更新汇总表
+        :param connection: 数据库连接
+        :param batch: [(设备类型, 时间, 设备ID, 值列表, 入队时间)]
+        :return: 无返回
+        """
+        rows = {}
+        rollups = {}
+        for deviceType, timestamp, deviceId, values, _ in batch:
+            rows.setdefault(deviceType, []).append([timestamp, deviceId] + values)
+            for suffix, interval in ROLLUPS.items():
+                key = (deviceType, suffix)
+                buckets = rollups.setdefault(key, {})
+                bucket = buckets.get((timestamp // interval, deviceId))
+                if bucket is None:
+                    buckets[(timestamp // interval, deviceId)] = [1, list(values), list(values), list(values)]
+                    continue
+                bucket[0] += 1
+                mins, maxs, sums = bucket[1], bucket[2], bucket[3]
+                for i, value in enumerate(values):
+                    if value < mins[i]:
+                        mins[i] = value
+                    elif value > maxs[i]:
+                        maxs[i] = value
+                    sums[i] += value
+        with connection:
+            for deviceType, typeRows in rows.items():
+                connection.executemany('INSERT INTO "%s" VALUES (%s)' % (deviceType, ",".join("?" * len(typeRows[0]))),
+                                       typeRows)
+            for (deviceType, suffix), buckets in rollups.items():
+                names = [name for _, name, _ in self.deviceTypes[deviceType]]
+                columns = ", ".join('"{0}_min", "{0}_max", "{0}_mean"'.format(name) for name in names)
+                # 已有的汇总行与本批合并，平均值按数量加权 Merge into existing rows, means weighted by count
+                updates = ", ".join('"{0}_min" = min("{0}_min", excluded."{0}_min"), '
+                                    '"{0}_max" = max("{0}_max", excluded."{0}_max"), '
+                                    '"{0}_mean" = ("{0}_mean" * count + excluded."{0}_mean" * excluded.count) '
+                                    '/ (count + excluded.count)'.format(name) for name in names)
+                sql = 'INSERT INTO "%s_%s" (bucket, device, count, %s) VALUES (%s) ' \
+                      'ON CONFLICT (device, bucket) DO UPDATE SET count = count + excluded.count, %s' \
+                      % (deviceType, suffix, columns, ",".join("?" * (3 + 3 * len(names))), updates)
+                params = []
+                for (bucket, deviceId), (count, mins, maxs, sums) in buckets.items():
+                    row = [bucket, deviceId, count]
+                    for i in range(len(names)):
+                        row += (mins[i], maxs[i], sums[i] / count)
+                    params.append(row)
+                connection.executemany(sql, params)
+        self.writtenCount += len(batch)
+        self.batchCount += 1
+        self.lag = time.monotonic() - batch[0][4]
+        self.maxLag = max(self.maxLag, self.lag)
+
+    def getStatus(self):
+        """
+        获取状态
+        :return: 队列长度、最近一批的排队时间、最大排队时间、写入和丢弃的采样数
+        """
+        return {"queued": self.queue.qsize(), "lag": self.lag, "maxLag": self.maxLag, "written": self.writtenCount,
+                "dropped": self.droppedCount, "batches": self.batchCount}
+
+    def close(self):
+        """
+        写完队列中的数据并停止写入线程
+        :return: 无返回
+        """
+        if self.thread is not None:
+            self.queue.put(None)
+            self.thread.join()
+            self.thread = None
@@ -0,0 +1,89 @@
+# coding:UTF-8
+import os
+import select
+import threading
+import tty
+from lib.utils.crc_utils import check_crc
+
+"""
+    伪终端模拟总线 Pseudo-terminal simulated bus
+    在伪终端的主端挂模拟传感器，从端是真实的串口设备文件（如 /dev/pts/3），可以用pyserial或任何串口工具打开，
+    用于端到端测试（仅Linux/macOS）
+    Simulated sensors behind the master side of a pseudo terminal; the slave side is a real serial device
+    file (e.g. /dev/pts/3) that pyserial or any serial tool can open, for end-to-end tests (Linux/macOS only)
+"""
+
+
+def modbusFrameLength(data):
+    """
+    根据功能码推算Modbus RTU指令帧长度
+    :param data: 收到的数据
+    :return: 帧长度，数据不够判断时返回None
+    """
+    if len(data) < 2:
+        return None
+    if data[1] in (0x03, 0x04, 0x06):
+        return 8
+    if data[1] == 0x10:
+        return 9 + data[6] if len(data) >= 7 else None
+    return 1                                # 未知功能码，丢弃一个字节 Unknown function: drop a byte
+
+
+class PtySimulator:
+    __slots__ = ('sensors', 'master', 'slave', 'portName', 'thread', 'running', 'requestCount')
+
+    def __init__(self, sensors):
+        """
+        初始化
+        :param sensors: 总线上的模拟传感器列表
+        """
+        self.sensors = list(sensors)        # 总线上的传感器 Sensors on the bus
+        self.master, self.slave = os.openpty()
+        tty.setraw(self.slave)              # 不做换行等转换 No line discipline processing
+        self.portName = os.ttyname(self.slave)  # 串口设备文件 Serial device file
+        self.thread = None
+        self.running = False
+        self.requestCount = 0               # 收到的指令数 Requests received
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self.serveLoop, name="PtySimulator", daemon=True)
+        self.thread.start()
+
+    def serveLoop(self):
+        """
+        读取指令并应答
+        :return:
+        """
+        buffer = bytearray()
+        while self.running:
+            ready, _, _ = select.select([self.master], [], [], 0.1)
+            if not ready:
+                buffer.clear()              # 帧间隔，丢弃不完整的数据 Frame gap: drop partial data
+                continue
+            try:
+                buffer += os.read(self.master, 4096)
+            except OSError:
+                break
+            while True:
+                length = modbusFrameLength(buffer)
+                if length is None or len(buffer) < length:
+                    break
+                frame = bytes(buffer[:length])
+                if length == 1 or not check_crc(frame):
+                    del buffer[:1]
+                    continue
+                del buffer[:length]
+                self.requestCount += 1
+                for sensor in self.sensors:
+                    response = sensor.handleModbus(frame)
+                    if response is not None:
+                        os.write(self.master, response)
+
+    def stop(self):
+        self.running = False
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        os.close(self.master)
+        os.close(self.slave)
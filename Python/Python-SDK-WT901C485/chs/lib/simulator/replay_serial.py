@@ -0,0 +1,210 @@
+# coding:UTF-8
+import collections
+import threading
+import time
+from lib.recorder.raw_capture import MAGIC, RawCaptureReader
+from lib.utils.crc_utils import check_crc
+
+"""
+    回放串口 Replay serial port
+    实现设备模型用到的pyserial接口（read、inWaiting、write、close），数据来自原始字节记录（raw_capture）
+    或convert.py使用的纯字节文件。主动回传的数据按记录时间回放（实时、按倍数加速或尽可能快），
+    轮询的读取指令用记录中对应的应答回复
+    Implements the pyserial subset used by the device models, fed by a raw capture or a plain byte dump
+    (convert.py input). Streamed data is paced by the recorded times (real time, scaled or as fast as
+    possible); poll requests are answered with the recorded responses
+"""
+
+
+def splitResponses(data):
+    """
+    从记录的字节流中找出Modbus应答（0x03读取、0x06写入）和维特协议寄存器应答（0x55 0x5F）
+    :param data: 字节流
+    :return: 应答key -> 按记录顺序的应答列表
+    """
+    responses = collections.defaultdict(collections.deque)
+    i = 0
+    size = len(data)
+    while i + 5 <= size:
+        if data[i] == 0x55 and data[i + 1] == 0x5F and i + 11 <= size and sum(data[i:i + 10]) & 0xff == data[i + 10]:
+            responses[("wit", 0x5F)].append(bytes(data[i:i + 11]))
+            i += 11
+            continue
+        if data[i + 1] == 0x03:
+            end = i + data[i + 2] + 5
+            if end <= size and check_crc(data[i:end]):
+                responses[(data[i], 0x03, data[i + 2])].append(bytes(data[i:end]))
+                i = end
+                continue
+        if data[i + 1] == 0x06 and i + 8 <= size and check_crc(data[i:i + 8]):
+            responses[(data[i], 0x06)].append(bytes(data[i:i + 8]))
+            i += 8
+            continue
+        i += 1
+    return responses
+
+
+class ReplaySerial:
+    __slots__ = ('chunks', 'mode', 'speed', 'timeout', 'port', 'baudrate', 'loop', 'is_open', 'buffer', 'index',
+                 'startTime', 'responses', 'used', 'lock', 'bytesRead', 'bytesWritten', 'missCount')
+
+    def __init__(self, fileName, speed=1.0, mode="auto", chunkSize=1024, timeout=0.5, port="REPLAY",
+                 baudrate=9600, loop=False):
+        """
+        初始化
+        :param fileName: 原始字节记录文件或纯字节文件
+        :param speed: 回放速度，1.0为实时，10为10倍速，None为尽可能快
+        :param mode: "stream" 按时间回放，"poll" 用记录的应答回复读取指令，"auto" 记录中有Modbus应答时为poll
+        :param chunkSize: 纯字节文件按多大分块（字节），按波特率推算时间
+        :param timeout: read的超时时间（秒）
+        :param port: 端口名
+        :param baudrate: 波特率
+        :param loop: 放完后是否从头开始
+        """
+        with open(fileName, "rb") as f:
+            isCapture = f.read(len(MAGIC)) == MAGIC
+        if isCapture:
+            reader = RawCaptureReader(fileName)
+            self.chunks = list(reader.chunks())
+        else:
+            with open(fileName, "rb") as f:
+                data = f.read()
+            byteTime = 10 * 1000000000 // baudrate      # 每字节10位 10 bits per byte
+            self.chunks = [(i * byteTime, data[i:i + chunkSize]) for i in range(0, len(data), chunkSize)]
+        self.responses = splitResponses(b"".join(data for _, data in self.chunks))
+        if mode == "auto":
+            mode = "poll" if any(key[0] != "wit" for key in self.responses) else "stream"
+        self.mode = mode                    # 回放方式 Replay mode
+        self.speed = speed                  # 回放速度 Replay speed
+        self.timeout = timeout              # 读取超时 Read timeout
+        self.port = port                    # 端口名 Port name
+        self.baudrate = baudrate            # 波特率 Baud rate
+        self.loop = loop                    # 循环回放 Loop playback
+        self.is_open = True                 # 是否打开 Whether open
+        self.buffer = bytearray()           # 接收缓冲 Receive buffer
+        self.index = 0                      # 下一个回放的数据块 Next chunk to play
+        self.startTime = time.monotonic()   # 回放开始时间 Playback start
+        self.used = collections.defaultdict(collections.deque)  # 已回复的应答，循环时放回 Replied, for looping
+        self.lock = threading.Lock()
+        self.bytesRead = 0                  # 读取字节数 Bytes read
+        self.bytesWritten = 0               # 写入字节数 Bytes written
+        self.missCount = 0                  # 没有记录应答的指令数 Requests without a recorded response
+
+    def isFinished(self):
+        """
+        是否已经放完
+        :return:
+        """
+        if self.mode == "poll":
+            return not self.loop and len(self.used) > 0 and not any(self.responses[key] for key in self.used)
+        return self.index >= len(self.chunks) and len(self.buffer) == 0
+
+    def pump(self):
+        """
+        把到时间的数据块放入接收缓冲，需持有锁
+        :return: 无返回
+        """
+        if self.mode != "stream":
+            return
+        chunks = self.chunks
+        if self.index >= len(chunks):
+            if not self.loop or len(chunks) == 0:
+                return
+            self.index = 0
+            self.startTime = time.monotonic()
+        if self.speed is None:                      # 尽可能快：缓冲空了才放下一块 As fast as possible: refill when empty
+            if len(self.buffer) == 0:
+                self.buffer += chunks[self.index][1]
+                self.index += 1
+            return
+        elapsed = (time.monotonic() - self.startTime) * self.speed * 1000000000
+        first = chunks[0][0]
+        while self.index < len(chunks) and chunks[self.index][0] - first <= elapsed:
+            self.buffer += chunks[self.index][1]
+            self.index += 1
+
+    def inWaiting(self):
+        """
+        接收缓冲中的字节数
+        :return:
+        """
+        with self.lock:
+            if not self.is_open:
+                raise IOError("port closed")
+            self.pump()
+            return len(self.buffer)
+
+    @property
+    def in_waiting(self):
+        return self.inWaiting()
+
+    def read(self, size=1):
+        """
+        读取数据，最多等待timeout秒
+        :param size: 读取字节数
+        :return: 读到的数据
+        """
+        deadline = time.monotonic() + (self.timeout or 0)
+        while True:
+            with self.lock:
+                if not self.is_open:
+                    raise IOError("port closed")
+                self.pump()
+                if len(self.buffer) >= size or time.monotonic() >= deadline:
+                    data = bytes(self.buffer[:size])
+                    del self.buffer[:size]
+                    self.bytesRead += len(data)
+                    return data
+            time.sleep(0.001)
+
+    def write(self, data):
+        """
+        写入指令，轮询方式下回复记录中对应的下一个应答
+        :param data: 指令数据
+        :return: 写入字节数
+        """
+        data = bytes(data)
+        with self.lock:
+            if not self.is_open:
+                raise IOError("port closed")
+            self.bytesWritten += len(data)
+            if self.mode != "poll":
+                return len(data)
+            key = None
+            if len(data) == 8 and data[1] == 0x03 and check_crc(data):
+                key = (data[0], 0x03, ((data[4] << 8) | data[5]) * 2)
+            elif len(data) == 8 and data[1] == 0x06 and check_crc(data):
+                key = (data[0], 0x06)
+            elif len(data) == 5 and data[0] == 0xFF and data[1] == 0xAA and data[2] == 0x27:
+                key = ("wit", 0x5F)
+            if key is None:
+                return len(data)
+            queue = self.responses.get(key)
+            if not queue and self.loop and self.used[key]:      # 循环回放 Loop playback
+                self.responses[key], self.used[key] = self.used[key], collections.deque()
+                queue = self.responses[key]
+            if queue:
+                response = queue.popleft()
+                self.used[key].append(response)
+                self.buffer += response
+            else:
+                self.missCount += 1
+        return len(data)
+
+    def flushInput(self):
+        with self.lock:
+            self.buffer = bytearray()
+
+    def reset_input_buffer(self):
+        self.flushInput()
+
+    def isOpen(self):
+        return self.is_open
+
+    def close(self):
+        with self.lock:
+            self.is_open = False
+
+    def open(self):
+        with self.lock:
+            self.is_open = True
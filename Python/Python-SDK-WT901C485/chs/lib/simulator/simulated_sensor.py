@@ -0,0 +1,193 @@
+# coding:UTF-8
+import math
+import time
+from lib.utils.crc_utils import append_crc, check_crc
+
+"""
+    模拟传感器 Simulated sensor
+    按维特寄存器表保存寄存器，可应答Modbus RTU和维特协议指令，用于没有硬件时的测试
+    Keeps a Wit register map and answers Modbus RTU / Wit protocol commands, for testing without hardware
+"""
+
+REGSIZE = 0x90      # 寄存器个数 Register count
+SAVE = 0x00         # 保存 Save
+RSW = 0x02          # 回传内容 Output content
+RRATE = 0x03        # 回传速率 Output rate
+BAUD = 0x04         # 波特率 Baud rate
+IICADDR = 0x1a      # 设备地址 Device address
+GYRORANGE = 0x20    # 角速度量程 Gyro range
+ACCRANGE = 0x21     # 加速度量程 Acc range
+READADDR = 0x27     # 维特协议读寄存器 Wit protocol read register
+VERSION = 0x2e      # 版本号 Version
+YYMM = 0x30         # 芯片时间 Chip time
+AX = 0x34           # 加速度 Acceleration
+GX = 0x37           # 角速度 Angular velocity
+HX = 0x3a           # 磁场 Magnetic field
+ROLL = 0x3d         # 角度 Angle
+TEMP = 0x40         # 温度 Temperature
+Q0 = 0x51           # 四元数 Quaternion
+KEY = 0x69          # 解锁 Unlock
+
+
+def toRegister(value):
+    """
+    有符号数转寄存器值
+    :param value: 有符号整数
+    :return: 16位无符号寄存器值
+    """
+    return int(value) & 0xffff
+
+
+class SimulatedSensor:
+    __slots__ = ('ADDR', 'registers', 'phase', 'temperature', 'startTime', 'writeCount')
+
+    def __init__(self, ADDR=0x50, phase=0.0, temperature=25.0):
+        """
+        初始化
+        :param ADDR: Modbus地址
+        :param phase: 模拟运动的相位，不同传感器数据不同
+        :param temperature: 模拟温度
+        """
+        self.ADDR = ADDR                    # 设备地址 Device address
+        self.phase = phase                  # 运动相位 Motion phase
+        self.temperature = temperature      # 温度 Temperature
+        self.startTime = time.monotonic()   # 启动时间 Start time
+        self.writeCount = 0                 # 写寄存器次数 Register write count
+        self.registers = [0] * REGSIZE      # 寄存器表 Register map
+        self.registers[RSW] = 0x1e          # 时间、加速度、角速度、角度、磁场 Time, acc, gyro, angle, mag
+        self.registers[RRATE] = 0x06        # 10Hz
+        self.registers[BAUD] = 0x02         # 9600
+        self.registers[IICADDR] = ADDR
+        self.registers[GYRORANGE] = 0x03    # 2000deg/s
+        self.registers[ACCRANGE] = 0x03     # 16g
+        self.registers[VERSION] = 0x1234
+        self.update()
+
+    def update(self):
+        """
+        按当前时间刷新数据寄存器
+        :return: 无返回
+        """
+        t = time.monotonic() - self.startTime + self.phase
+        regs = self.registers
+        now = time.localtime()
+        ms = int(time.time() * 1000) % 1000
+        regs[YYMM] = (now.tm_year % 100) | (now.tm_mon << 8)
+        regs[YYMM + 1] = now.tm_mday | (now.tm_hour << 8)
+        regs[YYMM + 2] = now.tm_min | (now.tm_sec << 8)
+        regs[YYMM + 3] = ms
+        roll = 10.0 * math.sin(t)
+        pitch = 5.0 * math.cos(t)
+        yaw = (t * 10.0) % 360.0 - 180.0
+        regs[ROLL] = toRegister(roll / 180.0 * 32768)
+        regs[ROLL + 1] = toRegister(pitch / 180.0 * 32768)
+        regs[ROLL + 2] = toRegister(yaw / 180.0 * 32768)
+        regs[AX] = toRegister(math.sin(math.radians(pitch)) / 16.0 * 32768)
+        regs[AX + 1] = toRegister(math.sin(math.radians(roll)) / 16.0 * 32768)
+        regs[AX + 2] = toRegister(math.cos(math.radians(roll)) / 16.0 * 32768)
+        regs[GX] = toRegister(10.0 * math.cos(t) / 2000.0 * 32768)
+        regs[GX + 1] = toRegister(-5.0 * math.sin(t) / 2000.0 * 32768)
+        regs[GX + 2] = toRegister(10.0 / 2000.0 * 32768)
+        regs[HX] = toRegister(300 * math.cos(math.radians(yaw)))
+        regs[HX + 1] = toRegister(300 * math.sin(math.radians(yaw)))
+        regs[HX + 2] = toRegister(-400)
+        regs[TEMP] = toRegister(self.temperature * 100)
+        half = math.radians(yaw) / 2
+        regs[Q0] = toRegister(math.cos(half) * 32767)
+        regs[Q0 + 3] = toRegister(math.sin(half) * 32767)
+
+    def readRegisters(self, regAddr, regCount):
+        """
+        读取寄存器
+        :param regAddr: 起始寄存器
+        :param regCount: 寄存器个数
+        :return: 寄存器值列表，超出范围的为0
+        """
+        return [self.registers[r] if 0 <= r < REGSIZE else 0 for r in range(regAddr, regAddr + regCount)]
+
+    def writeRegister(self, regAddr, sValue):
+        """
+        写入寄存器
+        :param regAddr: 寄存器地址
+        :param sValue: 写入值
+        :return: 无返回
+        """
+        self.writeCount += 1
+        if regAddr in (SAVE, KEY) or not 0 <= regAddr < REGSIZE:   # 保存、解锁只是指令 Save and unlock are commands only
+            return
+        self.registers[regAddr] = sValue & 0xffff
+        if regAddr == IICADDR:
+            self.ADDR = sValue & 0xff
+
+    def handleModbus(self, frame):
+        """
+        应答Modbus RTU指令
+        :param frame: 完整指令帧
+        :return: 应答数据，不是发给本设备的返回None
+        """
+        if len(frame) < 8 or frame[0] != self.ADDR or not check_crc(frame):
+            return None
+        func = frame[1]
+        regAddr = frame[2] << 8 | frame[3]
+        if func == 0x03:                                            # 读取保持寄存器 Read holding registers
+            regCount = frame[4] << 8 | frame[5]
+            self.update()
+            body = [self.ADDR, 0x03, regCount * 2]
+            for value in self.readRegisters(regAddr, regCount):
+                body.append(value >> 8)
+                body.append(value & 0xff)
+            return append_crc(body)
+        if func == 0x06:                                            # 写单个寄存器 Write single register
+            self.writeRegister(regAddr, frame[4] << 8 | frame[5])
+            return bytes(frame[:8])
+        if func == 0x10 and len(frame) >= 9:                        # 写多个寄存器 Write multiple registers
+            regCount = frame[4] << 8 | frame[5]
+            for i in range(regCount):
+                self.writeRegister(regAddr + i, frame[7 + i * 2] << 8 | frame[8 + i * 2])
+            return append_crc(frame[:6])
+        return None
+
+    def witPacket(self, kind, values):
+        """
+        生成维特协议数据包
+        :param kind: 包类型 0x50~0x5f
+        :param values: 4个16位值
+        :return: 11字节数据包
+        """
+        packet = [0x55, kind]
+        for value in values:
+            packet.append(value & 0xff)
+            packet.append((value >> 8) & 0xff)
+        packet.append(sum(packet) & 0xff)
+        return bytes(packet)
+
+    def witFrames(self):
+        """
+        生成一组主动回传的维特协议数据包：时间、加速度、角速度、角度、磁场
+        :return: 数据包字节串
+        """
+        self.update()
+        regs = self.registers
+        return b"".join((
+            self.witPacket(0x50, regs[YYMM:YYMM + 4]),
+            self.witPacket(0x51, regs[AX:AX + 3] + [regs[TEMP]]),
+            self.witPacket(0x52, regs[GX:GX + 3] + [0]),
+            self.witPacket(0x53, regs[ROLL:ROLL + 3] + [regs[VERSION]]),
+            self.witPacket(0x54, regs[HX:HX + 3] + [regs[TEMP]]),
+        ))
+
+    def handleWit(self, cmd):
+        """
+        应答维特协议指令 0xff 0xaa reg low high
+        :param cmd: 5字节指令
+        :return: 应答数据，没有应答返回None
+        """
+        if len(cmd) < 5 or cmd[0] != 0xff or cmd[1] != 0xaa:
+            return None
+        regAddr = cmd[2]
+        sValue = cmd[3] | (cmd[4] << 8)
+        if regAddr == READADDR:                                     # 读取寄存器 Read register
+            self.update()
+            return self.witPacket(0x5f, self.readRegisters(sValue, 4))
+        self.writeRegister(regAddr, sValue)
+        return None
@@ -0,0 +1,144 @@
+# coding:UTF-8
+import threading
+import time
+
+"""
+    模拟串口 Simulated serial port
+    实现设备模型用到的pyserial接口（read、inWaiting、write、close），背后是一条挂着模拟传感器的总线
+    Implements the pyserial subset used by the device models, backed by a bus of simulated sensors
+"""
+
+
+class SimulatedSerial:
+    __slots__ = ('sensors', 'protocol', 'rate', 'burst', 'responseDelay', 'timeout', 'port', 'baudrate',
+                 'is_open', 'buffer', 'pending', 'lastStreamTime', 'lock', 'bytesWritten', 'bytesRead')
+
+    def __init__(self, sensors, protocol="modbus", rate=0.0, burst=1, responseDelay=0.0, timeout=0.5,
+                 port="SIM", baudrate=9600):
+        """
+        初始化
+        :param sensors: 总线上的模拟传感器列表
+        :param protocol: "modbus" 应答Modbus RTU指令，"wit" 维特协议（主动回传并应答0xff 0xaa指令）
+        :param rate: 维特协议主动回传速率（Hz），0为不主动回传，None为尽可能快
+        :param burst: rate为None时每次查询生成的数据组数
+        :param responseDelay: 应答延时（秒）
+        :param timeout: read的超时时间（秒）
+        :param port: 端口名
+        :param baudrate: 波特率
+        """
+        self.sensors = list(sensors)        # 总线上的传感器 Sensors on the bus
+        self.protocol = protocol            # 协议 Protocol
+        self.rate = rate                    # 主动回传速率 Active output rate
+        self.burst = burst                  # 每次生成的组数 Groups per poll
+        self.responseDelay = responseDelay  # 应答延时 Response delay
+        self.timeout = timeout              # 读取超时 Read timeout
+        self.port = port                    # 端口名 Port name
+        self.baudrate = baudrate            # 波特率 Baud rate
+        self.is_open = True                 # 是否打开 Whether open
+        self.buffer = bytearray()           # 接收缓冲 Receive buffer
+        self.pending = []                   # 未到时间的应答 (时间, 数据) Pending responses (time, data)
+        self.lastStreamTime = time.monotonic()
+        self.lock = threading.Lock()
+        self.bytesWritten = 0               # 写入字节数 Bytes written
+        self.bytesRead = 0                  # 读取字节数 Bytes read
+
+    def pump(self):
+        """
+        把到时间的应答和主动回传数据放入接收缓冲，需持有锁
+        :return: 无返回
+        """
+        now = time.monotonic()
+        if self.pending:
+            ready = [data for (t, data) in self.pending if t <= now]
+            if ready:
+                self.pending = [(t, data) for (t, data) in self.pending if t > now]
+                for data in ready:
+                    self.buffer += data
+        if self.protocol != "wit":
+            return
+        if self.rate is None:                                       # 尽可能快 As fast as possible
+            for _ in range(self.burst):
+                for sensor in self.sensors:
+                    self.buffer += sensor.witFrames()
+            self.lastStreamTime = now
+        elif self.rate > 0:
+            count = int((now - self.lastStreamTime) * self.rate)
+            if count > 0:
+                for _ in range(min(count, 100)):
+                    for sensor in self.sensors:
+                        self.buffer += sensor.witFrames()
+                self.lastStreamTime += count / self.rate
+
+    def inWaiting(self):
+        """
+        接收缓冲中的字节数
+        :return:
+        """
+        with self.lock:
+            if not self.is_open:
+                raise IOError("port closed")
+            self.pump()
+            return len(self.buffer)
+
+    @property
+    def in_waiting(self):
+        return self.inWaiting()
+
+    def read(self, size=1):
+        """
+        读取数据，最多等待timeout秒
+        :param size: 读取字节数
+        :return: 读到的数据
+        """
+        deadline = time.monotonic() + (self.timeout or 0)
+        while True:
+            with self.lock:
+                if not self.is_open:
+                    raise IOError("port closed")
+                self.pump()
+                if len(self.buffer) >= size or time.monotonic() >= deadline:
+                    data = bytes(self.buffer[:size])
+                    del self.buffer[:size]
+                    self.bytesRead += len(data)
+                    return data
+            time.sleep(0.001)
+
+    def write(self, data):
+        """
+        写入指令，总线上的传感器按协议应答
+        :param data: 指令数据
+        :return: 写入字节数
+        """
+        data = bytes(data)
+        with self.lock:
+            if not self.is_open:
+                raise IOError("port closed")
+            self.bytesWritten += len(data)
+            readyTime = time.monotonic() + self.responseDelay
+            for sensor in self.sensors:
+                if self.protocol == "wit":
+                    response = sensor.handleWit(data)
+                else:
+                    response = sensor.handleModbus(data)
+                if response is not None:
+                    self.pending.append((readyTime, response))
+            self.pump()
+        return len(data)
+
+    def flushInput(self):
+        with self.lock:
+            self.buffer = bytearray()
+
+    def reset_input_buffer(self):
+        self.flushInput()
+
+    def isOpen(self):
+        return self.is_open
+
+    def close(self):
+        with self.lock:
+            self.is_open = False
+
+    def open(self):
+        with self.lock:
+            self.is_open = True
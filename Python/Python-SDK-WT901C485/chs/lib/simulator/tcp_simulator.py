@@ -0,0 +1,157 @@
+# coding:UTF-8
+import select
+import socket
+import threading
+import time
+from lib.simulator.pty_simulator import modbusFrameLength
+from lib.utils.crc_utils import check_crc
+
+"""
+    模拟串口服务器 Simulated serial-to-Ethernet converter
+    在TCP端口上挂模拟传感器，RTU帧原样收发（透传模式），可模拟串口传输时间和断线，用于测试RTU over TCP传输。
+    模拟传输时间时，设备应答期间到达的指令与应答冲突而丢失（半双工总线）；也可以模拟自己排队依次应答的串口服务器
+    Simulated sensors behind a TCP port with RTU frames passed through unchanged (transparent mode); bus time and
+    dropped connections can be simulated to test the RTU-over-TCP transport. With bus time simulated, a request
+    arriving while a device is answering collides and is lost (half-duplex bus), unless the simulated converter
+    queues requests and answers them in turn
+"""
+
+
+class TcpSimulator:
+    __slots__ = ('sensors', 'host', 'port', 'byteTime', 'queueing', 'server', 'thread', 'running', 'clients', 'lock',
+                 'requestCount', 'connectionCount', 'collisionCount')
+
+    def __init__(self, sensors, host="127.0.0.1", port=0, baud=0, queueing=False):
+        """
+        初始化
+        :param sensors: 总线上的模拟传感器列表
+        :param host: 监听地址
+        :param port: 监听端口，0为自动分配
+        :param baud: 模拟的串口波特率，0为不模拟传输时间
+        :param queueing: True 模拟自己排队的串口服务器，False 应答期间到达的指令冲突丢失
+        """
+        self.sensors = list(sensors)        # 总线上的传感器 Sensors on the bus
+        self.host = host
+        self.port = port
+        self.byteTime = 10.0 / baud if baud else 0.0    # 每字节传输时间 Time per byte on the bus
+        self.queueing = queueing                # 串口服务器是否排队 Whether the converter queues requests
+        self.server = None
+        self.thread = None
+        self.running = False
+        self.clients = []                   # 客户端连接 Client connections
+        self.lock = threading.Lock()
+        self.requestCount = 0               # 收到的指令数 Requests received
+        self.connectionCount = 0            # 连接次数 Connections accepted
+        self.collisionCount = 0             # 应答期间到达而丢失的指令 Requests lost to a reply on the bus
+
+    def start(self):
+        self.server = socket.create_server((self.host, self.port))
+        self.port = self.server.getsockname()[1]
+        self.server.settimeout(0.1)         # 定时检查是否停止 Check for stop periodically
+        self.running = True
+        self.thread = threading.Thread(target=self.acceptLoop, name="TcpSimulator", daemon=True)
+        self.thread.start()
+
+    def acceptLoop(self):
+        while self.running:
+            try:
+                client, _ = self.server.accept()
+            except socket.timeout:
+                continue
+            except OSError:
+                break
+            client.settimeout(None)
+            client.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            with self.lock:
+                self.clients.append(client)
+                self.connectionCount += 1
+            threading.Thread(target=self.serveLoop, args=(client,), name="TcpSimulator-Client", daemon=True).start()
+
+    def serveLoop(self, client):
+        """
+        读取指令并依次应答
+        :param client: 客户端连接
+        :return:
+        """
+        buffer = bytearray()
+        while self.running:
+            try:
+                data = client.recv(4096)
+            except OSError:
+                break
+            if not data:
+                break
+            buffer += data
+            while True:
+                length = modbusFrameLength(buffer)
+                if length is None or len(buffer) < length:
+                    break
+                frame = bytes(buffer[:length])
+                if length == 1 or not check_crc(frame):
+                    del buffer[:1]
+                    continue
+                del buffer[:length]
+                self.requestCount += 1
+                for sensor in self.sensors:
+                    response = sensor.handleModbus(frame)
+                    if response is not None:
+                        if self.byteTime:
+                            time.sleep((len(frame) + len(response)) * self.byteTime)
+                            if not self.queueing and self.collide(client, buffer):
+                                break
+                        try:
+                            client.sendall(response)
+                        except OSError:
+                            break
+        self.dropClient(client)
+
+    def collide(self, client, buffer):
+        """
+        丢弃设备应答完成前到达的指令（透传模式下它们与应答在总线上冲突）
+        :param client: 客户端连接
+        :param buffer: 接收缓冲
+        :return: 连接是否已断开
+        """
+        closed = False
+        try:
+            while select.select([client], [], [], 0)[0]:
+                data = client.recv(4096)
+                if not data:
+                    closed = True
+                    break
+                buffer += data
+        except OSError:
+            closed = True
+        if buffer:
+            self.collisionCount += 1
+            del buffer[:]
+        return closed
+
+    def dropClient(self, client):
+        with self.lock:
+            if client in self.clients:
+                self.clients.remove(client)
+        try:
+            client.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        client.close()
+
+    def dropConnections(self):
+        """
+        断开所有客户端连接（模拟网络中断）
+        :return: 无返回
+        """
+        with self.lock:
+            clients = list(self.clients)
+        for client in clients:
+            self.dropClient(client)
+
+    def stop(self):
+        self.running = False
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        if self.server is not None:
+            self.server.close()
+        self.dropConnections()
@@ -0,0 +1,128 @@
+# coding:UTF-8
+import random
+import threading
+import time
+
+"""
+    连接监控 Connection supervisor
+    记录端口的断开和恢复，给出带随机抖动的指数退避重连间隔，并统计断线时长。
+    串口拔出后由读取线程（或端口工作线程）自己重连，不新建线程，也不会所有端口同时重连
+    Tracks a port going down and coming back, hands out exponential reconnect delays with random jitter and keeps
+    downtime metrics. After a USB unplug the existing reader (or port worker) thread reconnects by itself: no new
+    thread, and ports do not all retry in lockstep
+"""
+
+
+class ConnectionSupervisor:
+    __slots__ = ('name', 'backoffMin', 'backoffMax', 'wanted', 'wakeup', 'connected', 'attempt', 'downSince',
+                 'lastError', 'downCount', 'reconnectCount', 'attemptCount', 'totalDowntime', 'lastDowntime',
+                 'maxDowntime')
+
+    def __init__(self, name="", backoffMin=0.1, backoffMax=5.0):
+        """
+        初始化
+        :param name: 端口名
+        :param backoffMin: 重连等待的初始值（秒）
+        :param backoffMax: 重连等待的最大值（秒）
+        """
+        self.name = name
+        self.backoffMin = backoffMin
+        self.backoffMax = backoffMax
+        self.wanted = False                 # 是否应该保持连接（用户没有关闭） Should stay connected (not closed by user)
+        self.wakeup = threading.Event()     # 关闭时打断重连等待 Interrupts the reconnect wait on close
+        self.connected = False
+        self.attempt = 0                    # 本次断线后的重连尝试次数 Attempts since going down
+        self.downSince = None               # 断开时间 Time the port went down
+        self.lastError = None               # 最近的错误 Last error
+        self.downCount = 0                  # 断开次数 Times the port went down
+        self.reconnectCount = 0             # 重连成功次数 Successful reconnects
+        self.attemptCount = 0               # 重连尝试总次数 Reconnect attempts
+        self.totalDowntime = 0.0            # 断线总时长（秒） Total downtime (s)
+        self.lastDowntime = 0.0             # 最近一次断线时长（秒） Last downtime (s)
+        self.maxDowntime = 0.0              # 最长断线时长（秒） Longest downtime (s)
+
+    def acquire(self):
+        """
+        用户打开端口
+        :return: 无返回
+        """
+        self.wanted = True
+        self.wakeup.clear()
+
+    def release(self):
+        """
+        用户关闭端口，停止重连
+        :return: 无返回
+        """
+        self.wanted = False
+        self.connected = False
+        self.downSince = None
+        self.wakeup.set()
+
+    def markUp(self):
+        """
+        端口已打开
+        :return: 无返回
+        """
+        if self.downSince is not None:
+            downtime = time.monotonic() - self.downSince
+            self.totalDowntime += downtime
+            self.lastDowntime = downtime
+            self.maxDowntime = max(self.maxDowntime, downtime)
+            self.reconnectCount += 1
+            self.downSince = None
+        self.connected = True
+        self.attempt = 0
+
+    def markDown(self, error=None):
+        """
+        端口已断开（拔出、读写出错）
+        :param error: 错误
+        :return: 无返回
+        """
+        if self.connected:
+            self.downCount += 1
+            self.downSince = time.monotonic()
+        elif self.downSince is None:
+            self.downSince = time.monotonic()
+        self.connected = False
+        self.lastError = None if error is None else str(error)
+
+    def nextDelay(self):
+        """
+        下一次重连前的等待时间：指数增长，取上限后在后一半范围内随机
+        :return: 秒
+        """
+        delay = min(self.backoffMax, self.backoffMin * (2 ** min(self.attempt, 30)))
+        self.attempt += 1
+        return delay * random.uniform(0.5, 1.0)
+
+    def waitRetry(self):
+        """
+        等待到下一次重连，期间用户关闭时提前返回
+        :return: 是否应该继续重连
+        """
+        if not self.wanted:
+            return False
+        self.wakeup.wait(self.nextDelay())
+        if self.wanted:
+            self.attemptCount += 1
+        return self.wanted
+
+    def getDowntime(self):
+        """
+        断线总时长，包括正在进行的断线
+        :return: 秒
+        """
+        if self.downSince is None:
+            return self.totalDowntime
+        return self.totalDowntime + time.monotonic() - self.downSince
+
+    def getStatus(self):
+        """
+        获取状态
+        :return: 是否连接、断开次数、重连次数、尝试次数、断线总时长、最近和最长断线时长、最近的错误
+        """
+        return {"connected": self.connected, "downCount": self.downCount, "reconnects": self.reconnectCount,
+                "attempts": self.attemptCount, "downtime": self.getDowntime(), "lastDowntime": self.lastDowntime,
+                "maxDowntime": self.maxDowntime, "lastError": self.lastError}
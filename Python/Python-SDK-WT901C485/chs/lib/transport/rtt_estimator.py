@@ -0,0 +1,110 @@
+# coding:UTF-8
+import threading
+
+"""
+    应答时间估计 Round-trip time estimator
+    按TCP的方法（RFC 6298）估计每个设备的应答时间：平滑均值加4倍平均偏差作为超时，超时后加倍，收到应答后恢复。
+    估计的是扣除串口传输时间之后的额外延时，所以同一个估计对不同长度的指令都适用；超时不会短于按波特率和帧长
+    算出的传输时间，也不会长于原来的固定超时
+    Estimates each device's response time the TCP way (RFC 6298): smoothed mean plus four mean deviations gives the
+    timeout, which doubles after a timeout and recovers on the next reply. The estimate covers the latency beyond the
+    serial transmission time, so one estimator serves frames of any length; the timeout never drops below the wire
+    time computed from the baud rate and frame lengths, nor exceeds the old fixed timeout
+"""
+
+BITS_PER_BYTE = 10      # 起始位+8数据位+停止位 Start + 8 data + stop bits
+FRAME_GAPS = 7.0        # 请求和应答各3.5个字符的帧间隔 3.5 character gaps after request and response
+MIN_SLACK = 0.003       # 传输时间之外至少留出的余量（秒） Minimum slack beyond the wire time (s)
+MAX_BACKOFF = 8         # 连续超时后超时时间最多放大的倍数 Maximum timeout multiplier after timeouts
+
+
+def wireTime(baud, requestBytes, responseBytes):
+    """
+    指令和应答在串口上的传输时间
+    :param baud: 波特率
+    :param requestBytes: 指令字节数
+    :param responseBytes: 应答字节数
+    :return: 秒
+    """
+    return (requestBytes + responseBytes + FRAME_GAPS) * BITS_PER_BYTE / float(baud)
+
+
+class RttEstimator:
+    __slots__ = ('alpha', 'beta', 'k', 'srtt', 'rttvar', 'backoff', 'sampleCount', 'timeoutCount', 'minRtt',
+                 'maxRtt', 'lastRtt', 'lock')
+
+    def __init__(self, alpha=0.125, beta=0.25, k=4.0):
+        """
+        初始化
+        :param alpha: 均值的平滑系数
+        :param beta: 偏差的平滑系数
+        :param k: 超时 = 均值 + k * 偏差
+        """
+        self.alpha = alpha
+        self.beta = beta
+        self.k = k
+        self.srtt = None                    # 平滑的额外延时（秒） Smoothed latency beyond the wire time (s)
+        self.rttvar = 0.0                   # 平均偏差（秒） Mean deviation (s)
+        self.backoff = 1                    # 超时后的放大倍数 Multiplier after timeouts
+        self.sampleCount = 0                # 样本数 Samples
+        self.timeoutCount = 0               # 超时次数 Timeouts
+        self.minRtt = None                  # 最短应答时间（秒） Shortest round trip (s)
+        self.maxRtt = None                  # 最长应答时间（秒） Longest round trip (s)
+        self.lastRtt = None                 # 最近一次应答时间（秒） Last round trip (s)
+        self.lock = threading.Lock()
+
+    def update(self, rtt, baud, requestBytes, responseBytes):
+        """
+        加入一个应答时间样本
+        :param rtt: 从发送指令到收完应答的时间（秒）
+        :param baud: 波特率
+        :param requestBytes: 指令字节数
+        :param responseBytes: 应答字节数
+        :return: 无返回
+        """
+        latency = max(0.0, rtt - wireTime(baud, requestBytes, responseBytes))
+        with self.lock:
+            if self.srtt is None:
+                self.srtt = latency
+                self.rttvar = latency / 2
+            else:
+                self.rttvar += self.beta * (abs(self.srtt - latency) - self.rttvar)
+                self.srtt += self.alpha * (latency - self.srtt)
+            self.backoff = 1
+            self.sampleCount += 1
+            self.lastRtt = rtt
+            self.minRtt = rtt if self.minRtt is None else min(self.minRtt, rtt)
+            self.maxRtt = rtt if self.maxRtt is None else max(self.maxRtt, rtt)
+
+    def onTimeout(self):
+        """
+        记录一次超时，下次超时时间加倍
+        :return: 无返回
+        """
+        with self.lock:
+            self.timeoutCount += 1
+            self.backoff = min(self.backoff * 2, MAX_BACKOFF)
+
+    def timeout(self, baud, requestBytes, responseBytes, ceiling):
+        """
+        计算本次的应答超时
+        :param baud: 波特率
+        :param requestBytes: 指令字节数
+        :param responseBytes: 应答字节数
+        :param ceiling: 超时上限（原来的固定超时），没有样本时直接使用
+        :return: 秒
+        """
+        floor = wireTime(baud, requestBytes, responseBytes) + MIN_SLACK
+        if self.srtt is None:
+            return max(ceiling, floor)
+        rto = floor + (self.srtt + self.k * self.rttvar) * self.backoff
+        return max(floor, min(rto, ceiling))
+
+    def getStatus(self):
+        """
+        获取统计
+        :return: 平滑延时、偏差、最短/最长/最近应答时间（秒）、样本数、超时次数、当前放大倍数
+        """
+        return {"srtt": self.srtt, "rttvar": self.rttvar, "minRtt": self.minRtt, "maxRtt": self.maxRtt,
+                "lastRtt": self.lastRtt, "samples": self.sampleCount, "timeouts": self.timeoutCount,
+                "backoff": self.backoff}
@@ -0,0 +1,444 @@
+# coding:UTF-8
+import collections
+import concurrent.futures
+import select
+import socket
+import threading
+import time
+from lib.transport.connection_supervisor import ConnectionSupervisor
+from lib.utils.crc_utils import check_crc
+
+"""
+    RTU over TCP传输 RTU-over-TCP transport
+    串口服务器（串口转以太网）透传模式下，Modbus RTU帧原样通过TCP收发，不需要虚拟串口驱动。
+    同一个地址的连接在连接池中共用并保持常连；关闭Nagle算法；断线后按指数退避重连；submit的请求排队发送，
+    应答按发送顺序匹配。默认等上一个应答再发下一条：透传模式下指令直接到半双工的RS-485总线，设备还在应答时发出的
+    指令会冲突。只有自己排队的串口服务器才能打开流水线（端口名加?depth=N）
+    With a serial-to-Ethernet converter in transparent mode the Modbus RTU frames travel over TCP unchanged, with
+    no virtual COM driver. Connections to one endpoint are shared from a pool and kept open; Nagle is disabled,
+    reconnects back off exponentially, and requests passed to submit are queued and matched to replies in send
+    order. By default a request waits for the previous reply: in transparent mode it goes straight onto the
+    half-duplex RS-485 bus and would collide with a device still answering. Pipelining is opt-in (?depth=N on the
+    port name) for converters that queue requests themselves
+"""
+
+MAX_BUFFER = 1 << 20    # 每个句柄的接收缓冲上限 Receive buffer limit per handle
+
+
+class PendingRequest:
+    __slots__ = ('frame', 'length', 'timeout', 'deadline', 'future')
+
+    def __init__(self, frame, length, timeout):
+        self.frame = frame                  # 含CRC的指令 Request with CRC
+        self.length = length                # 正常应答长度 Normal response length
+        self.timeout = timeout              # 应答超时 Response timeout
+        self.deadline = time.monotonic() + timeout * 4  # 排队期限，发送后改为应答期限 Queue deadline, then response
+        self.future = concurrent.futures.Future()
+
+
+class TcpConnection:
+    __slots__ = ('host', 'port', 'pipelineDepth', 'responseTimeout', 'connectTimeout', 'sendTimeout', 'supervisor',
+                 'sock',
+                 'lock', 'stopped', 'thread', 'waiting', 'outstanding', 'buffer', 'listeners',
+                 'connectCount', 'requestCount', 'timeoutCount', 'bytesSent', 'bytesReceived')
+
+    def __init__(self, host, port, pipelineDepth=1, responseTimeout=0.5, connectTimeout=3.0, backoffMin=0.1,
+                 backoffMax=5.0, sendTimeout=1.0):
+        """
+        初始化
+        :param host: 串口服务器地址
+        :param port: 串口服务器端口
+        :param pipelineDepth: 同时在途的请求数，1为等上一个应答再发；只有自己排队的串口服务器才能大于1
+        :param responseTimeout: 默认应答超时（秒）
+        :param connectTimeout: 连接超时（秒）
+        :param backoffMin: 重连等待的初始值（秒）
+        :param backoffMax: 重连等待的最大值（秒）
+        :param sendTimeout: 发送超时（秒），对方不再接收时断开连接，不会一直占着锁
+        """
+        self.host = host
+        self.port = port
+        self.pipelineDepth = max(1, pipelineDepth)
+        self.responseTimeout = responseTimeout
+        self.connectTimeout = connectTimeout
+        self.sendTimeout = sendTimeout
+        self.supervisor = ConnectionSupervisor("%s:%d" % (host, port), backoffMin, backoffMax)  # 退避重连 Backoff
+        self.supervisor.acquire()
+        self.sock = None
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = None
+        self.waiting = collections.deque()      # 未发送的请求 Requests not yet sent
+        self.outstanding = collections.deque()  # 已发送等应答的请求 Requests sent, awaiting replies
+        self.buffer = bytearray()               # 应答缓冲 Response buffer
+        self.listeners = []                     # 接收原始字节的句柄 Handles receiving the raw bytes
+        self.connectCount = 0                   # 建立连接的次数 Connections made
+        self.requestCount = 0                   # 流水线请求数 Pipelined requests
+        self.timeoutCount = 0                   # 超时次数 Timeouts
+        self.bytesSent = 0
+        self.bytesReceived = 0
+
+    def isConnected(self):
+        return self.sock is not None
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.ioLoop, name="Tcp-%s:%d" % (self.host, self.port),
+                                           daemon=True)
+            self.thread.start()
+
+    def connect(self):
+        """
+        建立连接并关闭Nagle算法
+        :return: 套接字
+        """
+        sock = socket.create_connection((self.host, self.port), timeout=self.connectTimeout)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        # 只影响发送：接收前已用select确认有数据 Only bounds sends: recv runs after select reports data
+        sock.settimeout(self.sendTimeout)
+        return sock
+
+    def ioLoop(self):
+        """
+        连接线程：连接（失败时退避重连）、接收数据、检查超时
+        :return:
+        """
+        while not self.stopped.is_set():
+            sock = self.sock
+            if sock is None:
+                try:
+                    sock = self.connect()
+                except OSError as ex:
+                    self.supervisor.markDown(ex)
+                    self.supervisor.waitRetry()
+                    self.fail(self.expire())
+                    continue
+                self.supervisor.markUp()
+                with self.lock:
+                    self.sock = sock
+                    self.connectCount += 1
+                    failed = self.sendPending()
+                self.fail(failed)
+            try:
+                ready, _, _ = select.select([sock], [], [], 0.02)
+                data = sock.recv(1 << 16) if ready else None
+            except (OSError, ValueError):
+                data = b""
+            if data == b"":
+                self.disconnect(sock)
+                continue
+            if data:
+                self.feed(data)
+            self.fail(self.expire())
+        self.disconnect(self.sock)
+
+    def disconnect(self, sock):
+        """
+        断开连接，已发送未应答的请求失败（可能已执行，不能重发）
+        :param sock: 要断开的套接字
+        :return: 无返回
+        """
+        if sock is None:
+            return
+        with self.lock:
+            if self.sock is sock:
+                self.sock = None
+            failed = [(request, ConnectionError("连接已断开 connection lost")) for request in self.outstanding]
+            self.outstanding.clear()
+            self.buffer.clear()
+        try:
+            sock.close()
+        except OSError:
+            pass
+        if not self.stopped.is_set():
+            self.supervisor.markDown("连接已断开 connection lost")
+        self.fail(failed)
+
+    def fail(self, failed):
+        for request, error in failed:
+            request.future.set_exception(error)
+
+    def abort(self, sock):
+        """
+        发送失败或超时后关闭连接的收发（可能只发出了半帧），由连接线程断开并重连，需持有锁
+        :param sock: 套接字
+        :return: 无返回
+        """
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+    def sendPending(self):
+        """
+        在流水线深度内发送排队的请求，需持有锁
+        :return: 发送失败的请求 [(请求, 异常)]
+        """
+        failed = []
+        while self.waiting and len(self.outstanding) < self.pipelineDepth and self.sock is not None:
+            request = self.waiting.popleft()
+            try:
+                self.sock.sendall(request.frame)
+            except OSError as ex:
+                failed.append((request, ex))
+                self.abort(self.sock)
+                break
+            self.bytesSent += len(request.frame)
+            request.deadline = time.monotonic() + request.timeout
+            self.outstanding.append(request)
+        return failed
+
+    def submit(self, frame, responseLength, timeout=None):
+        """
+        提交一个请求，排队发送，在途请求数不超过流水线深度
+        :param frame: 含CRC的RTU指令
+        :param responseLength: 正常应答的长度（含CRC）
+        :param timeout: 应答超时（秒），None使用连接的默认值
+        :return: Future，结果为含CRC的应答帧；超时为TimeoutError，断线为ConnectionError
+        """
+        request = PendingRequest(bytes(frame), responseLength, self.responseTimeout if timeout is None else timeout)
+        with self.lock:
+            self.requestCount += 1
+            self.waiting.append(request)
+            failed = self.sendPending()
+        self.fail(failed)
+        return request.future
+
+    def sendRaw(self, data):
+        """
+        直接发送原始字节（串口方式使用）
+        :param data: 数据
+        :return: 发送的字节数，未连接时为0（相当于总线上丢帧）
+        """
+        with self.lock:
+            sock = self.sock
+            if sock is None:
+                return 0
+            try:
+                sock.sendall(data)
+            except OSError:
+                self.abort(sock)
+                return 0
+            self.bytesSent += len(data)
+        return len(data)
+
+    def feed(self, data):
+        """
+        收到数据：交给所有句柄，并按发送顺序匹配流水线请求的应答
+        :param data: 收到的数据
+        :return: 无返回
+        """
+        self.bytesReceived += len(data)
+        for listener in list(self.listeners):
+            listener.receiveData(data)
+        done = []
+        with self.lock:
+            if not self.outstanding:
+                return
+            buffer = self.buffer
+            buffer += data
+            while self.outstanding and len(buffer) >= 3:
+                request = self.outstanding[0]
+                if buffer[0] != request.frame[0] or (buffer[1] & 0x7f) != request.frame[1]:
+                    del buffer[:1]              # 不属于当前请求，重新同步 Not ours: resynchronise
+                    continue
+                length = 5 if buffer[1] & 0x80 else request.length
+                if len(buffer) < length:
+                    break
+                frame = bytes(buffer[:length])
+                if not check_crc(frame):
+                    del buffer[:1]
+                    continue
+                del buffer[:length]
+                self.outstanding.popleft()
+                done.append((request, frame))
+            if not self.outstanding:
+                buffer.clear()
+            failed = self.sendPending()
+        for request, frame in done:
+            request.future.set_result(frame)
+        self.fail(failed)
+
+    def expire(self):
+        """
+        找出超时的请求。应答超时后缓冲中的残余数据无法再对应，一并清除
+        :return: 超时的请求 [(请求, 异常)]
+        """
+        now = time.monotonic()
+        expired = []
+        with self.lock:
+            while self.outstanding and self.outstanding[0].deadline < now:
+                expired.append((self.outstanding.popleft(), TimeoutError("应答超时 response timeout")))
+                self.buffer.clear()
+            if self.waiting and self.waiting[0].deadline < now:
+                waiting = collections.deque()
+                for request in self.waiting:
+                    if request.deadline < now:
+                        expired.append((request, TimeoutError("未能发送 not sent in time")))
+                    else:
+                        waiting.append(request)
+                self.waiting = waiting
+            self.timeoutCount += len(expired)
+            failed = self.sendPending()
+        return expired + failed
+
+    def stop(self):
+        self.stopped.set()
+        self.supervisor.release()
+        if self.thread is not None and self.thread is not threading.current_thread():
+            self.thread.join()
+        self.thread = None
+        with self.lock:
+            failed = [(request, ConnectionError("连接已关闭 connection closed")) for request in self.waiting]
+            self.waiting.clear()
+        self.fail(failed)
+
+
+class TcpConnectionPool:
+    __slots__ = ('connections', 'lock', 'options')
+
+    def __init__(self, **options):
+        """
+        初始化
+        :param options: 新建连接的参数，见TcpConnection
+        """
+        self.connections = {}               # (地址, 端口) -> 连接 (host, port) -> connection
+        self.lock = threading.Lock()
+        self.options = options
+
+    def acquire(self, host, port, pipelineDepth=None):
+        """
+        获取到指定地址的常连连接，没有时新建
+        :param host: 地址
+        :param port: 端口
+        :param pipelineDepth: 同时在途的请求数，None为连接池的设置
+        :return: 连接
+        """
+        with self.lock:
+            connection = self.connections.get((host, port))
+            if connection is None:
+                options = dict(self.options)
+                if pipelineDepth is not None:
+                    options["pipelineDepth"] = pipelineDepth
+                connection = TcpConnection(host, port, **options)
+                connection.start()
+                self.connections[(host, port)] = connection
+            elif pipelineDepth is not None:
+                connection.pipelineDepth = max(1, pipelineDepth)
+            return connection
+
+    def closeAll(self):
+        with self.lock:
+            connections = list(self.connections.values())
+            self.connections.clear()
+        for connection in connections:
+            connection.stop()
+
+    def getStatus(self):
+        """
+        获取状态
+        :return: {地址:端口: (是否连接, 连接次数, 请求数, 超时次数)}
+        """
+        with self.lock:
+            connections = list(self.connections.values())
+        return {"%s:%d" % (c.host, c.port): (c.isConnected(), c.connectCount, c.requestCount, c.timeoutCount)
+                for c in connections}
+
+
+defaultPool = TcpConnectionPool()
+
+
+class TcpTransport:
+    __slots__ = ('connection', 'port', 'baudrate', 'timeout', 'is_open', 'buffer', 'condition', 'listening')
+
+    def __init__(self, host, port, baudrate=9600, timeout=0.5, pool=None, pipelineDepth=None):
+        """
+        初始化，实现设备模型用到的pyserial接口
+        :param host: 串口服务器地址
+        :param port: 串口服务器端口
+        :param baudrate: 波特率（由串口服务器设置，这里只做记录）
+        :param timeout: read的超时时间（秒）
+        :param pool: 连接池，None使用默认连接池
+        :param pipelineDepth: 同时在途的请求数，None为连接池的设置（默认1）
+        """
+        self.connection = (defaultPool if pool is None else pool).acquire(host, port, pipelineDepth)
+        self.port = "tcp://%s:%d" % (host, port)
+        self.baudrate = baudrate
+        self.timeout = timeout
+        self.is_open = True
+        self.buffer = bytearray()           # 接收缓冲 Receive buffer
+        self.condition = threading.Condition()
+        self.listening = False              # 第一次读取时才开始接收原始字节 Raw bytes only once read is used
+
+    def listen(self):
+        if not self.listening:
+            self.listening = True
+            self.connection.listeners.append(self)
+
+    def receiveData(self, data):
+        with self.condition:
+            self.buffer += data
+            if len(self.buffer) > MAX_BUFFER:
+                del self.buffer[:len(self.buffer) - MAX_BUFFER]
+            self.condition.notify_all()
+
+    def inWaiting(self):
+        if not self.is_open:
+            raise IOError("port closed")
+        self.listen()
+        return len(self.buffer)
+
+    @property
+    def in_waiting(self):
+        return self.inWaiting()
+
+    def read(self, size=1):
+        """
+        读取数据，最多等待timeout秒
+        :param size: 读取字节数
+        :return: 读到的数据
+        """
+        if not self.is_open:
+            raise IOError("port closed")
+        self.listen()
+        deadline = time.monotonic() + (self.timeout or 0)
+        with self.condition:
+            while len(self.buffer) < size:
+                rest = deadline - time.monotonic()
+                if rest <= 0:
+                    break
+                self.condition.wait(rest)
+            data = bytes(self.buffer[:size])
+            del self.buffer[:size]
+        return data
+
+    def write(self, data):
+        if not self.is_open:
+            raise IOError("port closed")
+        return self.connection.sendRaw(bytes(data))
+
+    def submit(self, frame, responseLength, timeout=None):
+        """
+        流水线提交一个请求，见TcpConnection.submit
+        """
+        return self.connection.submit(frame, responseLength, timeout)
+
+    def flushInput(self):
+        with self.condition:
+            self.buffer = bytearray()
+
+    def reset_input_buffer(self):
+        self.flushInput()
+
+    def isOpen(self):
+        return self.is_open
+
+    def close(self):
+        """
+        关闭句柄，连接保留在连接池中供下次使用
+        :return: 无返回
+        """
+        self.is_open = False
+        if self.listening:
+            self.listening = False
+            self.connection.listeners.remove(self)
@@ -0,0 +1,46 @@
+# coding:UTF-8
+import serial
+from lib.transport.tcp_transport import TcpTransport
+
+"""
+    传输层 Transport
+    按端口名打开传输：tcp://地址:端口 为RTU over TCP（串口服务器），其他为本机串口。
+    自己排队的串口服务器可以加?depth=N打开流水线
+    Opens a transport by port name: tcp://host:port is RTU over TCP (serial-to-Ethernet converter),
+    anything else is a local serial port. Append ?depth=N to pipeline requests to a converter that queues them
+"""
+
+TCP_PREFIX = "tcp://"
+
+
+def parseTcpPort(portName):
+    """
+    解析tcp://地址:端口[?depth=N]
+    :param portName: 端口名
+    :return: (地址, 端口, 流水线深度)，没有给出深度时为None；不是TCP端口名时返回None
+    """
+    if not portName.startswith(TCP_PREFIX):
+        return None
+    address, _, query = portName[len(TCP_PREFIX):].partition("?")
+    host, _, port = address.rpartition(":")
+    depth = None
+    for option in query.split("&") if query else ():
+        name, _, value = option.partition("=")
+        if name != "depth":
+            raise ValueError("未知的端口选项 unknown port option: " + option)
+        depth = int(value)
+    return host.strip("[]"), int(port), depth
+
+
+def openTransport(portName, baud=9600, timeout=0.5):
+    """
+    打开传输
+    :param portName: 端口名，如 COM3、/dev/ttyUSB0、tcp://192.168.1.200:4196、tcp://192.168.1.200:502?depth=4
+    :param baud: 波特率
+    :param timeout: read的超时时间（秒）
+    :return: 实现pyserial接口的对象
+    """
+    address = parseTcpPort(portName)
+    if address is not None:
+        return TcpTransport(address[0], address[1], baud, timeout, pipelineDepth=address[2])
+    return serial.Serial(portName, baud, timeout=timeout)
@@ -0,0 +1,61 @@
+# coding:UTF-8
+"""
+    Modbus CRC工具类 Modbus CRC utilities
+    与解析器中的查表法结果一致：返回值高8位先发送
+    Same result as the table method in the resolvers: the high byte of the result is sent first
+"""
+
+
+def _makeTable():
+    table = []
+    for i in range(256):
+        crc = i
+        for _ in range(8):
+            if crc & 1:
+                crc = (crc >> 1) ^ 0xA001
+            else:
+                crc >>= 1
+        table.append(crc)
+    return table
+
+
+_CRC_TABLE = _makeTable()
+
+
+def get_crc(datas, dlen=None):
+    """
+    获取CRC校验
+    :param datas: 数据
+    :param dlen: 校验数据长度，默认全部数据
+    :return: 高8位为先发送的字节
+    """
+    if dlen is None:
+        dlen = len(datas)
+    crc = 0xffff
+    table = _CRC_TABLE
+    for i in range(dlen):
+        crc = (crc >> 8) ^ table[(crc ^ datas[i]) & 0xff]
+    return ((crc & 0xff) << 8) | (crc >> 8)
+
+
+def append_crc(datas):
+    """
+    在数据后追加CRC校验
+    :param datas: 数据
+    :return: 带CRC的字节串
+    """
+    tempCrc = get_crc(datas)
+    return bytes(datas) + bytes([tempCrc >> 8, tempCrc & 0xff])
+
+
+def check_crc(datas):
+    """
+    校验带CRC的完整数据包
+    :param datas: 数据包（含最后两个CRC字节）
+    :return: 是否通过
+    """
+    dlen = len(datas)
+    if dlen < 3:
+        return False
+    tempCrc = get_crc(datas, dlen - 2)
+    return (tempCrc >> 8) == datas[dlen - 2] and (tempCrc & 0xff) == datas[dlen - 1]
@@ -0,0 +1,232 @@
+# coding:UTF-8
+import lzma
+import struct
+import zlib
+import numpy as np
+
+"""
+    int16通道压缩编解码 Int16 channel codec
+    传感器寄存器相邻采样变化很小。每块数据按通道做差分（模2^16，zig-zag编码）或与上一个值异或，
+    再按该通道该块的最大位宽做位打包，最后可选用标准库zlib或lzma再压缩。编码和解码都用NumPy向量化。
+    数据以独立的帧输出，可以写入文件、通过网络发送或在回放时逐帧解码
+    Consecutive register samples differ very little. Each block is delta encoded per channel (mod 2^16,
+    zig-zag) or XORed with the previous value, bit-packed at the channel's widest value in the block and
+    optionally compressed with stdlib zlib or lzma. Encode and decode are vectorised with NumPy. Output is a
+    sequence of self-contained frames that can be written to a file, sent over the network or decoded frame
+    by frame during replay
+"""
+
+MAGIC = b"WZ"
+FRAME = struct.Struct("<2sBBHII")   # 标识, 变换, 压缩, 通道数, 采样数, 数据长度 Magic, transform, compression, channels, samples, length
+TRANSFORMS = {"delta": 0, "xor": 1}
+COMPRESSIONS = {None: 0, "zlib": 1, "lzma": 2}
+
+
+def zigzag(values):
+    """int16 -> uint16，绝对值小的数编码后也小 Small magnitudes stay small"""
+    values = values.astype(np.int32)
+    return ((values << 1) ^ (values >> 15)).astype(np.uint16)
+
+
+def unzigzag(values):
+    values = values.astype(np.int32)
+    return ((values >> 1) ^ -(values & 1)).astype(np.int16)
+
+
+def packBits(values, width):
+    """
+    把uint16按固定位宽打包
+    :param values: uint16数组
+    :param width: 位宽 (0~16)
+    :return: 字节
+    """
+    if width == 0 or len(values) == 0:
+        return b""
+    bits = np.unpackbits(values.astype(">u2").view(np.uint8).reshape(-1, 2), axis=1)
+    return np.packbits(bits[:, 16 - width:]).tobytes()
+
+
+def unpackBits(data, count, width):
+    """
+    解包固定位宽的uint16
+    :param data: 字节
+    :param count: 数量
+    :param width: 位宽 (0~16)
+    :return: uint16数组
+    """
+    if width == 0 or count == 0:
+        return np.zeros(count, dtype=np.uint16)
+    # 每个值最多跨3个字节，取出3个字节拼成24位再移位 A value spans at most 3 bytes: gather 24 bits and shift
+    buffer = np.frombuffer(bytes(data) + b"\x00\x00", dtype=np.uint8).astype(np.uint32)
+    position = np.arange(count, dtype=np.uint32) * width
+    index = position >> 3
+    window = (buffer[index] << 16) | (buffer[index + 1] << 8) | buffer[index + 2]
+    return ((window >> (24 - width - (position & 7))) & ((1 << width) - 1)).astype(np.uint16)
+
+
+def encodeBlock(values, transform="delta", compression=None, level=None):
+    """
+    编码一块数据
+    :param values: int16数组，形状 (采样数, 通道数)
+    :param transform: "delta" 差分 或 "xor" 异或
+    :param compression: None、"zlib" 或 "lzma"
+    :param level: 压缩级别，None为默认
+    :return: 一帧数据
+    """
+    values = np.asarray(values, dtype=np.int16)
+    if values.ndim == 1:
+        values = values.reshape(-1, 1)
+    samples, channels = values.shape
+    words = values.view(np.uint16)
+    if transform == "delta":
+        codes = zigzag(np.diff(words, axis=0).view(np.int16))     # uint16相减自动模2^16 uint16 wraps mod 2^16
+    else:
+        codes = words[1:] ^ words[:-1]
+    widths = bytes(int(codes[:, i].max()).bit_length() if samples > 1 else 0 for i in range(channels))
+    payload = bytearray(widths)
+    payload += values[:1].astype("<i2").tobytes() if samples > 0 else b""
+    for i in range(channels):
+        payload += packBits(codes[:, i], widths[i])
+    if compression == "zlib":
+        payload = zlib.compress(payload, 6 if level is None else level)
+    elif compression == "lzma":
+        payload = lzma.compress(payload, preset=6 if level is None else level)
+    return FRAME.pack(MAGIC, TRANSFORMS[transform], COMPRESSIONS[compression], channels, samples,
+                      len(payload)) + bytes(payload)
+
+
+def decodeBlock(data, offset=0):
+    """
+    解码一帧数据
+    :param data: 字节
+    :param offset: 帧开始的偏移
+    :return: (int16数组 (采样数, 通道数), 下一帧的偏移)
+    """
+    magic, transform, compression, channels, samples, length = FRAME.unpack_from(data, offset)
+    if magic != MAGIC:
+        raise ValueError("不是压缩数据帧 not a codec frame")
+    start = offset + FRAME.size
+    payload = bytes(data[start:start + length])
+    if len(payload) != length:
+        raise ValueError("数据帧不完整 truncated frame")
+    if compression == 1:
+        payload = zlib.decompress(payload)
+    elif compression == 2:
+        payload = lzma.decompress(payload)
+    if samples == 0:
+        return np.zeros((0, channels), dtype=np.int16), start + length
+    widths = payload[:channels]
+    first = np.frombuffer(payload, dtype="<i2", count=channels, offset=channels).view(np.uint16)
+    position = channels * 3
+    codes = np.empty((samples - 1, channels), dtype=np.uint16)
+    for i in range(channels):
+        size = ((samples - 1) * widths[i] + 7) // 8
+        codes[:, i] = unpackBits(payload[position:position + size], samples - 1, widths[i])
+        position += size
+    words = np.empty((samples, channels), dtype=np.uint16)
+    words[0] = first
+    if transform == 0:
+        words[1:] = unzigzag(codes).view(np.uint16)
+        words = np.cumsum(words, axis=0, dtype=np.uint16)           # 模2^16累加 Sum mod 2^16
+    else:
+        words[1:] = codes
+        words = np.bitwise_xor.accumulate(words, axis=0)
+    return words.view(np.int16), start + length
+
+
+class Int16Encoder:
+    __slots__ = ('channels', 'blockSamples', 'transform', 'compression', 'level', 'rows', 'sampleCount',
+                 'rawBytes', 'encodedBytes')
+
+    def __init__(self, channels, blockSamples=1024, transform="delta", compression=None, level=None):
+        """
+        流式编码器：攒够一块采样输出一帧
+        :param channels: 通道数
+        :param blockSamples: 每帧采样数
+        :param transform: "delta" 或 "xor"
+        :param compression: None、"zlib" 或 "lzma"
+        :param level: 压缩级别
+        """
+        self.channels = channels
+        self.blockSamples = blockSamples
+        self.transform = transform
+        self.compression = compression
+        self.level = level
+        self.rows = []                      # 未编码的采样 Samples not yet encoded
+        self.sampleCount = 0                # 已编码的采样数 Samples encoded
+        self.rawBytes = 0                   # 原始字节数 Raw bytes
+        self.encodedBytes = 0               # 编码后字节数 Encoded bytes
+
+    def write(self, values):
+        """
+        写入一个或多个采样
+        :param values: 一个采样（通道数个int16）或形状 (n, 通道数) 的数组
+        :return: 编码好的帧（可能为空）
+        """
+        values = np.asarray(values, dtype=np.int16).reshape(-1, self.channels)
+        self.rows.append(values)
+        pending = sum(len(rows) for rows in self.rows)
+        if pending < self.blockSamples:
+            return b""
+        block = np.concatenate(self.rows)
+        full = len(block) - len(block) % self.blockSamples
+        self.rows = [block[full:]] if full < len(block) else []
+        return b"".join(self.encode(block[i:i + self.blockSamples]) for i in range(0, full, self.blockSamples))
+
+    def encode(self, block):
+        frame = encodeBlock(block, self.transform, self.compression, self.level)
+        self.sampleCount += len(block)
+        self.rawBytes += block.nbytes
+        self.encodedBytes += len(frame)
+        return frame
+
+    def flush(self):
+        """
+        输出剩余不满一块的采样
+        :return: 编码好的帧（可能为空）
+        """
+        if not self.rows:
+            return b""
+        block = np.concatenate(self.rows)
+        self.rows = []
+        return self.encode(block) if len(block) > 0 else b""
+
+
+class Int16Decoder:
+    __slots__ = ('buffer',)
+
+    def __init__(self):
+        """
+        流式解码器：数据可以任意切分后送入，例如从网络收到的数据
+        """
+        self.buffer = bytearray()
+
+    def feed(self, data):
+        """
+        送入数据，返回已完整收到的帧解码结果
+        :param data: 字节
+        :return: int16数组列表
+        """
+        self.buffer += data
+        blocks = []
+        offset = 0
+        while len(self.buffer) - offset >= FRAME.size:
+            length = FRAME.unpack_from(self.buffer, offset)[5]
+            if len(self.buffer) - offset < FRAME.size + length:
+                break
+            block, offset = decodeBlock(self.buffer, offset)
+            blocks.append(block)
+        del self.buffer[:offset]
+        return blocks
+
+
+def iterBlocks(data):
+    """
+    依次解码字节中的所有帧
+    :param data: 字节
+    :return: 迭代 int16数组
+    """
+    offset = 0
+    while offset < len(data):
+        block, offset = decodeBlock(data, offset)
+        yield block
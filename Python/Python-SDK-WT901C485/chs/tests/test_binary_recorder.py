@@ -0,0 +1,84 @@
+# coding:UTF-8
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+import numpy as np
+import lib.device_model as deviceModel
+from lib.data_processor.roles.jy901s_dataProcessor import JY901SDataProcessor
+from lib.protocol_resolver.roles.protocol_485_resolver import Protocol485Resolver
+from lib.recorder.binary_reader import BinaryRecord
+from lib.recorder.binary_recorder import BinaryRecorder, JY901S_CHANNELS, RECORD_HEAD
+
+
+class StalledFile:
+    """
+    在release之前写不进去的文件 A file whose writes block until released
+    """
+
+    def __init__(self, file):
+        self.file = file
+        self.released = threading.Event()
+
+    def write(self, data):
+        self.released.wait(5)
+        return self.file.write(data)
+
+    def close(self):
+        self.file.close()
+
+
+class BinaryRecorderTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.fileName = os.path.join(self.directory, "test.bin")
+        self.device = deviceModel.DeviceModel("测试设备", Protocol485Resolver(), JY901SDataProcessor(), "")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def testRoundTrip(self):
+        recorder = BinaryRecorder(self.fileName, JY901S_CHANNELS, blockSize=256, bufferLimit=1 << 20)
+        recorder.setDeviceId(self.device, 7)
+        recorder.open()
+        for i in range(50):
+            self.device.registers[0x3D] = i * 100 - 2000        # 角度X Angle X
+            self.device.registers[0x40] = 2500                  # 温度 Temperature
+            self.device.registers[0x49] = -1                    # 经度低16位 Longitude low word
+            self.device.registers[0x4A] = i                     # 经度高16位 Longitude high word
+            recorder.write(self.device, 1000 + i)
+        recorder.close()
+
+        record = BinaryRecord(self.fileName)
+        self.assertEqual(record.channels, [(reg, name, scale) for reg, name, scale in JY901S_CHANNELS])
+        self.assertEqual(record.dtype.itemsize, RECORD_HEAD.size + 2 * len(JY901S_CHANNELS))
+        self.assertEqual(len(record), 50)
+        np.testing.assert_array_equal(record.records["timestamp"], np.arange(1000, 1050))
+        np.testing.assert_array_equal(record.records["device"], 7)
+        np.testing.assert_allclose(record.get("angleX", 7), (np.arange(50) * 100 - 2000) * 180.0 / 32768)
+        np.testing.assert_allclose(record.get("temperature"), 25.0)
+        np.testing.assert_array_equal(record.getInt32("lonL", "lonH"), (np.arange(50) << 16) | 0xffff)
+        self.assertEqual(len(record.get("angleX", 0x50)), 0)
+        self.assertEqual(recorder.bytesWritten, os.path.getsize(self.fileName))
+
+    def testStalledDisk(self):
+        recorder = BinaryRecorder(self.fileName, blockSize=440, flushInterval=0.01, bufferLimit=880)
+        recorder.open()
+        stalled = StalledFile(recorder.file)
+        recorder.file = stalled
+        for i in range(200):
+            recorder.write(self.device, i)
+        self.assertLessEqual(len(recorder.active), 880)        # 缓冲不再增长 The buffer stops growing
+        self.assertGreater(recorder.dropCount, 0)
+        self.assertEqual(recorder.recordCount + recorder.dropCount, 200)
+        stalled.released.set()
+        recorder.close()
+        record = BinaryRecord(self.fileName)
+        self.assertEqual(len(record), recorder.recordCount)
+        self.assertTrue(np.all(np.diff(record.records["timestamp"]) > 0))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,106 @@
+# coding:UTF-8
+import glob
+import json
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+import lib.device_model as deviceModel
+from lib.data_processor.roles.jy901s_dataProcessor import JY901SDataProcessor
+from lib.protocol_resolver.roles.protocol_485_resolver import Protocol485Resolver
+from lib.recorder.columnar_store import ColumnarReader, ColumnarStore, MANIFEST
+
+CHANNELS = [(0x34, "accX", 1.0), (0x35, "accY", 1.0), (0x36, "accZ", 1.0), (0x3D, "angleX", 0.5)]
+SECOND = 1000000000
+
+
+class ColumnarStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.device = deviceModel.DeviceModel("测试设备", Protocol485Resolver(), JY901SDataProcessor(), "")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def record(self, indexes, compress=True):
+        # 每秒一块、每块10条，角度X的原始值等于序号 One chunk a second, 10 records each, raw angleX equals the index
+        store = ColumnarStore(self.directory, CHANNELS, chunkDuration=1.0, compress=compress)
+        store.open()
+        for i in indexes:
+            self.device.registers[0x34] = 1000 if i == 25 else 1       # 第2块有一个峰值 A spike in chunk 2
+            self.device.registers[0x3D] = i
+            store.write(self.device, i * SECOND // 10)
+        store.close()
+        return store
+
+    def chunkFiles(self, entry):
+        return glob.glob(os.path.join(self.directory, "50", "%d_%06d_*" % (entry["start"], entry["seq"])))
+
+    def testRoundTrip(self):
+        self.record(range(50), compress=False)
+        reader = ColumnarReader(self.directory)
+        self.assertEqual(reader.devices(), [0x50])
+        self.assertEqual(len(reader.chunks[0x50]), 5)
+        self.assertEqual(reader.chunks[0x50][1]["stats"]["angleX"], [5.0, 9.5, 7.25])
+        result = reader.query(0x50, ["angleX"], 1.25, 3.55)
+        np.testing.assert_array_equal(result["timestamp"], np.arange(13, 36) * SECOND // 10)
+        np.testing.assert_allclose(result["angleX"], np.arange(13, 36) * 0.5)
+        self.assertEqual(len(reader.query(0x50, ["angleX"], 10.0)["angleX"]), 0)
+
+    def testTruncatedManifest(self):
+        self.record(range(30))
+        with open(os.path.join(self.directory, MANIFEST), "a") as f:
+            f.write('{"device": 80, "start": 3000000000, "en')     # 崩溃时写了一半的行 Cut short by a crash
+        reader = ColumnarReader(self.directory)
+        self.assertEqual([entry["start"] for entry in reader.chunks[0x50]], [0, SECOND, 2 * SECOND])
+        self.assertEqual(len(reader.query(0x50, ["angleX"])["timestamp"]), 30)
+
+    def testReopenContinuesSequence(self):
+        self.record(range(15))
+        store = self.record(range(15, 30))      # 第1块在两次写盘中都有数据 Chunk 1 spans both runs
+        self.assertEqual(store.sequence, 4)
+        reader = ColumnarReader(self.directory)
+        entries = reader.chunks[0x50]
+        self.assertEqual([(entry["start"], entry["seq"]) for entry in entries],
+                         [(0, 0), (SECOND, 1), (SECOND, 2), (2 * SECOND, 3)])
+        result = reader.query(0x50, ["angleX"], 1.2)
+        np.testing.assert_allclose(result["angleX"], np.arange(12, 30) * 0.5)
+        self.assertEqual(reader.aggregate(0x50, "angleX", "mean"), 14.5 * 0.5)
+
+    def testStatisticsSkipChunks(self):
+        self.record(range(50))
+        reader = ColumnarReader(self.directory)
+        entries = reader.chunks[0x50]
+        self.assertEqual([entry["start"] for entry in reader.findChunks(0x50, 1.5, 3.0)], [SECOND, 2 * SECOND])
+        # 整块落在范围内的块只用清单里的统计值 Chunks wholly inside the range use only the manifest statistics
+        for entry in entries[1:4]:
+            for path in self.chunkFiles(entry):
+                os.remove(path)
+        self.assertEqual(reader.aggregate(0x50, "angleX", "max", 1.0, 4.0), 39 * 0.5)
+        self.assertEqual(reader.aggregate(0x50, "angleX", "min", 0.5, 4.0), 2.5)
+
+    def testMaxMagnitudeSkipsChunks(self):
+        self.record(range(50))
+        # 上界小于峰值的块不读 Chunks whose bound is below the spike are never read
+        reader = ColumnarReader(self.directory)
+        for entry in reader.chunks[0x50]:
+            if entry["start"] != 2 * SECOND:
+                for path in self.chunkFiles(entry):
+                    os.remove(path)
+        magnitude, timestamp = reader.maxMagnitude(0x50)
+        self.assertAlmostEqual(magnitude, 1000.0)
+        self.assertEqual(timestamp, 25 * SECOND // 10)
+
+    def testManifestLines(self):
+        self.record(range(20))
+        with open(os.path.join(self.directory, MANIFEST)) as f:
+            entries = [json.loads(line) for line in f]
+        self.assertEqual([(entry["first"], entry["last"], entry["count"]) for entry in entries],
+                         [(0, 9 * SECOND // 10, 10), (SECOND, 19 * SECOND // 10, 10)])
+        self.assertFalse(glob.glob(os.path.join(self.directory, "50", "*.tmp")))
+
+
+if __name__ == '__main__':
+    unittest.main()
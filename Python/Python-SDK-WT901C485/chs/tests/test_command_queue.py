@@ -0,0 +1,100 @@
+# coding:UTF-8
+import time
+import unittest
+import lib.device_model as deviceModel
+from lib.bus.command_queue import CommandQueue, RetryBudget, CONTROL, CONFIG, POLL
+from lib.data_processor.roles.jy901s_dataProcessor import JY901SDataProcessor
+from lib.protocol_resolver.roles.protocol_485_resolver import Protocol485Resolver
+
+
+class CommandQueueTest(unittest.TestCase):
+
+    def setUp(self):
+        self.queue = CommandQueue("test", 115200)
+        self.holder = self.queue.enqueue()      # 先占住总线 Hold the bus first
+        self.assertTrue(self.queue.wait(self.holder))
+
+    def grantOrder(self, commands):
+        """
+        依次释放总线，记录获得总线的顺序
+        :return: 指令在commands中的序号列表
+        """
+        order = []
+        current = self.holder
+        for _ in commands:
+            self.queue.release(current)
+            index = next(i for i, command in enumerate(commands) if command.granted and i not in order)
+            order.append(index)
+            current = commands[index]
+            self.assertTrue(self.queue.wait(current))
+        self.queue.release(current)
+        return order
+
+    def testPriorityOrder(self):
+        commands = [self.queue.enqueue(POLL), self.queue.enqueue(CONFIG), self.queue.enqueue(CONTROL),
+                    self.queue.enqueue(CONFIG)]
+        self.assertEqual(self.grantOrder(commands), [2, 1, 3, 0])
+
+    def testDeadlineOrder(self):
+        now = time.monotonic()
+        commands = [self.queue.enqueue(CONFIG), self.queue.enqueue(CONFIG, now + 20),
+                    self.queue.enqueue(CONFIG, now + 10)]
+        self.assertEqual(self.grantOrder(commands), [2, 1, 0])
+
+    def testDeadlineExpiry(self):
+        command = self.queue.enqueue(CONFIG, time.monotonic() + 0.05)
+        self.assertFalse(self.queue.wait(command))
+        self.assertEqual(self.queue.getStatus()["expired"], 1)
+        submitted = self.queue.submit(b"\x50\x03", 7, 0.1, CONFIG, time.monotonic() + 0.01)
+        time.sleep(0.02)
+        self.queue.release(self.holder)         # 轮到时清掉过期的指令 Expired commands are dropped on grant
+        with self.assertRaises(TimeoutError):
+            submitted.future.result(0)
+        self.assertIsNone(self.queue.run(lambda: [1], deadline=time.monotonic() - 1))
+        self.assertTrue(self.queue.isIdle())
+
+    def testCancel(self):
+        first = self.queue.enqueue(CONFIG)
+        second = self.queue.submit(b"\x50\x03", 7, 0.1)
+        third = self.queue.enqueue(POLL)
+        self.assertTrue(self.queue.cancel(first))
+        self.assertTrue(second.future.cancel())
+        self.assertFalse(self.queue.wait(first))
+        self.queue.release(self.holder)
+        self.assertTrue(third.granted)          # 取消的指令被跳过 Cancelled commands are skipped
+        self.assertTrue(self.queue.wait(third))
+        self.assertFalse(self.queue.cancel(third))  # 已经在使用总线 Already holding the bus
+        self.queue.release(third)
+        self.assertEqual(self.queue.getStatus()["cancelled"], 1)
+        self.assertEqual(self.queue.getStatus()["queued"], 0)
+
+    def testRetryBudget(self):
+        self.queue.release(self.holder)
+        self.queue.budget = RetryBudget(limit=2, window=60)
+        attempts = []
+        self.assertEqual(self.queue.run(lambda: attempts.append(1), retries=5), None)
+        self.assertEqual(len(attempts), 3)      # 1次执行 + 预算内2次重试 One attempt plus two budgeted retries
+        status = self.queue.getStatus()
+        self.assertEqual((status["retries"], status["retriesDenied"]), (2, 1))
+        self.assertEqual(self.queue.run(lambda: attempts.append(1) or [1], retries=5), [1])
+        self.assertEqual(len(attempts), 4)
+
+    def testRetryLimit(self):
+        self.queue.release(self.holder)
+        attempts = []
+        self.queue.run(lambda: attempts.append(1), retries=1)
+        self.assertEqual(len(attempts), 2)
+        self.assertEqual(self.queue.getStatus()["retriesDenied"], 0)
+
+
+class ReadRegTest(unittest.TestCase):
+
+    def testEmptyResult(self):
+        device = deviceModel.DeviceModel("测试设备", Protocol485Resolver(), JY901SDataProcessor(), "")
+        self.assertEqual(device.readReg(0x02, 1, deadline=time.monotonic() - 1), [])
+        device.protocolResolver = None
+        self.assertEqual(device.readReg(0x02, 1), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,152 @@
+# coding:UTF-8
+import os
+import shutil
+import tempfile
+import unittest
+import lib.device_model as deviceModel
+from lib.config.config_snapshot import applyDiff, diffConfig, groupWrites, loadSnapshot, readConfig, restore, \
+    snapshot
+from lib.data_processor.roles.jy901s_dataProcessor import JY901SDataProcessor
+from lib.protocol_resolver.roles.protocol_485_resolver import Protocol485Resolver
+from lib.protocol_resolver.roles.wit_protocol_resolver import WitProtocolResolver
+from lib.simulator.simulated_sensor import SimulatedSensor
+from lib.simulator.simulated_serial import SimulatedSerial
+from lib.utils.crc_utils import append_crc
+
+CHANGES = {0x03: 0x08, 0x1F: 5, 0x20: 0, 0x21: 1, 0x25: 7}
+
+
+class RecordingSensor(SimulatedSensor):
+    """
+    记录收到的写指令，可以不接受0x10批量写入 Logs write requests and can ignore 0x10 batch writes
+    """
+
+    def __init__(self, ADDR=0x50, acceptBatch=True, frozen=()):
+        super().__init__(ADDR)
+        self.acceptBatch = acceptBatch
+        self.frozen = set(frozen)           # 写不进去的寄存器 Registers that ignore writes
+        self.writes = []                    # (功能码, 起始寄存器, 个数) (function, start, count)
+
+    def handleModbus(self, frame):
+        if len(frame) >= 8 and frame[0] == self.ADDR and frame[1] in (0x06, 0x10):
+            regAddr = frame[2] << 8 | frame[3]
+            self.writes.append((frame[1], regAddr, frame[4] << 8 | frame[5] if frame[1] == 0x10 else 1))
+            if frame[1] == 0x10 and not self.acceptBatch:
+                return append_crc(frame[:6])            # 应答但不写入 Answers without writing
+        return super().handleModbus(frame)
+
+    def writeRegister(self, regAddr, sValue):
+        if regAddr not in self.frozen:
+            super().writeRegister(regAddr, sValue)
+
+
+def makeDevice(sensor, protocol="modbus"):
+    resolver = WitProtocolResolver() if protocol == "wit" else Protocol485Resolver()
+    device = deviceModel.DeviceModel("模拟设备", resolver, JY901SDataProcessor(), "")
+    device.ADDR = sensor.ADDR
+    device.serialConfig.portName = "SIM"
+    device.portFactory = lambda portName, baud: SimulatedSerial([sensor], protocol=protocol, rate=0.0,
+                                                                port=portName, baudrate=baud)
+    device.openDevice()
+    return device
+
+
+class DiffTest(unittest.TestCase):
+
+    def testDiffConfig(self):
+        current = {0x02: 0x1e, 0x03: 0x06, 0x04: 0x02, 0x1A: 0x50, 0x20: 3, 0x2E: 0x1234}
+        target = {0x02: 0x1e, 0x03: 0x08, 0x04: 0x06, 0x1A: 0x51, 0x20: -1, 0x2E: 0x1300, 0x27: 5}
+        self.assertEqual(diffConfig(current, target), {0x03: 0x08, 0x20: 0xffff})
+        self.assertEqual(diffConfig(current, target, exclude=set()),
+                         {0x03: 0x08, 0x04: 0x06, 0x1A: 0x51, 0x20: 0xffff})
+
+    def testGroupWrites(self):
+        current = {reg: reg for reg in range(0x02, 0x30)}
+        self.assertEqual(groupWrites(CHANGES), [(0x03, [8]), (0x1F, [5, 0, 1]), (0x25, [7])])
+        # 间隔不超过2个寄存器时用当前值补上 Gaps of up to 2 registers are filled from the current config
+        self.assertEqual(groupWrites({0x20: 1, 0x23: 2}, current), [(0x20, [1, 0x21, 0x22, 2])])
+        self.assertEqual(groupWrites({0x20: 1, 0x24: 2}, current), [(0x20, [1]), (0x24, [2])])
+        self.assertEqual(groupWrites({0x20: 1, 0x23: 2}), [(0x20, [1]), (0x23, [2])])
+        # 设备自己的寄存器和只读寄存器不能用来补间隔 Device-specific and read-only registers never fill a gap
+        self.assertEqual(groupWrites({0x03: 1, 0x05: 2}, current, exclude={0x04}), [(0x03, [1]), (0x05, [2])])
+        self.assertEqual(groupWrites({0x26: 1, 0x28: 2}, current), [(0x26, [1]), (0x28, [2])])
+
+
+class ApplyTest(unittest.TestCase):
+
+    def setUp(self):
+        self.devices = []
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        for device in self.devices:
+            device.closeDevice()
+        shutil.rmtree(self.directory)
+
+    def connect(self, sensor, protocol="modbus"):
+        device = makeDevice(sensor, protocol)
+        self.devices.append(device)
+        return device
+
+    def testRestoreSnapshot(self):
+        source = RecordingSensor(0x50)
+        for reg, value in CHANGES.items():
+            source.registers[reg] = value
+        fileName = os.path.join(self.directory, "config.json")
+        snapshot(self.connect(source), fileName)
+        config = loadSnapshot(fileName)
+        self.assertEqual(config.registers[0x1F], 5)
+        self.assertEqual(config.firmware, [0x1234, 0])
+
+        target = RecordingSensor(0x51)
+        report = restore(self.connect(target), config, settle=0)
+        self.assertTrue(report["verified"])
+        self.assertTrue(report["firmwareMatch"])
+        self.assertEqual((report["changed"], report["writes"]), (5, 3))
+        self.assertEqual([write for write in target.writes if write[1] not in (0x00, 0x69)],
+                         [(0x10, 0x03, 1), (0x10, 0x1F, 3), (0x10, 0x25, 1)])
+        self.assertEqual(target.registers[0x1A], 0x51)         # 地址不复制 The address is not copied
+        self.assertEqual(restore(self.devices[1], config, settle=0)["writes"], 0)
+
+    def testBatchFallback(self):
+        sensor = RecordingSensor(0x50, acceptBatch=False)
+        device = self.connect(sensor)
+        report = applyDiff(device, CHANGES, readConfig(device), settle=0)
+        self.assertTrue(report["verified"])
+        self.assertEqual(report["writes"], 3 + 5)              # 每个寄存器再用0x06写一次 One 0x06 per register
+        self.assertEqual([write for write in sensor.writes if write[0] == 0x06 and write[1] not in (0x00, 0x69)],
+                         [(0x06, reg, 1) for reg in sorted(CHANGES)])
+        self.assertEqual(sensor.readRegisters(0x1F, 3), [5, 0, 1])
+
+    def testSingleRegisterFallback(self):
+        # 只有单个寄存器的段也是0x10写的 One-register runs are sent as 0x10 as well
+        sensor = RecordingSensor(0x50, acceptBatch=False)
+        report = applyDiff(self.connect(sensor), {0x03: 8, 0x25: 7}, settle=0)
+        self.assertTrue(report["verified"])
+        self.assertEqual(report["writes"], 2 + 2)
+        self.assertEqual((sensor.registers[0x03], sensor.registers[0x25]), (8, 7))
+
+    def testVerifyFailure(self):
+        sensor = RecordingSensor(0x50, acceptBatch=False, frozen={0x20})
+        device = self.connect(sensor)
+        report = applyDiff(device, CHANGES, settle=0)
+        self.assertFalse(report["verified"])
+        self.assertEqual(report["failed"], [0x20])             # 逐个补写后仍然不一致 Still wrong after single writes
+        self.assertEqual(sensor.readRegisters(0x1F, 3), [5, 3, 1])
+
+    def testWitProtocol(self):
+        sensor = RecordingSensor(0x50)
+        device = self.connect(sensor, "wit")
+        current = readConfig(device)
+        self.assertEqual(current[0x1A], 0x50)
+        writeCount = sensor.writeCount
+        report = applyDiff(device, CHANGES, current, settle=0)
+        self.assertTrue(report["verified"])
+        # 维特协议没有批量写入，每个寄存器一条指令 No batch write on the Wit protocol: one command per register
+        self.assertEqual(report["writes"], 3)
+        self.assertEqual(sensor.writeCount - writeCount, len(CHANGES) + 2)  # 加上解锁和保存 Plus unlock and save
+        self.assertEqual(sensor.readRegisters(0x1F, 3), [5, 0, 1])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,81 @@
+# coding:UTF-8
+import unittest
+from unittest import mock
+import lib.device_model as deviceModel
+from lib.data_processor.roles.deadband_dataProcessor import DeadbandDataProcessor
+from lib.data_processor.roles.jy901s_dataProcessor import JY901SDataProcessor
+from lib.protocol_resolver.roles.protocol_485_resolver import Protocol485Resolver
+
+
+class DeadbandTest(unittest.TestCase):
+
+    def setUp(self):
+        self.device = deviceModel.DeviceModel("测试设备", Protocol485Resolver(), JY901SDataProcessor(), "")
+        self.updates = []
+        self.now = 100.0
+
+    def makeFilter(self, **options):
+        processor = DeadbandDataProcessor(self.device.dataProcessor, **options)
+        processor.onVarChanged.append(lambda deviceModel: self.updates.append(deviceModel.getDeviceData("angleX")))
+        return processor
+
+    def update(self, processor, angleX, elapsed=0.1, **data):
+        # 模拟时间前进elapsed秒后收到一次数据 Data arriving elapsed seconds after the previous one
+        self.now += elapsed
+        self.device.setDeviceData("angleX", angleX)
+        for key, value in data.items():
+            self.device.setDeviceData(key, value)
+        with mock.patch("time.monotonic", return_value=self.now):
+            processor.onUpdate(self.device)
+
+    def testAbsoluteDeadband(self):
+        processor = self.makeFilter()
+        processor.setDeadband("angleX", absolute=0.1)
+        for value in (1.0, 1.05, 1.09, 1.2, 1.15, 1.0):
+            self.update(processor, value)
+        self.assertEqual(self.updates, [1.0, 1.2, 1.0])        # 相对上次转发的值 Relative to the last forwarded
+        self.assertEqual((processor.passCount, processor.dropCount), (3, 3))
+
+    def testRelativeDeadband(self):
+        processor = self.makeFilter()
+        processor.setDeadband("angleX", relative=0.1)
+        for value in (100.0, 109.0, 111.0, 101.0, 99.0):
+            self.update(processor, value)
+        self.assertEqual(self.updates, [100.0, 111.0, 99.0])
+
+    def testNonNumeric(self):
+        processor = self.makeFilter()
+        processor.setDeadband("Chiptime")
+        self.update(processor, 1.0, Chiptime="a")
+        self.update(processor, 2.0, Chiptime="a")
+        self.update(processor, 3.0, Chiptime="b")
+        self.assertEqual(self.updates, [1.0, 3.0])
+
+    def testMinInterval(self):
+        processor = self.makeFilter(minInterval=0.5)
+        for _ in range(10):                     # 没有死区时每次都算变化 Without deadbands every update counts
+            self.update(processor, 1.0, elapsed=0.1)
+        self.assertEqual(len(self.updates), 2)  # t=0.1, t=0.6
+
+    def testHeartbeat(self):
+        processor = self.makeFilter(maxSilence=1.0)
+        processor.setDeadband("angleX", absolute=0.1)
+        for _ in range(25):
+            self.update(processor, 1.0, elapsed=0.1)
+        self.assertEqual(len(self.updates), 3)  # 第一次 + 每秒一次心跳 First update plus one heartbeat a second
+        processor.reset()
+        self.update(processor, 1.0)
+        self.assertEqual(len(self.updates), 4)
+
+    def testRemoveDeadband(self):
+        processor = self.makeFilter()
+        processor.setDeadband("angleX", absolute=10)
+        self.update(processor, 1.0)
+        self.update(processor, 2.0)
+        processor.removeDeadband("angleX")
+        self.update(processor, 2.0)
+        self.assertEqual(self.updates, [1.0, 2.0])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,66 @@
+# coding:UTF-8
+import unittest
+import numpy as np
+from lib.utils.delta_codec import COMPRESSIONS, TRANSFORMS, Int16Decoder, Int16Encoder, decodeBlock, encodeBlock, \
+    iterBlocks
+
+
+def makeSamples(count, channels=4, seed=1):
+    # 缓慢变化的通道、随机通道、常数通道和正负极值跳变 Slow, random, constant and full-range jumps
+    rng = np.random.default_rng(seed)
+    values = np.empty((count, 4), dtype=np.int16)
+    values[:, 0] = np.cumsum(rng.integers(-3, 4, count)).astype(np.int16)
+    values[:, 1] = rng.integers(-32768, 32768, count)
+    values[:, 2] = 1234
+    values[:, 3] = np.where(np.arange(count) % 2 == 0, -32768, 32767)
+    return values[:, :channels]
+
+
+class DeltaCodecTest(unittest.TestCase):
+
+    def testRoundTrip(self):
+        for transform in TRANSFORMS:
+            for compression in COMPRESSIONS:
+                for count in (0, 1, 2, 5, 1000):
+                    with self.subTest(transform=transform, compression=compression, count=count):
+                        values = makeSamples(count)
+                        frame = encodeBlock(values, transform, compression)
+                        decoded, offset = decodeBlock(frame)
+                        self.assertEqual(offset, len(frame))
+                        self.assertEqual(decoded.shape, (count, 4))
+                        np.testing.assert_array_equal(decoded, values)
+
+    def testOneChannel(self):
+        values = makeSamples(100, 1)[:, 0]
+        decoded, _ = decodeBlock(encodeBlock(values))
+        np.testing.assert_array_equal(decoded[:, 0], values)
+
+    def testSlowChannelsShrink(self):
+        values = makeSamples(1000, 1)
+        frame = encodeBlock(values)
+        self.assertLess(len(frame), values.nbytes / 4)     # 每个差分最多3位 At most 3 bits per delta
+
+    def testStreaming(self):
+        values = makeSamples(2500)
+        encoder = Int16Encoder(4, blockSamples=1000, compression="zlib")
+        data = encoder.write(values[:700]) + encoder.write(values[700:]) + encoder.flush()
+        self.assertEqual(encoder.sampleCount, 2500)
+        self.assertEqual(encoder.encodedBytes, len(data))
+        decoder = Int16Decoder()
+        blocks = []
+        for i in range(0, len(data), 37):          # 任意切分 Split at arbitrary points
+            blocks += decoder.feed(data[i:i + 37])
+        self.assertEqual([len(block) for block in blocks], [1000, 1000, 500])
+        np.testing.assert_array_equal(np.concatenate(blocks), values)
+        np.testing.assert_array_equal(np.concatenate(list(iterBlocks(data))), values)
+
+    def testBadFrames(self):
+        frame = encodeBlock(makeSamples(10))
+        with self.assertRaises(ValueError):
+            decodeBlock(frame[:-1])
+        with self.assertRaises(ValueError):
+            decodeBlock(b"XX" + frame[2:])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,127 @@
+# coding:UTF-8
+import asyncio
+import socket
+import struct
+import unittest
+from lib.network.modbus_gateway import MBAP, ModbusGateway
+from lib.simulator.pty_simulator import PtySimulator
+from lib.simulator.simulated_sensor import SimulatedSensor
+
+
+def request(sock, transaction, unitId, pdu):
+    """
+    发送一个Modbus TCP请求并读取应答
+    :return: (事务号, 单元ID, 应答PDU)
+    """
+    sock.sendall(MBAP.pack(transaction, 0, len(pdu) + 1, unitId) + pdu)
+    head = receive(sock, MBAP.size)
+    transaction, _, length, unitId = MBAP.unpack(head)
+    return transaction, unitId, receive(sock, length - 1)
+
+
+def receive(sock, size):
+    data = b""
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            raise ConnectionError("连接已关闭 connection closed")
+        data += chunk
+    return data
+
+
+class GatewayPtyTest(unittest.TestCase):
+
+    def setUp(self):
+        self.sensors = [SimulatedSensor(ADDR=0x50), SimulatedSensor(ADDR=0x51, phase=1)]
+        self.simulator = PtySimulator(self.sensors)
+        self.simulator.start()
+        self.gateway = ModbusGateway("127.0.0.1", 0)
+        self.gateway.addBus("bus0", self.simulator.portName, 9600)
+        self.gateway.mapUnit(0x50, "bus0")
+        self.gateway.mapUnit(1, "bus0", 0x51)
+        self.gateway.start()
+        self.sock = socket.create_connection(("127.0.0.1", self.gateway.port), timeout=5)
+
+    def tearDown(self):
+        self.sock.close()
+        self.gateway.stop()
+        self.simulator.stop()
+
+    def testReadThroughBus(self):
+        transaction, unitId, pdu = request(self.sock, 7, 1, struct.pack(">BHH", 0x03, 0x2E, 2))
+        self.assertEqual((transaction, unitId), (7, 1))
+        self.assertEqual(pdu[:2], bytes([0x03, 4]))
+        self.assertEqual(struct.unpack(">HH", pdu[2:]), (0x1234, 0))
+        _, _, pdu = request(self.sock, 8, 9, struct.pack(">BHH", 0x03, 0x00, 1))
+        self.assertEqual(pdu, bytes([0x83, 0x0A]))                           # 未映射的单元 Unmapped unit
+
+    def testCacheAndWriteInvalidation(self):
+        read = struct.pack(">BHH", 0x03, 0x03, 1)
+        self.assertEqual(request(self.sock, 1, 0x50, read)[2], bytes([0x03, 2, 0, 0x06]))
+        self.assertEqual(request(self.sock, 2, 0x50, read)[2], bytes([0x03, 2, 0, 0x06]))
+        self.assertEqual(self.gateway.cacheHits, 1)
+        write = struct.pack(">BHH", 0x06, 0x03, 0x08)
+        self.assertEqual(request(self.sock, 3, 0x50, write)[2], write)
+        self.assertEqual(request(self.sock, 4, 0x50, read)[2], bytes([0x03, 2, 0, 0x08]))
+
+    def testShortFrameClosesConnection(self):
+        self.sock.sendall(MBAP.pack(1, 0, 0, 0x50))
+        self.assertEqual(self.sock.recv(1), b"")
+        with socket.create_connection(("127.0.0.1", self.gateway.port), timeout=5) as sock:
+            self.assertEqual(request(sock, 2, 0x50, struct.pack(">BHH", 0x03, 0x03, 1))[2][:2], bytes([0x03, 2]))
+
+
+class GatewayStartTest(unittest.TestCase):
+
+    def testPortInUse(self):
+        with socket.socket() as sock:
+            sock.bind(("127.0.0.1", 0))
+            sock.listen()
+            gateway = ModbusGateway("127.0.0.1", sock.getsockname()[1])
+            with self.assertRaises(OSError):
+                gateway.start()
+            self.assertIsNone(gateway.thread)
+
+
+class SlowReadGateway(ModbusGateway):
+    __slots__ = ('release', 'reads')
+
+    async def transact(self, bus, request, responseLength):
+        if request[1] == 0x03:
+            self.reads += 1
+            value = self.reads
+            await self.release.wait()
+            return bytes([0x03, 2, 0, value])
+        return request[1:]
+
+
+class GatewayGenerationTest(unittest.TestCase):
+
+    def testWriteDuringFetch(self):
+        async def run():
+            gateway = SlowReadGateway()
+            gateway.loop = asyncio.get_running_loop()
+            gateway.release = asyncio.Event()
+            gateway.reads = 0
+            gateway.addBus("bus0", "unused")
+            gateway.mapUnit(0x50, "bus0")
+            read = struct.pack(">BHH", 0x03, 0x03, 1)
+            before = gateway.loop.create_task(gateway.handleRequest(0x50, read))
+            await asyncio.sleep(0)
+            await gateway.handleRequest(0x50, struct.pack(">BHH", 0x06, 0x03, 0x08))
+            after = gateway.loop.create_task(gateway.handleRequest(0x50, read))
+            await asyncio.sleep(0)
+            gateway.release.set()
+            self.assertEqual(await before, bytes([0x03, 2, 0, 1]))
+            self.assertEqual(await after, bytes([0x03, 2, 0, 2]))     # 没有合并到写入前的读取 Not joined
+            self.assertEqual(gateway.coalescedCount, 0)
+            # 写入前读到的值没有缓存 The value read before the write was not cached
+            self.assertEqual(gateway.cache[("bus0", 0x50, 0x03, 0x03)][0], 2)
+            for bus in gateway.buses.values():
+                bus.close()
+
+        asyncio.run(run())
+
+
+if __name__ == '__main__':
+    unittest.main()
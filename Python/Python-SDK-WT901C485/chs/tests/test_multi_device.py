@@ -0,0 +1,63 @@
+# coding:UTF-8
+import threading
+import time
+import unittest
+from MultiDeviceStress import makeDevice
+
+
+class MultiDeviceTest(unittest.TestCase):
+
+    def setUp(self):
+        self.devices = []
+
+    def tearDown(self):
+        for device in self.devices:
+            device.closeDevice()
+
+    def open(self, count, protocol):
+        self.devices = [makeDevice(i, protocol) for i in range(count)]
+        for device in self.devices:
+            device.openDevice()
+        return self.devices
+
+    def testStateIsPerInstance(self):
+        first, second = [makeDevice(i, "wit") for i in range(2)]
+        for name in ("deviceData", "serialConfig", "registers", "commandQueue", "registerCache"):
+            self.assertIsNot(getattr(first, name), getattr(second, name), name)
+        self.assertIsNot(first.dataProcessor.onVarChanged, second.dataProcessor.onVarChanged)
+        self.assertIsNot(first.protocolResolver.TempBytes, second.protocolResolver.TempBytes)
+        first.dataProcessor.onVarChanged.append(print)
+        self.assertEqual(second.dataProcessor.onVarChanged, [])
+
+    def testStreamsDoNotMix(self):
+        # 每个模拟传感器温度不同 Each simulated sensor has its own temperature
+        devices = self.open(2, "wit")
+        updates = [[], []]
+        for device, received in zip(devices, updates):
+            device.dataProcessor.onVarChanged.append(
+                lambda model, received=received: received.append((model.ADDR, model.getDeviceData("temperature"))))
+        deadline = time.monotonic() + 5
+        while min(len(received) for received in updates) < 20 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        for i, received in enumerate(updates):
+            self.assertGreaterEqual(len(received), 20)
+            self.assertEqual(set(received), {(0x50 + i, 20.0 + i)})
+            self.assertEqual(devices[i].registers[0x40], int((20.0 + i) * 100))
+
+    def testConcurrentReads(self):
+        devices = self.open(4, "modbus")
+        results = {}
+
+        def readAddr(device):
+            results[device.ADDR] = device.readReg(0x1a, 1)
+
+        threads = [threading.Thread(target=readAddr, args=(device,)) for device in devices]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, {device.ADDR: [device.ADDR] for device in devices})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,52 @@
+# coding:UTF-8
+import gzip
+import os
+import shutil
+import tempfile
+import unittest
+from lib.recorder.raw_capture import RawCapture, RawCaptureReader
+
+
+class RawCaptureTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.fileName = os.path.join(self.directory, "capture.raw")
+        capture = RawCapture(self.fileName, indexInterval=0.001)
+        capture.open()
+        self.chunks = [(1000000 * i, bytes([i]) * (i % 7 + 1)) for i in range(100)]
+        for timestamp, data in self.chunks:
+            capture.write(data, timestamp)
+        capture.close()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def testIndexedFile(self):
+        reader = RawCaptureReader(self.fileName)
+        self.assertEqual(list(reader.chunks()), self.chunks)
+        self.assertEqual(list(reader.chunks(20000000, 30000000)), self.chunks[20:30])
+
+    def testCompressedSegment(self):
+        # ROS节点关闭的分段：gzip压缩、没有索引文件 A segment closed by a ROS node: gzipped, no index file
+        with open(self.fileName, "rb") as source, gzip.open(self.fileName + ".gz", "wb") as output:
+            shutil.copyfileobj(source, output)
+        reader = RawCaptureReader(self.fileName + ".gz")
+        self.assertEqual(len(reader.indexTimes), 1)                 # 扫描重建的索引 Rebuilt by a scan
+        self.assertEqual(list(reader.chunks()), self.chunks)
+        self.assertEqual(list(reader.chunks(50000000, 53000000)), self.chunks[50:53])
+
+    def testTruncatedChunk(self):
+        with open(self.fileName, "ab") as f:
+            f.write(b"\x01\x02\x03")                                 # 写到一半的数据块 A chunk cut short
+        self.assertEqual(list(RawCaptureReader(self.fileName).chunks()), self.chunks)
+
+    def testNotACapture(self):
+        with gzip.open(self.fileName + ".gz", "wb") as f:
+            f.write(b"abc")
+        with self.assertRaises(ValueError):
+            RawCaptureReader(self.fileName + ".gz")
+
+
+if __name__ == '__main__':
+    unittest.main()
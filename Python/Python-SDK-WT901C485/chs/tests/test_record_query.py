@@ -0,0 +1,63 @@
+# coding:UTF-8
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+import lib.device_model as deviceModel
+from lib.data_processor.roles.jy901s_dataProcessor import JY901SDataProcessor
+from lib.protocol_resolver.roles.protocol_485_resolver import Protocol485Resolver
+from lib.recorder.binary_recorder import WT901C485_CHANNELS
+from lib.recorder.record_query import query
+from lib.recorder.rotating_recorder import RotatingRecorder
+
+
+class RotatingQueryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.device = deviceModel.DeviceModel("测试设备", Protocol485Resolver(), JY901SDataProcessor(), "")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def record(self, count, compression="gzip"):
+        # 每段20条记录，角度X的原始值等于序号 20 records per segment, raw angleX equals the index
+        recordSize = 10 + 2 * len(WT901C485_CHANNELS)
+        recorder = RotatingRecorder(self.directory, "test", WT901C485_CHANNELS, maxBytes=20 * recordSize,
+                                    maxDuration=None, compression=compression, retentionBytes=None)
+        recorder.open()
+        for i in range(count):
+            self.device.registers[0x3D] = i
+            recorder.write(self.device, 1000 + i)
+        recorder.close()
+
+    def testQueryCompressedSegments(self):
+        self.record(100)
+        files = os.listdir(self.directory)
+        self.assertTrue(any(name.endswith(".bin.gz") for name in files))
+        self.assertFalse(any(name.endswith(".bin") for name in files))
+        result = query(self.directory, 0x50, ["angleX"])
+        np.testing.assert_array_equal(result["timestamp"], np.arange(1000, 1100))
+        np.testing.assert_allclose(result["angleX"], np.arange(100) * 180.0 / 32768)
+
+    def testTimeRangeAcrossSegments(self):
+        self.record(100, "lzma")
+        result = query(self.directory, 0x50, ["angleX"], start=1015, end=1065)
+        np.testing.assert_array_equal(result["timestamp"], np.arange(1015, 1065))
+        result = query(self.directory, 0x50, ["angleX"], start=1010, end=1050, every="10ns", agg="count")
+        np.testing.assert_array_equal(result["angleX"], [10, 10, 10, 10])
+
+    def testSingleSegment(self):
+        self.record(10)
+        segment = [name for name in os.listdir(self.directory) if name.endswith(".gz")][0]
+        result = query(os.path.join(self.directory, segment), 0x50, ["angleX"])
+        self.assertEqual(len(result["timestamp"]), 10)
+
+    def testUnknownDirectory(self):
+        with self.assertRaises(ValueError):
+            query(self.directory, 0x50, ["angleX"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,112 @@
+# coding:UTF-8
+import threading
+import time
+import unittest
+from lib.bus.command_queue import CONTROL, POLL
+from lib.bus.register_cache import RegisterCache, SLOW
+
+
+class BlockingFetch:
+    """
+    在release之前阻塞的读取函数 A fetch that blocks until released
+    """
+
+    def __init__(self, result):
+        self.result = result
+        self.started = threading.Event()
+        self.released = threading.Event()
+        self.count = 0
+
+    def __call__(self):
+        self.count += 1
+        self.started.set()
+        self.released.wait(5)
+        return self.result
+
+
+class RegisterCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = RegisterCache(ttls={SLOW: 0.05})
+        self.fetchCount = 0
+
+    def fetch(self, values):
+        def fetch():
+            self.fetchCount += 1
+            return values
+        return fetch
+
+    def readInThread(self, fetch, results, **options):
+        thread = threading.Thread(target=lambda: results.append(self.cache.read(0x03, 1, fetch, **options)))
+        thread.start()
+        return thread
+
+    def testTtlExpiry(self):
+        self.assertEqual(self.cache.read(0x03, 1, self.fetch([6])), [6])
+        self.assertEqual(self.cache.read(0x03, 1, self.fetch([7])), [6])
+        self.assertEqual(self.fetchCount, 1)
+        time.sleep(0.06)
+        self.assertEqual(self.cache.read(0x03, 1, self.fetch([7])), [7])
+        self.assertEqual(self.fetchCount, 2)
+        self.assertEqual(self.cache.read(0x2E, 1, self.fetch([0x1234])), [0x1234])   # 版本号不过期 Never expires
+        time.sleep(0.06)
+        self.assertEqual(self.cache.read(0x2E, 1, self.fetch([0])), [0x1234])
+        self.assertEqual(self.cache.read(0x34, 1, self.fetch([1])), [1])            # 实时数据不缓存 Live data
+        self.assertEqual(self.cache.read(0x34, 1, self.fetch([2])), [2])
+
+    def testCoalescing(self):
+        fetch = BlockingFetch([6])
+        results = []
+        first = self.readInThread(fetch, results)
+        fetch.started.wait(5)
+        second = self.readInThread(self.fetch([7]), results)
+        time.sleep(0.05)
+        fetch.released.set()
+        first.join()
+        second.join()
+        self.assertEqual(results, [[6], [6]])
+        self.assertEqual((fetch.count, self.fetchCount), (1, 0))
+        self.assertEqual(self.cache.getStatus()["joined"], 1)
+
+    def testFailureSharedByJoiners(self):
+        fetch = BlockingFetch(None)
+        results = []
+        first = self.readInThread(fetch, results)
+        fetch.started.wait(5)
+        second = self.readInThread(self.fetch([7]), results)
+        time.sleep(0.05)
+        fetch.released.set()
+        first.join()
+        second.join()
+        self.assertEqual(results, [[], []])
+        self.assertEqual(self.cache.getStatus()["cached"], 0)
+
+    def testJoinerDeadline(self):
+        fetch = BlockingFetch([6])
+        results = []
+        first = self.readInThread(fetch, results, priority=POLL)
+        fetch.started.wait(5)
+        start = time.monotonic()
+        self.assertEqual(self.cache.read(0x03, 1, self.fetch([7]), POLL, time.monotonic() + 0.05), [])
+        self.assertLess(time.monotonic() - start, 1)
+        # 优先级更高的读取不等低优先级的读取 A higher-priority read does not wait for a lower-priority one
+        self.assertEqual(self.cache.read(0x03, 1, self.fetch([7]), CONTROL), [7])
+        fetch.released.set()
+        first.join()
+        self.assertEqual(results, [[6]])
+
+    def testWriteDuringFetch(self):
+        fetch = BlockingFetch([6])
+        results = []
+        thread = self.readInThread(fetch, results)
+        fetch.started.wait(5)
+        self.cache.onWrite(0x03)                # 读取期间写入 A write lands during the fetch
+        fetch.released.set()
+        thread.join()
+        self.assertEqual(results, [[6]])
+        self.assertEqual(self.cache.read(0x03, 1, self.fetch([8])), [8])   # 写入前的值没有缓存 Not cached
+        self.assertEqual(self.fetchCount, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
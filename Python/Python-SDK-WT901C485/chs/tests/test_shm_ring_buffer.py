@@ -0,0 +1,76 @@
+# coding:UTF-8
+import sys
+import threading
+import unittest
+from lib.bus.shm_ring_buffer import ShmRingBuffer, HEADER_SIZE, RESERVE_SEQ_OFFSET, SEQ
+
+
+def pattern(seq, size):
+    """
+    按字节序号生成数据，读到的每个字节都能和序号对上
+    :param seq: 起始字节序号
+    :param size: 字节数
+    :return: 字节数据
+    """
+    return bytes((seq + i) % 251 for i in range(size))
+
+
+class ShmRingBufferTest(unittest.TestCase):
+
+    def setUp(self):
+        self.producer = ShmRingBuffer(capacity=64)
+        self.consumer = ShmRingBuffer(self.producer.name)
+
+    def tearDown(self):
+        self.consumer.close()
+        self.producer.close()
+
+    def testOverrunDetected(self):
+        self.producer.write(pattern(0, 100))
+        data, lost = self.consumer.read()
+        self.assertEqual(lost, 36)
+        self.assertEqual(data, pattern(36, 64))
+
+    def testWriteInProgressOverOldestBytes(self):
+        # 生产者已发布结束序号并覆盖了一部分最旧的未读数据，还没发布已写入序号
+        # The producer has published its end sequence and overwritten part of the oldest unread bytes
+        self.producer.write(pattern(0, 64))
+        buf = self.producer.shm.buf
+        SEQ.pack_into(buf, RESERVE_SEQ_OFFSET, 64 + 10)
+        buf[HEADER_SIZE:HEADER_SIZE + 5] = pattern(64, 5)
+        data, lost = self.consumer.read()
+        self.assertEqual(lost, 10)
+        self.assertEqual(data, pattern(10, 54))
+
+    def testOverrunWhileCopying(self):
+        # 生产者持续写入，消费者每次读到的字节都必须和序号对上，读到的加丢失的等于写入的
+        # The producer keeps writing; every byte read must match its sequence, and read plus lost must add up
+        total = 200000
+        written = [0]
+
+        def produce():
+            seq = 0
+            while seq < total:
+                size = 1 + seq % 37
+                self.producer.write(pattern(seq, size))
+                seq += size
+            written[0] = seq
+
+        interval = sys.getswitchinterval()
+        sys.setswitchinterval(1e-6)             # 尽量在复制中间切换线程 Switch threads as often as possible
+        thread = threading.Thread(target=produce)
+        thread.start()
+        seq = 0
+        while thread.is_alive() or seq < written[0]:
+            data, lost = self.consumer.read(48)
+            seq += lost
+            self.assertEqual(data, pattern(seq, len(data)))
+            seq += len(data)
+        thread.join()
+        sys.setswitchinterval(interval)
+        self.assertEqual(seq, written[0])
+        self.assertGreater(self.consumer.lostBytes, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
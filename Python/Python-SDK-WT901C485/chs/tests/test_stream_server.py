@@ -0,0 +1,132 @@
+# coding:UTF-8
+import socket
+import time
+import unittest
+import lib.device_model as deviceModel
+from lib.data_processor.roles.jy901s_dataProcessor import JY901SDataProcessor
+from lib.network.stream_client import StreamClient
+from lib.network.stream_protocol import HELLO, SAMPLES, FrameReader, decodeSamples, encodeJson, encodeSamples
+from lib.network.stream_server import StreamClientConnection, StreamServer
+from lib.protocol_resolver.roles.protocol_485_resolver import Protocol485Resolver
+
+CHANNELS = [(0x34, "accX", 16.0 / 32768), (0x3D, "angleX", 180.0 / 32768), (0x40, "temperature", 0.01)]
+
+
+def waitFor(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+class ProtocolTest(unittest.TestCase):
+
+    def testSamplesRoundTrip(self):
+        rows = [(1000 + i, 0x50 + i % 2, (i, -i, 0x7fff, -0x8000)) for i in range(100)]
+        indexes, decoded = decodeSamples(FrameReader().feed(encodeSamples(rows, [0, 3, 1]))[0][1])
+        self.assertEqual(indexes, [0, 3, 1])
+        self.assertEqual(decoded, [(t, d, (v[0], v[3], v[1])) for t, d, v in rows])
+        self.assertEqual(decodeSamples(FrameReader().feed(encodeSamples([], [0]))[0][1]), ([0], []))
+
+    def testFrameReaderSplits(self):
+        stream = encodeJson(HELLO, CHANNELS) + encodeSamples([(1, 2, (3, 4, 5))], [0, 1, 2])
+        reader = FrameReader()
+        frames = []
+        for i in range(len(stream)):                # 一个字节一个字节送入 One byte at a time
+            frames += reader.feed(stream[i:i + 1])
+        self.assertEqual([kind for kind, _ in frames], [HELLO, SAMPLES])
+        self.assertEqual(decodeSamples(frames[1][1]), ([0, 1, 2], [(1, 2, (3, 4, 5))]))
+        self.assertEqual(len(reader.buffer), 0)
+
+    def testDropOldest(self):
+        client = StreamClientConnection(None, "test", 3)
+        self.assertEqual([client.enqueue(i) for i in range(5)], [False, False, False, True, True])
+        self.assertEqual(list(client.frames), [2, 3, 4])
+        self.assertEqual(client.dropCount, 2)
+
+
+class StreamServerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.devices = []
+        for addr in (0x50, 0x51):
+            device = deviceModel.DeviceModel("测试设备", Protocol485Resolver(), JY901SDataProcessor(), "")
+            device.ADDR = addr
+            device.registers[0x3D] = addr * 10
+            device.registers[0x40] = 2500
+            self.devices.append(device)
+        self.server = None
+        self.sockets = []
+
+    def tearDown(self):
+        for sock in self.sockets:
+            sock.close()
+        if self.server is not None:
+            self.server.stop()
+
+    def startServer(self, **options):
+        self.server = StreamServer("127.0.0.1", 0, CHANNELS, batchInterval=0.005, **options)
+        self.server.start()
+        return self.server
+
+    def connectSlowClient(self):
+        # 连接后从不读取，接收缓冲很小 Never reads, with a tiny receive buffer
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+        sock.connect(("127.0.0.1", self.server.port))
+        self.sockets.append(sock)
+        self.assertTrue(waitFor(lambda: len(self.server.clients) == len(self.sockets)))
+        return sock
+
+    def flood(self, until):
+        # 每批约1MB，直到条件成立 About 1MB per batch until the condition holds
+        deadline = time.monotonic() + 20
+        while not until() and time.monotonic() < deadline:
+            for i in range(50000):
+                self.server.write(self.devices[0], i)
+            time.sleep(0.01)
+        return until()
+
+    def testSubscription(self):
+        server = self.startServer()
+        client = StreamClient("127.0.0.1", server.port, devices=[0x51], fields=["angleX", "temperature"], timeout=5)
+        client.connect()
+        try:
+            self.assertEqual(client.channels, [list(channel) for channel in CHANNELS])
+            self.assertTrue(waitFor(lambda: server.clients and server.clients[0].fields is not None))
+            for i in range(10):
+                for device in self.devices:
+                    server.write(device, 1000 + i)
+            samples = []
+            while len(samples) < 10:
+                samples += client.read()
+            self.assertEqual([sample.timestamp for sample in samples], list(range(1000, 1010)))
+            self.assertTrue(all(sample.ADDR == 0x51 for sample in samples))
+            self.assertEqual(samples[0].data, {"angleX": 0x51 * 10 * 180.0 / 32768, "temperature": 25.0})
+        finally:
+            client.close()
+
+    def testSlowClientDropsOldest(self):
+        server = self.startServer(maxQueue=4)
+        self.connectSlowClient()
+        client = StreamClient("127.0.0.1", server.port, fields=["angleX"], timeout=5)
+        client.connect()
+        try:
+            self.assertTrue(self.flood(lambda: server.clients[0].dropCount > 0))
+            self.assertLessEqual(len(server.clients[0].frames), 4)
+            self.assertEqual(len(server.clients), 2)        # 慢客户端仍然连着 The slow client stays connected
+            self.assertGreater(len(client.read()), 0)       # 正常客户端不受影响 The other client keeps up
+        finally:
+            client.close()
+
+    def testSlowClientDisconnected(self):
+        server = self.startServer(maxQueue=4, dropPolicy="disconnect")
+        self.connectSlowClient()
+        self.assertTrue(self.flood(lambda: len(server.clients) == 0))
+        self.assertTrue(waitFor(lambda: len(server.getStatus()) == 0))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,117 @@
+# coding:UTF-8
+import socket
+import time
+import unittest
+from lib.simulator.simulated_sensor import SimulatedSensor
+from lib.simulator.tcp_simulator import TcpSimulator
+from lib.transport.tcp_transport import PendingRequest, TcpConnection
+from lib.transport.transport import parseTcpPort
+from lib.utils.crc_utils import append_crc
+
+
+def readFrame(address, regAddr=0x00, regCount=1):
+    return append_crc([address, 0x03, regAddr >> 8, regAddr & 0xff, regCount >> 8, regCount & 0xff])
+
+
+class FeedTest(unittest.TestCase):
+
+    def testMatchInSendOrder(self):
+        connection = TcpConnection("127.0.0.1", 1)          # 不启动连接线程 No connection thread
+        first = PendingRequest(readFrame(0x50), 7, 1.0)
+        second = PendingRequest(readFrame(0x51), 7, 1.0)
+        connection.outstanding.extend([first, second])
+        reply1 = append_crc([0x50, 0x03, 2, 0x12, 0x34])
+        reply2 = append_crc([0x51, 0x83, 0x02])                # 异常应答 Exception response
+        connection.feed(b"\x00\x51" + reply1[:4])              # 前面的杂散字节被丢掉 Stray bytes are skipped
+        self.assertFalse(first.future.done())
+        connection.feed(reply1[4:] + reply2)
+        self.assertEqual(first.future.result(0), reply1)
+        self.assertEqual(second.future.result(0), reply2)
+        self.assertEqual(len(connection.outstanding), 0)
+
+
+class TcpTransportTest(unittest.TestCase):
+
+    def setUp(self):
+        self.simulator = TcpSimulator([SimulatedSensor(ADDR=0x50), SimulatedSensor(ADDR=0x51)], baud=115200)
+        self.simulator.start()
+        self.connection = None
+
+    def tearDown(self):
+        if self.connection is not None:
+            self.connection.stop()
+        self.simulator.stop()
+
+    def connect(self, **options):
+        self.connection = TcpConnection("127.0.0.1", self.simulator.port, responseTimeout=0.3, backoffMin=0.05,
+                                        **options)
+        self.connection.start()
+        return self.connection
+
+    def testRequestResponse(self):
+        connection = self.connect()
+        futures = [connection.submit(readFrame(address, 0x2E), 7) for address in (0x50, 0x51, 0x50)]
+        replies = [future.result(2) for future in futures]
+        self.assertEqual([reply[0] for reply in replies], [0x50, 0x51, 0x50])
+        self.assertTrue(all(reply[3:5] == b"\x12\x34" for reply in replies))
+        self.assertEqual(self.simulator.collisionCount, 0)
+
+    def testTimeout(self):
+        connection = self.connect()
+        future = connection.submit(readFrame(0x60), 7, timeout=0.1)    # 没有这个设备 No such device
+        with self.assertRaises(TimeoutError):
+            future.result(2)
+        self.assertEqual(connection.timeoutCount, 1)
+        self.assertEqual(connection.submit(readFrame(0x50), 7).result(2)[0], 0x50)
+
+    def testReconnect(self):
+        connection = self.connect()
+        self.assertEqual(connection.submit(readFrame(0x50), 7).result(2)[0], 0x50)
+        self.simulator.dropConnections()
+        deadline = time.monotonic() + 5
+        while connection.connectCount < 2 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(connection.connectCount, 2)
+        self.assertEqual(connection.submit(readFrame(0x51), 7).result(2)[0], 0x51)
+
+    def testPipelineDepth(self):
+        connection = self.connect()
+        futures = [connection.submit(readFrame(0x50, 0x30, 40), 85) for _ in range(4)]
+        self.assertLessEqual(len(connection.outstanding), 1)   # 等上一个应答再发 One request on the wire
+        for future in futures:
+            self.assertEqual(len(future.result(2)), 85)
+        self.assertEqual(self.simulator.collisionCount, 0)
+
+    def testQueueingConverter(self):
+        self.simulator.queueing = True
+        host, port, depth = parseTcpPort("tcp://127.0.0.1:%d?depth=3" % self.simulator.port)
+        connection = self.connect(pipelineDepth=depth)
+        while not connection.isConnected():
+            time.sleep(0.01)
+        futures = [connection.submit(readFrame(0x50, 0x30, 40), 85) for _ in range(5)]
+        self.assertEqual(len(connection.outstanding), 3)
+        self.assertEqual(len(connection.waiting), 2)
+        for future in futures:
+            self.assertEqual(len(future.result(2)), 85)
+
+
+class StalledPeerTest(unittest.TestCase):
+
+    def testSendTimeout(self):
+        with socket.create_server(("127.0.0.1", 0)) as server:
+            connection = TcpConnection("127.0.0.1", server.getsockname()[1], sendTimeout=0.2)
+            connection.start()
+            peer, _ = server.accept()           # 接受连接但不读取 Accepts but never reads
+            while not connection.isConnected():
+                time.sleep(0.01)
+            start = time.monotonic()
+            self.assertEqual(connection.sendRaw(b"\x00" * (64 << 20)), 0)
+            self.assertLess(time.monotonic() - start, 5)
+            with connection.lock:               # 锁已经释放 The lock is free again
+                pass
+            connection.stop()
+            peer.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,29 @@
+# coding:UTF-8
+import datetime
+import unittest
+import lib.device_model as deviceModel
+from lib.bus.time_merger import parseChiptime
+from lib.data_processor.roles.jy901s_dataProcessor import JY901SDataProcessor
+from lib.protocol_resolver.roles.protocol_485_resolver import Protocol485Resolver
+
+
+class ParseChiptimeTest(unittest.TestCase):
+
+    def testResolverChiptime(self):
+        # 用解析器从寄存器0x30~0x33得到的芯片时间字符串 The Chiptime string the resolver builds from 0x30-0x33
+        device = deviceModel.DeviceModel("测试设备", Protocol485Resolver(), JY901SDataProcessor(), "")
+        registers = [24 | (5 << 8), 6 | (7 << 8), 8 | (9 << 8), 123]
+        response = [0x50, 0x03, len(registers) * 2] + [b for r in registers for b in (r >> 8, r & 0xff)] + [0, 0]
+        device.protocolResolver.get_data(response, device)
+        chiptime = device.getDeviceData("Chiptime")
+        self.assertEqual(chiptime, "2024-5-6 7:8:9.123")
+        expected = datetime.datetime(2024, 5, 6, 7, 8, 9, 123000, tzinfo=datetime.timezone.utc)
+        self.assertEqual(parseChiptime(chiptime), int(expected.timestamp() * 1000) * 1000000)
+
+    def testInvalid(self):
+        self.assertIsNone(parseChiptime(None))
+        self.assertIsNone(parseChiptime("2024-13-1 0:0:0.0"))
+
+
+if __name__ == '__main__':
+    unittest.main()
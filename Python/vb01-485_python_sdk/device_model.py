@@ -7,43 +7,23 @@ from serial import SerialException
 
 # 串口配置 Serial Port Configuration
 class SerialConfig:
-    # 串口号
-    portName = ''
+    __slots__ = ('portName', 'baud')
 
-    # 波特率
-    baud = 9600
+    def __init__(self, portName='', baud=9600):
+        # 串口号
+        self.portName = portName
+
+        # 波特率
+        self.baud = baud
 
 
 # 设备实例 Device instance
 class DeviceModel:
     # region 属性 attribute
 
-    # 设备名称 deviceName
-    deviceName = "我的设备"
-
-    # 设备modbus ID
-    ADDR = 0x50
-
-    # 设备数据字典 Device Data Dictionary
-    deviceData = {}
-
-    # 设备是否开启
-    isOpen = False
-
-    # 是否循环读取 Whether to loop read
-    loop = False
-
-    # 串口 Serial port
-    serialPort = None
-
-    # 串口配置 Serial Port Configuration
-    serialConfig = SerialConfig()
-
-    # 临时数组 Temporary array
-    TempBytes = []
-
-    # 起始寄存器 Start register
-    statReg = None
+    # 所有状态按实例保存，同一进程可运行多个设备 All state is per instance so many devices can share a process
+    __slots__ = ('deviceName', 'ADDR', 'deviceData', 'isOpen', 'loop', 'serialPort', 'serialConfig',
+                 'TempBytes', 'statReg', 'callback_method')
 
     # endregion
 
@@ -94,13 +74,26 @@ class DeviceModel:
         print("初始化设备模型")
         # 设备名称（自定义） Device Name
         self.deviceName = deviceName
+        # 串口配置 Serial Port Configuration
+        self.serialConfig = SerialConfig()
         # 串口号 Serial port number
         self.serialConfig.portName = portName
         # 串口波特率 baud
         self.serialConfig.baud = baud
         # modbus ID 设备地址
         self.ADDR = ADDR
+        # 设备数据字典 Device Data Dictionary
         self.deviceData = {}
+        # 设备是否开启
+        self.isOpen = False
+        # 是否循环读取 Whether to loop read
+        self.loop = False
+        # 串口 Serial port
+        self.serialPort = None
+        # 临时数组 Temporary array
+        self.TempBytes = []
+        # 起始寄存器 Start register
+        self.statReg = None
         self.callback_method = callback_method
 
     # 获得CRC校验 Obtain CRC verification
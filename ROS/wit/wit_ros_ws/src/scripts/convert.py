@@ -1,85 +1,342 @@
 import time
 import sys
+import os
+import mmap
+import array
+import bisect
 import struct
+import argparse
+import collections
+from concurrent.futures import ProcessPoolExecutor
+
+# 离线数据转换：把串口原始数据（维特协议 0x55 或 Modbus 0x03 应答）转换成制表符分隔的文本
+# Offline converter: turns raw serial data (Wit 0x55 packets or Modbus 0x03 responses) into tab-separated text.
+# 输入文件用 mmap 映射，按安全的重新同步点（连续两个有效数据包）切块，由多个进程并行转换，按顺序输出
+# The input is mmapped, split at safe resync points (two consecutive valid frames), converted by a process pool
+# and written in order. Plain byte dumps and the chunk log written by recordThread (.raw) are both accepted.
+
+RAW_MAGIC = b"WITRAW\x00\x00"             # recordThread 记录文件  recordThread capture file
+RAW_HEADER = struct.Struct("<8sHqq")
+RAW_CHUNK = struct.Struct("<qI")
+WIT_SIZE = 11
+CHUNK_SIZE = 32 * 1024 * 1024            # 每个任务的数据量  Bytes per task
+SEARCH_SIZE = 64 * 1024                  # 查找同步点的范围  Resync search window
+
+WIT_COLUMNS = {
+    0x50: 'Chip-Time\t',
+    0x51: 'ax(g)\tay(g)\taz(g)\t',
+    0x52: 'wx(deg/s)\twy(deg/s)\twz(deg/s)\t',
+    0x53: 'AngleX(deg)\tAngleY(deg)\tAngleZ(deg)\t',
+    0x54: ' hx\thy\thz\t',
+}
+MODBUS_HEADER = 'ADDR\tChip-Time\tax(g)\tay(g)\taz(g)\twx(deg/s)\twy(deg/s)\twz(deg/s)\t' \
+                'AngleX(deg)\tAngleY(deg)\tAngleZ(deg)\t hx\thy\thz\tT(C)\t'
+
+
+def makeCrcTable():
+    table = []
+    for i in range(256):
+        crc = i
+        for _ in range(8):
+            crc = (crc >> 1) ^ 0xA001 if crc & 1 else crc >> 1
+        table.append(crc)
+    return table
+
+
+CRC_TABLE = makeCrcTable()
 
-argc = len(sys.argv)
-
-if argc < 2:
-    print('please input convert file name')
-    exit(1)
-filename = sys.argv[1]
-convertfilename = time.strftime("%Y%m%d%H%M%S", time.localtime()) + '.txt'
-headmsg = ''
-msg = ''
-headindex = 0x50
-headflag = 0
-key = 0
-raw_data = bytearray(11)
-fd = open(convertfilename, 'w+')
 
 def checkSum(list_data, check_data):
     return sum(list_data) & 0xff == check_data
 
 
-def hex_to_short(raw_data):
-    return list(struct.unpack("hhhh", bytearray(raw_data)))
-
-
-def ConvertData(val):
-    global headflag, headindex, fd, msg, headmsg, key, raw_data
-
-    raw_data[key] = val
-    key += 1
-    if raw_data[0] != 0x55: key = 0
-    if key < 11: return
-
-    if checkSum(raw_data[0:10], raw_data[10]):
-        if headindex == raw_data[1]:
-            if headflag == 1:
-                fd.write(headmsg+'\n')
-                headflag = 2
-            fd.write(msg+'\n')
-            msg = ''
-
-        if headflag == 0:
-            headflag = 1
-            headindex = raw_data[1]
-
-        val = hex_to_short(raw_data[2:10])
-        if raw_data[1] == 0x50:
-            if headflag == 1:   headmsg += 'Chip-Time\t'
-            ms = raw_data[9] * 256 + raw_data[8]
-            msg += '20{:0>2d}-{:0>2d}-{:0>2d} {:0>2d}:{:0>2d}:{:0>2d}.{:0>3d}\t'.format(raw_data[2], raw_data[3], raw_data[4], raw_data[5], raw_data[6], raw_data[7], ms)
-        elif raw_data[1] == 0x51:
-            if headflag == 1:   headmsg += 'ax(g)\tay(g)\taz(g)\t'
-            msg += "{:.3f}\t{:.3f}\t{:.3f}\t".format(val[0]/2048.0, val[1]/2048.0, val[2]/2048.0)
-        elif raw_data[1] == 0x52:
-            if headflag == 1:   headmsg += 'wx(deg/s)\twy(deg/s)\twz(deg/s)\t'
-            msg += "{:.3f}\t{:.3f}\t{:.3f}\t".format(val[0]/32768.0*2000.0, val[1]/32768.0*2000.0, val[2]/32768.0*2000.0)
-        elif raw_data[1] == 0x53:
-            if headflag == 1:   headmsg += 'AngleX(deg)\tAngleY(deg)\tAngleZ(deg)\t'
-            msg += "{:.3f}\t{:.3f}\t{:.3f}\t".format(val[0]/32768.0*180.0, val[1]/32768.0*180.0, val[2]/32768.0*180.0)
-        elif raw_data[1] == 0x54:
-            if headflag == 1:   headmsg += ' hx\thy\thz\t'
-            msg += "{:.0f}\t{:.0f}\t{:.0f}\t".format(val[0], val[1], val[2])
-    key = 0
-
-
-f = open(filename, 'rb')
-try:
-    while True:
-        data = f.read(1024)
-        datalen = len(data)
-        if datalen == 0:
+def checkCrc(data, start, end):
+    crc = 0xffff
+    for i in range(start, end - 2):
+        crc = (crc >> 8) ^ CRC_TABLE[(crc ^ data[i]) & 0xff]
+    return data[end - 2] == crc & 0xff and data[end - 1] == crc >> 8
+
+
+def witFrame(data, i):
+    """维特协议数据包是否有效  Whether a valid Wit packet starts at i"""
+    return i + WIT_SIZE <= len(data) and data[i] == 0x55 and checkSum(data[i:i + 10], data[i + 10])
+
+
+def modbusFrame(data, i):
+    """Modbus 读取应答的长度，无效返回 0  Length of a valid Modbus read response at i, 0 if none"""
+    if i + 5 > len(data) or data[i + 1] != 0x03:
+        return 0
+    end = i + data[i + 2] + 5
+    if end > len(data) or not checkCrc(data, i, end):
+        return 0
+    return end - i
+
+
+# 输入文件  Input file
+
+def loadSegments(mm):
+    """
+    数据段表：纯字节文件只有一段；.raw 记录文件每个数据块一段
+    Segment table: one segment for a plain dump, one per chunk for a .raw capture
+    :return: (数据偏移, 文件偏移, 长度) 三个数组, 数据总长度
+    """
+    starts, offsets, lengths = array.array('q'), array.array('q'), array.array('q')
+    if mm[:len(RAW_MAGIC)] != RAW_MAGIC:
+        starts.append(0)
+        offsets.append(0)
+        lengths.append(len(mm))
+        return (starts, offsets, lengths), len(mm)
+    pos = RAW_HEADER.size
+    total = 0
+    while pos + RAW_CHUNK.size <= len(mm):
+        length = RAW_CHUNK.unpack_from(mm, pos)[1]
+        if pos + RAW_CHUNK.size + length > len(mm):
             break
-        key = 0
-        index = 0
-        for val in data:
-            ConvertData(val)
-except Exception as e:
-    print(e)
+        starts.append(total)
+        offsets.append(pos + RAW_CHUNK.size)
+        lengths.append(length)
+        total += length
+        pos += RAW_CHUNK.size + length
+    return (starts, offsets, lengths), total
+
+
+def sliceSegments(segments, start, end):
+    """取出覆盖数据范围 [start, end) 的数据段  Segments covering payload range [start, end)"""
+    starts, offsets, lengths = segments
+    first = max(bisect.bisect_right(starts, start) - 1, 0)
+    last = bisect.bisect_left(starts, end)
+    return [(starts[i], offsets[i], lengths[i]) for i in range(first, last)]
+
+
+def readPayload(mm, segments, start, end):
+    """读取数据范围 [start, end) 的字节  Bytes of payload range [start, end)"""
+    parts = []
+    for segStart, offset, length in segments:
+        lo = max(start, segStart)
+        hi = min(end, segStart + length)
+        if lo < hi:
+            parts.append(mm[offset + lo - segStart:offset + hi - segStart])
+    return b''.join(parts)
+
+
+# 解析  Decoding
+
+def witLine(data, i, msg):
+    raw_data = data[i:i + WIT_SIZE]
+    kind = raw_data[1]
+    if kind == 0x50:
+        ms = raw_data[9] * 256 + raw_data[8]
+        msg.append('20{:0>2d}-{:0>2d}-{:0>2d} {:0>2d}:{:0>2d}:{:0>2d}.{:0>3d}\t'.format(
+            raw_data[2], raw_data[3], raw_data[4], raw_data[5], raw_data[6], raw_data[7], ms))
+    elif 0x51 <= kind <= 0x54:
+        val = struct.unpack_from("<hhh", raw_data, 2)
+        if kind == 0x51:
+            msg.append("{:.3f}\t{:.3f}\t{:.3f}\t".format(val[0] / 2048.0, val[1] / 2048.0, val[2] / 2048.0))
+        elif kind == 0x52:
+            msg.append("{:.3f}\t{:.3f}\t{:.3f}\t".format(val[0] / 32768.0 * 2000.0, val[1] / 32768.0 * 2000.0,
+                                                         val[2] / 32768.0 * 2000.0))
+        elif kind == 0x53:
+            msg.append("{:.3f}\t{:.3f}\t{:.3f}\t".format(val[0] / 32768.0 * 180.0, val[1] / 32768.0 * 180.0,
+                                                         val[2] / 32768.0 * 180.0))
+        else:
+            msg.append("{:.0f}\t{:.0f}\t{:.0f}\t".format(val[0], val[1], val[2]))
+
+
+def convertWit(data, limit, headindex, last):
+    """
+    转换维特协议数据，每组数据（以第一种数据包开头）一行
+    One line per group of packets; a group starts with the packet type seen first in the file
+    """
+    lines = []
+    msg = []
+    started = False
+    i = 0
+    size = len(data)
+    while i < limit:
+        if data[i] != 0x55:                 # 跳到下一个包头  Skip to the next header byte
+            i = data.find(b'\x55', i, limit)
+            if i < 0:
+                break
+            continue
+        if i + WIT_SIZE > size or sum(data[i:i + 10]) & 0xff != data[i + 10]:
+            i += 1
+            continue
+        if data[i + 1] == headindex:
+            if started:
+                lines.append(''.join(msg))
+            msg = []
+            started = True
+        if started:
+            witLine(data, i, msg)
+        i += WIT_SIZE
+    if started and not last:                # 下一块从新的一组开始  The next chunk starts a new group
+        lines.append(''.join(msg))
+    return lines
+
+
+def convertModbus(data, limit):
+    """
+    转换 Modbus 应答（从 0x30 开始读取至少 17 个寄存器），每个应答一行
+    One line per Modbus response that read at least 17 registers from 0x30
+    """
+    lines = []
+    i = 0
+    while i < limit:
+        size = modbusFrame(data, i)
+        if size == 0:
+            i += 1
+            continue
+        if data[i + 2] >= 34:
+            regs = struct.unpack_from(">17h", data, i + 3)
+            msg = ['0x{:02x}\t'.format(data[i])]
+            msg.append('20{:0>2d}-{:0>2d}-{:0>2d} {:0>2d}:{:0>2d}:{:0>2d}.{:0>3d}\t'.format(
+                regs[0] & 0xff, (regs[0] >> 8) & 0xff, regs[1] & 0xff, (regs[1] >> 8) & 0xff,
+                regs[2] & 0xff, (regs[2] >> 8) & 0xff, regs[3] & 0xffff))
+            msg.append("{:.3f}\t{:.3f}\t{:.3f}\t".format(regs[4] / 2048.0, regs[5] / 2048.0, regs[6] / 2048.0))
+            msg.append("{:.3f}\t{:.3f}\t{:.3f}\t".format(regs[7] / 32768.0 * 2000.0, regs[8] / 32768.0 * 2000.0,
+                                                         regs[9] / 32768.0 * 2000.0))
+            msg.append("{:.3f}\t{:.3f}\t{:.3f}\t".format(regs[13] / 32768.0 * 180.0, regs[14] / 32768.0 * 180.0,
+                                                         regs[15] / 32768.0 * 180.0))
+            msg.append("{:.0f}\t{:.0f}\t{:.0f}\t".format(regs[10], regs[11], regs[12]))
+            msg.append("{:.2f}\t".format(regs[16] / 100.0))
+            lines.append(''.join(msg))
+        i += size
+    return lines
+
+
+# 切块  Splitting
+
+def detectProtocol(data):
+    """
+    找到第一个安全同步点（连续两个有效数据包），判断协议
+    Find the first safe resync point (two consecutive valid frames) and the protocol
+    :return: (协议, 位置)，找不到返回 (None, 0)
+    """
+    for i in range(len(data)):
+        if witFrame(data, i) and witFrame(data, i + WIT_SIZE):
+            return 'wit', i
+        size = modbusFrame(data, i)
+        if size and modbusFrame(data, i + size):
+            return 'modbus', i
+    return None, 0
+
+
+def findResync(data, protocol, headindex):
+    """
+    查找安全同步点；维特协议还要求是一组数据的开头
+    Find a safe resync point; for Wit it must also start a group
+    :return: 位置，找不到返回 -1
+    """
+    for i in range(len(data)):
+        if protocol == 'wit':
+            if data[i + 1:i + 2] == bytes([headindex]) and witFrame(data, i) and witFrame(data, i + WIT_SIZE):
+                return i
+        else:
+            size = modbusFrame(data, i)
+            if size and modbusFrame(data, i + size):
+                return i
+    return -1
+
+
+def splitPoints(mm, segments, total, start, protocol, headindex, chunkSize):
+    points = [start]
+    target = start + chunkSize
+    while target < total:
+        window = readPayload(mm, sliceSegments(segments, target, target + SEARCH_SIZE), target, target + SEARCH_SIZE)
+        pos = findResync(window, protocol, headindex)
+        if pos >= 0:
+            points.append(target + pos)
+        target += chunkSize
+    points.append(total)
+    return points
+
+
+# 进程池  Process pool
+
+_input = None
+
+
+def openInput(filename):
+    global _input
+    f = open(filename, 'rb')
+    _input = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def convertChunk(task):
+    segments, start, end, protocol, headindex, last = task
+    lookahead = 256                         # 最后一个数据包可能跨过块尾  The last frame may cross the chunk end
+    data = readPayload(_input, segments, start, end + lookahead)
+    if protocol == 'wit':
+        lines = convertWit(data, end - start, headindex, last)
+    else:
+        lines = convertModbus(data, end - start)
+    return ''.join(line + '\n' for line in lines), len(lines)
+
+
+def convertFile(filename, convertfilename, workers=None, chunkSize=CHUNK_SIZE):
+    startTime = time.time()
+    size = os.path.getsize(filename)
+    if size == 0:
+        print('empty file {}'.format(filename))
+        return
+    f = open(filename, 'rb')
+    mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    segments, total = loadSegments(mm)
+    head = readPayload(mm, sliceSegments(segments, 0, SEARCH_SIZE), 0, SEARCH_SIZE)
+    protocol, first = detectProtocol(head)
+    if protocol is None:
+        print('no Wit or Modbus data found in {}'.format(filename))
+        return
+    headindex = head[first + 1] if protocol == 'wit' else None
+    if protocol == 'wit':                   # 第一组数据决定表头  The first group decides the header
+        headmsg = WIT_COLUMNS.get(headindex, '')
+        i = first + WIT_SIZE
+        while i < len(head):
+            if not witFrame(head, i):
+                i += 1
+                continue
+            if head[i + 1] == headindex:
+                break
+            headmsg += WIT_COLUMNS.get(head[i + 1], '')
+            i += WIT_SIZE
+    else:
+        headmsg = MODBUS_HEADER
+    points = splitPoints(mm, segments, total, first, protocol, headindex, chunkSize)
+    lineCount = 0
+    workers = workers or os.cpu_count() or 1
+    with open(convertfilename, 'w') as fd, \
+            ProcessPoolExecutor(max_workers=workers, initializer=openInput, initargs=(filename,)) as executor:
+        fd.write(headmsg + '\n')
+        pending = collections.deque()
+        window = 2 * workers
+        for k in range(len(points) - 1):
+            start, end = points[k], points[k + 1]
+            task = (sliceSegments(segments, start, end + 256), start, end, protocol, headindex, k == len(points) - 2)
+            pending.append(executor.submit(convertChunk, task))
+            while len(pending) >= window:   # 按顺序输出，限制在途任务数  Ordered output, bounded in flight
+                text, count = pending.popleft().result()
+                fd.write(text)
+                lineCount += count
+        while pending:
+            text, count = pending.popleft().result()
+            fd.write(text)
+            lineCount += count
+    mm.close()
+    f.close()
+    elapsed = max(time.time() - startTime, 1e-9)
+    print('convert {} file finish, output {} file'.format(filename, convertfilename))
+    print('{} protocol, {:.1f} MB, {} lines, {} chunks, {:.2f} s, {:.1f} MB/s'.format(
+        protocol, size / 1e6, lineCount, len(points) - 1, elapsed, size / 1e6 / elapsed))
 
 
-f.close()
-fd.close()
-print('convert {} file finish, output {} file'.format(filename, convertfilename))
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='convert raw Wit / Modbus data to text')
+    parser.add_argument('filename', help='input file (plain byte dump or .raw capture)')
+    parser.add_argument('-o', '--output', help='output file name')
+    parser.add_argument('-j', '--jobs', type=int, default=None, help='worker processes (default: all cores)')
+    args = parser.parse_args()
+    if not os.path.exists(args.filename):
+        print('please input convert file name')
+        sys.exit(1)
+    output = args.output or time.strftime("%Y%m%d%H%M%S", time.localtime()) + '.txt'
+    convertFile(args.filename, output, args.jobs)
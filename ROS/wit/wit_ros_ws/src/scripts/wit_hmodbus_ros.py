@@ -26,6 +26,18 @@ def find_ttyUSB():
         
 
 
+# 应答时间估计（TCP方法）：超时 = 传输时间 + 平滑延时 + 4倍偏差，最长仍为原来的1秒
+# RTT estimate (TCP style): timeout = wire time + smoothed latency + 4 deviations, at most the old 1 s
+RTT_ALPHA = 0.125
+RTT_BETA = 0.25
+MAX_TIMEOUT = 1.0
+
+
+def wire_time(baudrate, request_bytes, response_bytes):
+    # 起始位+8数据位+停止位，加请求和应答各3.5个字符的帧间隔 10 bits per byte plus 3.5-char gaps on each frame
+    return (request_bytes + response_bytes + 7.0) * 10 / baudrate
+
+
 angularVelocity = [0, 0, 0]
 acceleration = [0, 0, 0]
 magnetometer = [0, 0, 0]
@@ -58,17 +70,31 @@ if __name__ == "__main__":
         mag_pub = rospy.Publisher("wit/mag", MagneticField, queue_size=10)
 
         master = modbus_rtu.RtuMaster(wt_imu)
-        master.set_timeout(1)
+        master.set_timeout(MAX_TIMEOUT)
         master.set_verbose(True)
+        wire = wire_time(baudrate, 8, 5 + 15 * 2)
+        srtt = None
+        rttvar = 0.0
+        backoff = 1
         while not rospy.is_shutdown():            
-            
+            if srtt is not None:
+                master.set_timeout(max(wire + 0.003, min(wire + (srtt + 4 * rttvar) * backoff, MAX_TIMEOUT)))
+            start = time.time()
             try:
                 reg = master.execute(80,cst.READ_HOLDING_REGISTERS,52,15)
             except Exception as e:
+                backoff = min(backoff * 2, 8)
                 print(e)
                 rospy.loginfo("\033[31mread register time out, please check connection or baundrate set!\033[0m")
                 time.sleep(0.1)
             else:
+                latency = max(0.0, time.time() - start - wire)
+                if srtt is None:
+                    srtt, rttvar = latency, latency / 2
+                else:
+                    rttvar += RTT_BETA * (abs(srtt - latency) - rttvar)
+                    srtt += RTT_ALPHA * (latency - srtt)
+                backoff = 1
                 v=[0]*12
                 for i in range(0,9):
                     if (reg[i]>32767):
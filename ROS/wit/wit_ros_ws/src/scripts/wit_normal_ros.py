@@ -8,6 +8,10 @@ import math
 import sys
 import platform
 import threading
+import collections
+import gzip
+import os
+import shutil
 import serial.tools.list_ports
 from sensor_msgs.msg import Imu
 from sensor_msgs.msg import MagneticField
@@ -187,22 +191,112 @@ mag_offset = [0, 0, 0]
 mag_range = [0, 0, 0]
 global wt_imu
 baudlist = [4800, 9600, 19200, 38400, 57600, 115200, 230400, 460800]
+# 自动扫描按常见程度尝试波特率（出厂9600，其次115200） Auto scan tries baud rates by likelihood (factory 9600, then 115200)
+scan_baudlist = [9600, 115200, 19200, 38400, 57600, 4800, 230400, 460800]
+SCAN_SLACK = 0.02                # 传输时间之外等待应答的时间（秒） Wait for the reply beyond the wire time (s)
+
+# Python 2没有time_ns和monotonic_ns，用time.time代替  Python 2 has no time_ns/monotonic_ns: fall back to time.time
+if hasattr(time, 'monotonic_ns'):
+    wallNs = time.time_ns
+    monotonicNs = time.monotonic_ns
+else:
+    def wallNs():
+        return int(time.time() * 1e9)
+    monotonicNs = wallNs
+
+RECORD_MAX_BYTES = 64 << 20      # 每个分段最大字节数 Max bytes per segment
+RECORD_MAX_SECONDS = 3600        # 每个分段最长时间（秒） Max seconds per segment
+RECORD_BUDGET = 1 << 30          # 本节点压缩分段的总字节数上限 Disk budget for this node's compressed segments
+RECORD_DIR = 'wit_record'        # 录制目录，每个节点一个子目录 Recording directory, one subdirectory per node
+RECORD_MANIFEST = 'segments.txt' # 本节点写的压缩分段，从旧到新 Compressed segments this node wrote, oldest first
+# 换录制缓冲区和往里追加数据都持有这个锁，接收线程不会把数据追加到已经换掉的缓冲区
+# Held both to swap the recording buffer and to append to it, so the receive loop never appends to a retired one
+recordlock = threading.Lock()
+
+
+# 录制文件放在本节点自己的目录，保留策略只删除清单里本节点写的分段
+# Recordings go to this node's own directory; retention only deletes segments listed in its manifest
+def recordDirectory():
+    directory = os.path.join(RECORD_DIR, rospy.get_name().strip('/').replace('/', '_') or 'imu')
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    return directory
+
+
+def openRecordFile(directory, sequence):
+    recordname = os.path.join(directory, time.strftime("%Y%m%d%H%M%S", time.localtime()) +
+                              '_{:04d}.raw'.format(sequence))
+    fd = open(recordname, 'wb')
+    # 与Python SDK的 lib/recorder/raw_capture.py 格式相同，可用 RawCaptureReader 回放（包括压缩后的.gz分段）
+    # Same chunk log format as lib/recorder/raw_capture.py in the Python SDK, replayable with RawCaptureReader
+    # (compressed .gz segments included)
+    fd.write(struct.pack("<8sHqq", b"WITRAW\x00\x00", 1, wallNs(), monotonicNs()))
+    print('begin recording file name is {}'.format(recordname))
+    return recordname, fd
+
+
+# 压缩关闭的分段并记入清单，超出空间上限时删除清单里最旧的分段
+# Compress a closed segment and add it to the manifest, delete the oldest listed segments beyond the budget
+def compressRecordFile(directory, recordname):
+    with open(recordname, 'rb') as src, gzip.open(recordname + '.gz.tmp', 'wb') as dst:
+        shutil.copyfileobj(src, dst, 1 << 20)
+    os.rename(recordname + '.gz.tmp', recordname + '.gz')    # Python 2没有os.replace  No os.replace on Python 2
+    os.remove(recordname)
+    manifest = os.path.join(directory, RECORD_MANIFEST)
+    segments = []
+    if os.path.exists(manifest):
+        with open(manifest) as f:
+            segments = [line.strip() for line in f if line.strip()]
+    segments.append(os.path.basename(recordname) + '.gz')
+    segments = [name for name in segments if os.path.exists(os.path.join(directory, name))]
+    total = sum(os.path.getsize(os.path.join(directory, name)) for name in segments)
+    while len(segments) > 1 and total > RECORD_BUDGET:
+        name = os.path.join(directory, segments.pop(0))
+        total -= os.path.getsize(name)
+        os.remove(name)
+    with open(manifest + '.tmp', 'w') as f:
+        f.write(''.join(name + '\n' for name in segments))
+    os.rename(manifest + '.tmp', manifest)
+
 
 def recordThread():
     global recordflag, recordbuff
-    recordflag = 1
-    recordbuff = ''
-    recordname = time.strftime("%Y%m%d%H%M%S", time.localtime()) + '.txt'
-    fd = open(recordname, 'w+')
-    print('begin recording file name is {}'.format(recordname))
-    while recordflag:
-        if len(recordbuff):
-            fd.write(recordbuff)
-            recordbuff = ''
+    ownbuff = collections.deque()
+    with recordlock:
+        recordbuff = ownbuff
+        recordflag = 1
+    sequence = 1
+    directory = recordDirectory()
+    recordname, fd = openRecordFile(directory, sequence)
+    recordsize = 0
+    recordstart = monotonicNs()
+    compressor = None
+    # 再次开始录制时换了新缓冲区，本线程写完自己的缓冲区后退出
+    # A new recording swaps in a new buffer; this thread then drains its own buffer and exits
+    while (recordflag and recordbuff is ownbuff) or len(ownbuff):
+        if len(ownbuff):
+            stamp, data = ownbuff.popleft()
+            fd.write(struct.pack("<qI", stamp, len(data)))
+            fd.write(data)
+            recordsize += 12 + len(data)
+            # 按大小或时长换段，旧分段在另一个线程压缩  Roll by size or time, compress the old segment on another thread
+            if recordsize >= RECORD_MAX_BYTES or monotonicNs() - recordstart >= RECORD_MAX_SECONDS * 1000000000:
+                fd.close()
+                if compressor is not None:
+                    compressor.join()
+                compressor = threading.Thread(target=compressRecordFile, args=(directory, recordname))
+                compressor.start()
+                sequence += 1
+                recordname, fd = openRecordFile(directory, sequence)
+                recordsize = 0
+                recordstart = monotonicNs()
         else:
-            time.sleep(1)
+            time.sleep(0.01)
 
     fd.close()
+    if compressor is not None:
+        compressor.join()
+    compressRecordFile(directory, recordname)
     print("stop recording")
 
 def callback(data):
@@ -329,24 +423,27 @@ def thread_job():
     rospy.spin()
 
 def AutoScanSensor():
-    global wt_imu, baudlist
+    global wt_imu, scan_baudlist
     try:
-        for baud in baudlist:
+        for baud in scan_baudlist:
             read_cmd = '\xff\xaa\x27\x00\x00'.encode("utf-8")
             wt_imu.baudrate = baud
             wt_imu.flushInput()
             wt_imu.write(read_cmd)
-            time.sleep(0.2)
-            buff_count = wt_imu.inWaiting()
-            if buff_count >= 11:
-                buff_data = wt_imu.read(buff_count)
-                val = bytearray(buff_data)
-                for i in range(len(val)):
-                    if val[i] == 0x55:
-                        sumval = sum(val[i:i+10])
-                        if sumval == val[i+10]:
+            # 按波特率计算等待时间：指令和两包应答的传输时间加余量，代替固定的200毫秒
+            # Wait for the wire time of the command and two replies plus slack instead of a fixed 200 ms
+            deadline = time.time() + (len(read_cmd) + 22) * 10.0 / baud + SCAN_SLACK
+            val = bytearray()
+            while time.time() < deadline:
+                buff_count = wt_imu.inWaiting()
+                if buff_count > 0:
+                    val += bytearray(wt_imu.read(buff_count))
+                    for i in range(len(val) - 10):
+                        if val[i] == 0x55 and sum(val[i:i+10]) & 0xff == val[i+10]:
                             print('{} baud find sensor'.format(baud))
                             return
+                else:
+                    time.sleep(0.001)
 
     except Exception as e:
         print("exception:" + str(e))
@@ -358,7 +455,7 @@ def AutoScanSensor():
 if __name__ == "__main__":
     global recordflag, recordbuff, wt_imu
     recordflag = 0
-    recordbuff = list()
+    recordbuff = collections.deque()
     wt_imu = serial.Serial()
     python_version = platform.python_version()[0]
 
@@ -396,8 +493,9 @@ if __name__ == "__main__":
                 buff_count = wt_imu.inWaiting()
                 if buff_count > 0 and iapflag == 0:
                     buff_data = wt_imu.read(buff_count)
-                    if recordflag:
-                        recordbuff = recordbuff + buff_data
+                    with recordlock:
+                        if recordflag:
+                            recordbuff.append((monotonicNs(), buff_data))
                     for i in range(0, buff_count):
                         handleSerialData(buff_data[i])
             except Exception as e: